@@ -1,9 +1,11 @@
 from flask import Flask, request, jsonify
 import os
-import requests
 import datetime
 
+from metrics import http_call, instrument
+
 app = Flask(__name__)
+instrument(app, "holiday_service")
 
 NINJAS_API_KEY = os.environ.get("NINJAS_API_KEY")
 if not NINJAS_API_KEY:
@@ -19,7 +21,8 @@ def get_holiday():
 
         headers = {"X-Api-Key": NINJAS_API_KEY}
         params = {"country": country}
-        response = requests.get("https://api.api-ninjas.com/v1/publicholidays", headers=headers, params=params)
+        response = http_call("api_ninjas", "GET", "https://api.api-ninjas.com/v1/publicholidays", propagate=False,
+                             headers=headers, params=params)
         if response.status_code != 200:
             return jsonify({"error": "Error fetching holidays from Ninja API"}), 500
         holidays = response.json()
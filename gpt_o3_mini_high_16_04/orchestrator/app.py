@@ -1,16 +1,20 @@
 import os
 import datetime
-import requests
 from flask import Flask, request, jsonify
 from pymongo import MongoClient
+from metrics import http_call, instrument, observe
+from writebehind import BufferFull, WriteBehind
 
 app = Flask(__name__)
+instrument(app, "orchestrator")
 
 # Setup MongoDB connection (using environment variable, defaulting to container name)
 MONGO_URI = os.environ.get("MONGO_URI", "mongodb://mongodb:27017/")
 client = MongoClient(MONGO_URI)
 db = client["trending_products_db"]
 collection = db["recommendations"]
+# Recommendations are written in batches off the request path.
+writer = WriteBehind(collection, "recommendations", on_batch=lambda records, seconds: observe("mongo_insert", seconds))
 
 # Service URLs (using Docker Compose service names)
 HOLIDAY_SERVICE_URL = os.environ.get("HOLIDAY_SERVICE_URL", "http://holiday_service:5001")
@@ -40,8 +44,8 @@ def trending_products():
                 "date": data["holiday_date"]
             }
         else:
-            holiday_resp = requests.get(
-                f"{HOLIDAY_SERVICE_URL}/api/holiday",
+            holiday_resp = http_call(
+                "holiday_service", "GET", f"{HOLIDAY_SERVICE_URL}/api/holiday",
                 params={"country": target_country, "sales_window": shipping_duration}
             )
             if holiday_resp.status_code != 200:
@@ -60,10 +64,13 @@ def trending_products():
             "target_audience": target_audience,
             "number_of_ideas": number_of_ideas
         }
-        product_resp = requests.post(f"{PRODUCT_SERVICE_URL}/api/generate_products", json=product_payload)
+        product_resp = http_call("product_service", "POST", f"{PRODUCT_SERVICE_URL}/api/generate_products",
+                                 json=product_payload)
         if product_resp.status_code != 200:
             return jsonify({"error": "Failed to generate product ideas"}), 500
         product_ideas = product_resp.json().get("product_ideas", [])
+        # Token counts and LLM time of the product idea generation, stored with the recommendation
+        llm_usage = product_resp.json().get("usage")
 
         validated_products = []
         # For each product idea, validate popularity using the Trend Service.
@@ -76,7 +83,7 @@ def trending_products():
                 "historical_years": historical_years,
                 "popularity_threshold": popularity_threshold
             }
-            trend_resp = requests.get(f"{TREND_SERVICE_URL}/api/validate_trend", params=trend_params)
+            trend_resp = http_call("trend_service", "GET", f"{TREND_SERVICE_URL}/api/validate_trend", params=trend_params)
             if trend_resp.status_code != 200:
                 continue  # Log error or skip product if trend check fails.
             trend_data = trend_resp.json()
@@ -90,15 +97,18 @@ def trending_products():
         record = {
             "holiday": holiday_info,
             "validated_products": validated_products,
+            "llm_usage": llm_usage,
             "timestamp": datetime.datetime.utcnow()
         }
-        result = collection.insert_one(record)
+        record_id = writer.submit(record)
 
         return jsonify({
             "holiday": holiday_info,
             "validated_products": validated_products,
-            "record_id": str(result.inserted_id)
+            "record_id": record_id
         })
+    except BufferFull:
+        return jsonify({"error": "Service overloaded, retry later"}), 503
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
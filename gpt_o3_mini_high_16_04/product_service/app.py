@@ -2,7 +2,10 @@ from flask import Flask, request, jsonify
 import os
 import openai
 
+from metrics import LLMUsage, instrument, llm_headers
+
 app = Flask(__name__)
+instrument(app, "product_service")
 
 OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY")
 if not OPENAI_API_KEY:
@@ -27,18 +30,20 @@ def generate_products():
             f"for a target audience of {target_audience}. Provide only the product names as a list."
         )
 
-        response = openai.ChatCompletion.create(
+        usage = LLMUsage()
+        response = usage.create(
             model="gpt-3.5-turbo",
             messages=[
                 {"role": "system", "content": "You are a product idea generator."},
                 {"role": "user", "content": prompt}
             ],
-            max_tokens=150
+            max_tokens=150,
+            headers=llm_headers("product_service.generate_products")
         )
         content = response["choices"][0]["message"]["content"]
         # Assume the response is a newline-separated list of product ideas.
         product_ideas = [line.strip("- ").strip() for line in content.splitlines() if line.strip()]
-        return jsonify({"product_ideas": product_ideas})
+        return jsonify({"product_ideas": product_ideas, "usage": usage.as_dict()})
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
@@ -1,10 +1,12 @@
 from flask import Flask, request, jsonify
 import os
-import requests
 import datetime
 import statistics
 
+from metrics import http_call, instrument
+
 app = Flask(__name__)
+instrument(app, "trend_service")
 
 SERP_API_KEY = os.environ.get("SERP_API_KEY")
 if not SERP_API_KEY:
@@ -46,7 +48,7 @@ def validate_trend():
                 "date": f"{start_date_str} {end_date_str}",
                 "api_key": SERP_API_KEY
             }
-            serp_response = requests.get("https://serpapi.com/search", params=params)
+            serp_response = http_call("serpapi", "GET", "https://serpapi.com/search", propagate=False, params=params)
             if serp_response.status_code != 200:
                 continue
             serp_data = serp_response.json()
@@ -0,0 +1,258 @@
+import os
+import json
+import logging
+import time
+import threading
+from flask import Flask, Response, request, jsonify, stream_with_context
+import requests
+
+from gateway import (
+    InFlight,
+    ModelLimiter,
+    QueueTimeout,
+    ResponseCache,
+    StreamAccumulator,
+    UsageRecorder,
+    estimate_tokens,
+    parse_model_limits,
+    request_key,
+    sse_chunks,
+)
+from metrics import cache_result, instrument, llm_usage, observe, upstream_error
+
+# Logging configuration
+log_level = os.getenv("LOG_LEVEL", "INFO")
+logging.basicConfig(level=log_level)
+logger = logging.getLogger("llm-gateway")
+
+app = Flask(__name__)
+instrument(app, "llm-gateway")
+
+# Upstream: the real OpenAI API, or fake_openai.py for offline load tests
+UPSTREAM_BASE = os.getenv("UPSTREAM_BASE", "https://api.openai.com/v1").rstrip("/")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+UPSTREAM_TIMEOUT = float(os.getenv("UPSTREAM_TIMEOUT", "120"))
+QUEUE_TIMEOUT = float(os.getenv("QUEUE_TIMEOUT", "60"))
+
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", "1024"))
+CACHE_TTL_SECONDS = int(os.getenv("CACHE_TTL_SECONDS", "86400"))
+
+DEFAULT_MAX_CONCURRENCY = int(os.getenv("DEFAULT_MAX_CONCURRENCY", "8"))
+DEFAULT_TOKENS_PER_MINUTE = int(os.getenv("DEFAULT_TOKENS_PER_MINUTE", "0"))
+MODEL_LIMITS = parse_model_limits(os.getenv("MODEL_LIMITS", ""))
+
+
+def export_usage(call_site, model, outcome, latency_ms, usage_data):
+    """Per-call-site latency, cache outcome, errors and token counts for /metrics."""
+    observe(f"llm:{call_site}", latency_ms / 1000)
+    if outcome == "error":
+        upstream_error(f"llm:{call_site}", "error")
+        return
+    cache_result("llm_response", outcome)
+    if outcome == "miss":
+        llm_usage(call_site, model, usage_data)
+
+
+cache = ResponseCache(CACHE_MAX_ENTRIES, CACHE_TTL_SECONDS)
+inflight = InFlight()
+usage = UsageRecorder(on_record=export_usage)
+_limiters = {}
+_limiters_lock = threading.Lock()
+
+
+class UpstreamError(Exception):
+    def __init__(self, status_code, body):
+        super().__init__(f"Upstream returned {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+
+def limiter_for(model):
+    with _limiters_lock:
+        if model not in _limiters:
+            concurrency, tpm = MODEL_LIMITS.get(model, (DEFAULT_MAX_CONCURRENCY, DEFAULT_TOKENS_PER_MINUTE))
+            _limiters[model] = ModelLimiter(concurrency, tpm)
+        return _limiters[model]
+
+
+def error_body(message, error_type):
+    # Same shape as OpenAI errors so the openai client raises the usual exceptions.
+    return {"error": {"message": message, "type": error_type}}
+
+
+def upstream_headers(auth_header):
+    headers = {"Content-Type": "application/json"}
+    if OPENAI_API_KEY:
+        headers["Authorization"] = f"Bearer {OPENAI_API_KEY}"
+    elif auth_header:
+        headers["Authorization"] = auth_header
+    return headers
+
+
+def call_upstream(payload, auth_header):
+    limiter = limiter_for(payload.get("model"))
+    limiter.acquire(estimate_tokens(payload), QUEUE_TIMEOUT)
+    try:
+        resp = requests.post(
+            f"{UPSTREAM_BASE}/chat/completions",
+            json=payload,
+            headers=upstream_headers(auth_header),
+            timeout=UPSTREAM_TIMEOUT,
+        )
+    finally:
+        limiter.release()
+    if resp.status_code != 200:
+        raise UpstreamError(resp.status_code, resp.text)
+    return resp.json()
+
+
+def event_stream(body, outcome):
+    resp = Response(body, mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Gateway-Cache"] = outcome
+    return resp
+
+
+def stream_completion(payload, call_site, key, use_cache, auth_header):
+    """Proxy a streamed completion, caching the assembled result once it finishes.
+
+    Streams are not coalesced: each one holds its own upstream connection. A
+    cached completion is replayed as a single content chunk.
+    """
+    started = time.monotonic()
+    model = payload["model"]
+    cached = cache.get(key) if use_cache else None
+    if cached is not None:
+        usage.record(call_site, model, "hit", (time.monotonic() - started) * 1000)
+        return event_stream(sse_chunks(cached), "hit")
+
+    limiter = limiter_for(model)
+    try:
+        limiter.acquire(estimate_tokens(payload), QUEUE_TIMEOUT)
+    except QueueTimeout as e:
+        usage.record(call_site, model, "error", (time.monotonic() - started) * 1000)
+        return jsonify(error_body(str(e), "rate_limit_exceeded")), 429
+
+    # Ask for the trailing usage chunk so streamed calls are accounted too;
+    # it is only forwarded if the caller asked for it itself.
+    forward_usage_chunk = "stream_options" in payload
+    upstream_payload = dict(payload, stream_options=payload.get("stream_options") or {"include_usage": True})
+    try:
+        resp = requests.post(
+            f"{UPSTREAM_BASE}/chat/completions",
+            json=upstream_payload,
+            headers=upstream_headers(auth_header),
+            timeout=UPSTREAM_TIMEOUT,
+            stream=True,
+        )
+    except Exception as e:
+        limiter.release()
+        usage.record(call_site, model, "error", (time.monotonic() - started) * 1000)
+        if isinstance(e, requests.Timeout):
+            return jsonify(error_body("Upstream request timed out", "timeout")), 504
+        logger.exception("Gateway stream error")
+        return jsonify(error_body("Gateway error", "server_error")), 502
+    if resp.status_code != 200:
+        limiter.release()
+        usage.record(call_site, model, "error", (time.monotonic() - started) * 1000)
+        logger.error("Upstream error", extra={"call_site": call_site, "status_code": resp.status_code})
+        return app.response_class(resp.text, status=resp.status_code, mimetype="application/json")
+
+    def generate():
+        acc = StreamAccumulator()
+        completed = False
+        try:
+            resp.encoding = "utf-8"
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                data = line[len("data:"):].strip()
+                if data == "[DONE]":
+                    completed = True
+                    yield "data: [DONE]\n\n"
+                    break
+                if acc.add(json.loads(data)) or forward_usage_chunk:
+                    yield f"data: {data}\n\n"
+        finally:
+            resp.close()
+            limiter.release()
+            latency_ms = (time.monotonic() - started) * 1000
+            if completed:
+                cache.put(key, acc.completion())
+                usage.record(call_site, model, "miss", latency_ms, acc.usage)
+            else:
+                usage.record(call_site, model, "error", latency_ms)
+                logger.warning("Stream ended before completion", extra={"call_site": call_site})
+
+    return event_stream(stream_with_context(generate()), "miss")
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    started = time.monotonic()
+    payload = request.get_json(silent=True)
+    if not payload or not payload.get("model") or not payload.get("messages"):
+        return jsonify(error_body("model and messages are required", "invalid_request_error")), 400
+    model = payload["model"]
+    call_site = request.headers.get("X-Call-Site", "unknown")
+    use_cache = request.headers.get("Cache-Control", "").lower() != "no-cache"
+    key = request_key(payload)
+    if payload.get("stream"):
+        return stream_completion(payload, call_site, key, use_cache, request.headers.get("Authorization"))
+
+    result = cache.get(key) if use_cache else None
+    outcome = "hit"
+    try:
+        if result is None:
+            result, shared = inflight.run(
+                key,
+                lambda: call_upstream(payload, request.headers.get("Authorization")),
+                timeout=QUEUE_TIMEOUT + UPSTREAM_TIMEOUT,
+            )
+            outcome = "shared" if shared else "miss"
+            if not shared:
+                cache.put(key, result)
+    except QueueTimeout as e:
+        usage.record(call_site, model, "error", (time.monotonic() - started) * 1000)
+        logger.warning("Request rejected: %s", e, extra={"call_site": call_site, "model": model})
+        return jsonify(error_body(str(e), "rate_limit_exceeded")), 429
+    except requests.Timeout:
+        usage.record(call_site, model, "error", (time.monotonic() - started) * 1000)
+        logger.error("Upstream timeout", extra={"call_site": call_site, "model": model})
+        return jsonify(error_body("Upstream request timed out", "timeout")), 504
+    except UpstreamError as e:
+        usage.record(call_site, model, "error", (time.monotonic() - started) * 1000)
+        logger.error("Upstream error", extra={"call_site": call_site, "status_code": e.status_code})
+        return app.response_class(e.body, status=e.status_code, mimetype="application/json")
+    except Exception:
+        usage.record(call_site, model, "error", (time.monotonic() - started) * 1000)
+        logger.exception("Gateway error")
+        return jsonify(error_body("Gateway error", "server_error")), 502
+
+    latency_ms = (time.monotonic() - started) * 1000
+    usage.record(call_site, model, outcome, latency_ms, result.get("usage"))
+    logger.info("Completion served", extra={"call_site": call_site, "model": model, "cache": outcome})
+    # Also in the body, where OpenAI clients can see it: callers only pay for "miss" answers
+    resp = jsonify(dict(result, x_gateway_cache=outcome))
+    resp.headers["X-Gateway-Cache"] = outcome
+    return resp, 200
+
+
+@app.route("/stats", methods=["GET"])
+def stats():
+    with _limiters_lock:
+        models = {name: lim.stats() for name, lim in _limiters.items()}
+    return jsonify({
+        "cache": cache.stats(),
+        "models": models,
+        "call_sites": usage.snapshot(),
+    }), 200
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"status": "ok"}), 200
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5090, threaded=True)
@@ -0,0 +1,125 @@
+"""
+Local stand-in for the OpenAI chat completions API.
+
+Point the gateway at it (UPSTREAM_BASE=http://localhost:5091/v1) to exercise
+caching, dedupe and rate limiting offline. Latency and failures are tunable:
+
+    FAKE_LATENCY_MS         mean response latency (median for lognormal) (default 800)
+    FAKE_LATENCY_JITTER_MS  uniform jitter added/subtracted (default 200)
+    FAKE_LATENCY_DIST       uniform (mean +/- jitter), lognormal or exponential (default uniform)
+    FAKE_LATENCY_SIGMA      spread of the lognormal distribution (default 0.5)
+    FAKE_ERROR_RATE         fraction of requests answered with a 500 (default 0)
+    FAKE_TOKEN_DELAY_MS     delay between streamed chunks (default 20)
+"""
+import os
+import json
+import logging
+import random
+import time
+import uuid
+from flask import Flask, Response, request, jsonify
+
+from gateway import estimate_tokens
+
+log_level = os.getenv("LOG_LEVEL", "INFO")
+logging.basicConfig(level=log_level)
+logger = logging.getLogger("fake-openai")
+
+app = Flask(__name__)
+
+FAKE_LATENCY_MS = float(os.getenv("FAKE_LATENCY_MS", "800"))
+FAKE_LATENCY_JITTER_MS = float(os.getenv("FAKE_LATENCY_JITTER_MS", "200"))
+FAKE_LATENCY_DIST = os.getenv("FAKE_LATENCY_DIST", "uniform")
+FAKE_LATENCY_SIGMA = float(os.getenv("FAKE_LATENCY_SIGMA", "0.5"))
+FAKE_ERROR_RATE = float(os.getenv("FAKE_ERROR_RATE", "0"))
+FAKE_TOKEN_DELAY_MS = float(os.getenv("FAKE_TOKEN_DELAY_MS", "20"))
+
+
+def sample_latency_ms():
+    if FAKE_LATENCY_DIST == "lognormal":
+        return random.lognormvariate(0, FAKE_LATENCY_SIGMA) * FAKE_LATENCY_MS
+    if FAKE_LATENCY_DIST == "exponential":
+        return random.expovariate(1 / FAKE_LATENCY_MS) if FAKE_LATENCY_MS else 0.0
+    return FAKE_LATENCY_MS + random.uniform(-FAKE_LATENCY_JITTER_MS, FAKE_LATENCY_JITTER_MS)
+
+
+def prompt_text(messages):
+    parts = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            parts.append(content)
+        elif isinstance(content, list):
+            parts.extend(p.get("text", "") for p in content if p.get("type") == "text")
+    return "\n".join(parts)
+
+
+def fake_answer(messages):
+    """Answer in the shape each pipeline stage expects so end-to-end runs succeed."""
+    text = prompt_text(messages)
+    # Synthesis prompts embed the priority URL too, so they are matched first.
+    if "risk_score" in text:
+        return '{"risk_score": "Low", "reasoning": "Synthetic response from fake model server."}'
+    if '"risk"' in text:
+        return '{"risk": "Low", "reasoning": "Synthetic response from fake model server."}'
+    if "priority_url" in text:
+        return '{"priority_url": null}'
+    if "visual_type" in text or "prominent_elements" in text:
+        return ('{"visual_type": "document", "layout": "single column", '
+                '"anomalies": [], "prominent_elements": []}')
+    return "Synthetic response from fake model server."
+
+
+@app.route("/v1/chat/completions", methods=["POST"])
+def chat_completions():
+    payload = request.get_json() or {}
+    delay = max(0.0, sample_latency_ms())
+    time.sleep(delay / 1000)
+    if random.random() < FAKE_ERROR_RATE:
+        return jsonify({"error": {"message": "Injected failure", "type": "server_error"}}), 500
+
+    content = fake_answer(payload.get("messages", []))
+    completion_tokens = max(1, len(content) // 4)
+    prompt_tokens = estimate_tokens(dict(payload, max_tokens=1)) - 1
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens,
+    }
+    base = {
+        "id": f"chatcmpl-{uuid.uuid4().hex}",
+        "created": int(time.time()),
+        "model": payload.get("model"),
+    }
+    if payload.get("stream"):
+        include_usage = (payload.get("stream_options") or {}).get("include_usage")
+        return Response(stream_chunks(base, content, usage if include_usage else None),
+                        mimetype="text/event-stream")
+    return jsonify(dict(
+        base,
+        object="chat.completion",
+        choices=[{
+            "index": 0,
+            "message": {"role": "assistant", "content": content},
+            "finish_reason": "stop",
+        }],
+        usage=usage,
+    )), 200
+
+
+def stream_chunks(base, content, usage):
+    base = dict(base, object="chat.completion.chunk")
+    words = content.split(" ")
+    for i, word in enumerate(words):
+        piece = word if i == len(words) - 1 else word + " "
+        chunk = dict(base, choices=[{"index": 0, "delta": {"content": piece}, "finish_reason": None}])
+        yield f"data: {json.dumps(chunk)}\n\n"
+        time.sleep(FAKE_TOKEN_DELAY_MS / 1000)
+    yield f"data: {json.dumps(dict(base, choices=[{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]))}\n\n"
+    if usage:
+        yield f"data: {json.dumps(dict(base, choices=[], usage=usage))}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5091, threaded=True)
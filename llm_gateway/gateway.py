@@ -0,0 +1,306 @@
+"""
+Core building blocks of the LLM gateway.
+
+Everything here is in-process and thread-safe so it can sit behind the
+threaded Flask server in app.py:
+
+- ResponseCache: LRU + TTL cache of completed chat completions.
+- InFlight: coalesces concurrent identical requests onto one upstream call.
+- ModelLimiter: per-model concurrency cap and tokens-per-minute budget.
+- UsageRecorder: token usage and latency aggregated per call site.
+"""
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict, deque
+
+# Request fields that do not change the completion and must not split the cache.
+CACHE_EXCLUDED_PARAMS = {"stream", "stream_options", "user", "request_timeout", "timeout"}
+
+# Rough prompt cost of one image part; OpenAI bills a high-detail tile at ~765 tokens.
+IMAGE_TOKEN_ESTIMATE = 765
+DEFAULT_COMPLETION_ESTIMATE = 512
+
+
+class QueueTimeout(Exception):
+    """Raised when a request could not be admitted before its deadline."""
+
+
+def request_key(payload):
+    """Stable hash of (model, messages, params) for a chat completion request."""
+    body = {k: v for k, v in payload.items() if k not in CACHE_EXCLUDED_PARAMS}
+    canonical = json.dumps(body, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def estimate_tokens(payload):
+    """Cheap local estimate (~4 chars per token) of prompt plus completion tokens."""
+    chars = 0
+    images = 0
+    for message in payload.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            for part in content:
+                if part.get("type") == "text":
+                    chars += len(part.get("text", ""))
+                elif part.get("type") == "image_url":
+                    images += 1
+    completion = payload.get("max_tokens") or DEFAULT_COMPLETION_ESTIMATE
+    return chars // 4 + images * IMAGE_TOKEN_ESTIMATE + completion
+
+
+class ResponseCache:
+    def __init__(self, max_entries=1024, ttl_seconds=3600):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if self.max_entries <= 0:
+            return None
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl_seconds, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "hits": self.hits, "misses": self.misses}
+
+
+class _Call:
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class InFlight:
+    """Runs at most one upstream call per key; concurrent callers share its outcome."""
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def run(self, key, fn, timeout=None):
+        """Return (result, shared) where shared is True if another caller did the work."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+        if not leader:
+            if not call.event.wait(timeout):
+                raise QueueTimeout("Timed out waiting for identical in-flight request")
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+        try:
+            call.result = fn()
+            return call.result, False
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.event.set()
+
+
+class ModelLimiter:
+    """Admission control for one model: max concurrent calls and tokens per minute."""
+
+    def __init__(self, max_concurrency, tokens_per_minute):
+        self.max_concurrency = max_concurrency
+        self.tokens_per_minute = tokens_per_minute
+        self._active = 0
+        self._waiting = 0
+        self._window = deque()
+        self._window_tokens = 0
+        self._cond = threading.Condition()
+
+    def _expire(self, now):
+        while self._window and self._window[0][0] <= now - 60:
+            self._window_tokens -= self._window.popleft()[1]
+
+    def _admissible(self, tokens, now):
+        if self.max_concurrency and self._active >= self.max_concurrency:
+            return False
+        if not self.tokens_per_minute:
+            return True
+        self._expire(now)
+        # A single oversized request is still admitted once the window is empty.
+        return not self._window or self._window_tokens + tokens <= self.tokens_per_minute
+
+    def acquire(self, tokens, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self._waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    if self._admissible(tokens, now):
+                        break
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise QueueTimeout("Timed out waiting for model capacity")
+                    # Token budget frees up as the window slides, so wake periodically.
+                    self._cond.wait(min(remaining, 1.0))
+            finally:
+                self._waiting -= 1
+            self._active += 1
+            if self.tokens_per_minute:
+                self._window.append((now, tokens))
+                self._window_tokens += tokens
+
+    def release(self):
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            self._expire(time.monotonic())
+            return {
+                "active": self._active,
+                "waiting": self._waiting,
+                "max_concurrency": self.max_concurrency,
+                "tokens_per_minute": self.tokens_per_minute,
+                "tokens_in_window": self._window_tokens,
+            }
+
+
+class UsageRecorder:
+    def __init__(self, on_record=None):
+        """on_record: optional callback with the arguments of every record() call, for metrics."""
+        self._sites = {}
+        self._lock = threading.Lock()
+        self.on_record = on_record
+
+    def record(self, call_site, model, outcome, latency_ms, usage=None):
+        usage = usage or {}
+        if self.on_record:
+            self.on_record(call_site, model, outcome, latency_ms, usage)
+        with self._lock:
+            site = self._sites.setdefault(call_site, {
+                "calls": 0,
+                "cache_hits": 0,
+                "shared": 0,
+                "errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+                "total_latency_ms": 0.0,
+                "max_latency_ms": 0.0,
+                "models": {},
+            })
+            site["calls"] += 1
+            if outcome == "hit":
+                site["cache_hits"] += 1
+            elif outcome == "shared":
+                site["shared"] += 1
+            elif outcome == "error":
+                site["errors"] += 1
+            if outcome == "miss":
+                # Only calls that reached the upstream actually spent tokens.
+                site["prompt_tokens"] += usage.get("prompt_tokens", 0)
+                site["completion_tokens"] += usage.get("completion_tokens", 0)
+            site["total_latency_ms"] += latency_ms
+            site["max_latency_ms"] = max(site["max_latency_ms"], latency_ms)
+            site["models"][model] = site["models"].get(model, 0) + 1
+
+    def snapshot(self):
+        with self._lock:
+            out = {}
+            for name, site in self._sites.items():
+                entry = dict(site, models=dict(site["models"]))
+                entry["total_latency_ms"] = round(site["total_latency_ms"], 1)
+                entry["max_latency_ms"] = round(site["max_latency_ms"], 1)
+                entry["avg_latency_ms"] = round(site["total_latency_ms"] / site["calls"], 1)
+                out[name] = entry
+            return out
+
+
+def parse_model_limits(spec):
+    """Parse MODEL_LIMITS, e.g. "gpt-4o=8:30000,gpt-3.5-turbo=16:90000"."""
+    limits = {}
+    for item in filter(None, (s.strip() for s in (spec or "").split(","))):
+        model, _, values = item.partition("=")
+        concurrency, _, tpm = values.partition(":")
+        limits[model.strip()] = (int(concurrency or 0), int(tpm or 0))
+    return limits
+
+
+def sse_chunks(result):
+    """Replay a cached completion as chat.completion.chunk server-sent events."""
+    choice = result["choices"][0]
+    base = {
+        "id": result.get("id"),
+        "object": "chat.completion.chunk",
+        "created": result.get("created"),
+        "model": result.get("model"),
+    }
+    content = choice["message"].get("content") or ""
+    first = dict(base, choices=[{"index": 0, "delta": {"role": "assistant", "content": content}, "finish_reason": None}])
+    last = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": choice.get("finish_reason") or "stop"}])
+    for chunk in (first, last):
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+class StreamAccumulator:
+    """Rebuilds a regular chat.completion from streamed chunks so it can be cached."""
+
+    def __init__(self):
+        self.parts = []
+        self.header = {}
+        self.finish_reason = None
+        self.usage = None
+
+    def add(self, chunk):
+        """Fold in one chunk; returns False for usage-only chunks that carry no choices."""
+        if chunk.get("usage"):
+            self.usage = chunk["usage"]
+        if not chunk.get("choices"):
+            return False
+        if not self.header:
+            self.header = {k: chunk.get(k) for k in ("id", "created", "model")}
+        choice = chunk["choices"][0]
+        content = (choice.get("delta") or {}).get("content")
+        if content:
+            self.parts.append(content)
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+        return True
+
+    def completion(self):
+        return dict(
+            self.header,
+            object="chat.completion",
+            choices=[{
+                "index": 0,
+                "message": {"role": "assistant", "content": "".join(self.parts)},
+                "finish_reason": self.finish_reason or "stop",
+            }],
+            usage=self.usage,
+        )
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+"""
+Fire concurrent chat completions at the gateway and report latency.
+
+Usage (offline, against fake_openai.py):
+    python fake_openai.py &
+    UPSTREAM_BASE=http://localhost:5091/v1 python app.py &
+    python loadtest.py --requests 200 --concurrency 32 --distinct 20
+"""
+import argparse
+import statistics
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--gateway", default="http://localhost:5090")
+    parser.add_argument("--model", default="gpt-4o")
+    parser.add_argument("--requests", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--distinct", type=int, default=10, help="number of distinct prompts to cycle through")
+    args = parser.parse_args()
+
+    def one(i):
+        payload = {
+            "model": args.model,
+            "messages": [{"role": "user", "content": f"load test prompt {i % args.distinct}"}],
+        }
+        started = time.monotonic()
+        resp = requests.post(
+            f"{args.gateway}/v1/chat/completions",
+            json=payload,
+            headers={"X-Call-Site": "loadtest"},
+            timeout=300,
+        )
+        return resp.status_code, resp.headers.get("X-Gateway-Cache"), (time.monotonic() - started) * 1000
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(args.requests)))
+    elapsed = time.monotonic() - started
+
+    latencies = [r[2] for r in results if r[0] == 200]
+    outcomes = {}
+    for status, cache_state, _ in results:
+        label = cache_state if status == 200 else f"http_{status}"
+        outcomes[label] = outcomes.get(label, 0) + 1
+
+    print(f"requests: {len(results)} in {elapsed:.2f}s ({len(results) / elapsed:.1f} req/s)")
+    print(f"outcomes: {outcomes}")
+    if latencies:
+        print(
+            f"latency ms: mean={statistics.mean(latencies):.0f} "
+            f"p50={percentile(latencies, 50):.0f} p95={percentile(latencies, 95):.0f} "
+            f"p99={percentile(latencies, 99):.0f}"
+        )
+    print(requests.get(f"{args.gateway}/stats", timeout=10).json())
+
+
+if __name__ == "__main__":
+    main()
@@ -1,10 +1,18 @@
 import os
-import io
-import requests
 import logging
 from flask import Flask, request, jsonify
 from pymongo import MongoClient
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
+from accounting import DEGRADED, BudgetExceeded, TenantBudgets, summarize_usage
+from dedup import SeenHashes
+from fastpath import VERDICT_SOURCE_LLM, VERDICT_SOURCE_RULES, fast_verdict
+from ingest import MAX_PDF_BYTES, IngestError, from_stream, from_url
+from metrics import cache_result, http_call, instrument, observe, timed
+from pdffeatures import stored_features
+from scoring import SCORE_BATCH_MAX, BatchScorer, ScoreModel
+from similarity import SIMILARITY_MAX_RESULTS, SIMILARITY_MIN_SCORE, SimilarityIndex, reusable, similar_verdict
+from writebehind import BufferFull, WriteBehind
 
 # Logging setup
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
@@ -22,61 +30,138 @@ MONGO_URI = os.getenv('MONGO_URI', 'mongodb://mongodb:27017')
 # Mongo
 client = MongoClient(MONGO_URI)
 db = client.pdf_analysis
+# reports are written in batches off the request path
+# stored_at: insert time for the columnar export watermark (columnar.py)
+writer = WriteBehind(db.reports, 'reports', on_batch=lambda records, seconds: observe('mongo_insert', seconds),
+                     stamp_field='stored_at')
+# known files are answered from their hash before the pipeline runs
+seen = SeenHashes(db.reports, 'hashes.sha256', writer)
+CACHED_FIELDS = {'final':1,'verdict_source':1,'degraded':1}
+# LLM tokens per tenant and budget window
+budgets = TenantBudgets(db.tenant_usage)
+# campaign variants: MinHash/LSH search over similarity sketches taken at ingest
+similar_index = SimilarityIndex(db.reports, 'hashes.sha256', 'final.risk')
+# vectorized re-scoring of stored feature vectors (SCORE_MODEL_FILE or the default rule set)
+batch_scorer = BatchScorer(db.reports, ScoreModel.load(), 'hashes.sha256', 'final.risk')
 
 app = Flask(__name__)
+instrument(app, 'api_service')
+# reject oversized uploads before the multipart body is parsed (1 MiB allowance for form overhead)
+app.config['MAX_CONTENT_LENGTH'] = MAX_PDF_BYTES + 1024 * 1024
+
+@app.errorhandler(IngestError)
+def ingest_error(e):
+    logger.error({'event':'input_rejected','error':str(e),'status':e.status_code})
+    return jsonify({'error':str(e)}),e.status_code
+
+@app.errorhandler(RequestEntityTooLarge)
+def too_large(e):
+    logger.error({'event':'input_rejected','error':'upload too large','status':413})
+    return jsonify({'error':f'PDF exceeds the {MAX_PDF_BYTES} byte limit'}),413
+
+@app.errorhandler(BudgetExceeded)
+def budget_exceeded(e):
+    return jsonify({'error':str(e)}),429
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     logger.info({'event':'request_received'})
-    # Get file or URL
+    tenant = budgets.tenant_of(request.headers)
+    # Get file or URL, streamed into a size-capped spool and hashed on the way
     file = None
+    body = request.get_json(silent=True) or {}
     if 'file' in request.files:
         file = request.files['file']
-        data = file.read()
+        pdf = from_stream(file.stream)
         filename = secure_filename(file.filename)
         logger.info({'event':'file_upload', 'filename':filename})
-    elif request.json and request.json.get('url'):
-        pdf_url = request.json['url']
+    elif body.get('url'):
+        pdf_url = body['url']
         logger.info({'event':'download_started','url':pdf_url})
-        resp = requests.get(pdf_url)
-        if resp.status_code != 200:
-            logger.error({'event':'download_failed','status':resp.status_code})
-            return jsonify({'error':'Unable to download PDF'}),400
-        data = resp.content
+        with timed('download'):
+            pdf = from_url(pdf_url)
         filename = pdf_url.split('/')[-1]
         logger.info({'event':'download_success','filename':filename})
     else:
         logger.error({'event':'invalid_input'})
         return jsonify({'error':'No file or URL provided'}),400
+    try:
+        # Early dedup: a previously analysed file is answered without the pipeline
+        with timed('dedup_lookup'):
+            existing = seen.lookup(pdf.sha256, CACHED_FIELDS)
+        cache_result('reports', 'hit' if existing else 'miss')
+        if existing:
+            logger.info({'event':'cached_report','sha256':pdf.sha256})
+            return cached_response(existing)
+        # The spooled PDF is streamed to the services and closed once the pipeline is done
+        return run_pipeline(pdf, filename, tenant)
+    finally:
+        pdf.close()
+
+def run_pipeline(pdf, filename, tenant):
     # Process PDF
-    files = {'file': (filename, io.BytesIO(data), 'application/pdf')}
-    pdf_proc = requests.post(PDF_PROCESSOR_URL, files=files)
+    upload = pdf.upload(filename)
+    pdf_proc = http_call('pdf_processor', 'POST', PDF_PROCESSOR_URL, data=upload, headers=upload.headers)
     if pdf_proc.status_code !=200:
         logger.error({'event':'pdf_processor_error','status':pdf_proc.status_code})
         return jsonify({'error':'PDF processing failed'}),502
     pdf_res = pdf_proc.json()
-    # Visual
-    vis_resp = requests.post(VISUAL_ANALYSIS_URL, files=files)
-    if vis_resp.status_code!=200:
-        logger.error({'event':'visual_analysis_error','status':vis_resp.status_code})
-        return jsonify({'error':'Visual analysis failed'}),502
-    visual = vis_resp.json()
+    # The feature vector is stored packed, not passed on to the LLM service
+    vector = pdf_res['structural_report'].pop('vector', None)
     # File reputation
-    rep_resp = requests.post(REPUTATION_URL, json={'sha256':pdf_res['hashes']['sha256']})
+    rep_resp = http_call('file_reputation', 'POST', REPUTATION_URL, json={'sha256':pdf_res['hashes']['sha256']})
     if rep_resp.status_code!=200:
         logger.error({'event':'file_reputation_error','status':rep_resp.status_code})
         return jsonify({'error':'File reputation check failed'}),502
     file_rep = rep_resp.json()
+    # Fast path: clear-cut documents skip the LLM stages
+    url_count = len({u['url'] for u in pdf_res['content_report'].get('urls', [])})
+    rule = fast_verdict(pdf_res['structural_report'], file_rep, url_count, vector)
+    # variants of an analysed malicious document take over its verdict
+    if not rule and pdf.similarity:
+        with timed('similarity_search'):
+            match = reusable(similar_index.search(pdf.similarity, exclude=pdf.sha256))
+        if match:
+            rule = similar_verdict(match)
+    if rule:
+        logger.info({'event':'fast_path_verdict','rule':rule['rule']})
+        record = {
+            'filename':filename,'hashes':pdf_res['hashes'],
+            'structural_report':pdf_res['structural_report'],
+            'content_report':pdf_res['content_report'],
+            'visual_report':None,'file_reputation':file_rep,
+            'priority_url':None,'url_reputation':None,
+            'final':{'risk':rule['verdict'],'reasoning':rule['reasoning']},
+            'verdict_source':VERDICT_SOURCE_RULES,'rule':rule['rule'],
+            'tenant':tenant,'llm_usage':None,'degraded':None,
+            'similarity':pdf.similarity,'features':stored_features(vector)
+        }
+        return store_and_respond(record)
+    # Over-budget tenants get a degraded analysis without the visual stage, or a 429
+    degraded = budgets.admit(tenant) == DEGRADED
+    usage = {}
+    # Visual
+    if degraded:
+        visual = None
+    else:
+        upload = pdf.upload(filename)
+        vis_resp = http_call('visual_service', 'POST', VISUAL_ANALYSIS_URL, data=upload, headers=upload.headers)
+        if vis_resp.status_code!=200:
+            logger.error({'event':'visual_analysis_error','status':vis_resp.status_code})
+            return jsonify({'error':'Visual analysis failed'}),502
+        visual = vis_resp.json()
+        usage['visual'] = visual.pop('usage', None)
     # URL selection
-    select_resp = requests.post(LLM_SELECT_URL, json={'urls':pdf_res['urls'],'visual_report':visual})
+    select_resp = http_call('select_url', 'POST', LLM_SELECT_URL, json={'urls':pdf_res['content_report'].get('urls', []),'visual_report':visual})
     if select_resp.status_code!=200:
         logger.error({'event':'url_selection_error','status':select_resp.status_code})
         return jsonify({'error':'URL selection failed'}),502
     priority_url = select_resp.json().get('priority_url')
+    usage['select_url'] = select_resp.json().get('usage')
     url_rep=None
     if priority_url:
         logger.info({'event':'scanning_priority_url','url':priority_url})
-        urlscan_resp = requests.post(URL_REPUTATION_URL, json={'url':priority_url})
+        urlscan_resp = http_call('url_reputation', 'POST', URL_REPUTATION_URL, json={'url':priority_url})
         if urlscan_resp.status_code==200:
             url_rep = urlscan_resp.json()
         else:
@@ -90,11 +175,12 @@ def analyze():
         'priority_url': priority_url,
         'url_reputation': url_rep
     }
-    synth_resp = requests.post(LLM_SYNTH_URL, json=synth_payload)
+    synth_resp = http_call('synthesize', 'POST', LLM_SYNTH_URL, json=synth_payload)
     if synth_resp.status_code!=200:
         logger.error({'event':'synthesis_error','status':synth_resp.status_code})
         return jsonify({'error':'Risk synthesis failed'}),502
     final = synth_resp.json()
+    usage['synthesize'] = final.pop('usage', None)
     # Store
     record = {
         'filename':filename,'hashes':pdf_res['hashes'],
@@ -102,14 +188,88 @@ def analyze():
         'content_report':pdf_res['content_report'],
         'visual_report':visual,'file_reputation':file_rep,
         'priority_url':priority_url,'url_reputation':url_rep,
-        'final':final
+        'final':final,
+        'verdict_source':VERDICT_SOURCE_LLM,'rule':None,
+        'tenant':tenant,'llm_usage':summarize_usage(usage),
+        'degraded':['visual'] if degraded else None,
+        'similarity':pdf.similarity,'features':stored_features(vector)
     }
-    res = db.reports.insert_one(record)
-    logger.info({'event':'record_stored','id':str(res.inserted_id)})
+    return store_and_respond(record)
+
+def cached_response(doc):
+    final = doc['final']
+    response = {'analysis_id': str(doc['_id']), 'risk':final['risk'], 'reasoning':final['reasoning'],
+                'verdict_source':doc.get('verdict_source', VERDICT_SOURCE_LLM)}
+    if doc.get('degraded'):
+        response['degraded'] = doc['degraded']
+    return jsonify(response),200
+
+def store_and_respond(record):
+    try:
+        analysis_id = writer.submit(record)
+    except BufferFull:
+        logger.error({'event':'write_buffer_full'})
+        return jsonify({'error':'Service overloaded, retry later'}),503
+    seen.add(record['hashes']['sha256'])
+    budgets.charge(record['tenant'], record['llm_usage'])
+    logger.info({'event':'record_queued','id':analysis_id})
     # Response
-    response = {'analysis_id': str(res.inserted_id), 'risk':final['risk'], 'reasoning':final['reasoning']}
-    logger.info({'event':'response_sent','analysis_id':str(res.inserted_id)})
+    final = record['final']
+    response = {'analysis_id': analysis_id, 'risk':final['risk'], 'reasoning':final['reasoning'],
+                'verdict_source':record['verdict_source']}
+    if record['degraded']:
+        response['degraded'] = record['degraded']
+    logger.info({'event':'response_sent','analysis_id':analysis_id})
     return jsonify(response),200
 
+@app.route('/results/similar/<sha256>', methods=['GET'])
+def similar_results(sha256):
+    # reports of files that share most of their PDF objects with this one
+    try:
+        limit = min(max(int(request.args.get('limit', SIMILARITY_MAX_RESULTS)), 1), 100)
+        min_score = float(request.args.get('min_score', SIMILARITY_MIN_SCORE))
+    except ValueError:
+        return jsonify({'error':'limit and min_score must be numbers'}),400
+    found, sketch = similar_index.sketch_of(sha256)
+    if not found:
+        pending = writer.find_pending({'hashes.sha256':sha256})
+        if not pending:
+            return jsonify({'error':'Report not found'}),404
+        sketch = pending.get('similarity')
+    if not sketch:
+        return jsonify({'error':'No similarity sketch stored for this report'}),404
+    with timed('similarity_search'):
+        matches = similar_index.search(sketch, exclude=sha256, limit=limit, min_score=min_score)
+    logger.info({'event':'similar_reports','sha256':sha256,'matches':len(matches)})
+    return jsonify({'sha256':sha256,'fingerprint':sketch['fingerprint'],'similar':matches}),200
+
+@app.route('/score/batch', methods=['POST'])
+def score_batch():
+    # score the stored feature vectors of many reports at once with the local model
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify({'error':'Expected a JSON object'}),400
+    query = {}
+    hashes = body.get('sha256')
+    if hashes is not None:
+        if not isinstance(hashes, list):
+            return jsonify({'error':'sha256 must be a list of hashes'}),400
+        query['hashes.sha256'] = {'$in':hashes}
+    risk = body.get('risk')
+    if risk:
+        query['final.risk'] = {'$in':risk if isinstance(risk, list) else risk.split(',')}
+    limit = body.get('limit', SCORE_BATCH_MAX)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        return jsonify({'error':'limit must be a positive integer'}),400
+    with timed('score_batch'):
+        report = batch_scorer.score(query, min(limit, SCORE_BATCH_MAX), bool(body.get('store')))
+    logger.info({'event':'batch_scored','scored':report['scored'],'model':report['model']})
+    return jsonify(report),200
+
+@app.route('/usage', methods=['GET'])
+def usage_report():
+    # LLM tokens and estimated cost per tenant in the current budget window
+    return jsonify(budgets.report(request.args.get('tenant'))),200
+
 if __name__=='__main__':
     app.run(host='0.0.0.0', port=5001)
\ No newline at end of file
@@ -0,0 +1,242 @@
+"""
+Streaming PDF ingest.
+
+Uploads and URL downloads are copied in chunks into a spooled temporary file
+(in memory up to INGEST_SPOOL_MEMORY bytes, on disk beyond that). MD5 and
+SHA256 are updated as the bytes arrive, the `%PDF` header is checked on the
+first bytes, and MAX_PDF_BYTES is enforced mid-stream, so an oversized or
+non-PDF body is rejected without being read to the end. A similarity sketch
+(see similarity.py) is built from the same chunks.
+
+The PDF is never read back into one buffer: stages get it as a streamed
+multipart upload (MultipartUpload) and GridFS through a file-like reader, each
+with its own read position so concurrent uploads can share the spooled file,
+and random access, e.g. for validation, maps the spooled file (mapped()).
+"""
+import asyncio
+import hashlib
+import mmap
+import os
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+from similarity import SIMILARITY_ENABLED, PDFSketcher
+
+MAX_PDF_BYTES = int(os.getenv("MAX_PDF_BYTES", str(50 * 1024 * 1024)))
+INGEST_SPOOL_MEMORY = int(os.getenv("INGEST_SPOOL_MEMORY", str(1024 * 1024)))
+# Connect timeout and total time budget for downloading a PDF from a URL
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv("DOWNLOAD_CONNECT_TIMEOUT", "10"))
+DOWNLOAD_TIMEOUT = float(os.getenv("DOWNLOAD_TIMEOUT", "60"))
+CHUNK_SIZE = 64 * 1024
+PDF_MAGIC = b"%PDF"
+
+
+class IngestError(Exception):
+    """The input was rejected; the message and status code are returned to the client."""
+
+    def __init__(self, message, status_code=400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+class IngestedPDF:
+    """A PDF being received: write() chunks, then finish(); hashes are ready afterwards."""
+
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes or MAX_PDF_BYTES
+        self.file = tempfile.SpooledTemporaryFile(max_size=INGEST_SPOOL_MEMORY)
+        self.size = 0
+        self._md5 = hashlib.md5()
+        self._sha256 = hashlib.sha256()
+        self._head = b""
+        self._sketcher = PDFSketcher() if SIMILARITY_ENABLED else None
+        self.similarity = None
+        self._lock = threading.Lock()
+
+    def write(self, chunk):
+        if not chunk:
+            return
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise IngestError(f"PDF exceeds the {self.max_bytes} byte limit", 413)
+        if len(self._head) < len(PDF_MAGIC):
+            self._head += chunk[:len(PDF_MAGIC)]
+            if not PDF_MAGIC.startswith(self._head[:len(PDF_MAGIC)]):
+                raise IngestError("Invalid PDF file")
+        self._md5.update(chunk)
+        self._sha256.update(chunk)
+        if self._sketcher:
+            self._sketcher.update(chunk)
+        self.file.write(chunk)
+
+    def finish(self):
+        if not self._head.startswith(PDF_MAGIC):
+            raise IngestError("Invalid PDF file")
+        self.md5 = self._md5.hexdigest()
+        self.sha256 = self._sha256.hexdigest()
+        if self._sketcher:
+            self.similarity = self._sketcher.finish()
+        self.file.seek(0)
+        return self
+
+    def read_at(self, offset, size=CHUNK_SIZE):
+        """Up to size bytes from offset."""
+        with self._lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def reader(self):
+        """A file-like reader from the start of the PDF, e.g. for GridFS."""
+        return SpoolReader(self)
+
+    def upload(self, filename="file.pdf", **fields):
+        """A multipart/form-data body with the PDF as "file" and fields as form values."""
+        return MultipartUpload(self, filename, fields)
+
+    @contextmanager
+    def mapped(self):
+        """The PDF for random access: a read-only mmap of the spooled file once it is on disk, its
+        bytes while it is still in memory (at most INGEST_SPOOL_MEMORY)."""
+        if self.size <= INGEST_SPOOL_MEMORY:
+            yield self.read_at(0, self.size)
+            return
+        view = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            yield view
+        finally:
+            view.close()
+
+    def close(self):
+        self.file.close()
+
+
+class SpoolReader:
+    """Reads an IngestedPDF with a read position of its own."""
+
+    def __init__(self, pdf):
+        self.pdf = pdf
+        self.offset = 0
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = self.pdf.size - self.offset
+        chunk = self.pdf.read_at(self.offset, size)
+        self.offset += len(chunk)
+        return chunk
+
+
+class MultipartUpload:
+    """A multipart/form-data body that streams an IngestedPDF in CHUNK_SIZE pieces.
+
+    Pass it as data= to requests or content= to httpx, with headers: the Content-Length is known
+    up front, so neither client falls back to chunked encoding.
+    """
+
+    def __init__(self, pdf, filename, fields):
+        self.pdf = pdf
+        boundary = uuid.uuid4().hex
+        filename = filename.replace('"', "").replace("\r", "").replace("\n", "")
+        parts = [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'
+            for name, value in fields.items()
+        ]
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+            "Content-Type: application/pdf\r\n\r\n"
+        )
+        self._head = "".join(parts).encode("utf-8")
+        self._tail = f"\r\n--{boundary}--\r\n".encode("ascii")
+        self.headers = {
+            "Content-Type": f"multipart/form-data; boundary={boundary}",
+            "Content-Length": str(len(self)),
+        }
+
+    def __len__(self):
+        return len(self._head) + self.pdf.size + len(self._tail)
+
+    def __iter__(self):
+        yield self._head
+        reader = self.pdf.reader()
+        yield from iter(lambda: reader.read(CHUNK_SIZE), b"")
+        yield self._tail
+
+    async def __aiter__(self):
+        yield self._head
+        reader = self.pdf.reader()
+        while True:
+            chunk = await asyncio.to_thread(reader.read, CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        yield self._tail
+
+
+def declared_size(headers, max_bytes):
+    length = headers.get("Content-Length")
+    if length and length.isdigit() and int(length) > max_bytes:
+        raise IngestError(f"PDF exceeds the {max_bytes} byte limit", 413)
+
+
+def from_stream(stream, max_bytes=None):
+    """Ingest a file-like object, e.g. an uploaded file."""
+    pdf = IngestedPDF(max_bytes)
+    try:
+        for chunk in iter(lambda: stream.read(CHUNK_SIZE), b""):
+            pdf.write(chunk)
+        return pdf.finish()
+    except Exception:
+        pdf.close()
+        raise
+
+
+def from_url(url, session=None, max_bytes=None):
+    """Download url with requests, streaming it through the size and header checks."""
+    import requests
+
+    session = session or requests
+    pdf = IngestedPDF(max_bytes)
+    deadline = time.monotonic() + DOWNLOAD_TIMEOUT
+    try:
+        with session.get(url, stream=True, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_TIMEOUT)) as resp:
+            if resp.status_code != 200:
+                raise IngestError(f"Failed to download PDF (status {resp.status_code})")
+            declared_size(resp.headers, pdf.max_bytes)
+            for chunk in resp.iter_content(CHUNK_SIZE):
+                pdf.write(chunk)
+                if time.monotonic() > deadline:
+                    raise IngestError("PDF download timed out", 408)
+        return pdf.finish()
+    except requests.RequestException:
+        pdf.close()
+        raise IngestError("Failed to download PDF")
+    except Exception:
+        pdf.close()
+        raise
+
+
+async def from_url_async(client, url, max_bytes=None):
+    """Download url with an httpx.AsyncClient, streaming it through the size and header checks."""
+    import httpx
+
+    pdf = IngestedPDF(max_bytes)
+    deadline = time.monotonic() + DOWNLOAD_TIMEOUT
+    try:
+        timeout = httpx.Timeout(DOWNLOAD_TIMEOUT, connect=DOWNLOAD_CONNECT_TIMEOUT)
+        async with client.stream("GET", url, timeout=timeout, follow_redirects=True) as resp:
+            if resp.status_code != 200:
+                raise IngestError(f"Failed to download PDF (status {resp.status_code})")
+            declared_size(resp.headers, pdf.max_bytes)
+            async for chunk in resp.aiter_bytes(CHUNK_SIZE):
+                pdf.write(chunk)
+                if time.monotonic() > deadline:
+                    raise IngestError("PDF download timed out", 408)
+        return pdf.finish()
+    except httpx.HTTPError:
+        pdf.close()
+        raise IngestError("Failed to download PDF")
+    except Exception:
+        pdf.close()
+        raise
@@ -0,0 +1,141 @@
+"""
+Vectorized scoring of the feature vectors stored with analyses (see pdffeatures.py).
+
+ScoreModel is a logistic model over a feature vector: counts are log-scaled
+(log1p), weighted per feature and mapped to a 0-1 score, and thresholds turn
+the score into a risk level. The default weights are a hand-set rule set
+(active content, obfuscation and metadata anomalies raise the score, long
+documents lower it); SCORE_MODEL_FILE loads a trained model of the same shape:
+
+    {"name": "lr-2025-05", "bias": -3.0, "weights": {"javascript": 2.0, ...},
+     "thresholds": [0.2, 0.4, 0.6, 0.8]}
+
+BatchScorer reads the packed vectors of the matching records in one query,
+stacks them with a single numpy.frombuffer and scores them all in a few array
+operations, so a fleet of stored analyses is re-scored in seconds instead of
+re-running their pipelines. Records stored without vectors of the current
+FEATURE_VERSION are not scored.
+"""
+import json
+import os
+import time
+from datetime import datetime
+
+import numpy as np
+from pymongo import UpdateOne
+
+from pdffeatures import FEATURE_COUNT, FEATURE_NAMES, FEATURE_VERSION
+from writebehind import field_value
+
+SCORE_MODEL_FILE = os.getenv("SCORE_MODEL_FILE", "")
+# Most records scored by one /score/batch request
+SCORE_BATCH_MAX = int(os.getenv("SCORE_BATCH_MAX", "100000"))
+
+LEVELS = ("Safe", "Low", "Medium", "High", "Malicious")
+# Features used as they are; everything else is a count and log-scaled
+LINEAR_FEATURES = {
+    "pdf_version", "stream_entropy_mean", "stream_entropy_max",
+    "metadata_missing", "metadata_date_mismatch", "metadata_future_date",
+}
+DEFAULT_MODEL = {
+    "name": "rules-v1",
+    "bias": -3.0,
+    "weights": {
+        "javascript": 2.0, "launch": 2.5, "open_action": 1.0, "additional_actions": 0.8,
+        "embedded_files": 1.5, "submit_form": 1.0, "goto_remote": 1.0, "rich_media": 1.0,
+        "xfa": 1.0, "acroform": 0.4, "uri_actions": 0.4, "link_annotations": 0.2, "encrypted": 0.5,
+        "object_streams": 0.2, "xref_sections": 0.3, "filter_ascii_hex": 0.5, "filter_ascii85": 0.3,
+        "hex_escaped_names": 2.0, "header_offset": 0.5, "trailing_bytes": 0.2,
+        "metadata_missing": 0.5, "metadata_date_mismatch": 0.8, "metadata_future_date": 0.8,
+        "pages": -0.3,
+    },
+    "thresholds": [0.2, 0.4, 0.6, 0.8],
+}
+
+
+class ScoreModel:
+    def __init__(self, name, weights, bias=0.0, thresholds=DEFAULT_MODEL["thresholds"]):
+        unknown = sorted(set(weights) - set(FEATURE_NAMES))
+        if unknown:
+            raise ValueError(f"Unknown features in score model {name}: {', '.join(unknown)}")
+        if len(thresholds) != len(LEVELS) - 1:
+            raise ValueError(f"Score model {name} needs {len(LEVELS) - 1} thresholds")
+        self.name = name
+        self.bias = float(bias)
+        self.weights = np.array([weights.get(feature, 0.0) for feature in FEATURE_NAMES], dtype=np.float64)
+        self.log_scaled = np.array([feature not in LINEAR_FEATURES for feature in FEATURE_NAMES])
+        self.thresholds = np.array(sorted(thresholds), dtype=np.float64)
+
+    @classmethod
+    def load(cls, path=SCORE_MODEL_FILE):
+        """The model in path, or the default rule set when no file is configured."""
+        spec = DEFAULT_MODEL
+        if path:
+            with open(path, encoding="utf-8") as f:
+                spec = json.load(f)
+        return cls(spec.get("name", os.path.basename(path)), spec["weights"], spec.get("bias", 0.0),
+                   spec.get("thresholds", DEFAULT_MODEL["thresholds"]))
+
+    def score(self, matrix):
+        """(scores, level indexes into LEVELS) for a records x FEATURE_COUNT matrix."""
+        values = np.where(self.log_scaled, np.log1p(np.maximum(matrix, 0)), matrix)
+        scores = 1.0 / (1.0 + np.exp(-(values @ self.weights + self.bias)))
+        return scores, np.searchsorted(self.thresholds, scores, side="right")
+
+
+class BatchScorer:
+    def __init__(self, collection, model, sha_field="sha256", verdict_field="risk_score"):
+        """collection: the analyses; sha_field and verdict_field: where each record keeps its
+        SHA256 and risk verdict (dotted paths allowed)."""
+        self.collection = collection
+        self.model = model
+        self.sha_field = sha_field
+        self.verdict_field = verdict_field
+
+    def load(self, query, limit=SCORE_BATCH_MAX):
+        """(documents, records x FEATURE_COUNT matrix) of the matching records with current vectors."""
+        query = dict(query, **{"features.version": FEATURE_VERSION})
+        projection = {self.sha_field: 1, self.verdict_field: 1, "features.vector": 1}
+        docs, blobs = [], []
+        for doc in self.collection.find(query, projection).limit(limit).batch_size(10000):
+            blob = doc.pop("features")["vector"]
+            if len(blob) == FEATURE_COUNT * 4:
+                docs.append(doc)
+                blobs.append(blob)
+        matrix = np.frombuffer(b"".join(blobs), dtype="<f4").reshape(len(blobs), FEATURE_COUNT)
+        return docs, matrix
+
+    def score(self, query, limit=SCORE_BATCH_MAX, store=False):
+        """Score the matching records, most suspicious first; store=True keeps the
+        scores on the records as model_score and marks them updated (updated_at)."""
+        started = time.monotonic()
+        docs, matrix = self.load(query, limit)
+        loaded = time.monotonic()
+        scores, levels = self.model.score(matrix)
+        results = []
+        for doc, score, level in zip(docs, scores.tolist(), levels.tolist()):
+            results.append({
+                "sha256": field_value(doc, self.sha_field),
+                "analysis_id": str(doc["_id"]),
+                "score": round(score, 4),
+                "risk": LEVELS[level],
+                "stored_risk": field_value(doc, self.verdict_field),
+            })
+        results.sort(key=lambda result: result["score"], reverse=True)
+        if store and results:
+            scored_at = datetime.utcnow()
+            self.collection.bulk_write([
+                UpdateOne({"_id": doc["_id"]}, {"$set": {"model_score": {
+                    "model": self.model.name, "score": round(score, 4), "risk": LEVELS[level], "at": scored_at
+                }, "updated_at": scored_at}})
+                for doc, score, level in zip(docs, scores.tolist(), levels.tolist())
+            ], ordered=False)
+        return {
+            "model": self.model.name,
+            "feature_version": FEATURE_VERSION,
+            "scored": len(results),
+            "levels": {name: int(count) for name, count in zip(LEVELS, np.bincount(levels, minlength=len(LEVELS)))},
+            "disagreements": sum(1 for result in results if result["stored_risk"] not in (None, result["risk"])),
+            "seconds": {"load": round(loaded - started, 3), "total": round(time.monotonic() - started, 3)},
+            "results": results,
+        }
@@ -0,0 +1,250 @@
+"""
+Similarity sketches of ingested PDFs and a MinHash/LSH index over stored analyses.
+
+Campaign variants of a PDF differ in a few bytes (recipient name, link,
+timestamp), so their SHA256s differ while most of the file does not.
+PDFSketcher is fed the bytes while they are ingested (see ingest.py) and cuts
+them at `endobj`, the end of every PDF object:
+
+- each object, without its object number, is hashed with BLAKE2b, and the set
+  of object hashes is summarized in a 64-slot one-permutation MinHash: the
+  share of slots two sketches agree on estimates the share of objects the two
+  files have in common (Jaccard similarity);
+- the object dictionaries give a structural fingerprint: object type
+  histogram, producer and the layout of link annotations, hashed into one key.
+
+The per-object work is done by hashlib, bytes.find and compiled patterns, so
+sketching adds little to ingesting a file. Bytes outside objects (xref tables,
+trailers) are ignored since every rewrite changes them.
+
+SimilarityIndex stores sketches with the analyses. The 64 slots are cut into
+16 bands of 4 (locality-sensitive hashing): records that share a band or the
+structural fingerprint are found through multikey indexes and then scored. Two
+files share a band with probability 1 - (1 - s^4)^16 for similarity s, 0.99 at
+0.7 and 0.64 at 0.5, so candidate lookups stay indexed over any number of
+records.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+
+from pymongo import ASCENDING
+
+from writebehind import field_value
+
+logger = logging.getLogger("similarity")
+
+SIMILARITY_ENABLED = os.getenv("SIMILARITY_ENABLED", "true").lower() in ("1", "true", "yes")
+# Lowest estimated similarity reported as a match
+SIMILARITY_MIN_SCORE = float(os.getenv("SIMILARITY_MIN_SCORE", "0.6"))
+SIMILARITY_MAX_RESULTS = int(os.getenv("SIMILARITY_MAX_RESULTS", "10"))
+SIMILARITY_MAX_CANDIDATES = int(os.getenv("SIMILARITY_MAX_CANDIDATES", "1000"))
+# A new file this similar to an LLM-reviewed analysis with the same structure takes over its verdict
+# when the verdict is one of SIMILARITY_REUSE_VERDICTS (0 disables)
+SIMILARITY_REUSE_THRESHOLD = float(os.getenv("SIMILARITY_REUSE_THRESHOLD", "0.9"))
+SIMILARITY_REUSE_VERDICTS = os.getenv("SIMILARITY_REUSE_VERDICTS", "High,Malicious")
+
+SLOTS = 64
+BANDS = 16
+ROWS = SLOTS // BANDS
+MAX_ANNOTATIONS = 100
+# Dictionary bytes examined per object for the structural fingerprint
+HEAD_BYTES = 2048
+
+END_OBJECT = b"endobj"
+OBJECT_HEADER = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+TYPE = re.compile(rb"/Type\s*/([A-Za-z]+)")
+SUBTYPE = re.compile(rb"/Subtype\s*/([A-Za-z0-9]+)")
+RECT = re.compile(rb"/Rect\s*\[\s*([-+\d.\s]+)\]")
+PRODUCER = re.compile(rb"/Producer\s*\(((?:[^()\\]|\\.){0,200})\)")
+
+REUSE_VERDICTS = {v.strip() for v in SIMILARITY_REUSE_VERDICTS.split(",") if v.strip()}
+REUSE_RULE = "similar_document"
+
+
+def _hash64(data):
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "big")
+
+
+def _densify(mins):
+    """Fill empty slots from the next filled one, so sketches of small files stay comparable."""
+    filled = [i for i, value in enumerate(mins) if value is not None]
+    if not filled:
+        return None
+    result = list(mins)
+    for i, value in enumerate(mins):
+        if value is None:
+            result[i] = mins[next((j for j in filled if j > i), filled[0])]
+    return result
+
+
+def bands(minhash):
+    """LSH band keys of a MinHash: band number and a hash of its ROWS slots."""
+    keys = []
+    for band in range(BANDS):
+        rows = minhash[band * ROWS:(band + 1) * ROWS]
+        keys.append(f"{band:x}{hashlib.blake2b(json.dumps(rows).encode(), digest_size=8).hexdigest()}")
+    return keys
+
+
+def estimate(a, b):
+    """Estimated Jaccard similarity of the object sets behind two MinHashes."""
+    return sum(1 for x, y in zip(a, b) if x == y) / SLOTS
+
+
+class PDFSketcher:
+    """Incremental sketch of a PDF: update() with chunks as they arrive, then finish()."""
+
+    def __init__(self):
+        self._buffer = bytearray()
+        self._scanned = 0
+        self._mins = [None] * SLOTS
+        self._objects = 0
+        self._types = {}
+        self._annotations = []
+        self._producer = None
+
+    def update(self, chunk):
+        self._buffer += chunk
+        start = 0
+        while True:
+            # Resume where the last search stopped, minus a marker split across chunks
+            end = self._buffer.find(END_OBJECT, max(start, self._scanned - len(END_OBJECT) + 1))
+            if end < 0:
+                break
+            self._object(bytes(self._buffer[start:end]))
+            start = end + len(END_OBJECT)
+        if start:
+            del self._buffer[:start]
+        self._scanned = len(self._buffer)
+
+    def _object(self, segment):
+        header = OBJECT_HEADER.search(segment)
+        if not header:
+            return
+        body = segment[header.end():]
+        self._objects += 1
+        value = _hash64(body.strip())
+        slot, value = value % SLOTS, value // SLOTS
+        if self._mins[slot] is None or value < self._mins[slot]:
+            self._mins[slot] = value
+        head = body[:HEAD_BYTES].split(b"stream", 1)[0]
+        kind = TYPE.search(head)
+        kind = kind.group(1).decode("ascii") if kind else "Other"
+        if kind == "Annot" or (kind == "Other" and b"/Rect" in head):
+            subtype = SUBTYPE.search(head)
+            kind = "Annot/" + (subtype.group(1).decode("ascii") if subtype else "Other")
+            rect = RECT.search(head)
+            if rect and len(self._annotations) < MAX_ANNOTATIONS:
+                try:
+                    self._annotations.append([round(float(v) / 10) * 10 for v in rect.group(1).split()[:4]])
+                except ValueError:
+                    pass
+        self._types[kind] = self._types.get(kind, 0) + 1
+        if self._producer is None:
+            producer = PRODUCER.search(head)
+            if producer:
+                self._producer = producer.group(1).decode("latin-1")
+
+    def finish(self):
+        """The sketch stored with an analysis, or None for a file without objects."""
+        minhash = _densify(self._mins)
+        if minhash is None:
+            return None
+        structure = {
+            "types": dict(sorted(self._types.items())),
+            "producer": self._producer,
+            "annotations": sorted(self._annotations),
+        }
+        return {
+            "objects": self._objects,
+            "minhash": minhash,
+            "bands": bands(minhash),
+            "fingerprint": hashlib.blake2b(json.dumps(structure, sort_keys=True).encode(), digest_size=8).hexdigest(),
+            "structure": structure,
+        }
+
+
+def sketch_bytes(data):
+    sketcher = PDFSketcher()
+    sketcher.update(data)
+    return sketcher.finish()
+
+
+class SimilarityIndex:
+    def __init__(self, collection, sha_field="sha256", verdict_field="risk_score"):
+        """collection: the analyses; sha_field and verdict_field: where each record keeps its
+        SHA256 and risk verdict (dotted paths allowed)."""
+        self.collection = collection
+        self.sha_field = sha_field
+        self.verdict_field = verdict_field
+        try:
+            collection.create_index([("similarity.bands", ASCENDING)], name="similarity_bands")
+            collection.create_index([("similarity.fingerprint", ASCENDING)], name="similarity_fingerprint")
+        except Exception:
+            logger.exception("Similarity index creation failed; /results/similar will be unindexed")
+
+    def sketch_of(self, sha256):
+        """(found, sketch) of a stored analysis; the sketch is None for records stored without one."""
+        doc = self.collection.find_one({self.sha_field: sha256}, {"similarity": 1})
+        return doc is not None, (doc or {}).get("similarity")
+
+    def search(self, sketch, exclude=None, limit=SIMILARITY_MAX_RESULTS, min_score=SIMILARITY_MIN_SCORE):
+        """Stored analyses similar to sketch, most similar first.
+
+        Each match has sha256, analysis_id, similarity (estimated share of PDF objects in
+        common), structure_match (same structural fingerprint), verdict and verdict_source.
+        """
+        if not sketch:
+            return []
+        query = {"$or": [{"similarity.bands": {"$in": sketch["bands"]}},
+                         {"similarity.fingerprint": sketch["fingerprint"]}]}
+        if exclude:
+            query[self.sha_field] = {"$ne": exclude}
+        projection = {self.sha_field: 1, self.verdict_field: 1, "verdict_source": 1,
+                      "similarity.minhash": 1, "similarity.fingerprint": 1}
+        matches = []
+        for doc in self.collection.find(query, projection).limit(SIMILARITY_MAX_CANDIDATES):
+            other = doc.get("similarity") or {}
+            if not other.get("minhash"):
+                continue
+            score = estimate(sketch["minhash"], other["minhash"])
+            same = other.get("fingerprint") == sketch["fingerprint"]
+            if score >= min_score:
+                matches.append({
+                    "sha256": field_value(doc, self.sha_field),
+                    "analysis_id": str(doc["_id"]),
+                    "similarity": round(score, 3),
+                    "structure_match": same,
+                    "verdict": field_value(doc, self.verdict_field),
+                    "verdict_source": doc.get("verdict_source"),
+                })
+        matches.sort(key=lambda match: (match["similarity"], match["structure_match"]), reverse=True)
+        return matches[:limit]
+
+
+def reusable(matches):
+    """The first match whose verdict a new file may take over, or None.
+
+    Only LLM-reviewed verdicts in REUSE_VERDICTS are reused: a benign template with one
+    swapped link must still be analysed, a variant of a malicious one need not be.
+    """
+    if not SIMILARITY_REUSE_THRESHOLD:
+        return None
+    for match in matches:
+        if match["similarity"] >= SIMILARITY_REUSE_THRESHOLD and match["structure_match"] and \
+                match["verdict"] in REUSE_VERDICTS and match["verdict_source"] == "llm":
+            return match
+    return None
+
+
+def similar_verdict(match):
+    """Rule-based verdict (as fastpath.fast_verdict returns) taken over from a similar analysis."""
+    return {
+        "verdict": match["verdict"],
+        "reasoning": (f"Near-identical to analysis {match['sha256']} ({match['similarity']:.0%} of PDF objects "
+                      f"shared, same structure), which was rated {match['verdict']} after LLM review."),
+        "rule": REUSE_RULE,
+    }
@@ -1,25 +1,31 @@
 import os
-import json
 import logging
 from flask import Flask, request, jsonify
 import openai
+from evidence import compact_evidence, dumps as evidence_dumps, url_candidates
+from llmjson import JSON_MODE, PRIORITY_SCHEMA_HINT, parse_structured, validate_priority, validate_risk
+from metrics import LLMUsage, instrument, llm_headers
+
+RISK_SCHEMA_HINT = '{"risk": "Safe|Low|Medium|High|Malicious", "reasoning": "<brief reasoning>"}'
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger('llm_service')
 app = Flask(__name__)
+instrument(app, 'llm_service')
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
 @app.route('/select_url', methods=['POST'])
 def select_url():
     data = request.json
-    urls = data.get('urls', [])
-    visual = data.get('visual_report')
-    prompt = f"Given URLs: {urls} and visual report: {visual}, select the single priority URL or null. Respond JSON {{\"priority_url\": ...}}"
+    # One compact line per URL with its local domain risk, within SELECT_URL_TOKEN_BUDGET
+    urls, visual = url_candidates(None, data.get('urls'), data.get('visual_report'))
+    prompt = f"Given URLs (URL | where found x count | local domain risk: signals | context):\n{urls or 'none'}\nand visual report: {visual}, select the single priority URL or null. Respond JSON {{\"priority_url\": ...}}"
+    usage = LLMUsage()
     try:
-        resp = openai.ChatCompletion.create(model="gpt-4o", messages=[{"role":"user","content":prompt}])
-        result = json.loads(resp.choices[0].message.content)
+        resp = usage.create(model="gpt-4o", messages=[{"role":"user","content":prompt}], headers=llm_headers('llm_service.select_url'), **JSON_MODE)
+        result = parse_structured(resp.choices[0].message.content, validate_priority, PRIORITY_SCHEMA_HINT, 'llm_service.select_url', usage)
         logger.info({'event':'select_url_success','url':result.get('priority_url')})
-        return jsonify(result),200
+        return jsonify(dict(result, usage=usage.as_dict())),200
     except Exception as e:
         logger.error({'event':'select_url_error','error':str(e)})
         return jsonify({'error':'URL selection failed'}),502
@@ -27,12 +33,13 @@ def select_url():
 @app.route('/synthesize', methods=['POST'])
 def synth():
     bundle = request.json
-    prompt = f"Synthesize risk from data: {bundle}. Respond JSON {'{'}\"risk\":...,\"reasoning\":...{'}'}"
+    prompt = f"Synthesize risk from data: {evidence_dumps(compact_evidence(bundle))}. Respond JSON {'{'}\"risk\":...,\"reasoning\":...{'}'}"
+    usage = LLMUsage()
     try:
-        resp = openai.ChatCompletion.create(model="gpt-4o", messages=[{"role":"user","content":prompt}])
-        result = json.loads(resp.choices[0].message.content)
+        resp = usage.create(model="gpt-4o", messages=[{"role":"user","content":prompt}], headers=llm_headers('llm_service.synthesize'), **JSON_MODE)
+        result = parse_structured(resp.choices[0].message.content, lambda obj: validate_risk(obj, 'risk'), RISK_SCHEMA_HINT, 'llm_service.synthesize', usage)
         logger.info({'event':'synthesis_success','risk':result.get('risk')})
-        return jsonify(result),200
+        return jsonify(dict(result, usage=usage.as_dict())),200
     except Exception as e:
         logger.error({'event':'synthesis_error','error':str(e)})
         return jsonify({'error':'Synthesis failed'}),502
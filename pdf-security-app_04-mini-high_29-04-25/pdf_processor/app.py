@@ -1,47 +1,59 @@
 import os
-import io
 import json
 import logging
 from flask import Flask, request, jsonify
 import hashlib
-from PyPDF2 import PdfReader
+from domainintel import DomainIndex
+from extractors import get_extractor
+from metrics import instrument, timed
+from pdfwalk import MalformedPDF, structure
+from urlextract import extract_urls, merge_annotations
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger('pdf_processor')
 app = Flask(__name__)
+instrument(app, 'pdf_processor')
+# Text extraction engine, PDF_TEXT_BACKEND (see extractors.py)
+TEXT_BACKEND, extract_pages = get_extractor(default='pypdf2')
+logger.info({'event':'text_backend','backend':TEXT_BACKEND})
+# Local allow/deny lists, public suffixes and lookalike brands (see domainintel.py)
+domain_index = DomainIndex()
 
 @app.route('/process', methods=['POST'])
 def process():
     file = request.files.get('file')
     data = file.read()
-    # Validate PDF
-    if not data.startswith(b'%PDF'):
-        logger.error('Invalid PDF')
+    # Validate PDF and walk its catalog and link annotations lazily, within budgets; the feature
+    # vector for bulk scoring comes from the same walk (see pdfwalk.py)
+    try:
+        with timed('parse'):
+            walked = structure(data)
+    except MalformedPDF as e:
+        logger.error({'event':'invalid_pdf','error':str(e)})
         return jsonify({'error':'Not a valid PDF'}),400
     # Hashes
     md5 = hashlib.md5(data).hexdigest()
     sha256 = hashlib.sha256(data).hexdigest()
     hashes = {'md5':md5,'sha256':sha256}
     logger.info({'event':'hashes_calculated','hashes':hashes})
-    # Structural
-    reader = PdfReader(io.BytesIO(data))
-    info = reader.metadata
+    # Structural; javascript includes what the feature vector counts in page and annotation actions
     features = {
-        'javascript': '/JavaScript' in reader.trailer.keys(),
-        'encrypted': reader.is_encrypted,
-        'forms': bool(reader.trailer.get('/AcroForm'))
+        'javascript': walked['javascript'],
+        'encrypted': walked['encrypted'],
+        'forms': walked['forms']
     }
-    struct = {'metadata':{k:str(v) for k,v in info.items()}, 'features':features}
+    struct = {'metadata':{'/'+k:v for k,v in walked['metadata'].items()}, 'features':features,
+              'walk':walked['walk'], 'vector':walked['vector']}
     logger.info({'event':'structural_analysis_done'})
     # Content
-    text = ''
-    urls=[]
-    for page in reader.pages:
-        text += page.extract_text() or ''
-        # naive URL find
-    import re
-    for match in re.finditer(r'(https?://\S+)', text):
-        urls.append({'url':match.group(1), 'context': text[max(0,match.start()-30):match.end()+30]})
+    with timed('extract_text'):
+        pages = extract_pages(data)
+    text = '\n'.join(pages)
+    # Deduplicated, normalized URLs from the text and link annotations
+    with timed('extract_urls'):
+        urls = merge_annotations(extract_urls(pages), walked['links'])
+    with timed('domain_intel'):
+        domain_index.annotate(urls)
     content = {'text': text[:1000], 'urls': urls}
     logger.info({'event':'content_extraction_done','urls_found':len(urls)})
     return jsonify({'hashes':hashes, 'structural_report':struct, 'content_report':content}),200
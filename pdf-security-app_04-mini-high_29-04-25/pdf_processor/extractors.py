@@ -0,0 +1,113 @@
+"""
+Pluggable PDF text extraction backends.
+
+PDF_TEXT_BACKEND selects the engine a service uses to extract text:
+
+- pypdf2     PyPDF2 (the original engine of service-pdf and pdf_processor)
+- pypdf      pypdf, PyPDF2's maintained successor
+- pdfminer   pdfminer.six (the original engine of analysis_service)
+- pypdfium2  PDFium bindings
+- pymupdf    PyMuPDF (MuPDF bindings, AGPL licensed)
+
+Libraries are imported on first use, so a service only needs the backend it
+is configured with installed. Each backend returns one string per page;
+bench/extractbench.py compares their speed, memory and URL recall.
+"""
+import io
+import os
+
+# Package to install for each backend
+PACKAGES = {
+    "pypdf2": "PyPDF2",
+    "pypdf": "pypdf",
+    "pdfminer": "pdfminer.six",
+    "pypdfium2": "pypdfium2",
+    "pymupdf": "PyMuPDF",
+}
+
+
+class ExtractorUnavailable(RuntimeError):
+    """The configured backend is unknown or its library is not installed."""
+
+
+def _pypdf2(data):
+    from PyPDF2 import PdfReader
+
+    return [page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages]
+
+
+def _pypdf(data):
+    from pypdf import PdfReader
+
+    return [page.extract_text() or "" for page in PdfReader(io.BytesIO(data)).pages]
+
+
+def _pdfminer(data):
+    from pdfminer.high_level import extract_text
+
+    # Pages are separated by form feeds, with one after the last page
+    pages = extract_text(io.BytesIO(data)).split("\x0c")
+    return pages[:-1] if len(pages) > 1 and not pages[-1].strip() else pages
+
+
+def _pypdfium2(data):
+    import pypdfium2
+
+    pdf = pypdfium2.PdfDocument(data)
+    try:
+        pages = []
+        for page in pdf:
+            textpage = page.get_textpage()
+            pages.append(textpage.get_text_range())
+            textpage.close()
+            page.close()
+        return pages
+    finally:
+        pdf.close()
+
+
+def _pymupdf(data):
+    try:
+        import pymupdf
+    except ImportError:
+        import fitz as pymupdf
+
+    with pymupdf.open(stream=data, filetype="pdf") as doc:
+        return [page.get_text() for page in doc]
+
+
+BACKENDS = {
+    "pypdf2": _pypdf2,
+    "pypdf": _pypdf,
+    "pdfminer": _pdfminer,
+    "pypdfium2": _pypdfium2,
+    "pymupdf": _pymupdf,
+}
+_MODULES = {"pypdf2": "PyPDF2", "pypdf": "pypdf", "pdfminer": "pdfminer", "pypdfium2": "pypdfium2",
+            "pymupdf": "fitz"}
+
+
+def installed(name):
+    import importlib.util
+
+    return importlib.util.find_spec(_MODULES[name]) is not None
+
+
+def available():
+    return [name for name in BACKENDS if installed(name)]
+
+
+def get_extractor(name=None, default="pypdf2"):
+    """Return (name, fn) for the backend named, or PDF_TEXT_BACKEND, or default.
+    fn(pdf_bytes) returns the text of each page."""
+    name = (name or os.getenv("PDF_TEXT_BACKEND") or default).strip().lower()
+    if name not in BACKENDS:
+        raise ExtractorUnavailable(f"Unknown PDF text backend {name!r} (use one of {', '.join(BACKENDS)})")
+    if not installed(name):
+        raise ExtractorUnavailable(f"PDF text backend {name!r} needs `pip install {PACKAGES[name]}`")
+    return name, BACKENDS[name]
+
+
+def extract_text(extractor, data):
+    """Text of the whole document, one line break between pages."""
+    return "\n".join(extractor(data))
@@ -0,0 +1,710 @@
+"""
+Lazy, budgeted structural walk of a PDF, object by object.
+
+PdfReader(...).pages builds the whole page tree and every structural check then
+loads all annotations, so a file with a huge cross-reference table, thousands
+of pages or deeply nested object streams costs time and memory in proportion to
+its worst part. PDFWalker reads only what it is asked for:
+
+- the cross-reference sections are located from `startxref` and followed
+  through /Prev; classic tables are not parsed, an entry is read at its fixed
+  20-byte position when its object is needed, and xref streams are kept as
+  their decoded bytes and indexed the same way. Files whose xref is missing or
+  broken fall back to one scan for `N G obj` headers;
+- objects are parsed when resolved, object streams are decompressed when one
+  of their objects is needed, and both are cached;
+- every walk has budgets: indirect objects resolved (WALK_MAX_OBJECTS), values
+  parsed (WALK_MAX_ITEMS), bytes decompressed (WALK_MAX_INFLATE_BYTES), pages
+  visited (WALK_MAX_PAGES) and nesting depth (WALK_MAX_DEPTH), which counts
+  object streams resolved inside object streams as well as nested values. An
+  indirect stream /Length is read as a bare integer, without parsing, so
+  chains of streams cannot nest resolves. A spent budget raises
+  BudgetExceeded; structure() stops there and reports what it found and
+  which budget ran out, so decompression bombs and page-tree loops cannot
+  stall a worker;
+- PNG predictor rows are checked against the inflate budget, and rows that
+  are not Up-predicted (undone byte by byte) are charged to the items budget.
+
+check_pdf() is the fast validation: a header, a readable trailer or object
+index and a catalog, without touching any page. structure() walks the catalog
+and pages and adds the feature vector of pdffeatures.py in the same call: the
+object streams the walk inflated are handed to feature_vector() instead of
+being inflated again, and the JavaScript and embedded file flags also count the
+names the vector finds in page and annotation dictionaries.
+"""
+import os
+import re
+import threading
+import zlib
+
+from pdffeatures import FEATURE_NAMES, FEATURE_VERSION, feature_vector
+
+WALK_MAX_OBJECTS = int(os.getenv("WALK_MAX_OBJECTS", "20000"))
+WALK_MAX_ITEMS = int(os.getenv("WALK_MAX_ITEMS", "2000000"))
+WALK_MAX_INFLATE_BYTES = int(os.getenv("WALK_MAX_INFLATE_BYTES", str(32 * 1024 * 1024)))
+WALK_MAX_PAGES = int(os.getenv("WALK_MAX_PAGES", "2000"))
+WALK_MAX_DEPTH = int(os.getenv("WALK_MAX_DEPTH", "64"))
+# Pages whose link text is read with PDFium (anchor text); 0 skips it
+WALK_ANCHOR_PAGES = int(os.getenv("WALK_ANCHOR_PAGES", "50"))
+
+# Bytes searched for the header at the start and for startxref at the end
+HEADER_WINDOW = 1024
+TRAILER_WINDOW = 64 * 1024
+MAX_XREF_SECTIONS = 64
+# Up-predicted rows undone per big-integer prefix sum
+PREDICTOR_CHUNK_ROWS = 1024
+
+WHITESPACE = b" \t\r\n\x0c\x00"
+DELIMITERS = b"()<>[]{}/%"
+REGULAR = re.compile(rb"[^\s()<>\[\]{}/%\x00]+")
+NUMBER = re.compile(rb"[+-]?(?:\d+\.?\d*|\.\d+)")
+HEX_ESCAPE = re.compile(rb"#([0-9A-Fa-f]{2})")
+# Predictor tags: runs of Up rows, runs of rows stored as they are (None or unknown), other rows
+PREDICTOR_RUN = re.compile(rb"\x02+|[^\x01-\x04]+|[\x01\x03\x04]")
+REFERENCE = re.compile(rb"\s+(\d+)\s+R\b")
+OBJECT_HEADER = re.compile(rb"(\d+)\s+(\d+)\s+obj\b")
+XREF_SUBSECTION = re.compile(rb"\s*(\d+)\s+(\d+)\s*[\r\n]")
+ESCAPES = {b"n": b"\n", b"r": b"\r", b"t": b"\t", b"b": b"\b", b"f": b"\f", b"(": b"(", b")": b")", b"\\": b"\\"}
+
+PDFIUM_LOCK = threading.Lock()
+
+
+class MalformedPDF(ValueError):
+    """The file is not a PDF the walker can read."""
+
+
+class BudgetExceeded(Exception):
+    """A walk budget ran out; budget names it."""
+
+    def __init__(self, budget):
+        super().__init__(f"Walk budget exceeded: {budget}")
+        self.budget = budget
+
+
+class Name(str):
+    """A PDF name, without the slash."""
+
+
+class Ref(tuple):
+    """An indirect reference (number, generation)."""
+
+    @property
+    def number(self):
+        return self[0]
+
+
+class Stream(dict):
+    """A stream dictionary; raw is the undecoded data, start its offset in the file (None inside
+    object streams)."""
+
+    raw = b""
+    start = None
+
+
+def text(value):
+    """A PDF string or other value as text."""
+    if isinstance(value, bytes):
+        if value.startswith(b"\xfe\xff"):
+            return value[2:].decode("utf-16-be", errors="replace")
+        if value.startswith(b"\xef\xbb\xbf"):
+            return value[3:].decode("utf-8", errors="replace")
+        return value.decode("latin-1")
+    return "" if value is None else str(value)
+
+
+def _add_bytes(x, y, low, high):
+    """Bytewise sum mod 256 of two byte strings held as big integers: one addition with the
+    carries out of each byte masked off (low: 0x7f bytes, high: 0x80 bytes)."""
+    return ((x & low) + (y & low)) ^ ((x ^ y) & high)
+
+
+def _up_rows(block, previous, columns):
+    """Undo the Up predictor over consecutive rows. Each row is the bytewise sum of the rows
+    before it, so a chunk of rows is a prefix sum: log2(rows) shifted additions of the whole
+    chunk instead of a Python step per byte."""
+    out = bytearray()
+    size = columns * PREDICTOR_CHUNK_ROWS
+    for start in range(0, len(block), size):
+        chunk = block[start:start + size]
+        n = len(chunk)
+        low, high = int.from_bytes(b"\x7f" * n, "big"), int.from_bytes(b"\x80" * n, "big")
+        total, shift = int.from_bytes(chunk, "big"), columns
+        while shift < n:
+            total = _add_bytes(total, total >> 8 * shift, low, high)
+            shift *= 2
+        total = _add_bytes(total, int.from_bytes(previous * (n // columns), "big"), low, high)
+        chunk = total.to_bytes(n, "big")
+        out += chunk
+        previous = chunk[-columns:]
+    return out
+
+
+def _at(data, pos, prefix):
+    """data.startswith(prefix, pos) for bytes and mmap alike."""
+    return data[pos:pos + len(prefix)] == prefix
+
+
+class PDFWalker:
+    def __init__(self, data, max_objects=WALK_MAX_OBJECTS, max_items=WALK_MAX_ITEMS,
+                 max_inflate=WALK_MAX_INFLATE_BYTES, max_depth=WALK_MAX_DEPTH):
+        self.data = data
+        self.max_objects = max_objects
+        self.max_items = max_items
+        self.max_inflate = max_inflate
+        self.max_depth = max_depth
+        self.objects = 0
+        self.items = 0
+        self.inflated = 0
+        self._cache = {}
+        self._objstms = {}
+        # {file offset: inflated data} of the Flate object streams read, for feature_vector()
+        self.objstm_data = {}
+        self._scanned = None
+        self._resolving = 0
+        header = data.find(b"%PDF-", 0, HEADER_WINDOW)
+        if header < 0:
+            raise MalformedPDF("No PDF header")
+        self.version = data[header + 5:header + 8].decode("latin-1", errors="replace")
+        self.sections = []
+        self.trailer = {}
+        try:
+            self._read_xref()
+        except (MalformedPDF, ValueError, IndexError, zlib.error):
+            self.sections, self.trailer = [], {}
+        if "Root" not in self.trailer:
+            self._scan_trailer()
+
+    # Parsing
+
+    def _count(self):
+        self.items += 1
+        if self.items > self.max_items:
+            raise BudgetExceeded("items")
+
+    def _skip(self, pos, data=None):
+        data = self.data if data is None else data
+        while pos < len(data):
+            c = data[pos]
+            if c in WHITESPACE:
+                pos += 1
+            elif c == 0x25:  # % comment
+                end = data.find(b"\n", pos)
+                cr = data.find(b"\r", pos)
+                ends = [e for e in (end, cr) if e >= 0]
+                pos = min(ends) + 1 if ends else len(data)
+            else:
+                break
+        return pos
+
+    def parse(self, pos, depth=0, data=None):
+        """(value, end) of the object at pos of data (the file, or a decoded object stream)."""
+        if depth + self._resolving > self.max_depth:
+            raise BudgetExceeded("depth")
+        self._count()
+        data = self.data if data is None else data
+        pos = self._skip(pos, data)
+        if pos >= len(data):
+            raise MalformedPDF("Unexpected end of file")
+        c = data[pos:pos + 1]
+        if _at(data, pos, b"<<"):
+            return self._dict(pos + 2, depth, data)
+        if c == b"[":
+            items, pos = [], pos + 1
+            while True:
+                pos = self._skip(pos, data)
+                if pos >= len(data):
+                    raise MalformedPDF("Unterminated array")
+                if data[pos:pos + 1] == b"]":
+                    return items, pos + 1
+                value, pos = self.parse(pos, depth + 1, data)
+                items.append(value)
+        if c == b"/":
+            match = REGULAR.match(data, pos + 1)
+            raw = match.group(0) if match else b""
+            if b"#" in raw:
+                raw = HEX_ESCAPE.sub(lambda m: bytes([int(m.group(1), 16)]), raw)
+            return Name(raw.decode("latin-1")), pos + 1 + (match.end() - match.start() if match else 0)
+        if c == b"(":
+            return self._literal(pos + 1, data)
+        if c == b"<":
+            end = data.find(b">", pos)
+            if end < 0:
+                raise MalformedPDF("Unterminated hex string")
+            digits = re.sub(rb"[^0-9A-Fa-f]", b"", data[pos + 1:end])
+            return bytes.fromhex((digits + b"0" * (len(digits) % 2)).decode("ascii")), end + 1
+        match = NUMBER.match(data, pos)
+        if match:
+            token = match.group(0)
+            if b"." in token:
+                return float(token), match.end()
+            # `N G R` is a reference
+            ref = REFERENCE.match(data, match.end())
+            if ref:
+                return Ref((int(token), int(ref.group(1)))), ref.end()
+            return int(token), match.end()
+        match = REGULAR.match(data, pos)
+        if not match:
+            raise MalformedPDF(f"Unexpected {c!r} at {pos}")
+        word = match.group(0)
+        return {b"true": True, b"false": False, b"null": None}.get(word, Name(word.decode("latin-1"))), match.end()
+
+    def _dict(self, pos, depth, data):
+        result = {}
+        while True:
+            pos = self._skip(pos, data)
+            if _at(data, pos, b">>"):
+                pos += 2
+                break
+            if pos >= len(data):
+                raise MalformedPDF("Unterminated dictionary")
+            key, pos = self.parse(pos, depth + 1, data)
+            if not isinstance(key, Name):
+                raise MalformedPDF(f"Dictionary key expected at {pos}")
+            value, pos = self.parse(pos, depth + 1, data)
+            result[str(key)] = value
+        after = self._skip(pos, data)
+        if not _at(data, after, b"stream"):
+            return result, pos
+        start = after + 6
+        if _at(data, start, b"\r\n"):
+            start += 2
+        elif data[start:start + 1] in (b"\n", b"\r"):
+            start += 1
+        length = result.get("Length")
+        if isinstance(length, Ref):
+            length = self._length(length)
+        end = start + length if isinstance(length, int) and length >= 0 else -1
+        if end < 0 or end > len(data) or data.find(b"endstream", end, end + 32) < 0:
+            end = data.find(b"endstream", start)
+            if end < 0:
+                end = len(data)
+        stream = Stream(result)
+        stream.raw = data[start:end]
+        if data is self.data:
+            stream.start = start
+        return stream, end
+
+    def _literal(self, pos, data):
+        out, nesting = bytearray(), 1
+        while pos < len(data):
+            c = data[pos:pos + 1]
+            if c == b"\\":
+                nxt = data[pos + 1:pos + 2]
+                if nxt in ESCAPES:
+                    out += ESCAPES[nxt]
+                    pos += 2
+                elif nxt.isdigit():
+                    digits = re.match(rb"[0-7]{1,3}", data[pos + 1:pos + 4]).group(0)
+                    out.append(int(digits, 8) & 0xFF)
+                    pos += 1 + len(digits)
+                else:
+                    # Line continuation (backslash, EOL) or an unknown escape; both are dropped
+                    pos += 3 if data[pos + 1:pos + 3] == b"\r\n" else 2
+                continue
+            if c == b"(":
+                nesting += 1
+            elif c == b")":
+                nesting -= 1
+                if nesting == 0:
+                    return bytes(out), pos + 1
+            out += c
+            pos += 1
+        raise MalformedPDF("Unterminated string")
+
+    def decode(self, stream):
+        """The decoded data of a Flate (or unfiltered) stream, charged to the inflate budget."""
+        filters = stream.get("Filter")
+        filters = filters if isinstance(filters, list) else [filters] if filters else []
+        params = stream.get("DecodeParms")
+        params = params[0] if isinstance(params, list) and params else params
+        data = stream.raw
+        for name in filters:
+            if name not in ("FlateDecode", "Fl"):
+                raise MalformedPDF(f"Unsupported filter {name}")
+            remaining = self.max_inflate - self.inflated
+            try:
+                data = zlib.decompressobj().decompress(data, remaining + 1)
+            except zlib.error as e:
+                raise MalformedPDF(f"Bad Flate data: {e}")
+            self.inflated += len(data)
+            if self.inflated > self.max_inflate:
+                raise BudgetExceeded("inflate_bytes")
+            data = self._unpredict(data, params if isinstance(params, dict) else {})
+        return data
+
+    def _unpredict(self, data, params):
+        """Undo PNG predictors (Predictor >= 10), as used by xref streams."""
+        predictor = params.get("Predictor", 1)
+        if not isinstance(predictor, int) or predictor < 10:
+            return data
+        colors, bits, width = params.get("Colors", 1), params.get("BitsPerComponent", 8), params.get("Columns", 1)
+        if not all(isinstance(v, int) and v > 0 for v in (colors, bits, width)) or \
+                width * colors * bits > 8 * self.max_inflate:
+            raise MalformedPDF("Bad predictor parameters")
+        columns = (width * colors * bits + 7) // 8
+        bpp = max(1, colors * bits // 8)
+        stride = columns + 1
+        rows = len(data) // stride
+        # Split the tag byte of every row from the row data, one slice per column
+        kinds = data[0:rows * stride:stride]
+        plain = bytearray(rows * columns)
+        for column in range(columns):
+            plain[column::columns] = data[1 + column:rows * stride:stride]
+        out = bytearray()
+        previous = bytes(columns)
+        for run in PREDICTOR_RUN.finditer(kinds):
+            self._count()
+            block = plain[run.start() * columns:run.end() * columns]
+            kind = kinds[run.start()]
+            if kind == 2:
+                block = _up_rows(block, previous, columns)
+            elif kind in (1, 3, 4):
+                block = self._unfilter(kind, block, previous, bpp)
+            out += block
+            previous = out[-columns:]
+        return bytes(out)
+
+    def _unfilter(self, kind, row, previous, bpp):
+        """Undo a Sub, Average or Paeth row in place, one byte (and item) at a time."""
+        for i in range(len(row)):
+            self._count()
+            left = row[i - bpp] if i >= bpp else 0
+            if kind == 1:
+                row[i] = (row[i] + left) & 0xFF
+            elif kind == 3:
+                row[i] = (row[i] + (left + previous[i]) // 2) & 0xFF
+            elif kind == 4:
+                up, corner = previous[i], previous[i - bpp] if i >= bpp else 0
+                p = left + up - corner
+                pa, pb, pc = abs(p - left), abs(p - up), abs(p - corner)
+                row[i] = (row[i] + (left if pa <= pb and pa <= pc else up if pb <= pc else corner)) & 0xFF
+        return bytes(row)
+
+    # Cross-reference sections
+
+    def _read_xref(self):
+        data = self.data
+        marker = data.rfind(b"startxref", max(0, len(data) - TRAILER_WINDOW))
+        if marker < 0:
+            raise MalformedPDF("No startxref")
+        offset, _ = self.parse(marker + 9)
+        seen = set()
+        while isinstance(offset, int) and offset not in seen and len(seen) < MAX_XREF_SECTIONS:
+            seen.add(offset)
+            if 0 <= offset < len(data) and _at(data, self._skip(offset), b"xref"):
+                trailer = self._read_table(self._skip(offset) + 4)
+                if isinstance(trailer.get("XRefStm"), int):
+                    self._read_stream_section(trailer["XRefStm"])
+            else:
+                trailer = self._read_stream_section(offset)
+            for key, value in trailer.items():
+                self.trailer.setdefault(key, value)
+            offset = trailer.get("Prev")
+
+    def _read_table(self, pos):
+        """Record the subsections of a classic table (entries are read later); return its trailer."""
+        data = self.data
+        while True:
+            match = XREF_SUBSECTION.match(data, pos)
+            if not match:
+                break
+            first, count = int(match.group(1)), int(match.group(2))
+            self.sections.append(("table", first, count, match.end()))
+            pos = match.end() + count * 20
+        pos = self._skip(pos)
+        if not _at(data, pos, b"trailer"):
+            raise MalformedPDF("No trailer after xref table")
+        trailer, _ = self.parse(pos + 7)
+        return trailer
+
+    def _read_stream_section(self, offset):
+        stream = self._object_at(offset)
+        if not isinstance(stream, Stream) or stream.get("Type") != "XRef":
+            raise MalformedPDF("startxref does not point to an xref section")
+        widths = stream.get("W") or [1, 2, 1]
+        index = stream.get("Index") or [0, stream.get("Size", 0)]
+        entries = self.decode(stream)
+        pos = 0
+        for first, count in zip(index[::2], index[1::2]):
+            self.sections.append(("stream", first, count, (entries, pos, widths)))
+            pos += count * sum(widths)
+        return stream
+
+    def _entry(self, number):
+        """(1, offset, gen) or (2, objstm, index) from the newest xref section listing number, or None.
+
+        Free entries are skipped: hybrid files list objects of their object streams as free in
+        the classic table and in the /XRefStm section that follows it.
+        """
+        for source, first, count, where in self.sections:
+            if not first <= number < first + count:
+                continue
+            if source == "table":
+                line = self.data[where + (number - first) * 20:where + (number - first) * 20 + 18].split()
+                if len(line) != 3 or not line[0].isdigit():
+                    raise MalformedPDF("Bad xref table entry")
+                if line[2] == b"n":
+                    return 1, int(line[0]), int(line[1])
+                continue
+            entries, pos, widths = where
+            start = pos + (number - first) * sum(widths)
+            fields, cursor = [], start
+            for width in widths:
+                fields.append(int.from_bytes(entries[cursor:cursor + width], "big") if width else None)
+                cursor += width
+            kind = 1 if fields[0] is None else fields[0]
+            if kind in (1, 2):
+                return kind, fields[1] or 0, fields[2] or 0
+        return None
+
+    def _scan_trailer(self):
+        """Index objects by scanning for their headers, for files without a usable xref."""
+        self._scan()
+        data = self.data
+        pos = data.rfind(b"trailer")
+        while pos >= 0 and "Root" not in self.trailer:
+            try:
+                trailer, _ = self.parse(pos + 7)
+                if isinstance(trailer, dict):
+                    self.trailer = dict(trailer, **self.trailer)
+            except (MalformedPDF, ValueError):
+                pass
+            pos = data.rfind(b"trailer", 0, pos)
+        if "Root" not in self.trailer:
+            for number in sorted(self._scanned, reverse=True):
+                head = data[self._scanned[number]:self._scanned[number] + 200]
+                if re.search(rb"/Type\s*/Catalog\b", head):
+                    self.trailer["Root"] = Ref((number, 0))
+                    break
+        if "Root" not in self.trailer:
+            raise MalformedPDF("No catalog")
+
+    def _scan(self):
+        if self._scanned is None:
+            self._scanned = {int(m.group(1)): m.start() for m in OBJECT_HEADER.finditer(self.data)}
+        return self._scanned
+
+    # Objects
+
+    def _length(self, ref):
+        """An indirect stream /Length, read as the bare integer after its object header instead
+        of resolved, so a chain of streams whose lengths are streams cannot nest resolves; None
+        when it is not there (the stream then ends at endstream)."""
+        self._count()
+        if ref.number in self._cache:
+            length = self._cache[ref.number]
+            return length if isinstance(length, int) else None
+        try:
+            entry = self._entry(ref.number) if self.sections else None
+        except MalformedPDF:
+            entry = None
+        if entry:
+            offset = entry[1] if entry[0] == 1 else None
+        else:
+            offset = self._scan().get(ref.number)
+        if offset is None:
+            return None
+        header = OBJECT_HEADER.match(self.data, self._skip(offset))
+        if not header:
+            return None
+        match = NUMBER.match(self.data, self._skip(header.end()))
+        if not match or b"." in match.group(0):
+            return None
+        return int(match.group(0))
+
+    def _object_at(self, offset):
+        match = OBJECT_HEADER.match(self.data, self._skip(offset))
+        if not match:
+            raise MalformedPDF(f"No object at {offset}")
+        value, _ = self.parse(match.end())
+        return value
+
+    def _from_objstm(self, stream_number, index):
+        if stream_number not in self._objstms:
+            stream = self.resolve(Ref((stream_number, 0)))
+            if not isinstance(stream, Stream):
+                raise MalformedPDF(f"Object {stream_number} is not an object stream")
+            body = self.decode(stream)
+            if stream.start is not None and stream.get("Filter") in ("FlateDecode", "Fl") and \
+                    not stream.get("DecodeParms"):
+                self.objstm_data[stream.start] = body
+            count, first = stream.get("N", 0), stream.get("First", 0)
+            numbers = body[:first].split()
+            try:
+                offsets = [int(numbers[i * 2 + 1]) for i in range(min(count, len(numbers) // 2))]
+            except ValueError:
+                raise MalformedPDF(f"Bad object stream header in {stream_number}")
+            self._objstms[stream_number] = (body, first, offsets)
+        body, first, offsets = self._objstms[stream_number]
+        if index >= len(offsets):
+            return None
+        value, _ = self.parse(first + offsets[index], data=body)
+        return value
+
+    def resolve(self, value):
+        """value with an indirect reference followed; other values are returned as they are."""
+        if not isinstance(value, Ref):
+            return value
+        number = value.number
+        if number in self._cache:
+            return self._cache[number]
+        self.objects += 1
+        if self.objects > self.max_objects:
+            raise BudgetExceeded("objects")
+        # Objects resolved while parsing another (in object streams) nest: their depth adds up
+        if self._resolving >= self.max_depth:
+            raise BudgetExceeded("depth")
+        self._cache[number] = None  # reference loops resolve to null
+        self._resolving += 1
+        result = None
+        try:
+            entry = self._entry(number) if self.sections else None
+            if entry and entry[0] == 1:
+                result = self._object_at(entry[1])
+            elif entry and entry[0] == 2:
+                result = self._from_objstm(entry[1], entry[2])
+            elif entry is None and number in self._scan():
+                result = self._object_at(self._scanned[number])
+        except MalformedPDF:
+            # A stale offset: fall back to the scanned index
+            if number in self._scan():
+                result = self._object_at(self._scanned[number])
+        finally:
+            self._resolving -= 1
+        self._cache[number] = result
+        return result
+
+    def get(self, obj, key):
+        """obj[key] resolved, or None."""
+        obj = self.resolve(obj)
+        return self.resolve(obj.get(key)) if isinstance(obj, dict) else None
+
+    def catalog(self):
+        root = self.resolve(self.trailer.get("Root"))
+        if not isinstance(root, dict):
+            raise MalformedPDF("No catalog")
+        return root
+
+    def info(self):
+        """The document information dictionary as {key: text}."""
+        info = self.resolve(self.trailer.get("Info"))
+        if not isinstance(info, dict):
+            return {}
+        return {key: text(self.resolve(value)) for key, value in info.items()}
+
+    def pages(self, limit=WALK_MAX_PAGES):
+        """Yield (page number, page dictionary) in document order, visiting at most limit pages."""
+        stack = [(self.get(self.catalog(), "Pages"), 0)]
+        seen, number = set(), 0
+        while stack:
+            node, depth = stack.pop()
+            node = self.resolve(node)
+            if not isinstance(node, dict) or id(node) in seen or depth > self.max_depth:
+                continue
+            seen.add(id(node))
+            kids = self.resolve(node.get("Kids"))
+            if node.get("Type") == "Page" or not isinstance(kids, list):
+                number += 1
+                if number > limit:
+                    raise BudgetExceeded("pages")
+                yield number, node
+            else:
+                stack.extend((kid, depth + 1) for kid in reversed(kids))
+
+
+def check_pdf(data):
+    """Fast validation: header, trailer or object index, and catalog. Raises MalformedPDF."""
+    try:
+        walker = PDFWalker(data)
+        walker.catalog()
+    except BudgetExceeded as e:
+        raise MalformedPDF(f"Catalog could not be read: {e}")
+    except (RecursionError, MemoryError) as e:
+        raise MalformedPDF(f"Catalog could not be read: {type(e).__name__}")
+    return walker
+
+
+def _anchor_texts(data, links):
+    """Fill anchor_text of links with the text PDFium finds inside each link rectangle."""
+    try:
+        import pypdfium2
+    except ImportError:
+        return
+    by_page = {}
+    for link in links:
+        if link.get("rect"):
+            by_page.setdefault(link["page"], []).append(link)
+    with PDFIUM_LOCK:
+        pdf = pypdfium2.PdfDocument(data)
+        try:
+            for number in sorted(by_page)[:WALK_ANCHOR_PAGES]:
+                page = pdf[number - 1]
+                textpage = page.get_textpage()
+                try:
+                    for link in by_page[number]:
+                        x1, y1, x2, y2 = link["rect"]
+                        found = textpage.get_text_bounded(min(x1, x2), min(y1, y2), max(x1, x2), max(y1, y2))
+                        link["anchor_text"] = " ".join(found.split()) or None
+                finally:
+                    textpage.close()
+                    page.close()
+        finally:
+            pdf.close()
+
+
+def structure(data, anchor_text=True):
+    """Walk the catalog, document info and page annotations of a PDF within the walk budgets.
+
+    Returns {"metadata", "encrypted", "javascript", "embedded_files", "forms", "open_action",
+    "links": [{"url", "page", "anchor_text"}], "walk": {"pages", "objects", "inflated_bytes",
+    "truncated"}, "vector": {"version", "values"}}; truncated names the budget that stopped the
+    walk, "malformed" when a damaged object did, "depth" or "memory" when Python ran out of stack
+    or memory, or is None. javascript and embedded_files are also set when the feature vector
+    counts them. Raises MalformedPDF when the file has no readable catalog.
+    """
+    walker = check_pdf(data)
+    root = walker.catalog()
+    report = {"metadata": {}, "encrypted": "Encrypt" in walker.trailer, "javascript": False,
+              "embedded_files": False, "forms": False, "open_action": "OpenAction" in root, "links": []}
+    pages, truncated = 0, None
+    try:
+        report["metadata"] = walker.info()
+        names = walker.get(root, "Names") or {}
+        open_action = walker.get(root, "OpenAction")
+        report["javascript"] = "JavaScript" in names or (
+            isinstance(open_action, dict) and open_action.get("S") == "JavaScript")
+        report["embedded_files"] = "EmbeddedFiles" in names
+        report["forms"] = "AcroForm" in root
+        for pages, page in walker.pages():
+            annots = walker.resolve(page.get("Annots"))
+            for annot in annots if isinstance(annots, list) else []:
+                action = walker.get(annot, "A")
+                uri = walker.get(action, "URI") if isinstance(action, dict) else None
+                if uri:
+                    rect = walker.get(annot, "Rect")
+                    rect = [float(v) for v in rect[:4]] if isinstance(rect, list) and len(rect) >= 4 and \
+                        all(isinstance(v, (int, float)) for v in rect[:4]) else None
+                    report["links"].append({"url": text(uri), "page": pages, "anchor_text": None, "rect": rect})
+    except BudgetExceeded as e:
+        truncated = e.budget
+    except MalformedPDF:
+        truncated = "malformed"
+    except RecursionError:
+        truncated = "depth"
+    except MemoryError:
+        truncated = "memory"
+    if anchor_text and report["links"] and WALK_ANCHOR_PAGES:
+        try:
+            _anchor_texts(data, report["links"])
+        except Exception:
+            pass
+    for link in report["links"]:
+        link.pop("rect")
+    report["walk"] = {"pages": pages, "objects": walker.objects, "inflated_bytes": walker.inflated,
+                      "truncated": truncated}
+    values = feature_vector(data, walker.objstm_data)
+    counts = dict(zip(FEATURE_NAMES, values))
+    report["javascript"] = report["javascript"] or counts["javascript"] > 0
+    report["embedded_files"] = report["embedded_files"] or counts["embedded_files"] > 0
+    report["vector"] = {"version": FEATURE_VERSION, "values": values}
+    return report
@@ -2,11 +2,12 @@ import os
 import json
 import logging
 from flask import Flask, request, jsonify
-import requests
+from metrics import http_call, instrument
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger('reputation_service')
 app = Flask(__name__)
+instrument(app, 'reputation_service')
 VT_API_KEY = os.getenv('VT_API_KEY')
 URLSCAN_API_KEY = os.getenv('URLSCAN_API_KEY')
 
@@ -16,7 +17,7 @@ def file_rep():
     headers = {'x-apikey':VT_API_KEY}
     url = f"https://www.virustotal.com/api/v3/files/{sha256}"
     logger.info({'event':'vt_request','sha256':sha256})
-    resp = requests.get(url, headers=headers)
+    resp = http_call('virustotal', 'GET', url, propagate=False, headers=headers)
     if resp.status_code!=200:
         logger.error({'event':'vt_error','status':resp.status_code})
         return jsonify({'error':'VT request failed'}),502
@@ -31,7 +32,7 @@ def url_rep():
     headers = {'API-Key':URLSCAN_API_KEY,'Content-Type':'application/json'}
     payload = {'url':url_t}
     logger.info({'event':'urlscan_request','url':url_t})
-    resp = requests.post('https://urlscan.io/api/v1/scan/', headers=headers, json=payload)
+    resp = http_call('urlscan_submit', 'POST', 'https://urlscan.io/api/v1/scan/', propagate=False, headers=headers, json=payload)
     if resp.status_code!=200:
         logger.error({'event':'urlscan_error','status':resp.status_code})
         return jsonify({'error':'urlscan failed'}),502
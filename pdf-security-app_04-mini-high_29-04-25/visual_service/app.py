@@ -5,11 +5,16 @@ import logging
 from flask import Flask, request, jsonify
 from pdf2image import convert_from_bytes
 import openai
-import json
+from llmjson import JSON_MODE, parse_structured, validate_report
+from metrics import LLMUsage, instrument, llm_headers, timed
+
+VISUAL_REPORT_KEYS = ('type', 'layout', 'anomalies', 'prominent_elements')
+VISUAL_SCHEMA_HINT = '{"type": ..., "layout": ..., "anomalies": [...], "prominent_elements": [...]}'
 
 logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
 logger = logging.getLogger('visual_service')
 app = Flask(__name__)
+instrument(app, 'visual_service')
 openai.api_key = os.getenv('OPENAI_API_KEY')
 
 @app.route('/analyze', methods=['POST'])
@@ -18,7 +23,8 @@ def analyze():
     data = file.read()
     # Convert first page
     try:
-        images = convert_from_bytes(data, first_page=1, last_page=1)
+        with timed('render'):
+            images = convert_from_bytes(data, first_page=1, last_page=1)
         img = images[0]
         buffered = io.BytesIO()
         img.save(buffered, format="PNG")
@@ -29,12 +35,13 @@ def analyze():
         return jsonify({'error':'Image conversion failed'}),500
     # LLM
     prompt = f"Analyze this image: data:image/png;base64,{img_str} \nRespond JSON with 'type','layout','anomalies','prominent_elements'."
+    usage = LLMUsage()
     try:
-        resp = openai.ChatCompletion.create(model="gpt-4o", messages=[{"role":"user","content":prompt}])
+        resp = usage.create(model="gpt-4o", messages=[{"role":"user","content":prompt}], headers=llm_headers('visual_service.analyze'), **JSON_MODE)
         content = resp.choices[0].message.content
-        report = json.loads(content)
+        report = parse_structured(content, validate_report(VISUAL_REPORT_KEYS), VISUAL_SCHEMA_HINT, 'visual_service.analyze', usage)
         logger.info({'event':'visual_analysis_success'})
-        return jsonify(report),200
+        return jsonify(dict(report, usage=usage.as_dict())),200
     except Exception as e:
         logger.error({'event':'visual_analysis_error','error':str(e)})
         return jsonify({'error':'Visual LLM failed'}),502
@@ -0,0 +1,134 @@
+"""
+Structured output handling for LLM responses.
+
+- JSON_MODE: request params that ask the model for a JSON object.
+- extract_json(): tolerant local extractor (fenced blocks, prose around the
+  object, trailing text) so a chatty answer does not fail the stage.
+- validate_*(): schema checks and normalisation for risk/reasoning,
+  priority_url and free-form report objects.
+- parse_structured(): extract + validate, falling back to a single cheap
+  repair call that reformats the existing answer instead of rerunning the
+  analysis. Pass the request's metrics.LLMUsage to have the repair counted.
+"""
+import json
+import os
+import re
+
+import openai
+
+from metrics import llm_headers
+
+LLM_JSON_MODE = os.getenv("LLM_JSON_MODE", "true").lower() in ("1", "true", "yes")
+LLM_REPAIR_MODEL = os.getenv("LLM_REPAIR_MODEL", "gpt-4o-mini")
+LLM_REPAIR_ENABLED = os.getenv("LLM_REPAIR_ENABLED", "true").lower() in ("1", "true", "yes")
+MAX_REPAIR_INPUT_CHARS = 6000
+
+JSON_MODE = {"response_format": {"type": "json_object"}} if LLM_JSON_MODE else {}
+
+RISK_LEVELS = ("Safe", "Low", "Medium", "High", "Malicious")
+RISK_SCHEMA_HINT = '{"risk_score": "Safe|Low|Medium|High|Malicious", "reasoning": "<brief reasoning>"}'
+PRIORITY_SCHEMA_HINT = '{"priority_url": "<one URL from the input>" or null}'
+RISK_LEVEL_PATTERN = re.compile(r"\b(" + "|".join(RISK_LEVELS) + r")\b", re.IGNORECASE)
+FENCED_BLOCK = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+
+
+class SchemaError(ValueError):
+    """The model output could not be turned into the expected structure."""
+
+
+def extract_json(text):
+    """Return the first JSON object found in text."""
+    if text is None:
+        raise SchemaError("Empty model output")
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        pass
+    candidates = FENCED_BLOCK.findall(text) + [text]
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        start = candidate.find("{")
+        while start != -1:
+            try:
+                obj, _ = decoder.raw_decode(candidate, start)
+                if isinstance(obj, dict):
+                    return obj
+            except ValueError:
+                pass
+            start = candidate.find("{", start + 1)
+    raise SchemaError("No JSON object in model output")
+
+
+def _require_dict(obj):
+    if not isinstance(obj, dict):
+        raise SchemaError("Model output is not a JSON object")
+    return obj
+
+
+def normalize_risk(value):
+    match = RISK_LEVEL_PATTERN.search(str(value or ""))
+    if not match:
+        raise SchemaError(f"Unrecognised risk level: {value!r}")
+    return match.group(1).capitalize()
+
+
+def validate_risk(obj, score_key="risk_score"):
+    """Validate {score_key: one of RISK_LEVELS, "reasoning": str}; accepts risk/risk_score."""
+    obj = _require_dict(obj)
+    score = obj.get(score_key, obj.get("risk_score", obj.get("risk")))
+    reasoning = obj.get("reasoning")
+    if reasoning is None or isinstance(reasoning, (dict, list)):
+        reasoning = json.dumps(reasoning) if reasoning is not None else ""
+    return {score_key: normalize_risk(score), "reasoning": str(reasoning).strip()}
+
+
+def validate_priority(obj):
+    """Validate {"priority_url": absolute http(s) URL or null}."""
+    obj = _require_dict(obj)
+    url = obj.get("priority_url")
+    if isinstance(url, str):
+        url = url.strip().strip("<>\"'")
+        if url.lower() in ("", "null", "none"):
+            url = None
+    if url is not None and not (isinstance(url, str) and re.match(r"https?://\S+$", url, re.IGNORECASE)):
+        raise SchemaError(f"priority_url is not a URL: {url!r}")
+    return {"priority_url": url}
+
+
+def validate_report(keys):
+    """Validator for free-form report objects; missing keys are filled with None."""
+    def validate(obj):
+        obj = _require_dict(obj)
+        return dict({k: None for k in keys}, **obj)
+    return validate
+
+
+def repair(text, error, schema_hint, call_site, usage=None):
+    """Ask a small model to reformat an existing answer; far cheaper than redoing the analysis."""
+    create = usage.create if usage is not None else openai.ChatCompletion.create
+    response = create(
+        model=LLM_REPAIR_MODEL,
+        messages=[
+            {"role": "system", "content": (
+                "Convert the assistant answer below into a single JSON object matching this schema: "
+                f"{schema_hint}. It could not be used as-is ({error}). "
+                "Keep the original meaning; output only the JSON."
+            )},
+            {"role": "user", "content": text[:MAX_REPAIR_INPUT_CHARS]}
+        ],
+        temperature=0,
+        headers=llm_headers(f"{call_site}.repair"),
+        **JSON_MODE
+    )
+    return response.choices[0].message.content
+
+
+def parse_structured(text, validator, schema_hint, call_site, usage=None):
+    """Extract and validate model output, with at most one repair call on failure."""
+    try:
+        return validator(extract_json(text))
+    except SchemaError as e:
+        if not LLM_REPAIR_ENABLED:
+            raise
+        return validator(extract_json(repair(text or "", str(e), schema_hint, call_site, usage)))
@@ -1,9 +1,11 @@
-import os, base64, logging, re
-from io import BytesIO
+import os, base64, logging
 from flask import Flask, request, jsonify
 from pythonjsonlogger import jsonlogger
-from PyPDF2 import PdfReader
-from pdfminer.high_level import extract_text
+from domainintel import DomainIndex
+from extractors import get_extractor
+from metrics import instrument, timed
+from pdfwalk import structure
+from urlextract import extract_urls, merge_annotations
 
 app = Flask(__name__)
 
@@ -13,70 +15,64 @@ formatter = jsonlogger.JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+instrument(app, 'analysis_service')
+# Text extraction engine, PDF_TEXT_BACKEND (see extractors.py)
+TEXT_BACKEND, extract_pages = get_extractor(default='pdfminer')
+logger.info('Text extraction backend', extra={'backend': TEXT_BACKEND})
+# Local allow/deny lists, public suffixes and lookalike brands (see domainintel.py)
+domain_index = DomainIndex()
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     logger.info('Received analysis request')
-    data = request.get_json()
-    if not data or 'pdf' not in data:
+    # a multipart upload (api_service streams the PDF), or base64 in a JSON body
+    file = request.files.get('file')
+    data = request.get_json(silent=True)
+    if not file and (not data or 'pdf' not in data):
         logger.error('No PDF provided')
         return jsonify(error='No PDF provided'), 400
     try:
-        pdf_bytes = base64.b64decode(data['pdf'])
-        reader = PdfReader(BytesIO(pdf_bytes))
-        logger.info('PDF parsed successfully')
+        pdf_bytes = file.read() if file else base64.b64decode(data['pdf'])
+        # lazy walk of the catalog and page annotations, within the walk budgets, and the
+        # feature vector from the same walk (see pdfwalk.py)
+        with timed('parse'):
+            walked = structure(pdf_bytes)
+        logger.info('PDF parsed successfully', extra={'walk': walked['walk']})
     except Exception as e:
         logger.error('Failed to parse PDF', extra={'error': str(e)})
         return jsonify(error='Failed to parse PDF'), 400
 
-    info = reader.metadata or {}
-    metadata = {k: str(v) for k, v in info.items()}
+    metadata = {'/' + k: v for k, v in walked['metadata'].items()}
 
+    # javascript and embedded files include those the feature vector counts in page and annotation actions
     features = {
-        'is_encrypted': reader.is_encrypted,
-        'has_javascript': False,
-        'has_embedded_files': False,
-        'has_forms': False
+        'is_encrypted': walked['encrypted'],
+        'has_javascript': walked['javascript'],
+        'has_embedded_files': walked['embedded_files'],
+        'has_forms': walked['forms']
     }
-    try:
-        names = reader.trailer['/Root'].get('/Names', {})
-        if names.get('/JavaScript'):
-            features['has_javascript'] = True
-        if names.get('/EmbeddedFiles'):
-            features['has_embedded_files'] = True
-        if reader.trailer['/Root'].get('/AcroForm'):
-            features['has_forms'] = True
-    except Exception:
-        pass
 
-    urls = []
-    try:
-        for page in reader.pages:
-            annots = page.get('/Annots')
-            if annots:
-                for a in annots:
-                    obj = a.get_object()
-                    A = obj.get('/A')
-                    if A and '/URI' in A:
-                        urls.append(A['/URI'])
-    except Exception:
-        pass
+    links = merge_annotations([], walked['links'])
+    urls = [link['url'] for link in links]
 
     try:
-        text = extract_text(BytesIO(pdf_bytes))
+        with timed('extract_text'):
+            pages = extract_pages(pdf_bytes)
+        text = '\n'.join(pages)
         logger.info('Text extracted', extra={'length': len(text)})
     except Exception as e:
-        text = ''
+        pages, text = [], ''
         logger.error('Text extraction failed', extra={'error': str(e)})
 
-    content_urls = []
-    for match in re.finditer(r'(https?://[^\s]+)', text):
-        url = match.group(0)
-        start, end = match.span()
-        context = text[max(0, start-30):min(len(text), end+30)]
-        content_urls.append({'url': url, 'context': context})
+    # Deduplicated, normalized URLs with the context of their first occurrence
+    with timed('extract_urls'):
+        content_urls = extract_urls(pages)
+    with timed('domain_intel'):
+        domain_index.annotate(links)
+        domain_index.annotate(content_urls)
 
-    structural_report = {'metadata': metadata, 'features': features, 'urls': urls}
+    structural_report = {'metadata': metadata, 'features': features, 'urls': urls, 'links': links,
+                         'walk': walked['walk'], 'vector': walked['vector']}
     content_report = {'text_summary': text[:200], 'urls': content_urls}
 
     logger.info('Analysis complete', extra={'struct_urls': len(urls), 'content_urls': len(content_urls)})
@@ -0,0 +1,234 @@
+"""
+URL extraction and normalization for PDF text and link annotations.
+
+extract_urls() scans page text with one compiled pattern that finds, in a
+single pass:
+
+- http(s) and ftp URLs, including defanged and obfuscated forms such as
+  hxxp://, https[:]//, example[.]com and example(dot)com;
+- hosts starting with www. that have no scheme;
+- bare domains with a known top-level domain (URL_BARE_TLDS), e.g.
+  secure-login.com/verify.
+
+URLs that text extraction broke at a line end are rejoined, trailing
+punctuation and unbalanced brackets are trimmed, and every URL is normalized:
+refanged, scheme added, host lowercased and IDNA (punycode) encoded, default
+port dropped. The same link written several ways, or repeated in a footer on
+every page, is reported once with its occurrence count, its pages and the
+context of its first occurrence.
+
+merge_annotations() folds link annotations, with the text shown under them
+(pdfwalk.structure()), into the text URLs, flagging links whose visible text
+names a different host.
+"""
+import os
+import re
+from urllib.parse import urlsplit, urlunsplit
+
+URL_CONTEXT_CHARS = int(os.getenv("URL_CONTEXT_CHARS", "30"))
+URL_MAX_RESULTS = int(os.getenv("URL_MAX_RESULTS", "100"))
+URL_BARE_DOMAINS = os.getenv("URL_BARE_DOMAINS", "true").lower() in ("1", "true", "yes")
+# Top-level domains a bare domain must end in; file extensions such as .py or .js would be noise
+URL_BARE_TLDS = os.getenv(
+    "URL_BARE_TLDS",
+    "com,net,org,edu,gov,info,biz,io,co,me,us,uk,eu,de,fr,it,nl,es,ru,cn,br,in,jp,au,ca,ch,su,ua,kr,ir,"
+    "xyz,top,online,site,club,app,dev,shop,live,link,click,ly,tk,ml,ga,cf,gq,cc,tv,ws,pw,zip,mov",
+)
+
+DEFAULT_PORTS = {"http": 80, "https": 443, "ftp": 21}
+# Obfuscated dots: [.] (.) {.} [dot] (dot)
+DOT = r"(?:\.|\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\))"
+LABEL = r"[^\W_](?:[\w-]{0,61}[^\W_])?"
+PATH = r"(?:[/?#][^\s<>\"'`{}|\\^]*)?"
+TLDS = "|".join(sorted({t.strip().lower() for t in URL_BARE_TLDS.split(",") if t.strip()}, key=len, reverse=True))
+
+SCANNER = re.compile(
+    rf"""
+    (?P<scheme>h(?:tt|xx)ps?|ftps?|fxp)(?:://|\[:\]//|\[://\])(?P<rest>[^\s<>"'`]+)
+    | (?<![\w.@/-])(?P<www>www\d{{0,3}}{DOT}(?:{LABEL}{DOT})*{LABEL}(?![\w-]){PATH})
+    """ + (rf"""
+    | (?<![\w.@/-])(?P<bare>(?:{LABEL}{DOT})+(?:{TLDS})(?![\w-]|\.\w){PATH})
+    """ if URL_BARE_DOMAINS and TLDS else ""),
+    re.IGNORECASE | re.VERBOSE,
+)
+TRIGGER = re.compile(r"[.:\[({]")
+WHITESPACE = re.compile(r"\s")
+# The next line continues a URL broken by text extraction
+CONTINUATION = re.compile(r"[ \t]*\r?\n[ \t]*([^\s<>\"'`]+)")
+URL_CHARS = re.compile(r"[/=&?%#]")
+REFANG = re.compile(r"\[\.\]|\(\.\)|\{\.\}|\[dot\]|\(dot\)|\[:\]|\[://\]", re.IGNORECASE)
+REFANGED = {"[:]": ":", "[://]": "://"}
+SCHEME = re.compile(r"h(?:tt|xx)ps?|ftps?|fxp", re.IGNORECASE)
+TRAILING = ".,;:!?'\"*"
+BRACKETS = {")": "(", "]": "[", "}": "{", ">": "<"}
+
+
+def _trim(raw):
+    """Drop trailing punctuation and closing brackets the URL did not open."""
+    while raw:
+        last = raw[-1]
+        if last in TRAILING:
+            raw = raw[:-1]
+        elif last in BRACKETS and raw.count(BRACKETS[last]) < raw.count(last):
+            raw = raw[:-1]
+        else:
+            break
+    return raw
+
+
+def _wraps(raw, continuation):
+    """Whether continuation, the first word of the next line, is the rest of raw."""
+    if continuation.lower().startswith(("http", "hxxp", "ftp", "www.")):
+        return False
+    # A capitalized word starts a new sentence
+    if continuation[0].isupper() and continuation.isalpha():
+        return False
+    return raw[-1] in "/-_=&?%#~+" or bool(URL_CHARS.search(continuation))
+
+
+def normalize(raw):
+    """(url, defanged) for a URL as written, or None when it has no usable host."""
+    refanged = REFANG.sub(lambda m: REFANGED.get(m.group(0), "."), raw)
+    defanged = refanged != raw
+    scheme, sep, rest = refanged.partition("://")
+    if sep and SCHEME.fullmatch(scheme):
+        defanged = defanged or "x" in scheme.lower()
+        scheme = scheme.lower().replace("xx", "tt").replace("fxp", "ftp")
+    else:
+        scheme, rest = "http", refanged
+    try:
+        parts = urlsplit(f"{scheme}://{rest}")
+        host, port = parts.hostname, parts.port
+    except ValueError:
+        return None
+    host = (host or "").rstrip(".")
+    if "." not in host and ":" not in host:
+        return None
+    try:
+        host = host.encode("idna").decode("ascii")
+    except UnicodeError:
+        pass
+    netloc = host if ":" not in host else f"[{host}]"
+    if port and port != DEFAULT_PORTS.get(scheme):
+        netloc = f"{netloc}:{port}"
+    userinfo = parts.netloc.rpartition("@")[0]
+    if userinfo:
+        netloc = f"{userinfo}@{netloc}"
+    return urlunsplit((scheme, netloc, parts.path or "/", parts.query, parts.fragment)), defanged
+
+
+def _context(text, start, end, chars):
+    return " ".join(text[max(0, start - chars):end + chars].split())
+
+
+def scan(text):
+    """Yield (raw, start, end) for each URL in text, with wrapped URLs rejoined.
+
+    Every URL form contains one of the TRIGGER characters, so the scanner only runs over the
+    whitespace-delimited words around them; searching the whole text would cost ten times more.
+    """
+    pos = 0
+    while True:
+        trigger = TRIGGER.search(text, pos)
+        if not trigger:
+            return
+        start = trigger.start()
+        while start > pos and not text[start - 1].isspace():
+            start -= 1
+        space = WHITESPACE.search(text, trigger.start())
+        stop = space.start() if space else len(text)
+        pos = stop
+        match = SCANNER.search(text, start, stop)
+        while match:
+            raw, end = match.group(0), match.end()
+            # Follow the URL over line breaks inserted by text extraction
+            for _ in range(3):
+                cont = CONTINUATION.match(text, end)
+                if not cont or not _wraps(raw, cont.group(1)):
+                    break
+                raw += cont.group(1)
+                end = cont.end()
+            pos = max(pos, end)
+            raw = _trim(raw)
+            if raw:
+                yield raw, match.start(), end
+            match = SCANNER.search(text, end, stop) if end < stop else None
+
+
+def extract_urls(pages, context_chars=URL_CONTEXT_CHARS, limit=URL_MAX_RESULTS):
+    """Deduplicated URLs in page text, in order of first occurrence.
+
+    pages is a list of page texts (or one string). Each entry has the normalized url, the
+    context of its first occurrence, count, pages (1-based), raw when written differently
+    and defanged when it was obfuscated.
+    """
+    if isinstance(pages, str):
+        pages = [pages]
+    found = {}
+    for page_number, text in enumerate(pages, 1):
+        for raw, start, end in scan(text or ""):
+            normalized = normalize(raw)
+            if not normalized:
+                continue
+            url, defanged = normalized
+            entry = found.get(url)
+            if entry is None:
+                if len(found) >= limit:
+                    continue
+                entry = found[url] = {
+                    "url": url,
+                    "context": _context(text, start, end, context_chars),
+                    "count": 0,
+                    "pages": [],
+                    "sources": ["text"],
+                }
+                if raw != url:
+                    entry["raw"] = raw
+            entry["count"] += 1
+            if defanged:
+                entry["defanged"] = True
+            if page_number not in entry["pages"]:
+                entry["pages"].append(page_number)
+    return list(found.values())
+
+
+def _hosts(text):
+    hosts = set()
+    for raw, _, _ in scan(text or ""):
+        normalized = normalize(raw)
+        if normalized:
+            hosts.add(urlsplit(normalized[0]).hostname)
+    return hosts
+
+
+def merge_annotations(urls, links):
+    """Fold annotation links into extract_urls() entries (a new list; urls may be empty).
+
+    Links whose visible text shows other hosts than the link target get anchor_mismatch
+    and anchor_hosts, the classic "text says bank.com, link goes elsewhere" lure.
+    """
+    merged = {entry["url"]: dict(entry, pages=list(entry["pages"]), sources=list(entry["sources"]))
+              for entry in urls}
+    for link in links:
+        normalized = normalize(link["url"].strip())
+        if not normalized:
+            continue
+        url = normalized[0]
+        entry = merged.get(url)
+        if entry is None:
+            entry = merged[url] = {"url": url, "context": None, "count": 0, "pages": [], "sources": []}
+            if link["url"] != url:
+                entry["raw"] = link["url"]
+        entry["count"] += 1
+        if "annotation" not in entry["sources"]:
+            entry["sources"].append("annotation")
+        if link.get("page") and link["page"] not in entry["pages"]:
+            entry["pages"].append(link["page"])
+        anchor = link.get("anchor_text")
+        if anchor:
+            entry.setdefault("anchor_text", anchor)
+            shown = _hosts(anchor) - {urlsplit(url).hostname}
+            if shown:
+                entry["anchor_mismatch"] = True
+                entry["anchor_hosts"] = sorted(set(entry.get("anchor_hosts", [])) | shown)
+    return list(merged.values())
@@ -0,0 +1,188 @@
+"""
+LLM cost accounting and per-tenant token budgets.
+
+- summarize_usage(): the `usage` objects returned by the LLM services, keyed by
+  stage, become the `llm_usage` stored with an analysis: totals, the per-stage
+  breakdown and an estimated cost from LLM_PRICES.
+- TenantBudgets: tokens used per tenant (X-Tenant-ID header) in the current
+  budget window, kept in MongoDB so every worker sees the same totals. admit()
+  decides whether a new analysis runs in full, runs degraded (visual analysis
+  skipped) once the tenant's budget is used up, or is rejected once usage passes
+  TENANT_BUDGET_REJECT_RATIO times the budget.
+- Only configured tenants (TENANT_TOKEN_BUDGETS, TENANT_KEYS, DEFAULT_TENANT)
+  are honoured, and with TENANT_KEYS only together with their key in the
+  X-Tenant-Key header. Any other value is charged to, and labelled as, the one
+  tenant UNKNOWN_TENANT, so made-up names neither escape a budget nor add
+  metric labels.
+
+Usage is charged when an analysis finishes, so analyses already running when a
+budget runs out can overshoot it. Cached results cost nothing and are served
+regardless of budget.
+"""
+import hmac
+import logging
+import os
+import time
+from datetime import datetime
+
+from prometheus_client import Counter
+from pymongo import ASCENDING, DESCENDING
+
+logger = logging.getLogger("accounting")
+
+# USD per million prompt:completion tokens
+LLM_PRICES = os.getenv("LLM_PRICES", "gpt-4o=2.50:10.00,gpt-4o-mini=0.15:0.60")
+TENANT_HEADER = os.getenv("TENANT_HEADER", "X-Tenant-ID")
+DEFAULT_TENANT = os.getenv("DEFAULT_TENANT", "default")
+UNKNOWN_TENANT = "unknown"
+# tenant=key; when set, a tenant header is only honoured with the tenant's key
+TENANT_KEYS = os.getenv("TENANT_KEYS", "")
+TENANT_KEY_HEADER = os.getenv("TENANT_KEY_HEADER", "X-Tenant-Key")
+# tenant=tokens per window; tenants not listed get TENANT_DEFAULT_BUDGET (0 = unlimited)
+TENANT_TOKEN_BUDGETS = os.getenv("TENANT_TOKEN_BUDGETS", "")
+TENANT_DEFAULT_BUDGET = int(os.getenv("TENANT_DEFAULT_BUDGET", "0"))
+TENANT_BUDGET_WINDOW = int(os.getenv("TENANT_BUDGET_WINDOW", "86400"))
+TENANT_BUDGET_REJECT_RATIO = float(os.getenv("TENANT_BUDGET_REJECT_RATIO", "1.5"))
+
+FULL = "full"
+DEGRADED = "degraded"
+REJECTED = "rejected"
+
+TENANT_TOKENS = Counter("tenant_llm_tokens_total", "LLM tokens charged to tenants", ["tenant", "kind"])
+TENANT_COST = Counter("tenant_llm_cost_usd_total", "Estimated LLM cost charged to tenants", ["tenant"])
+BUDGET_DECISIONS = Counter("tenant_budget_decisions_total", "Analyses admitted, degraded or rejected by budget",
+                           ["tenant", "decision"])
+
+
+class BudgetExceeded(Exception):
+    """The tenant has used up its token budget; answered with 429."""
+
+
+def parse_pairs(raw, convert):
+    pairs = {}
+    for item in raw.split(","):
+        name, sep, value = item.partition("=")
+        if sep and name.strip():
+            pairs[name.strip()] = convert(value.strip())
+    return pairs
+
+
+PRICES = parse_pairs(LLM_PRICES, lambda value: tuple(float(p) for p in value.split(":")))
+BUDGETS = parse_pairs(TENANT_TOKEN_BUDGETS, int)
+KEYS = parse_pairs(TENANT_KEYS, str)
+TENANTS = set(BUDGETS) | set(KEYS) | {DEFAULT_TENANT}
+
+
+def cost_usd(model, prompt_tokens, completion_tokens):
+    prompt_price, completion_price = PRICES.get(model, (0.0, 0.0))
+    return (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1_000_000
+
+
+def summarize_usage(stages):
+    """Combine {stage: usage returned by an LLM service or None} into the stored llm_usage."""
+    stages = {name: usage for name, usage in stages.items() if usage}
+    summary = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0, "seconds": 0.0,
+               "cost_usd": 0.0, "stages": stages}
+    for usage in stages.values():
+        for key in ("calls", "prompt_tokens", "completion_tokens", "cached_tokens", "seconds"):
+            summary[key] += usage.get(key) or 0
+        for model, counts in (usage.get("models") or {}).items():
+            summary["cost_usd"] += cost_usd(model, counts.get("prompt_tokens", 0), counts.get("completion_tokens", 0))
+    summary["seconds"] = round(summary["seconds"], 3)
+    summary["cost_usd"] = round(summary["cost_usd"], 6)
+    return summary
+
+
+class TenantBudgets:
+    def __init__(self, collection):
+        """collection: one document per tenant and budget window."""
+        self.collection = collection
+        try:
+            collection.create_index([("window_start", DESCENDING), ("tenant", ASCENDING)], name="window_tenant")
+        except Exception:
+            logger.exception("Tenant usage index creation failed; /usage will be unindexed")
+
+    def tenant_of(self, headers):
+        """The configured tenant named by the request, DEFAULT_TENANT without a name, UNKNOWN_TENANT
+        for names that are not configured or, with TENANT_KEYS, not authenticated."""
+        name = (headers.get(TENANT_HEADER) or "").strip()
+        if not name:
+            return DEFAULT_TENANT
+        if name not in TENANTS:
+            return UNKNOWN_TENANT
+        if KEYS:
+            key = (headers.get(TENANT_KEY_HEADER) or "").encode()
+            if name not in KEYS or not hmac.compare_digest(KEYS[name].encode(), key):
+                return UNKNOWN_TENANT
+        return name
+
+    def budget(self, tenant):
+        return BUDGETS.get(tenant, TENANT_DEFAULT_BUDGET)
+
+    def _window(self):
+        """Start of the current budget window, in epoch seconds."""
+        return int(time.time()) // TENANT_BUDGET_WINDOW * TENANT_BUDGET_WINDOW
+
+    def used(self, tenant):
+        doc = self.collection.find_one({"_id": f"{tenant}:{self._window()}"}, {"tokens": 1})
+        return doc["tokens"] if doc else 0
+
+    def admit(self, tenant):
+        """FULL or DEGRADED for a new analysis; raises BudgetExceeded past the reject threshold."""
+        budget = self.budget(tenant)
+        decision = FULL
+        if budget > 0:
+            used = self.used(tenant)
+            if used >= budget * TENANT_BUDGET_REJECT_RATIO:
+                decision = REJECTED
+            elif used >= budget:
+                decision = DEGRADED
+        BUDGET_DECISIONS.labels(tenant, decision).inc()
+        if decision == REJECTED:
+            logger.warning("Token budget exhausted", extra={"tenant": tenant, "budget": budget})
+            raise BudgetExceeded(f"Token budget of tenant {tenant!r} exhausted, retry in the next window")
+        return decision
+
+    def charge(self, tenant, llm_usage):
+        """Add a finished analysis and its LLM usage (None for rule-based verdicts) to the tenant's window."""
+        llm_usage = llm_usage or {}
+        prompt, completion = llm_usage.get("prompt_tokens", 0), llm_usage.get("completion_tokens", 0)
+        cost = llm_usage.get("cost_usd", 0.0)
+        start = self._window()
+        self.collection.update_one(
+            {"_id": f"{tenant}:{start}"},
+            {
+                "$inc": {"tokens": prompt + completion, "prompt_tokens": prompt, "completion_tokens": completion,
+                         "cost_usd": cost, "analyses": 1},
+                "$setOnInsert": {"tenant": tenant, "window_start": datetime.utcfromtimestamp(start)},
+            },
+            upsert=True,
+        )
+        TENANT_TOKENS.labels(tenant, "prompt").inc(prompt)
+        TENANT_TOKENS.labels(tenant, "completion").inc(completion)
+        TENANT_COST.labels(tenant).inc(cost)
+
+    def report(self, tenant=None):
+        """Usage of every tenant (or one) in the current window, with budgets."""
+        start = self._window()
+        query = {"window_start": datetime.utcfromtimestamp(start)}
+        if tenant:
+            query["tenant"] = tenant
+        tenants = []
+        for doc in self.collection.find(query).sort("tokens", DESCENDING):
+            budget = self.budget(doc["tenant"])
+            tenants.append({
+                "tenant": doc["tenant"],
+                "analyses": doc.get("analyses", 0),
+                "tokens": doc.get("tokens", 0),
+                "prompt_tokens": doc.get("prompt_tokens", 0),
+                "completion_tokens": doc.get("completion_tokens", 0),
+                "cost_usd": round(doc.get("cost_usd", 0.0), 6),
+                "budget": budget or None,
+                "remaining": max(0, budget - doc.get("tokens", 0)) if budget else None,
+            })
+        return {
+            "window_start": datetime.utcfromtimestamp(start).isoformat() + "Z",
+            "window_seconds": TENANT_BUDGET_WINDOW,
+            "tenants": tenants,
+        }
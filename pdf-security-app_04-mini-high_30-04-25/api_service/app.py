@@ -1,11 +1,22 @@
-import os, base64, hashlib, requests, logging, json
+import os, logging, json
 from flask import Flask, request, jsonify
-from io import BytesIO
-from PyPDF2 import PdfReader
+from werkzeug.exceptions import RequestEntityTooLarge
 from pythonjsonlogger import jsonlogger
 from pymongo import MongoClient
+from accounting import DEGRADED, BudgetExceeded, TenantBudgets, summarize_usage
+from fastpath import VERDICT_SOURCE_LLM, VERDICT_SOURCE_RULES, fast_verdict
+from dedup import SeenHashes
+from ingest import MAX_PDF_BYTES, IngestError, from_stream, from_url
+from metrics import cache_result, http_call, instrument, observe, timed
+from pdffeatures import stored_features
+from pdfwalk import check_pdf
+from scoring import SCORE_BATCH_MAX, BatchScorer, ScoreModel
+from similarity import SIMILARITY_MAX_RESULTS, SIMILARITY_MIN_SCORE, SimilarityIndex, reusable, similar_verdict
+from writebehind import BufferFull, WriteBehind
 
 app = Flask(__name__)
+# reject oversized uploads before the multipart body is parsed (1 MiB allowance for form overhead)
+app.config['MAX_CONTENT_LENGTH'] = MAX_PDF_BYTES + 1024 * 1024
 
 # setup logging
 logger = logging.getLogger()
@@ -14,6 +25,7 @@ formatter = jsonlogger.JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+instrument(app, 'api_service')
 
 # service URLs and DB
 ANALYSIS_URL = os.environ['ANALYSIS_SERVICE_URL']
@@ -27,122 +39,284 @@ MONGODB_URI = os.environ.get('MONGODB_URI', 'mongodb://mongodb:27017/pdf_analysi
 client = MongoClient(MONGODB_URI)
 db = client.get_default_database()
 collection = db.analyses
+# analyses are written in batches off the request path
+# stored_at: insert time for the columnar export watermark (columnar.py)
+writer = WriteBehind(collection, 'analyses', on_batch=lambda records, seconds: observe('mongo_insert', seconds),
+                     stamp_field='stored_at')
+# known files are answered from their hash before any parsing
+seen = SeenHashes(collection, 'sha256', writer)
+CACHED_FIELDS = {'risk_score': 1, 'reasoning': 1, 'verdict_source': 1, 'degraded': 1}
+# LLM tokens per tenant and budget window
+budgets = TenantBudgets(db.tenant_usage)
+# campaign variants: MinHash/LSH search over similarity sketches taken at ingest
+similar_index = SimilarityIndex(collection)
+# vectorized re-scoring of stored feature vectors (SCORE_MODEL_FILE or the default rule set)
+batch_scorer = BatchScorer(collection, ScoreModel.load())
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     logger.info('Received request', extra={'endpoint': '/analyze'})
+    tenant = budgets.tenant_of(request.headers)
     try:
+        # input is streamed into a size-capped spooled file and hashed on the way
         if 'file' in request.files:
             file = request.files['file']
-            file_bytes = file.read()
+            pdf = from_stream(file.stream)
             input_source = 'upload'
             source_name = file.filename
         else:
-            data = request.get_json()
+            data = request.get_json(silent=True)
             if not data or 'url' not in data:
                 logger.error('No file or URL provided')
                 return jsonify(error='No file or URL provided'), 400
             pdf_url = data['url']
             logger.info('Downloading PDF', extra={'url': pdf_url})
-            r = requests.get(pdf_url)
-            if r.status_code != 200:
-                logger.error('Failed to download PDF', extra={'status_code': r.status_code})
-                return jsonify(error='Failed to download PDF'), 400
-            file_bytes = r.content
+            with timed('download'):
+                pdf = from_url(pdf_url)
             input_source = 'url'
             source_name = pdf_url
-        # validate PDF
-        try:
-            reader = PdfReader(BytesIO(file_bytes))
-            reader.pages
-            logger.info('PDF validation successful')
-        except Exception as e:
-            logger.error('Invalid PDF file', extra={'error': str(e)})
-            return jsonify(error='Invalid PDF file'), 400
-        # hashes
-        md5 = hashlib.md5(file_bytes).hexdigest()
-        sha256 = hashlib.sha256(file_bytes).hexdigest()
+        md5, sha256 = pdf.md5, pdf.sha256
         logger.info('Hash calculation', extra={'md5': md5, 'sha256': sha256})
-        # encode pdf
-        pdf_b64 = base64.b64encode(file_bytes).decode()
-        # structural & content
-        resp = requests.post(f'{ANALYSIS_URL}/analyze', json={'pdf': pdf_b64})
-        if resp.status_code != 200:
-            logger.error('Analysis service error', extra={'status_code': resp.status_code, 'body': resp.text})
-            return jsonify(error='Analysis service error', details=resp.text), 502
-        analysis = resp.json()
-        structural = analysis.get('structural_report')
-        content = analysis.get('content_report')
-        # visual
-        resp = requests.post(f'{VISUAL_URL}/analyze', json={'pdf': pdf_b64})
-        if resp.status_code != 200:
-            logger.error('Visual service error', extra={'status_code': resp.status_code, 'body': resp.text})
-            return jsonify(error='Visual service error', details=resp.text), 502
-        visual_report = resp.json().get('visual_report')
-        # file reputation
-        resp = requests.post(f'{VT_URL}/reputation', json={'sha256': sha256})
-        if resp.status_code != 200:
-            logger.error('VirusTotal service error', extra={'status_code': resp.status_code, 'body': resp.text})
-            return jsonify(error='VirusTotal service error', details=resp.text), 502
-        file_reputation = resp.json().get('file_reputation')
-        # prioritize URL
-        urls_struct = structural.get('urls', [])
-        urls_content = [u['url'] for u in content.get('urls', [])]
-        resp = requests.post(f'{PRIORITIZER_URL}/prioritize', json={'structural_urls': urls_struct, 'content_urls': urls_content, 'visual_report': visual_report})
-        if resp.status_code != 200:
-            logger.error('Prioritizer service error', extra={'status_code': resp.status_code, 'body': resp.text})
-            return jsonify(error='Prioritizer service error', details=resp.text), 502
-        priority_url = resp.json().get('priority_url')
-        # conditional URL reputation
-        url_reputation = None
-        if priority_url:
-            logger.info('Scanning priority URL', extra={'url': priority_url})
-            resp = requests.post(f'{URLSCAN_URL}/reputation', json={'url': priority_url})
-            if resp.status_code != 200:
-                logger.error('URLScan service error', extra={'status_code': resp.status_code, 'body': resp.text})
-                return jsonify(error='URLScan service error', details=resp.text), 502
-            url_reputation = resp.json().get('url_reputation')
-        # synthesize
-        synth_payload = {
-            'structural_report': structural,
-            'content_report': content,
-            'visual_report': visual_report,
-            'file_reputation': file_reputation,
-            'priority_url': priority_url,
-            'url_reputation': url_reputation
-        }
-        resp = requests.post(f'{SYNTHESIZER_URL}/synthesize', json=synth_payload)
-        if resp.status_code != 200:
-            logger.error('Synthesizer service error', extra={'status_code': resp.status_code, 'body': resp.text})
-            return jsonify(error='Synthesizer service error', details=resp.text), 502
-        result = resp.json()
-        risk_score = result.get('risk_score')
-        reasoning = result.get('reasoning')
-        # store in db
-        record = {
+        try:
+            # early dedup: a previously analysed file skips validation and the pipeline
+            with timed('dedup_lookup'):
+                existing = seen.lookup(sha256, CACHED_FIELDS)
+            cache_result('analyses', 'hit' if existing else 'miss')
+            if existing:
+                logger.info('Returning cached analysis', extra={'sha256': sha256})
+                return jsonify(cached_response(existing)), 200
+            # the spooled PDF is streamed to the services and closed once the pipeline is done
+            return run_pipeline(pdf, input_source, source_name, tenant)
+        finally:
+            pdf.close()
+    except IngestError as e:
+        logger.error('PDF rejected', extra={'error': str(e), 'status_code': e.status_code})
+        return jsonify(error=str(e)), e.status_code
+    except RequestEntityTooLarge:
+        logger.error('PDF rejected', extra={'error': 'upload too large', 'status_code': 413})
+        return jsonify(error=f'PDF exceeds the {MAX_PDF_BYTES} byte limit'), 413
+    except BudgetExceeded as e:
+        return jsonify(error=str(e)), 429
+    except BufferFull:
+        logger.error('Analysis write buffer full')
+        return jsonify(error='Service overloaded, retry later'), 503
+    except Exception as e:
+        logger.exception('Internal server error')
+        return jsonify(error='Internal server error', details=str(e)), 500
+
+def run_pipeline(pdf, input_source, source_name, tenant):
+    """The analysis services for an ingested PDF that is not yet known; service errors return 502."""
+    md5, sha256 = pdf.md5, pdf.sha256
+    # validate PDF: header, trailer and catalog only, no page tree (see pdfwalk.py)
+    try:
+        with timed('validate'), pdf.mapped() as data:
+            check_pdf(data)
+        logger.info('PDF validation successful')
+    except Exception as e:
+        logger.error('Invalid PDF file', extra={'error': str(e)})
+        return jsonify(error='Invalid PDF file'), 400
+    # structural & content, the PDF streamed from the spool as a multipart upload
+    upload = pdf.upload()
+    resp = http_call('analysis_service', 'POST', f'{ANALYSIS_URL}/analyze', data=upload, headers=upload.headers)
+    if resp.status_code != 200:
+        logger.error('Analysis service error', extra={'status_code': resp.status_code, 'body': resp.text})
+        return jsonify(error='Analysis service error', details=resp.text), 502
+    analysis = resp.json()
+    structural = analysis.get('structural_report')
+    # the feature vector is stored packed, not passed on to the LLM services
+    vector = structural.pop('vector', None)
+    content = analysis.get('content_report')
+    # file reputation
+    resp = http_call('vt_service', 'POST', f'{VT_URL}/reputation', json={'sha256': sha256})
+    if resp.status_code != 200:
+        logger.error('VirusTotal service error', extra={'status_code': resp.status_code, 'body': resp.text})
+        return jsonify(error='VirusTotal service error', details=resp.text), 502
+    file_reputation = resp.json().get('file_reputation')
+    urls_struct = structural.get('urls', [])
+    urls_content = [u['url'] for u in content.get('urls', [])]
+    # fast path: clear-cut documents skip the LLM stages
+    rule = fast_verdict(structural, file_reputation, len(set(urls_struct) | set(urls_content)), vector)
+    # variants of an analysed malicious document take over its verdict
+    if not rule and pdf.similarity:
+        with timed('similarity_search'):
+            match = reusable(similar_index.search(pdf.similarity, exclude=sha256))
+        if match:
+            rule = similar_verdict(match)
+    if rule:
+        logger.info('Fast-path verdict', extra={'sha256': sha256, 'rule': rule['rule']})
+        return store_and_respond({
             'input_source': input_source,
             'source_name': source_name,
             'md5': md5,
             'sha256': sha256,
             'structural_report': structural,
             'content_report': content,
-            'visual_report': visual_report,
+            'visual_report': None,
             'file_reputation': file_reputation,
-            'priority_url': priority_url,
-            'url_reputation': url_reputation,
-            'risk_score': risk_score,
-            'reasoning': reasoning
-        }
-        db_res = collection.insert_one(record)
-        analysis_id = str(db_res.inserted_id)
-        logger.info('Analysis stored', extra={'analysis_id': analysis_id})
-        # response
-        response_body = {'analysis_id': analysis_id, 'risk_score': risk_score, 'reasoning': reasoning}
-        logger.info('Sending final response', extra=response_body)
-        return jsonify(response_body), 200
+            'priority_url': None,
+            'url_reputation': None,
+            'risk_score': rule['verdict'],
+            'reasoning': rule['reasoning'],
+            'verdict_source': VERDICT_SOURCE_RULES,
+            'rule': rule['rule'],
+            'tenant': tenant,
+            'llm_usage': None,
+            'degraded': None,
+            'similarity': pdf.similarity,
+            'features': stored_features(vector)
+        })
+    # over-budget tenants get a degraded analysis without the visual stage, or a 429
+    degraded = budgets.admit(tenant) == DEGRADED
+    usage = {}
+    # visual
+    if degraded:
+        visual_report = None
+    else:
+        upload = pdf.upload()
+        resp = http_call('visual_service', 'POST', f'{VISUAL_URL}/analyze', data=upload, headers=upload.headers)
+        if resp.status_code != 200:
+            logger.error('Visual service error', extra={'status_code': resp.status_code, 'body': resp.text})
+            return jsonify(error='Visual service error', details=resp.text), 502
+        visual_report = resp.json().get('visual_report')
+        usage['visual'] = resp.json().get('usage')
+    # prioritize URL
+    resp = http_call('prioritizer_service', 'POST', f'{PRIORITIZER_URL}/prioritize', json={'structural_urls': urls_struct, 'content_urls': content.get('urls', []), 'visual_report': visual_report})
+    if resp.status_code != 200:
+        logger.error('Prioritizer service error', extra={'status_code': resp.status_code, 'body': resp.text})
+        return jsonify(error='Prioritizer service error', details=resp.text), 502
+    priority_url = resp.json().get('priority_url')
+    usage['prioritize'] = resp.json().get('usage')
+    # conditional URL reputation
+    url_reputation = None
+    if priority_url:
+        logger.info('Scanning priority URL', extra={'url': priority_url})
+        resp = http_call('urlscan_service', 'POST', f'{URLSCAN_URL}/reputation', json={'url': priority_url})
+        if resp.status_code != 200:
+            logger.error('URLScan service error', extra={'status_code': resp.status_code, 'body': resp.text})
+            return jsonify(error='URLScan service error', details=resp.text), 502
+        url_reputation = resp.json().get('url_reputation')
+    # synthesize
+    synth_payload = {
+        'structural_report': structural,
+        'content_report': content,
+        'visual_report': visual_report,
+        'file_reputation': file_reputation,
+        'priority_url': priority_url,
+        'url_reputation': url_reputation
+    }
+    resp = http_call('synthesizer_service', 'POST', f'{SYNTHESIZER_URL}/synthesize', json=synth_payload)
+    if resp.status_code != 200:
+        logger.error('Synthesizer service error', extra={'status_code': resp.status_code, 'body': resp.text})
+        return jsonify(error='Synthesizer service error', details=resp.text), 502
+    result = resp.json()
+    risk_score = result.get('risk_score')
+    reasoning = result.get('reasoning')
+    usage['synthesize'] = result.get('usage')
+    record = {
+        'input_source': input_source,
+        'source_name': source_name,
+        'md5': md5,
+        'sha256': sha256,
+        'structural_report': structural,
+        'content_report': content,
+        'visual_report': visual_report,
+        'file_reputation': file_reputation,
+        'priority_url': priority_url,
+        'url_reputation': url_reputation,
+        'risk_score': risk_score,
+        'reasoning': reasoning,
+        'verdict_source': VERDICT_SOURCE_LLM,
+        'rule': None,
+        'tenant': tenant,
+        'llm_usage': summarize_usage(usage),
+        'degraded': ['visual'] if degraded else None,
+        'similarity': pdf.similarity,
+        'features': stored_features(vector)
+    }
+    return store_and_respond(record)
+
+
+@app.route('/usage', methods=['GET'])
+def usage_report():
+    # LLM tokens and estimated cost per tenant in the current budget window
+    try:
+        return jsonify(budgets.report(request.args.get('tenant'))), 200
     except Exception as e:
-        logger.exception('Internal server error')
+        logger.exception('Usage report error')
         return jsonify(error='Internal server error', details=str(e)), 500
 
+@app.route('/results/similar/<sha256>', methods=['GET'])
+def similar_results(sha256):
+    # analyses of files that share most of their PDF objects with this one
+    try:
+        try:
+            limit = min(max(int(request.args.get('limit', SIMILARITY_MAX_RESULTS)), 1), 100)
+            min_score = float(request.args.get('min_score', SIMILARITY_MIN_SCORE))
+        except ValueError:
+            return jsonify(error='limit and min_score must be numbers'), 400
+        found, sketch = similar_index.sketch_of(sha256)
+        if not found:
+            pending = writer.find_pending({'sha256': sha256})
+            if not pending:
+                return jsonify(error='Analysis not found'), 404
+            sketch = pending.get('similarity')
+        if not sketch:
+            return jsonify(error='No similarity sketch stored for this analysis'), 404
+        with timed('similarity_search'):
+            matches = similar_index.search(sketch, exclude=sha256, limit=limit, min_score=min_score)
+        logger.info('Similar analyses', extra={'sha256': sha256, 'matches': len(matches)})
+        return jsonify(sha256=sha256, fingerprint=sketch['fingerprint'], similar=matches), 200
+    except Exception as e:
+        logger.exception('Similar analyses error')
+        return jsonify(error='Internal server error', details=str(e)), 500
+
+@app.route('/score/batch', methods=['POST'])
+def score_batch():
+    # score the stored feature vectors of many analyses at once with the local model
+    body = request.get_json(silent=True) or {}
+    if not isinstance(body, dict):
+        return jsonify(error='Expected a JSON object'), 400
+    query = {}
+    hashes = body.get('sha256')
+    if hashes is not None:
+        if not isinstance(hashes, list):
+            return jsonify(error='sha256 must be a list of hashes'), 400
+        query['sha256'] = {'$in': hashes}
+    risk = body.get('risk')
+    if risk:
+        query['risk_score'] = {'$in': risk if isinstance(risk, list) else risk.split(',')}
+    limit = body.get('limit', SCORE_BATCH_MAX)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        return jsonify(error='limit must be a positive integer'), 400
+    try:
+        with timed('score_batch'):
+            report = batch_scorer.score(query, min(limit, SCORE_BATCH_MAX), bool(body.get('store')))
+        logger.info('Batch scored', extra={'scored': report['scored'], 'model': report['model']})
+        return jsonify(report), 200
+    except Exception as e:
+        logger.exception('Batch scoring error')
+        return jsonify(error='Internal server error', details=str(e)), 500
+
+def cached_response(doc):
+    body = {'analysis_id': str(doc['_id']), 'risk_score': doc['risk_score'],
+            'reasoning': doc['reasoning'], 'verdict_source': doc.get('verdict_source', VERDICT_SOURCE_LLM)}
+    if doc.get('degraded'):
+        body['degraded'] = doc['degraded']
+    return body
+
+def store_and_respond(record):
+    # queue for storage
+    analysis_id = writer.submit(record)
+    seen.add(record['sha256'])
+    budgets.charge(record['tenant'], record['llm_usage'])
+    logger.info('Analysis queued for storage', extra={'analysis_id': analysis_id})
+    # response
+    response_body = {'analysis_id': analysis_id, 'risk_score': record['risk_score'],
+                     'reasoning': record['reasoning'], 'verdict_source': record['verdict_source']}
+    if record['degraded']:
+        response_body['degraded'] = record['degraded']
+    logger.info('Sending final response', extra=response_body)
+    return jsonify(response_body), 200
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
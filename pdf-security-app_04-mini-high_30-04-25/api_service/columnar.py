@@ -0,0 +1,341 @@
+"""
+Incremental columnar export of analyses to partitioned Parquet, and reports over it.
+
+SOC reports (risk by day, top priority-URL domains, VirusTotal detection
+ratios) need a few scalar fields of every analysis; run against the serving
+database they scan documents holding structural reports, URL lists and
+images. Exporter copies just those fields into Parquet files that analytics
+read instead:
+
+- one row per analysis with the columns of SCHEMA, the same for every app:
+  the Layout of an app says where its documents keep hashes, verdict, URLs
+  and creation time;
+- rows are written under <EXPORT_DIR>/<collection>/date=YYYY-MM-DD/ (Hive
+  partitioning by creation day), one part file per partition and pass;
+- a pass exports analyses stored after the last exported (`stored_at`,
+  `_id`) and analyses changed (`updated_at`, set by in-place updates such as
+  re-enrichment and batch scoring) after the last exported change.
+  `stored_at` is the server time of the insert, stamped by the write-behind
+  writer, so records that waited in its buffer or spool (a MongoDB outage,
+  a replay after a crash) are exported when they land, not skipped behind a
+  watermark their `_id` is older than. Analyses stored before stamping are
+  exported once by `_id`. Watermarks stop EXPORT_LAG seconds before now, to
+  let writes in flight and replication to the secondary catch up; they are
+  kept in _state.json next to the partitions and only advance after the
+  files are written.
+
+A changed analysis is exported again, so a dataset may hold several rows per
+analysis_id; load() keeps the one with the latest version_at. Reads use a
+secondary when the database is a replica set.
+"""
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlsplit
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from bson import ObjectId
+from pymongo import ASCENDING, ReadPreference
+
+from writebehind import field_value
+
+logger = logging.getLogger("columnar")
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "analytics")
+EXPORT_INTERVAL = float(os.getenv("EXPORT_INTERVAL", "300"))
+# Seconds between a write and its export, longer than a batch insert plus the replication lag
+EXPORT_LAG = float(os.getenv("EXPORT_LAG", "60"))
+# Most rows exported per pass and watermark; a backlog is worked off over several passes
+EXPORT_MAX_ROWS = int(os.getenv("EXPORT_MAX_ROWS", "200000"))
+EXPORT_COMPRESSION = os.getenv("EXPORT_COMPRESSION", "zstd")
+
+SCHEMA = pa.schema([
+    ("analysis_id", pa.string()),
+    ("created_at", pa.timestamp("ms")),
+    ("version_at", pa.timestamp("ms")),
+    ("sha256", pa.string()),
+    ("md5", pa.string()),
+    ("risk", pa.string()),
+    ("verdict_source", pa.string()),
+    ("rule", pa.string()),
+    ("profile", pa.string()),
+    ("degraded", pa.list_(pa.string())),
+    ("tenant", pa.string()),
+    ("priority_url", pa.string()),
+    ("priority_domain", pa.string()),
+    ("url_count", pa.int32()),
+    ("domains", pa.list_(pa.string())),
+    ("vt_malicious", pa.int32()),
+    ("vt_suspicious", pa.int32()),
+    ("vt_engines", pa.int32()),
+    ("vt_detection_ratio", pa.float64()),
+    ("llm_calls", pa.int32()),
+    ("llm_tokens", pa.int64()),
+    ("llm_cost_usd", pa.float64()),
+    ("model_score", pa.float64()),
+    ("model_risk", pa.string()),
+])
+# The columns of the files plus the date partition key
+DATASET_SCHEMA = SCHEMA.append(pa.field("date", pa.string()))
+
+
+class Layout:
+    def __init__(self, sha_field="sha256", md5_field="md5", risk_field="risk_score", created_field="created_at",
+                 url_fields=("structural.urls", "content.urls"), stored_field="stored_at"):
+        """Where an app's documents keep each exported value (dotted paths). created_field None
+        takes the creation time from the ObjectId; url_fields hold URL strings or urlextract
+        entries; stored_field is the insert time stamped by the writer (WriteBehind stamp_field)."""
+        self.sha_field = sha_field
+        self.md5_field = md5_field
+        self.risk_field = risk_field
+        self.created_field = created_field
+        self.url_fields = url_fields
+        self.stored_field = stored_field
+
+    def projection(self):
+        fields = [self.sha_field, self.md5_field, self.risk_field, "verdict_source", "rule", "profile", "degraded",
+                  "tenant", "priority_url", "file_reputation", "llm_usage", "model_score", "updated_at"]
+        fields += [self.created_field] if self.created_field else []
+        fields.append(self.stored_field)
+        return dict.fromkeys(fields + list(self.url_fields), 1)
+
+
+def _domain(entry):
+    """Registered domain of a URL string or urlextract entry (host when it has no domain features)."""
+    if isinstance(entry, dict):
+        registered = (entry.get("domain") or {}).get("registered_domain")
+        if registered:
+            return registered
+        entry = entry.get("url")
+    try:
+        return urlsplit(entry or "").hostname
+    except ValueError:
+        return None
+
+
+def _int(value):
+    return int(value) if isinstance(value, (int, float)) else None
+
+
+def to_row(doc, layout):
+    """The SCHEMA row of a stored analysis."""
+    created = field_value(doc, layout.created_field) if layout.created_field else None
+    if not isinstance(created, datetime):
+        created = doc["_id"].generation_time.replace(tzinfo=None)
+    urls = {}
+    for path in layout.url_fields:
+        for entry in field_value(doc, path) or []:
+            url = entry.get("url") if isinstance(entry, dict) else entry
+            if url and url not in urls:
+                urls[url] = _domain(entry)
+    priority_url = doc.get("priority_url")
+    file_rep = doc.get("file_reputation") or {}
+    stats = file_rep.get("stats") or file_rep.get("last_analysis_stats") or {}
+    engines = sum(v for v in stats.values() if isinstance(v, int)) if stats else None
+    usage = doc.get("llm_usage") or {}
+    model = doc.get("model_score") or {}
+    degraded = doc.get("degraded")
+    return {
+        "analysis_id": str(doc["_id"]),
+        "created_at": created,
+        "version_at": doc.get("updated_at") or created,
+        "sha256": field_value(doc, layout.sha_field),
+        "md5": field_value(doc, layout.md5_field),
+        "risk": field_value(doc, layout.risk_field),
+        "verdict_source": doc.get("verdict_source"),
+        "rule": doc.get("rule"),
+        "profile": doc.get("profile"),
+        "degraded": list(degraded) if isinstance(degraded, list) else None,
+        "tenant": doc.get("tenant"),
+        "priority_url": priority_url,
+        "priority_domain": (urls.get(priority_url) or _domain(priority_url)) if priority_url else None,
+        "url_count": len(urls),
+        "domains": sorted({domain for domain in urls.values() if domain}),
+        "vt_malicious": _int(stats.get("malicious")),
+        "vt_suspicious": _int(stats.get("suspicious")),
+        "vt_engines": engines,
+        "vt_detection_ratio": round(stats.get("malicious", 0) / engines, 4) if engines else None,
+        "llm_calls": _int(usage.get("calls")),
+        "llm_tokens": (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0) if usage else None,
+        "llm_cost_usd": usage.get("cost_usd"),
+        "model_score": model.get("score"),
+        "model_risk": model.get("risk"),
+    }
+
+
+class Exporter:
+    def __init__(self, collection, layout=None, directory=EXPORT_DIR):
+        self.collection = collection.with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+        self.layout = layout or Layout()
+        self.directory = os.path.join(directory, collection.name)
+        self.state_path = os.path.join(self.directory, "_state.json")
+        collection.create_index([("updated_at", ASCENDING)], name="updated_at", sparse=True)
+        collection.create_index([(self.layout.stored_field, ASCENDING), ("_id", ASCENDING)],
+                                name=self.layout.stored_field, sparse=True)
+
+    def state(self):
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return {"last_stored": None, "last_id": None, "last_updated": None}
+        # State written before the stored_at watermark
+        state.setdefault("last_stored", None)
+        return state
+
+    def _save_state(self, state):
+        tmp = self.state_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp, self.state_path)
+
+    def _write(self, rows, stamp):
+        """Write rows as one part file per creation day; returns the files written."""
+        partitions = {}
+        for row in rows:
+            partitions.setdefault(row["created_at"].strftime("%Y-%m-%d"), []).append(row)
+        files = []
+        for day, part in sorted(partitions.items()):
+            directory = os.path.join(self.directory, f"date={day}")
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"part-{stamp}.parquet")
+            # Readers skip dot files, so a part is only seen once it is complete
+            tmp = os.path.join(directory, f".part-{stamp}.parquet.tmp")
+            pq.write_table(pa.Table.from_pylist(part, schema=SCHEMA), tmp, compression=EXPORT_COMPRESSION)
+            os.replace(tmp, path)
+            files.append(path)
+        return files
+
+    def export(self, now=None):
+        """One incremental pass; returns the new watermarks with the rows and files written."""
+        now = now or datetime.utcnow()
+        until = now - timedelta(seconds=EXPORT_LAG)
+        state = self.state()
+        projection = self.layout.projection()
+
+        field = self.layout.stored_field
+        docs = {}
+
+        query = {field: {"$lte": until}}
+        if state["last_stored"]:
+            # Records stored in the same millisecond are told apart by `_id`
+            last_stored, last_id = datetime.fromisoformat(state["last_stored"][0]), ObjectId(state["last_stored"][1])
+            query = {"$or": [{field: {"$gt": last_stored, "$lte": until}}, {field: last_stored, "_id": {"$gt": last_id}}]}
+        for doc in self.collection.find(query, projection).sort([(field, ASCENDING), ("_id", ASCENDING)]).limit(
+                EXPORT_MAX_ROWS):
+            docs[doc["_id"]] = doc
+            state["last_stored"] = [doc[field].isoformat(), str(doc["_id"])]
+
+        # Records stored without the stamp (before it was introduced) go by `_id`
+        created_until = ObjectId.from_datetime(until.replace(tzinfo=timezone.utc))
+        created = {"$lte": created_until}
+        if state["last_id"]:
+            created["$gt"] = ObjectId(state["last_id"])
+        unstamped = self.collection.find({"_id": created, field: {"$exists": False}}, projection).sort(
+            "_id", ASCENDING).limit(EXPORT_MAX_ROWS)
+        count = 0
+        for count, doc in enumerate(unstamped, 1):
+            docs[doc["_id"]] = doc
+            state["last_id"] = str(doc["_id"])
+        if count < EXPORT_MAX_ROWS:
+            # Nothing unstamped is left below the bound: later passes only look at newer ids
+            state["last_id"] = str(created_until)
+
+        changed = {"$lte": until}
+        if state["last_updated"]:
+            changed["$gt"] = datetime.fromisoformat(state["last_updated"])
+        # A record changed before its first export is written twice; load() keeps one row
+        query = {"updated_at": changed}
+        for doc in self.collection.find(query, projection).sort("updated_at", ASCENDING).limit(EXPORT_MAX_ROWS):
+            docs[doc["_id"]] = doc
+            state["last_updated"] = doc["updated_at"].isoformat()
+
+        rows = [to_row(doc, self.layout) for doc in docs.values()]
+        files = self._write(rows, now.strftime("%Y%m%dT%H%M%S%f")) if rows else []
+        state["exported_at"] = now.isoformat()
+        self._save_state(state)
+        return dict(state, rows=len(rows), files=len(files))
+
+    def run_forever(self):
+        while True:
+            started = time.monotonic()
+            try:
+                result = self.export()
+                logger.info("Export pass", extra=result)
+                if result["rows"] >= EXPORT_MAX_ROWS:
+                    continue
+            except Exception:
+                logger.exception("Export pass failed")
+            time.sleep(max(0.0, EXPORT_INTERVAL - (time.monotonic() - started)))
+
+
+def load(directory, since=None, until=None, columns=None):
+    """The exported analyses under directory (one collection) as a pyarrow Table, latest row
+    per analysis_id, optionally limited to creation days since <= date < until (YYYY-MM-DD)."""
+    if not os.path.isdir(directory):
+        return pa.Table.from_pylist([], schema=SCHEMA)
+    dataset = ds.dataset(directory, format="parquet", partitioning="hive", schema=DATASET_SCHEMA)
+    condition = None
+    if since:
+        condition = ds.field("date") >= since
+    if until:
+        condition = (ds.field("date") < until) if condition is None else condition & (ds.field("date") < until)
+    wanted = [name for name in SCHEMA.names if name in set(columns or SCHEMA.names) | {"analysis_id", "version_at"}]
+    table = dataset.to_table(columns=wanted, filter=condition)
+    if table.num_rows == 0:
+        return table
+    # Keep the newest version of analyses exported more than once
+    table = table.append_column("_row", pa.array(range(table.num_rows), pa.int64()))
+    ordered = table.sort_by([("analysis_id", "ascending"), ("version_at", "descending"), ("_row", "descending")])
+    ids = ordered.column("analysis_id")
+    first = pc.not_equal(ids.slice(1), ids.slice(0, len(ids) - 1))
+    keep = pa.concat_arrays([pa.array([True]), pc.fill_null(first, True).combine_chunks()])
+    return ordered.filter(keep).drop_columns(["_row"])
+
+
+def risk_by_day(table):
+    """[{"date", "risk", "count"}] by creation day."""
+    days = pc.strftime(table.column("created_at"), format="%Y-%m-%d")
+    grouped = pa.table({"date": days, "risk": table.column("risk")}).group_by(["date", "risk"]).aggregate(
+        [([], "count_all")])
+    rows = grouped.rename_columns(["date", "risk", "count"]).to_pylist()
+    return sorted(rows, key=lambda row: (row["date"], row["risk"] or ""))
+
+
+def top_domains(table, limit=20):
+    """[{"domain", "count", "high_risk"}] of priority URLs, most frequent first."""
+    table = table.filter(pc.is_valid(table.column("priority_domain")))
+    high = pc.is_in(table.column("risk"), value_set=pa.array(["High", "Malicious"]))
+    grouped = pa.table({"domain": table.column("priority_domain"), "high": pc.cast(high, pa.int64())}).group_by(
+        "domain").aggregate([("domain", "count"), ("high", "sum")])
+    rows = [{"domain": row["domain"], "count": row["domain_count"], "high_risk": row["high_sum"] or 0}
+            for row in grouped.to_pylist()]
+    return sorted(rows, key=lambda row: (-row["count"], row["domain"]))[:limit]
+
+
+def vt_ratios(table):
+    """[{"risk", "analyses", "with_vt", "mean_detection_ratio", "max_detection_ratio"}] per verdict."""
+    grouped = table.select(["risk", "vt_detection_ratio"]).group_by("risk").aggregate([
+        ([], "count_all"), ("vt_detection_ratio", "count"), ("vt_detection_ratio", "mean"),
+        ("vt_detection_ratio", "max"),
+    ])
+    rows = []
+    for row in grouped.to_pylist():
+        mean = row["vt_detection_ratio_mean"]
+        rows.append({"risk": row["risk"], "analyses": row["count_all"], "with_vt": row["vt_detection_ratio_count"],
+                     "mean_detection_ratio": round(mean, 4) if mean is not None else None,
+                     "max_detection_ratio": row["vt_detection_ratio_max"]})
+    return sorted(rows, key=lambda row: row["risk"] or "")
+
+
+# Report name: (function, columns it reads)
+REPORTS = {
+    "risk-by-day": (risk_by_day, ["created_at", "risk"]),
+    "top-domains": (top_domains, ["priority_domain", "risk"]),
+    "vt-ratios": (vt_ratios, ["risk", "vt_detection_ratio"]),
+}
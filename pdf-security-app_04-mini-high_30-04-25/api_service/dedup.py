@@ -0,0 +1,135 @@
+"""
+Early duplicate detection for ingested PDFs.
+
+The SHA256 of an input is known as soon as it has been streamed in (see
+ingest.py), before any parsing. SeenHashes answers "was this file analysed
+before?" from that hash alone:
+
+- An in-memory Bloom filter of every stored hash says "definitely new" without
+  touching MongoDB, so new files pay no lookup at all.
+- A possible hit is confirmed against records still queued in the write-behind
+  buffer and then against the collection (an indexed find_one), so a known
+  file is answered in milliseconds, without a PDF parse or any pipeline stage.
+
+The filter is loaded from the collection by a background thread at startup
+(until then every lookup goes to MongoDB; a failed load is retried) and the
+same thread tops it up every DEDUP_REFRESH_INTERVAL seconds with records
+stored by other workers, so no request waits for a refresh scan. A file stored
+by another worker inside that window may be analysed once more.
+"""
+import logging
+import math
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from bson import ObjectId
+from pymongo import ASCENDING
+
+from writebehind import field_value
+
+DEDUP_ENABLED = os.getenv("DEDUP_ENABLED", "true").lower() in ("1", "true", "yes")
+DEDUP_BLOOM_CAPACITY = int(os.getenv("DEDUP_BLOOM_CAPACITY", "1000000"))
+DEDUP_BLOOM_ERROR_RATE = float(os.getenv("DEDUP_BLOOM_ERROR_RATE", "0.001"))
+DEDUP_REFRESH_INTERVAL = float(os.getenv("DEDUP_REFRESH_INTERVAL", "5"))
+# Records are stored some time after their _id is assigned; refreshes look back this far
+REFRESH_OVERLAP = timedelta(seconds=60)
+
+logger = logging.getLogger("dedup")
+
+
+class BloomFilter:
+    """Bloom filter over hex digests; positions come from the digest bits themselves."""
+
+    def __init__(self, capacity, error_rate):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, digest):
+        # Double hashing: the digest is already uniformly distributed
+        h1 = int(digest[:16], 16)
+        h2 = int(digest[16:32], 16) | 1
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, digest):
+        for pos in self._positions(digest):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, digest):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(digest))
+
+
+class SeenHashes:
+    def __init__(self, collection, field, writer=None):
+        """collection: stored results; field: (dotted) path of the SHA256 in a record;
+        writer: optional WriteBehind whose queued records also count as seen."""
+        self.collection = collection
+        self.field = field
+        self.writer = writer
+        self.enabled = DEDUP_ENABLED
+        self.bloom = BloomFilter(DEDUP_BLOOM_CAPACITY, DEDUP_BLOOM_ERROR_RATE)
+        self.ready = False
+        self._lock = threading.Lock()  # guards the filter bits
+        self._since = None
+        self._stats = {"lookups": 0, "bloom_negative": 0, "hits": 0, "false_positives": 0}
+        try:
+            collection.create_index([(field, ASCENDING)], name=field.replace(".", "_"))
+        except Exception:
+            logger.exception("Hash index creation failed; duplicate lookups will be unindexed")
+        if self.enabled:
+            threading.Thread(target=self._run, name="dedup-filter", daemon=True).start()
+
+    def add(self, sha256):
+        """Record a hash this process has just submitted for storage."""
+        with self._lock:
+            self.bloom.add(sha256)
+
+    def lookup(self, sha256, projection=None):
+        """Return the stored or queued record for sha256, or None if it is new."""
+        self._stats["lookups"] += 1
+        if self.enabled and self.ready:
+            if sha256 not in self.bloom:
+                self._stats["bloom_negative"] += 1
+                return None
+        doc = None
+        if self.writer is not None:
+            doc = self.writer.find_pending({self.field: sha256})
+        if doc is None:
+            doc = self.collection.find_one({self.field: sha256}, projection)
+        self._stats["hits" if doc else "false_positives"] += 1
+        return doc
+
+    def stats(self):
+        return dict(self._stats, ready=self.ready, bloom_inserts=self.bloom.count)
+
+    def _run(self):
+        """Load the filter, retrying until it succeeds, then refresh it periodically."""
+        while not self.ready:
+            try:
+                started = time.time()
+                self._scan({})
+                self.ready = True
+                logger.info("Hash filter loaded", extra={"entries": self.bloom.count,
+                                                          "seconds": round(time.time() - started, 2)})
+            except Exception:
+                # Without the filter every lookup simply goes to MongoDB
+                logger.exception("Hash filter load failed")
+                time.sleep(DEDUP_REFRESH_INTERVAL)
+        while True:
+            time.sleep(DEDUP_REFRESH_INTERVAL)
+            try:
+                self._scan({"_id": {"$gte": ObjectId.from_datetime(self._since - REFRESH_OVERLAP)}})
+            except Exception:
+                logger.exception("Hash filter refresh failed")
+
+    def _scan(self, query):
+        since = datetime.utcnow()
+        for doc in self.collection.find(query, {self.field: 1, "_id": 0}):
+            value = field_value(doc, self.field)
+            if isinstance(value, str):
+                self.add(value)
+        self._since = since
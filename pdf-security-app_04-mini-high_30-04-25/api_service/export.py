@@ -0,0 +1,56 @@
+"""
+Columnar export of stored analyses and SOC reports over it (see columnar.py).
+
+    python export.py run                    # export every EXPORT_INTERVAL seconds
+    python export.py once                   # one incremental pass
+    python export.py report risk-by-day --since 2025-05-01
+    python export.py report top-domains --limit 50
+    python export.py report vt-ratios
+
+Reports read only the Parquet files under EXPORT_DIR and print JSON lines.
+"""
+import os, json, logging, argparse
+from pymongo import MongoClient
+from pythonjsonlogger import jsonlogger
+from columnar import EXPORT_DIR, REPORTS, Exporter, Layout, load
+
+COLLECTION = 'analyses'
+LAYOUT = Layout(sha_field='sha256', md5_field='md5', risk_field='risk_score', created_field=None,
+                url_fields=('structural_report.urls', 'content_report.urls'))
+
+def exporter():
+    client = MongoClient(os.environ.get('MONGODB_URI', 'mongodb://mongodb:27017/pdf_analysis'))
+    return Exporter(client.get_default_database()[COLLECTION], LAYOUT)
+
+def main():
+    parser = argparse.ArgumentParser(description='Export analyses to Parquet and report on the export')
+    commands = parser.add_subparsers(dest='command', required=True)
+    commands.add_parser('run', help='export every EXPORT_INTERVAL seconds')
+    commands.add_parser('once', help='one incremental export pass')
+    report = commands.add_parser('report', help='report over the exported analyses')
+    report.add_argument('name', choices=sorted(REPORTS))
+    report.add_argument('--since', help='first creation day (YYYY-MM-DD)')
+    report.add_argument('--until', help='day after the last creation day (YYYY-MM-DD)')
+    report.add_argument('--limit', type=int, default=20, help='rows of top-domains')
+    args = parser.parse_args()
+
+    # setup logging
+    logger = logging.getLogger()
+    handler = logging.StreamHandler()
+    handler.setFormatter(jsonlogger.JsonFormatter())
+    logger.addHandler(handler)
+    logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+
+    if args.command == 'run':
+        exporter().run_forever()
+    elif args.command == 'once':
+        print(json.dumps(exporter().export()))
+    else:
+        fn, columns = REPORTS[args.name]
+        table = load(os.path.join(EXPORT_DIR, COLLECTION), args.since, args.until, columns)
+        rows = fn(table, args.limit) if args.name == 'top-domains' else fn(table)
+        for row in rows:
+            print(json.dumps(row, default=str))
+
+if __name__ == '__main__':
+    main()
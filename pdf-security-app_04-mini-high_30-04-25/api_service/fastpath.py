@@ -0,0 +1,88 @@
+"""
+Rule-based fast-path verdicts.
+
+Runs once structural and file reputation data are in hand and returns a
+verdict for clear-cut documents, so the visual, URL selection and synthesis
+LLM calls can be skipped. Anything ambiguous returns None and goes through the
+full pipeline. Understands the feature/reputation shapes of all three PDF apps.
+
+A document is only inert when the feature vector of the structural report
+(pdffeatures.py) counts none of ACTIVE_COUNTS in its object dictionaries:
+the structural flags come from the catalog and miss actions on pages and
+annotations. A file VirusTotal has no scan for (unknown sample, failed
+lookup) is never taken as clean.
+"""
+import os
+
+from pdffeatures import feature_counts
+
+FASTPATH_ENABLED = os.getenv("FASTPATH_ENABLED", "true").lower() in ("1", "true", "yes")
+# Minimum VirusTotal "malicious" engine count for an immediate Malicious verdict (0 disables).
+FASTPATH_VT_MALICIOUS = int(os.getenv("FASTPATH_VT_MALICIOUS", "10"))
+# An inert document (no active features, no VT detections) may have at most this many URLs.
+FASTPATH_INERT_MAX_URLS = int(os.getenv("FASTPATH_INERT_MAX_URLS", "0"))
+FASTPATH_INERT_VERDICT = os.getenv("FASTPATH_INERT_VERDICT", "Low")
+
+VERDICT_SOURCE_RULES = "rules"
+VERDICT_SOURCE_LLM = "llm"
+# Feature vector counts of active content: scripts, actions, attachments, forms and encryption
+ACTIVE_COUNTS = ("javascript", "launch", "open_action", "additional_actions", "embedded_files", "acroform",
+                 "xfa", "submit_form", "goto_remote", "rich_media", "encrypted")
+
+
+def _vt_stats(file_reputation):
+    """VirusTotal engine counts, or None when there is no scan (unknown file or failed lookup)."""
+    file_reputation = file_reputation or {}
+    if file_reputation.get("error"):
+        return None
+    stats = file_reputation.get("stats") or file_reputation.get("last_analysis_stats")
+    if not isinstance(stats, dict) or not sum(v for v in stats.values() if isinstance(v, int)):
+        return None
+    return stats
+
+
+def _active_features(structural):
+    """Feature flags that are set, e.g. JavaScript, AcroForm, has_embedded_files, encrypted."""
+    features = (structural or {}).get("features") or {}
+    return sorted(k for k, v in features.items() if v is True)
+
+
+def fast_verdict(structural, file_reputation, url_count, vector=None):
+    """Return {"verdict", "reasoning", "rule"} for a clear-cut case, otherwise None.
+
+    vector is the feature vector of /structural ({"version", "values"}) or the stored features,
+    when it was taken off the structural report."""
+    if not FASTPATH_ENABLED:
+        return None
+    stats = _vt_stats(file_reputation)
+    if stats is None:
+        return None
+    malicious = stats.get("malicious") or 0
+    suspicious = stats.get("suspicious") or 0
+
+    if FASTPATH_VT_MALICIOUS and malicious >= FASTPATH_VT_MALICIOUS:
+        return {
+            "verdict": "Malicious",
+            "reasoning": (
+                f"{malicious} VirusTotal engines detect this file as malicious "
+                f"(fast-path threshold {FASTPATH_VT_MALICIOUS})."
+            ),
+            "rule": "vt_malicious",
+        }
+
+    counts = feature_counts(vector or (structural or {}).get("vector"))
+    if counts is None or _active_features(structural) or any(counts[name] for name in ACTIVE_COUNTS):
+        return None
+    if url_count <= FASTPATH_INERT_MAX_URLS and not malicious and not suspicious:
+        engines = sum(v for v in stats.values() if isinstance(v, int))
+        return {
+            "verdict": FASTPATH_INERT_VERDICT,
+            "reasoning": (
+                "Inert document: its object dictionaries name none of "
+                f"{', '.join(name.replace('_', ' ') for name in ACTIVE_COUNTS)}, "
+                f"no structural feature flag is set, {url_count} URL(s), and none of the {engines} "
+                "VirusTotal engines that scanned it reports it malicious or suspicious."
+            ),
+            "rule": "inert_document",
+        }
+    return None
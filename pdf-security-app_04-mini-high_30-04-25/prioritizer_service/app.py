@@ -1,7 +1,10 @@
-import os, logging, json
+import os, logging
 from flask import Flask, request, jsonify
 from pythonjsonlogger import jsonlogger
 import openai
+from evidence import url_candidates
+from llmjson import JSON_MODE, PRIORITY_SCHEMA_HINT, parse_structured, validate_priority
+from metrics import LLMUsage, instrument, llm_headers
 
 app = Flask(__name__)
 logger = logging.getLogger()
@@ -10,6 +13,7 @@ formatter = jsonlogger.JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+instrument(app, 'prioritizer_service')
 
 openai.api_key = os.environ['OPENAI_API_KEY']
 
@@ -17,31 +21,35 @@ openai.api_key = os.environ['OPENAI_API_KEY']
 def prioritize():
     logger.info('Received prioritization request')
     data = request.get_json()
-    structural_urls = data.get('structural_urls', [])
-    content_urls = data.get('content_urls', [])
-    visual_report = data.get('visual_report', {})
+    # one compact line per URL with its local domain risk, within SELECT_URL_TOKEN_BUDGET
+    urls, visual_report = url_candidates(data.get('structural_urls'), data.get('content_urls'),
+                                         data.get('visual_report'))
     prompt_system = ('You are a security analyst. Based on structural URLs, content URLs, '
                      'and visual report, select the single URL that is the primary '
                      'call-to-action or most suspicious. Respond with JSON {"priority_url": "..."} '
                      'or {"priority_url": null}.')
-    prompt_user = (f'structural_urls: {structural_urls}\n'
-                   f'content_urls: {content_urls}\n'
-                   f'visual_report: {visual_report}')
+    prompt_user = ('urls (URL | where found x count | local domain risk: signals | context):\n'
+                   f'{urls or "none"}\n'
+                   f'visual_report: {visual_report or ""}')
+    usage = LLMUsage()
     try:
-        response = openai.ChatCompletion.create(
+        response = usage.create(
             model='gpt-4o',
             messages=[{'role': 'system', 'content': prompt_system},
-                      {'role': 'user', 'content': prompt_user}]
+                      {'role': 'user', 'content': prompt_user}],
+            headers=llm_headers('prioritizer_service.prioritize'),
+            **JSON_MODE
         )
         content = response.choices[0].message.content
-        result = json.loads(content)
-        priority = result.get('priority_url')
+        result = parse_structured(content, validate_priority, PRIORITY_SCHEMA_HINT, 'prioritizer_service.prioritize',
+                                  usage)
+        priority = result['priority_url']
         logger.info('Priority URL selected', extra={'priority_url': priority})
     except Exception as e:
         logger.error('LLM prioritization failed', extra={'error': str(e)})
         return jsonify(error='LLM prioritization failed', details=str(e)), 502
 
-    return jsonify(priority_url=priority)
+    return jsonify(priority_url=priority, usage=usage.as_dict())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
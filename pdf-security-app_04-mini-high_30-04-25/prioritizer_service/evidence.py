@@ -0,0 +1,262 @@
+"""
+Evidence compaction for risk synthesis prompts.
+
+Turns the raw stage outputs (structural, content, visual, reputation) into a
+small JSON document with a stable schema, so prompt size stays bounded no
+matter how large the analysed PDF is. Accepts both the `structural`/`content`/
+`visual` and `*_report` naming used by the different pipelines. URL selection
+gets the same URLs as one compact line each (url_candidates).
+"""
+import json
+import math
+import os
+import re
+
+EVIDENCE_TOKEN_BUDGET = int(os.getenv("EVIDENCE_TOKEN_BUDGET", "2000"))
+SELECT_URL_TOKEN_BUDGET = int(os.getenv("SELECT_URL_TOKEN_BUDGET", "1000"))
+MAX_URLS = int(os.getenv("EVIDENCE_MAX_URLS", "15"))
+MAX_URL_CHARS = 200
+MAX_CONTEXT_CHARS = 80
+MAX_FIELD_CHARS = 120
+MAX_ENGINES = 10
+# Categories and brands of the urlscan verdict
+MAX_LABELS = 10
+
+METADATA_KEYS = ("Title", "Author", "Creator", "Producer", "CreationDate", "ModDate", "Subject")
+
+SALIENT_TERMS = re.compile(
+    r"password|passcode|log ?in|sign ?in|verify|verification|account|invoice|payment|"
+    r"bank|wire|urgent|immediately|suspend|expire|click|download|enable (?:content|macros)|"
+    r"confirm|security alert|unusual activity|credential",
+    re.IGNORECASE,
+)
+WHITESPACE = re.compile(r"\s+")
+
+
+def estimate_tokens(text):
+    """Local approximation of GPT tokenisation (~4 characters per token)."""
+    return math.ceil(len(text) / 4)
+
+
+def _first(data, *keys):
+    for key in keys:
+        if data.get(key) is not None:
+            return data[key]
+    return None
+
+
+def _clip(value, limit):
+    text = WHITESPACE.sub(" ", str(value)).strip()
+    return text if len(text) <= limit else text[: limit - 3] + "..."
+
+
+def _truthy_flags(features):
+    return sorted(k for k, v in (features or {}).items() if v is True)
+
+
+def _metadata(metadata):
+    metadata = {k.lstrip("/"): v for k, v in (metadata or {}).items()}
+    return {k: _clip(metadata[k], MAX_FIELD_CHARS) for k in METADATA_KEYS if metadata.get(k)}
+
+
+def _urls(structural_urls, content_urls, priority_url):
+    """Merge annotation and text URLs, dedupe them and keep the most salient ones."""
+    merged = {}
+
+    def add(url, source, context=None, count=1, domain=None):
+        url = str(url).strip().rstrip(".,;:'\")]>")
+        if not url:
+            return
+        entry = merged.setdefault(url, {"url": _clip(url, MAX_URL_CHARS), "sources": set(), "count": 0})
+        entry["sources"].add(source)
+        entry["count"] += count
+        if context and "context" not in entry:
+            entry["context"] = _clip(context, MAX_CONTEXT_CHARS)
+        # Local domain intelligence of the PDF service (domainintel.py)
+        if domain and domain.get("risk") not in (None, "none") and "domain_risk" not in entry:
+            entry["domain_risk"] = domain["risk"]
+            signals = list(domain.get("signals") or [])
+            if domain.get("list"):
+                signals.insert(0, f"{domain['list']}_list")
+            if domain.get("brand"):
+                signals.append(f"brand:{domain['brand']}")
+            if signals:
+                entry["domain_signals"] = signals
+
+    for item in structural_urls or []:
+        if isinstance(item, dict):
+            add(item.get("url", ""), "annotation", domain=item.get("domain"))
+        else:
+            add(item, "annotation")
+    for item in content_urls or []:
+        if isinstance(item, dict):
+            add(item.get("url", ""), "text", item.get("context"), item.get("count") or 1, item.get("domain"))
+        else:
+            add(item, "text")
+
+    def rank(entry):
+        return (entry["url"] != priority_url, entry.get("domain_risk") != "high", "annotation" not in entry["sources"],
+                -entry["count"], entry["url"])
+
+    ranked = sorted(merged.values(), key=rank)
+    for entry in ranked:
+        entry["sources"] = sorted(entry["sources"])
+    return ranked[:MAX_URLS], len(ranked)
+
+
+def _text_excerpt(text, token_budget):
+    """Head of the document plus lines with phishing-relevant terms, within budget."""
+    char_budget = max(0, token_budget) * 4
+    text = text or ""
+    if len(text) <= char_budget:
+        return WHITESPACE.sub(" ", text).strip()
+    head_chars = char_budget // 2
+    head = WHITESPACE.sub(" ", text[:head_chars]).strip()
+    picked = []
+    used = len(head)
+    seen = set()
+    for line in text[head_chars:].splitlines():
+        line = WHITESPACE.sub(" ", line).strip()
+        if not line or line in seen or not SALIENT_TERMS.search(line):
+            continue
+        line = _clip(line, MAX_FIELD_CHARS * 2)
+        if used + len(line) + 5 > char_budget:
+            break
+        seen.add(line)
+        picked.append(line)
+        used += len(line) + 5
+    return " ... ".join([head] + picked)
+
+
+def _visual(visual):
+    if visual is None:
+        return None
+    if isinstance(visual, dict):
+        if "analysis" in visual:
+            visual = visual["analysis"]
+        else:
+            visual = {k: v for k, v in visual.items() if not k.startswith("image")}
+    if not isinstance(visual, str):
+        visual = json.dumps(visual, sort_keys=True, ensure_ascii=False)
+    return WHITESPACE.sub(" ", visual).strip()
+
+
+def _file_reputation(rep):
+    if not rep:
+        return None
+    if rep.get("error"):
+        return {"error": _clip(rep["error"], MAX_FIELD_CHARS)}
+    stats = _first(rep, "stats", "last_analysis_stats") or {}
+    engines = rep.get("malicious_engines")
+    if engines is None:
+        engines = [k for k, v in (rep.get("vendor_results") or {}).items() if v == "malicious"]
+    compact = {
+        "stats": {k: v for k, v in stats.items() if v},
+        "malicious_engines": sorted(engines)[:MAX_ENGINES],
+        "first_seen": rep.get("first_seen"),
+        "last_seen": rep.get("last_seen"),
+    }
+    return {k: v for k, v in compact.items() if v not in (None, [], {})}
+
+
+def _labels(values):
+    values = values if isinstance(values, list) else [values]
+    return [_clip(v, MAX_FIELD_CHARS) for v in values[:MAX_LABELS]]
+
+
+def _url_reputation(rep):
+    if not rep:
+        return None
+    verdicts = rep.get("verdicts") or {}
+    overall = verdicts.get("overall") or {}
+    if overall:
+        compact = {k: overall[k] for k in ("score", "malicious") if k in overall}
+        compact.update({k: _labels(overall[k]) for k in ("categories", "brands") if k in overall})
+        return compact
+    if rep.get("error"):
+        return {"error": _clip(rep["error"], MAX_FIELD_CHARS)}
+    return {"status": "submitted, no verdict"}
+
+
+def _url_line(entry):
+    parts = [entry["url"], f"{'+'.join(entry['sources'])} x{entry['count']}"]
+    if entry.get("domain_risk"):
+        parts.append(f"{entry['domain_risk']} risk: {', '.join(entry.get('domain_signals') or [])}")
+    if entry.get("context"):
+        parts.append(json.dumps(entry["context"], ensure_ascii=False))
+    return " | ".join(parts)
+
+
+def url_candidates(structural_urls, content_urls, visual=None, token_budget=None):
+    """(URL lines, visual report) for priority URL selection, within token_budget.
+
+    One line per URL: the URL, where it was found and how often, the local domain risk and its
+    signals, and its context. URLs are ranked as in the synthesis evidence and kept while they
+    fit; a last line counts the ones left out. The visual report gets at most a quarter of the
+    budget.
+    """
+    token_budget = token_budget or SELECT_URL_TOKEN_BUDGET
+    visual = _visual(visual)
+    if visual is not None:
+        visual = _clip(visual, token_budget)
+    remaining = token_budget - estimate_tokens(visual or "")
+    urls, url_count = _urls(structural_urls, content_urls, None)
+    lines = []
+    for entry in urls:
+        line = _url_line(entry)
+        remaining -= estimate_tokens(line) + 1
+        if remaining < 0:
+            break
+        lines.append(line)
+    if url_count > len(lines):
+        lines.append(f"(+{url_count - len(lines)} more URLs not shown)")
+    return "\n".join(lines), visual
+
+
+def compact_evidence(data, token_budget=None):
+    """Build the compact evidence document for a synthesis request."""
+    token_budget = token_budget or EVIDENCE_TOKEN_BUDGET
+    structural = _first(data, "structural", "structural_report") or {}
+    content = _first(data, "content", "content_report") or {}
+    priority_url = _clip(data["priority_url"], MAX_URL_CHARS) if data.get("priority_url") else None
+    urls, url_count = _urls(structural.get("links") or structural.get("urls"), content.get("urls"), priority_url)
+    text = _first(content, "text", "text_summary") or ""
+
+    evidence = {
+        "metadata": _metadata(structural.get("metadata")),
+        "features": _truthy_flags(structural.get("features")),
+        "urls": urls,
+        "url_count": url_count,
+        "priority_url": priority_url,
+        "file_reputation": _file_reputation(data.get("file_reputation")),
+        "url_reputation": _url_reputation(data.get("url_reputation")),
+        "text_chars": len(text),
+    }
+    # The visual report gets at most a quarter of the budget, the text whatever is left.
+    visual = _visual(_first(data, "visual", "visual_report"))
+    if visual is not None:
+        evidence["visual"] = _clip(visual, token_budget)
+    remaining = token_budget - estimate_tokens(dumps(evidence))
+    evidence["text_excerpt"] = _text_excerpt(text, remaining)
+    return _fit(evidence, token_budget)
+
+
+def _fit(evidence, token_budget):
+    """Trim evidence that is still over budget: text, then visual, then the URL list."""
+    def over():
+        return estimate_tokens(dumps(evidence)) > token_budget
+
+    if over():
+        evidence["text_excerpt"] = ""
+    while over() and len(evidence.get("visual") or "") > MAX_FIELD_CHARS:
+        evidence["visual"] = _clip(evidence["visual"], len(evidence["visual"]) // 2)
+    while over() and evidence["urls"]:
+        evidence["urls"].pop()
+    if over():
+        evidence["metadata"] = {}
+    return evidence
+
+
+def dumps(evidence):
+    """Serialise evidence deterministically so identical inputs give identical prompts."""
+    return json.dumps(evidence, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
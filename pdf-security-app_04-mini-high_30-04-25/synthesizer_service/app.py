@@ -1,7 +1,10 @@
-import os, logging, json
+import os, logging
 from flask import Flask, request, jsonify
 from pythonjsonlogger import jsonlogger
 import openai
+from evidence import compact_evidence, dumps as evidence_dumps
+from llmjson import JSON_MODE, RISK_SCHEMA_HINT, parse_structured, validate_risk
+from metrics import LLMUsage, instrument, llm_headers
 
 app = Flask(__name__)
 logger = logging.getLogger()
@@ -10,6 +13,7 @@ formatter = jsonlogger.JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+instrument(app, 'synthesizer_service')
 
 openai.api_key = os.environ['OPENAI_API_KEY']
 
@@ -20,23 +24,26 @@ def synthesize():
     prompt_system = ('You are a security analyst. Synthesize all findings and produce a final '
                      'risk score (Safe, Low, Medium, High, Malicious) and concise reasoning. '
                      'Respond with JSON {"risk_score": "...", "reasoning": "..."}.')
-    prompt_user = json.dumps(data)
+    prompt_user = evidence_dumps(compact_evidence(data))
+    usage = LLMUsage()
     try:
-        response = openai.ChatCompletion.create(
+        response = usage.create(
             model='gpt-4o',
             messages=[{'role': 'system', 'content': prompt_system},
-                      {'role': 'user', 'content': prompt_user}]
+                      {'role': 'user', 'content': prompt_user}],
+            headers=llm_headers('synthesizer_service.synthesize'),
+            **JSON_MODE
         )
         content = response.choices[0].message.content
-        result = json.loads(content)
-        risk_score = result.get('risk_score')
-        reasoning = result.get('reasoning')
+        result = parse_structured(content, validate_risk, RISK_SCHEMA_HINT, 'synthesizer_service.synthesize', usage)
+        risk_score = result['risk_score']
+        reasoning = result['reasoning']
         logger.info('Synthesis complete', extra={'risk_score': risk_score})
     except Exception as e:
         logger.error('LLM synthesis failed', extra={'error': str(e)})
         return jsonify(error='LLM synthesis failed', details=str(e)), 502
 
-    return jsonify(risk_score=risk_score, reasoning=reasoning)
+    return jsonify(risk_score=risk_score, reasoning=reasoning, usage=usage.as_dict())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
@@ -1,7 +1,7 @@
 import os, logging
 from flask import Flask, request, jsonify
 from pythonjsonlogger import jsonlogger
-import requests
+from metrics import http_call, instrument
 
 app = Flask(__name__)
 logger = logging.getLogger()
@@ -10,6 +10,7 @@ formatter = jsonlogger.JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+instrument(app, 'urlscan_service')
 
 URLSCAN_API_KEY = os.environ['URLSCAN_API_KEY']
 
@@ -26,7 +27,7 @@ def reputation():
     headers = {'API-Key': URLSCAN_API_KEY, 'Content-Type': 'application/json'}
     payload = {'url': url_to_scan, 'public': 'on'}
     try:
-        resp = requests.post(api_url, headers=headers, json=payload)
+        resp = http_call('urlscan_submit', 'POST', api_url, propagate=False, headers=headers, json=payload)
         if resp.status_code not in (200, 201):
             logger.error('urlscan API error', extra={'status_code': resp.status_code})
             return jsonify(error='urlscan API error', details=resp.text), 502
@@ -1,9 +1,14 @@
-import os, base64, logging, json
+import os, base64, logging
 from io import BytesIO
 from flask import Flask, request, jsonify
 from pythonjsonlogger import jsonlogger
 from pdf2image import convert_from_bytes
 import openai
+from llmjson import JSON_MODE, parse_structured, validate_report
+from metrics import LLMUsage, instrument, llm_headers, timed
+
+VISUAL_REPORT_KEYS = ('visual_type', 'layout', 'anomalies', 'prominent_elements')
+VISUAL_SCHEMA_HINT = '{"visual_type": ..., "layout": ..., "anomalies": [...], "prominent_elements": [...]}'
 
 app = Flask(__name__)
 logger = logging.getLogger()
@@ -12,19 +17,23 @@ formatter = jsonlogger.JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+instrument(app, 'visual_service')
 
 openai.api_key = os.environ['OPENAI_API_KEY']
 
 @app.route('/analyze', methods=['POST'])
 def analyze():
     logger.info('Received visual analysis request')
-    data = request.get_json()
-    if not data or 'pdf' not in data:
+    # a multipart upload (api_service streams the PDF), or base64 in a JSON body
+    file = request.files.get('file')
+    data = request.get_json(silent=True)
+    if not file and (not data or 'pdf' not in data):
         logger.error('No PDF provided')
         return jsonify(error='No PDF provided'), 400
     try:
-        pdf_bytes = base64.b64decode(data['pdf'])
-        images = convert_from_bytes(pdf_bytes, first_page=1, last_page=1)
+        pdf_bytes = file.read() if file else base64.b64decode(data['pdf'])
+        with timed('render'):
+            images = convert_from_bytes(pdf_bytes, first_page=1, last_page=1)
         image = images[0]
         buffer = BytesIO()
         image.save(buffer, format='PNG')
@@ -37,20 +46,24 @@ def analyze():
     prompt_system = ('You are a security analyst. Analyze the following image of a PDF first page. '
                      'Provide a JSON with keys: visual_type, layout, anomalies, prominent_elements.')
     prompt_user = f'data:image/png;base64,{img_b64}'
+    usage = LLMUsage()
     try:
-        response = openai.ChatCompletion.create(
+        response = usage.create(
             model='gpt-4o',
             messages=[{'role': 'system', 'content': prompt_system},
-                      {'role': 'user', 'content': prompt_user}]
+                      {'role': 'user', 'content': prompt_user}],
+            headers=llm_headers('visual_service.analyze'),
+            **JSON_MODE
         )
         content = response.choices[0].message.content
-        report = json.loads(content)
+        report = parse_structured(content, validate_report(VISUAL_REPORT_KEYS), VISUAL_SCHEMA_HINT,
+                                  'visual_service.analyze', usage)
         logger.info('Received visual analysis from LLM')
     except Exception as e:
         logger.error('LLM visual analysis failed', extra={'error': str(e)})
         return jsonify(error='LLM visual analysis failed', details=str(e)), 502
 
-    return jsonify(visual_report=report)
+    return jsonify(visual_report=report, usage=usage.as_dict())
 
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5000)
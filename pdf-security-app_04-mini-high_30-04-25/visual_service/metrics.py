@@ -0,0 +1,276 @@
+"""
+Prometheus metrics and request tracing shared by every service.
+
+- instrument(app, service) / instrument_quart(app, service): `GET /metrics`, a
+  per-endpoint latency histogram and an in-flight gauge. Every request gets a
+  trace id, taken from the X-Request-ID header or generated, which is echoed in
+  the response and added to log records as `trace_id`.
+- trace_headers() / llm_headers(): headers that carry the current trace id to
+  the next hop; http_call() wraps requests with them, a stage timer and error
+  counting.
+- timed(stage) / observe(stage, seconds): per-stage latency (parse, render,
+  LLM calls, VirusTotal, urlscan, Mongo, downstream services).
+- upstream_error(), cache_result(), llm_usage(): error, cache and token counters.
+- LLMUsage: tokens and wall time of the LLM calls made for one request, which
+  LLM services return to their caller as `usage`.
+
+Servers with several worker processes (gunicorn, uvicorn) aggregate their
+workers' metrics when PROMETHEUS_MULTIPROC_DIR is set.
+"""
+import contextvars
+import logging
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+TRACE_HEADER = "X-Request-ID"
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+if MULTIPROC_DIR:
+    os.makedirs(MULTIPROC_DIR, exist_ok=True)
+# LLM calls and urlscan polling run for tens of seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120, 300)
+
+REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds", "Inbound request latency",
+    ["service", "method", "endpoint", "status"], buckets=LATENCY_BUCKETS,
+)
+IN_FLIGHT = Gauge("http_requests_in_flight", "Requests being handled", ["service"], multiprocess_mode="livesum")
+STAGE_SECONDS = Histogram("stage_duration_seconds", "Pipeline stage latency", ["service", "stage"],
+                          buckets=LATENCY_BUCKETS)
+STAGE_ERRORS = Counter("stage_errors_total", "Pipeline stages that raised", ["service", "stage"])
+UPSTREAM_ERRORS = Counter("upstream_errors_total", "Failed calls to other services and external APIs",
+                          ["service", "upstream", "reason"])
+CACHE_REQUESTS = Counter("cache_requests_total", "Cache lookups by result", ["service", "cache", "result"])
+LLM_TOKENS = Counter("llm_tokens_total", "LLM tokens by call site", ["service", "call_site", "model", "kind"])
+
+SERVICE = "unknown"
+_trace_id = contextvars.ContextVar("trace_id", default=None)
+
+
+def trace_id():
+    return _trace_id.get()
+
+
+def trace_headers():
+    """Headers that propagate the current trace id; empty outside a request."""
+    current = _trace_id.get()
+    return {TRACE_HEADER: current} if current else {}
+
+
+def llm_headers(call_site):
+    """Headers for an LLM gateway call: call-site attribution plus the trace id."""
+    return dict({"X-Call-Site": call_site}, **trace_headers())
+
+
+class TraceIdFilter(logging.Filter):
+    def filter(self, record):
+        record.trace_id = _trace_id.get()
+        return True
+
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        STAGE_ERRORS.labels(SERVICE, stage).inc()
+        raise
+    finally:
+        STAGE_SECONDS.labels(SERVICE, stage).observe(time.perf_counter() - started)
+
+
+def observe(stage, seconds):
+    STAGE_SECONDS.labels(SERVICE, stage).observe(seconds)
+
+
+def upstream_error(upstream, reason):
+    UPSTREAM_ERRORS.labels(SERVICE, upstream, str(reason)).inc()
+
+
+def cache_result(cache, result):
+    """result: "hit", "miss" or a cache-specific outcome such as "shared"."""
+    CACHE_REQUESTS.labels(SERVICE, cache, result).inc()
+
+
+def llm_usage(call_site, model, usage):
+    """Count the tokens of an OpenAI-style usage object or dict."""
+    if not usage:
+        return
+    for kind in ("prompt_tokens", "completion_tokens"):
+        count = usage.get(kind) if isinstance(usage, dict) else getattr(usage, kind, None)
+        if count:
+            LLM_TOKENS.labels(SERVICE, call_site, model or "unknown", kind.split("_")[0]).inc(count)
+
+
+class LLMUsage:
+    """Tokens and wall time of the LLM calls made while handling one request.
+
+    create() wraps openai.ChatCompletion.create(). Answers the gateway served
+    from its cache, or shared with an identical in-flight call, cost nothing and
+    are counted as cached_tokens only.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.models = {}
+
+    def create(self, **kwargs):
+        import openai
+
+        started = time.perf_counter()
+        if kwargs.get("stream"):
+            # The usage of a stream arrives in a last chunk without choices
+            kwargs.setdefault("stream_options", {"include_usage": True})
+            return self._stream(openai.ChatCompletion.create(**kwargs), kwargs.get("model"), started)
+        response = openai.ChatCompletion.create(**kwargs)
+        cached = response.get("x_gateway_cache") in ("hit", "shared")
+        self.add(kwargs.get("model"), response.get("usage"), time.perf_counter() - started, cached)
+        return response
+
+    def _stream(self, chunks, model, started):
+        usage = None
+        try:
+            for chunk in chunks:
+                usage = chunk.get("usage") or usage
+                yield chunk
+        finally:
+            self.add(model, usage, time.perf_counter() - started)
+
+    def add(self, model, usage, seconds, cached=False):
+        self.calls += 1
+        self.seconds += seconds
+        counts = self.models.setdefault(model or "unknown", {"prompt_tokens": 0, "completion_tokens": 0,
+                                                             "cached_tokens": 0})
+        for kind in ("prompt_tokens", "completion_tokens"):
+            count = (usage or {}).get(kind) or 0
+            counts["cached_tokens" if cached else kind] += count
+
+    def as_dict(self):
+        totals = {kind: sum(counts[kind] for counts in self.models.values())
+                  for kind in ("prompt_tokens", "completion_tokens", "cached_tokens")}
+        return dict(totals, calls=self.calls, seconds=round(self.seconds, 3), models=self.models)
+
+
+def http_call(stage, method, url, propagate=True, **kwargs):
+    """requests.request() timed as stage. Connection failures and error statuses count as
+    upstream errors; propagate=False keeps the trace id away from external APIs."""
+    import requests
+
+    if propagate:
+        kwargs["headers"] = dict(kwargs.get("headers") or {}, **trace_headers())
+    with timed(stage):
+        try:
+            resp = requests.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            upstream_error(stage, type(e).__name__)
+            raise
+    if resp.status_code >= 400:
+        upstream_error(stage, resp.status_code)
+    return resp
+
+
+def metrics_body():
+    """(body, content type) of the exposition for this process, or all workers in multiprocess mode."""
+    if MULTIPROC_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def _install_log_filter():
+    for handler in logging.getLogger().handlers:
+        if not any(isinstance(f, TraceIdFilter) for f in handler.filters):
+            handler.addFilter(TraceIdFilter())
+
+
+def _begin(headers):
+    _trace_id.set(headers.get(TRACE_HEADER) or uuid.uuid4().hex)
+    IN_FLIGHT.labels(SERVICE).inc()
+    return time.perf_counter()
+
+
+def _end(started, method, rule, response):
+    endpoint = rule.rule if rule is not None else "unmatched"
+    REQUEST_SECONDS.labels(SERVICE, method, endpoint, response.status_code).observe(time.perf_counter() - started)
+    response.headers[TRACE_HEADER] = _trace_id.get()
+    return response
+
+
+def instrument(app, service):
+    """Add /metrics, request metrics and trace ids to a Flask app."""
+    global SERVICE
+    from flask import g, request
+
+    SERVICE = service
+    _install_log_filter()
+
+    @app.before_request
+    def _metrics_begin():
+        g.metrics_started = _begin(request.headers)
+
+    @app.after_request
+    def _metrics_end(response):
+        started = g.get("metrics_started")
+        if started is None:
+            return response
+        return _end(started, request.method, request.url_rule, response)
+
+    @app.teardown_request
+    def _metrics_teardown(exc):
+        if g.pop("metrics_started", None) is not None:
+            IN_FLIGHT.labels(SERVICE).dec()
+
+    @app.route("/metrics", methods=["GET"])
+    def metrics():
+        body, content_type = metrics_body()
+        return body, 200, {"Content-Type": content_type}
+
+    return app
+
+
+def instrument_quart(app, service):
+    """instrument() for a Quart app."""
+    global SERVICE
+    from quart import g, request
+
+    SERVICE = service
+    _install_log_filter()
+
+    @app.before_request
+    async def _metrics_begin():
+        g.metrics_started = _begin(request.headers)
+
+    @app.after_request
+    async def _metrics_end(response):
+        started = g.get("metrics_started")
+        if started is None:
+            return response
+        return _end(started, request.method, request.url_rule, response)
+
+    @app.teardown_request
+    async def _metrics_teardown(exc):
+        if g.pop("metrics_started", None) is not None:
+            IN_FLIGHT.labels(SERVICE).dec()
+
+    @app.route("/metrics", methods=["GET"])
+    async def metrics():
+        body, content_type = metrics_body()
+        return body, 200, {"Content-Type": content_type}
+
+    return app
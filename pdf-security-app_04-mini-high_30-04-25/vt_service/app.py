@@ -1,7 +1,7 @@
 import os, logging
 from flask import Flask, request, jsonify
 from pythonjsonlogger import jsonlogger
-import requests
+from metrics import http_call, instrument
 
 app = Flask(__name__)
 logger = logging.getLogger()
@@ -10,6 +10,7 @@ formatter = jsonlogger.JsonFormatter()
 handler.setFormatter(formatter)
 logger.addHandler(handler)
 logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO'))
+instrument(app, 'vt_service')
 
 VT_API_KEY = os.environ['VT_API_KEY']
 
@@ -25,7 +26,7 @@ def reputation():
     url = f'https://www.virustotal.com/api/v3/files/{sha256}'
     headers = {'x-apikey': VT_API_KEY}
     try:
-        resp = requests.get(url, headers=headers)
+        resp = http_call('virustotal', 'GET', url, propagate=False, headers=headers)
         if resp.status_code != 200:
             logger.error('VirusTotal API error', extra={'status_code': resp.status_code})
             return jsonify(error='VirusTotal API error', details=resp.text), 502
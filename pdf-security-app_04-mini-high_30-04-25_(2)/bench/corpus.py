@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Generate a synthetic PDF corpus for benchmarking /analyze.
+
+Each file is a valid PDF written from scratch (no dependencies) with a random
+mix of the features the pipeline reacts to:
+
+- size: an incompressible grayscale image on the first page pads the file to
+  one of --sizes, so parsing, upload and rendering costs scale realistically;
+- page count (1..--max-pages) with a few lines of text per page;
+- URLs (0..--max-urls), split between link annotations and URLs in the text;
+- JavaScript (/OpenAction) and AcroForm fields, each with its own rate.
+
+Every file is unique, so results are not served from the result cache unless
+the load driver replays the corpus. A manifest.json lists each file's features
+and its URLs (link annotations and URLs in the page text).
+
+Usage:
+    python corpus.py --out corpus --count 200 --seed 1
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+
+WORDS = (
+    "invoice account payment verify update security password urgent review document "
+    "shipment order confirm login bank customer support delivery notice transfer"
+).split()
+DOMAINS = ("example.com", "example.net", "example.org", "login-verify.example", "cdn.example.com",
+           "docs.example.org", "pay.example.net", "secure-update.example")
+PAGE_WIDTH, PAGE_HEIGHT = 612, 792
+IMAGE_WIDTH = 1024
+
+
+def parse_size(value):
+    value = value.strip().lower()
+    for suffix, factor in (("k", 1024), ("m", 1024 * 1024)):
+        if value.endswith(suffix):
+            return int(float(value[:-1]) * factor)
+    return int(value)
+
+
+def escape(text):
+    return text.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def random_url(rng):
+    path = "/".join(rng.choice(WORDS) for _ in range(rng.randint(1, 3)))
+    return f"{rng.choice(('http', 'https'))}://{rng.choice(DOMAINS)}/{path}?id={rng.randint(1, 99999)}"
+
+
+def random_sentence(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 12))).capitalize() + "."
+
+
+class PDFWriter:
+    """Collects numbered objects and serializes them with a cross-reference table."""
+
+    def __init__(self):
+        self.objects = []
+
+    def reserve(self):
+        self.objects.append(None)
+        return len(self.objects)
+
+    def set(self, number, body):
+        self.objects[number - 1] = body
+
+    def add(self, body):
+        number = self.reserve()
+        self.set(number, body)
+        return number
+
+    def stream(self, data, entries=b""):
+        return self.add(b"<< /Length %d %s>>\nstream\n" % (len(data), entries) + data + b"\nendstream")
+
+    def serialize(self, root):
+        out = bytearray(b"%PDF-1.7\n%\xe2\xe3\xcf\xd3\n")
+        offsets = []
+        for number, body in enumerate(self.objects, 1):
+            offsets.append(len(out))
+            out += b"%d 0 obj\n" % number + body + b"\nendobj\n"
+        xref = len(out)
+        out += b"xref\n0 %d\n0000000000 65535 f \n" % (len(self.objects) + 1)
+        for offset in offsets:
+            out += b"%010d 00000 n \n" % offset
+        out += b"trailer\n<< /Size %d /Root %d 0 R /Info << /Producer (bench corpus) >> >>\n" % (
+            len(self.objects) + 1, root)
+        out += b"startxref\n%d\n%%%%EOF\n" % xref
+        return bytes(out)
+
+
+def make_pdf(rng, index, target_bytes, pages, url_count, javascript, form):
+    pdf = PDFWriter()
+    catalog = pdf.reserve()
+    page_tree = pdf.reserve()
+    font = pdf.add(b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>")
+
+    urls = [random_url(rng) for _ in range(url_count)]
+    annotated, in_text = urls[: url_count // 2], urls[url_count // 2:]
+    # Text and image bytes are added last, once the size of everything else is known
+    image_height = 0
+    image = None
+    if target_bytes > 4096:
+        image_height = max(1, (target_bytes - 4096 - 400 * pages - 200 * url_count) // IMAGE_WIDTH)
+        image = pdf.stream(
+            rng.randbytes(IMAGE_WIDTH * image_height),
+            b"/Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray /BitsPerComponent 8 "
+            % (IMAGE_WIDTH, image_height),
+        )
+
+    field = None
+    page_ids = []
+    for page_number in range(pages):
+        lines = [f"Benchmark document {index} page {page_number + 1}"]
+        lines += [random_sentence(rng) for _ in range(rng.randint(3, 8))]
+        lines += [f"Visit {url} for details" for url in in_text[page_number::pages]]
+        text = b"BT /F1 11 Tf 14 TL 72 720 Td " + b" ".join(
+            b"(%s) Tj T*" % escape(line).encode("latin-1") for line in lines) + b" ET"
+        resources = b"/Font << /F1 %d 0 R >>" % font
+        if page_number == 0 and image:
+            # Scaled to the page width, under the text
+            drawn_height = min(PAGE_HEIGHT - 300, image_height * (PAGE_WIDTH - 144) // IMAGE_WIDTH or 1)
+            text = b"q %d 0 0 %d 72 72 cm /Im1 Do Q " % (PAGE_WIDTH - 144, drawn_height) + text
+            resources += b" /XObject << /Im1 %d 0 R >>" % image
+        contents = pdf.stream(text)
+
+        annots = []
+        for n, url in enumerate(annotated[page_number::pages]):
+            y = 700 - 20 * n
+            annots.append(pdf.add(b"<< /Type /Annot /Subtype /Link /Rect [72 %d 300 %d] /Border [0 0 0] "
+                                  b"/A << /S /URI /URI (%s) >> >>" % (y, y + 14, escape(url).encode("latin-1"))))
+        page = pdf.reserve()
+        if form and page_number == 0:
+            field = pdf.add(b"<< /Type /Annot /Subtype /Widget /FT /Tx /T (password) /Rect [72 100 300 120] "
+                            b"/P %d 0 R /F 4 >>" % page)
+            annots.append(field)
+        annots_entry = b" /Annots [%s]" % b" ".join(b"%d 0 R" % a for a in annots) if annots else b""
+        pdf.set(page, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] /Contents %d 0 R /Resources << %s >>%s >>"
+                % (page_tree, PAGE_WIDTH, PAGE_HEIGHT, contents, resources, annots_entry))
+        page_ids.append(page)
+
+    pdf.set(page_tree, b"<< /Type /Pages /Kids [%s] /Count %d >>"
+            % (b" ".join(b"%d 0 R" % p for p in page_ids), len(page_ids)))
+    extra = b""
+    if javascript:
+        script = pdf.stream(b"app.alert('Benchmark document %d');" % index)
+        extra += b" /OpenAction << /S /JavaScript /JS %d 0 R >>" % script
+    if field:
+        extra += b" /AcroForm << /Fields [%d 0 R] >>" % field
+    pdf.set(catalog, b"<< /Type /Catalog /Pages %d 0 R%s >>" % (page_tree, extra))
+    return pdf.serialize(catalog), annotated, in_text
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default="corpus", help="output directory")
+    parser.add_argument("--count", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--sizes", default="20k,200k,1m,5m",
+                        help="comma-separated target sizes, picked uniformly (k/m suffixes)")
+    parser.add_argument("--max-pages", type=int, default=20)
+    parser.add_argument("--max-urls", type=int, default=30)
+    parser.add_argument("--js-rate", type=float, default=0.2, help="fraction of files with JavaScript")
+    parser.add_argument("--form-rate", type=float, default=0.2, help="fraction of files with a form")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sizes = [parse_size(s) for s in args.sizes.split(",") if s.strip()]
+    os.makedirs(args.out, exist_ok=True)
+    manifest = []
+    for index in range(args.count):
+        # Skewed towards small documents, like real mail attachments
+        pages = min(args.max_pages, max(1, int(rng.expovariate(1 / 3)) + 1))
+        url_count = min(args.max_urls, int(rng.expovariate(1 / 5)))
+        javascript = rng.random() < args.js_rate
+        form = rng.random() < args.form_rate
+        data, link_urls, text_urls = make_pdf(rng, index, rng.choice(sizes), pages, url_count, javascript, form)
+        name = f"doc_{index:05d}.pdf"
+        with open(os.path.join(args.out, name), "wb") as f:
+            f.write(data)
+        manifest.append({
+            "file": name,
+            "sha256": hashlib.sha256(data).hexdigest(),
+            "bytes": len(data),
+            "pages": pages,
+            "urls": len(link_urls) + len(text_urls),
+            "link_urls": link_urls,
+            "text_urls": text_urls,
+            "javascript": javascript,
+            "form": form,
+        })
+    with open(os.path.join(args.out, "manifest.json"), "w") as f:
+        json.dump({"seed": args.seed, "files": manifest}, f, indent=2)
+    total = sum(entry["bytes"] for entry in manifest)
+    print(f"wrote {len(manifest)} PDFs ({total / 1024 / 1024:.1f} MiB) to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Compare the PDF text extraction backends of service-pdf/extractors.py.
+
+Each backend runs over the corpus in its own process, so peak RSS is measured
+per backend. Reports time per document (mean/p50/p95), throughput, peak RSS,
+page count mismatches, failures and URL recall: the share of the URLs written
+into page text (from the corpus manifest) that service-pdf's URL extraction
+(urlextract.py) finds in the extracted text.
+
+Usage:
+    python corpus.py --out corpus --count 100
+    python extractbench.py --corpus corpus
+    python extractbench.py --corpus corpus --backends pypdf2,pdfminer --rounds 3 --out extract.json
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import statistics
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "service-pdf"))
+
+import extractors  # noqa: E402
+import urlextract  # noqa: E402
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_backend(name, corpus, entries, rounds, queue):
+    """Child process: extract every document and send the measurements back."""
+    _, extract_pages = extractors.get_extractor(name)
+    documents = []
+    for entry in entries:
+        with open(os.path.join(corpus, entry["file"]), "rb") as f:
+            documents.append((entry, f.read()))
+    # Warm-up: library import and one-off initialisation are not part of the timings
+    extract_pages(documents[0][1])
+    baseline_rss = peak_rss_mib()
+
+    timings, failures, page_mismatches = [], 0, 0
+    expected_urls = found_urls = 0
+    for round_number in range(rounds):
+        for entry, data in documents:
+            started = time.perf_counter()
+            try:
+                pages = extract_pages(data)
+            except Exception:
+                failures += 1
+                continue
+            timings.append(time.perf_counter() - started)
+            if round_number:
+                continue
+            if len(pages) != entry["pages"]:
+                page_mismatches += 1
+            found = {found["url"] for found in urlextract.extract_urls(pages)}
+            expected_urls += len(entry["text_urls"])
+            found_urls += sum(1 for url in entry["text_urls"] if urlextract.normalize(url)[0] in found)
+
+    total_bytes = sum(len(data) for _, data in documents) * rounds
+    queue.put({
+        "backend": name,
+        "documents": len(documents) * rounds,
+        "failures": failures,
+        "mean_ms": statistics.mean(timings) * 1000 if timings else None,
+        "p50_ms": percentile(timings, 50) * 1000 if timings else None,
+        "p95_ms": percentile(timings, 95) * 1000 if timings else None,
+        "mib_per_s": total_bytes / 1024 / 1024 / sum(timings) if timings else None,
+        "peak_rss_mib": peak_rss_mib(),
+        "rss_growth_mib": peak_rss_mib() - baseline_rss,
+        "page_mismatches": page_mismatches,
+        "url_recall": found_urls / expected_urls if expected_urls else None,
+    })
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default="corpus", help="directory written by corpus.py")
+    parser.add_argument("--backends", help="comma-separated backends (default: every installed one)")
+    parser.add_argument("--rounds", type=int, default=1, help="passes over the corpus per backend")
+    parser.add_argument("--out", help="write the results as JSON")
+    args = parser.parse_args()
+
+    with open(os.path.join(args.corpus, "manifest.json")) as f:
+        entries = json.load(f)["files"]
+    if entries and "text_urls" not in entries[0]:
+        sys.exit("manifest has no URL lists; regenerate the corpus with the current corpus.py")
+    names = args.backends.split(",") if args.backends else extractors.available()
+    missing = [name for name in names if name not in extractors.BACKENDS or not extractors.installed(name)]
+    if missing:
+        sys.exit(f"unavailable backends: {', '.join(missing)} (installed: {', '.join(extractors.available())})")
+
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for name in names:
+        queue = context.Queue()
+        process = context.Process(target=run_backend, args=(name, args.corpus, entries, args.rounds, queue))
+        process.start()
+        results.append(queue.get())
+        process.join()
+
+    print(f"{len(entries)} documents x {args.rounds} round(s)\n")
+    print(f"{'backend':<10} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'MiB/s':>8} {'peak MiB':>9} "
+          f"{'+MiB':>7} {'recall':>7} {'pages!=':>8} {'failed':>7}")
+
+    def fmt(value, spec):
+        return format(value, spec) if value is not None else "-"
+
+    for r in sorted(results, key=lambda r: r["mean_ms"] if r["mean_ms"] is not None else float("inf")):
+        print(f"{r['backend']:<10} {fmt(r['mean_ms'], '>9.1f')} {fmt(r['p50_ms'], '>9.1f')} "
+              f"{fmt(r['p95_ms'], '>9.1f')} {fmt(r['mib_per_s'], '>8.1f')} {r['peak_rss_mib']:>9.1f} "
+              f"{r['rss_growth_mib']:>7.1f} {fmt(r['url_recall'], '>7.3f')} {r['page_mismatches']:>8} "
+              f"{r['failures']:>7}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Drive service-api /analyze with a PDF corpus and report throughput and latency.
+
+Reports end-to-end p50/p95/p99, outcomes by status and verdict source, and a
+per-stage breakdown taken from the services' /metrics (the difference between
+scrapes before and after the run, so earlier traffic does not count).
+
+Usage (offline, against the stubs; see the Benchmarking section of the README):
+    python corpus.py --out corpus --count 200
+    python loadtest.py --corpus corpus --concurrency 16 --out run.json
+    python loadtest.py --corpus corpus --concurrency 16 --baseline run.json
+
+With --baseline the run fails (exit status 1) when throughput drops or a
+latency percentile grows by more than --tolerance, or the error rate rises.
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from prometheus_client.parser import text_string_to_metric_families
+
+DEFAULT_METRICS = ",".join(f"http://localhost:{port}/metrics" for port in (5001, 5002, 5003, 5004, 5005, 5090))
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def scrape(urls):
+    """Stage histograms and error/cache counters from every reachable /metrics endpoint."""
+    stages = defaultdict(lambda: defaultdict(float))  # (service, stage) -> {le/"sum"/"count": value}
+    counters = defaultdict(float)
+    for url in urls:
+        try:
+            resp = requests.get(url, timeout=10)
+            resp.raise_for_status()
+        except requests.RequestException:
+            print(f"warning: could not scrape {url}", file=sys.stderr)
+            continue
+        for family in text_string_to_metric_families(resp.text):
+            for sample in family.samples:
+                labels = sample.labels
+                if family.name == "stage_duration_seconds":
+                    series = stages[(labels["service"], labels["stage"])]
+                    if sample.name.endswith("_bucket"):
+                        series[float(labels["le"])] += sample.value
+                    elif sample.name.endswith("_sum"):
+                        series["sum"] += sample.value
+                    elif sample.name.endswith("_count"):
+                        series["count"] += sample.value
+                elif family.name == "upstream_errors" and sample.name.endswith("_total"):
+                    counters[("upstream_error", labels["service"], labels["upstream"], labels["reason"])] += sample.value
+                elif family.name == "cache_requests" and sample.name.endswith("_total"):
+                    counters[("cache", labels["service"], labels["cache"], labels["result"])] += sample.value
+    return stages, counters
+
+
+def bucket_quantile(buckets, q):
+    """histogram_quantile() over cumulative {upper bound: count} buckets."""
+    bounds = sorted(buckets)
+    total = buckets[bounds[-1]] if bounds else 0
+    if not total:
+        return None
+    rank = q * total
+    lower, below = 0.0, 0.0
+    for bound in bounds:
+        if buckets[bound] >= rank:
+            if bound == float("inf"):
+                return lower
+            return lower + (bound - lower) * (rank - below) / max(buckets[bound] - below, 1e-9)
+        lower, below = bound, buckets[bound]
+    return lower
+
+
+def stage_breakdown(before, after):
+    rows = []
+    for key, series in after.items():
+        previous = before.get(key, {})
+        delta = {k: v - previous.get(k, 0.0) for k, v in series.items()}
+        count = delta.get("count", 0)
+        if count <= 0:
+            continue
+        buckets = {k: v for k, v in delta.items() if isinstance(k, float)}
+        rows.append({
+            "service": key[0],
+            "stage": key[1],
+            "count": int(count),
+            "mean_ms": delta["sum"] / count * 1000,
+            "p50_ms": (bucket_quantile(buckets, 0.5) or 0) * 1000,
+            "p95_ms": (bucket_quantile(buckets, 0.95) or 0) * 1000,
+        })
+    return sorted(rows, key=lambda r: (r["service"], -r["mean_ms"]))
+
+
+def counter_deltas(before, after):
+    return {"/".join(key): value - before.get(key, 0.0) for key, value in after.items() if value > before.get(key, 0.0)}
+
+
+def load_corpus(path):
+    manifest = os.path.join(path, "manifest.json")
+    if os.path.exists(manifest):
+        with open(manifest) as f:
+            names = [entry["file"] for entry in json.load(f)["files"]]
+    else:
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(".pdf"))
+    if not names:
+        sys.exit(f"no PDFs in {path}")
+    return [os.path.join(path, name) for name in names]
+
+
+def compare(result, baseline, tolerance):
+    """Return the regressions of result against baseline."""
+    regressions = []
+    if result["throughput_rps"] < baseline["throughput_rps"] * (1 - tolerance):
+        regressions.append(f"throughput {result['throughput_rps']:.2f} < {baseline['throughput_rps']:.2f} req/s")
+    for name in ("p50_ms", "p95_ms", "p99_ms"):
+        if baseline["latency"].get(name) and result["latency"].get(name, 0) > baseline["latency"][name] * (1 + tolerance):
+            regressions.append(f"{name} {result['latency'][name]:.0f} > {baseline['latency'][name]:.0f}")
+    if result["error_rate"] > baseline["error_rate"] + tolerance / 10:
+        regressions.append(f"error rate {result['error_rate']:.3f} > {baseline['error_rate']:.3f}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--api", default="http://localhost:5001")
+    parser.add_argument("--corpus", default="corpus", help="directory written by corpus.py")
+    parser.add_argument("--requests", type=int, help="number of requests (default: one per file); "
+                                                      "files are reused beyond the corpus size, hitting the cache")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--include", default="none", help="include= for /analyze (default none: no artifacts)")
+    parser.add_argument("--metrics", default=DEFAULT_METRICS, help="comma-separated /metrics URLs for the stage breakdown")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--out", help="write the results as JSON, e.g. to use as a baseline")
+    parser.add_argument("--baseline", help="JSON from an earlier --out run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative regression (default 0.15)")
+    args = parser.parse_args()
+
+    files = load_corpus(args.corpus)
+    total = args.requests or len(files)
+    metrics_urls = [url.strip() for url in args.metrics.split(",") if url.strip()]
+    run_id = uuid.uuid4().hex[:8]
+    session = requests.Session()
+    session.mount("http://", requests.adapters.HTTPAdapter(pool_maxsize=args.concurrency))
+
+    def one(i):
+        path = files[i % len(files)]
+        started = time.monotonic()
+        try:
+            with open(path, "rb") as f:
+                resp = session.post(
+                    f"{args.api}/analyze",
+                    params={"include": args.include},
+                    files={"file": (os.path.basename(path), f, "application/pdf")},
+                    headers={"X-Request-ID": f"bench-{run_id}-{i}"},
+                    timeout=args.timeout,
+                )
+            status = resp.status_code
+            source = resp.json().get("verdict_source") if status == 200 else None
+        except requests.RequestException as e:
+            status, source = type(e).__name__, None
+        return status, source, (time.monotonic() - started) * 1000
+
+    before = scrape(metrics_urls)
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(one, range(total)))
+    elapsed = time.monotonic() - started
+    after = scrape(metrics_urls)
+
+    latencies = [r[2] for r in results if r[0] == 200]
+    outcomes = defaultdict(int)
+    for status, source, _ in results:
+        outcomes[f"{source or 'ok'}" if status == 200 else f"http_{status}"] += 1
+    result = {
+        "requests": total,
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "throughput_rps": total / elapsed,
+        "error_rate": 1 - len(latencies) / total,
+        "outcomes": dict(outcomes),
+        "latency": {
+            "mean_ms": statistics.mean(latencies),
+            "p50_ms": percentile(latencies, 50),
+            "p95_ms": percentile(latencies, 95),
+            "p99_ms": percentile(latencies, 99),
+        } if latencies else {},
+        "stages": stage_breakdown(before[0], after[0]),
+        "counters": counter_deltas(before[1], after[1]),
+    }
+
+    print(f"requests: {total} in {elapsed:.2f}s ({result['throughput_rps']:.2f} req/s), concurrency {args.concurrency}")
+    print(f"outcomes: {result['outcomes']}")
+    if latencies:
+        lat = result["latency"]
+        print(f"latency ms: mean={lat['mean_ms']:.0f} p50={lat['p50_ms']:.0f} "
+              f"p95={lat['p95_ms']:.0f} p99={lat['p99_ms']:.0f}")
+    if result["stages"]:
+        print(f"\n{'service':<20} {'stage':<40} {'count':>6} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9}")
+        for row in result["stages"]:
+            print(f"{row['service']:<20} {row['stage']:<40} {row['count']:>6} {row['mean_ms']:>9.1f} "
+                  f"{row['p50_ms']:>9.1f} {row['p95_ms']:>9.1f}")
+    for name, value in sorted(result["counters"].items()):
+        print(f"{name}: {value:.0f}")
+
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump(result, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        if regressions:
+            print("\nREGRESSION: " + "; ".join(regressions))
+            sys.exit(1)
+        print("\nno regression against baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+Local stand-ins for the VirusTotal and urlscan.io APIs used by service-reputation.
+
+Point service-reputation at it with VT_API_BASE=http://<host>:5095/api/v3 and
+URLSCAN_API_BASE=http://<host>:5095/api/v1. OpenAI is emulated by
+llm_gateway/fake_openai.py behind the gateway.
+
+Latencies are distributions given as `kind:args` in milliseconds:
+
+    fixed:MS                  always MS
+    uniform:LOW:HIGH          uniform between LOW and HIGH
+    normal:MEAN:STDDEV        normal, clipped at 0
+    lognormal:MEDIAN:SIGMA    lognormal with the given median (heavy tail)
+    exponential:MEAN          exponential with the given mean
+
+    STUB_VT_LATENCY            /files/{sha256} latency (default lognormal:300:0.5)
+    STUB_VT_ERROR_RATE         fraction answered with a 500 (default 0)
+    STUB_VT_NOT_FOUND_RATE     fraction answered with a 404, i.e. unknown files (default 0.5)
+    STUB_VT_MALICIOUS_RATE     fraction of known files flagged by many engines (default 0.05)
+    STUB_URLSCAN_LATENCY       /scan/ and /result/ latency (default lognormal:200:0.5)
+    STUB_URLSCAN_ERROR_RATE    fraction of submissions answered with a 500 (default 0)
+    STUB_URLSCAN_SCAN_SECONDS  time until a result is ready, before that /result/ is a 404 (default 3)
+    STUB_SEED                  random seed for reproducible runs (default unset)
+
+Answers are derived from the hash or URL, so repeated runs see the same verdicts.
+"""
+import hashlib
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+
+from flask import Flask, jsonify, request
+
+log_level = os.getenv("LOG_LEVEL", "INFO")
+logging.basicConfig(level=log_level)
+logger = logging.getLogger("bench-stubs")
+
+app = Flask(__name__)
+
+
+def parse_latency(spec):
+    """Return a function sampling seconds from a `kind:args` distribution in milliseconds."""
+    kind, _, args = spec.partition(":")
+    params = [float(x) for x in args.split(":") if x]
+    samplers = {
+        "fixed": lambda ms: ms,
+        "uniform": lambda low, high: random.uniform(low, high),
+        "normal": lambda mean, stddev: random.gauss(mean, stddev),
+        "lognormal": lambda median, sigma: random.lognormvariate(0, sigma) * median,
+        "exponential": lambda mean: random.expovariate(1 / mean) if mean else 0,
+    }
+    if kind not in samplers:
+        raise ValueError(f"Unknown latency distribution {kind!r} (use one of {', '.join(samplers)})")
+    sampler = samplers[kind]
+    sampler(*params)  # fail at startup on a wrong argument count
+    return lambda: max(0.0, sampler(*params)) / 1000
+
+
+VT_LATENCY = parse_latency(os.getenv("STUB_VT_LATENCY", "lognormal:300:0.5"))
+VT_ERROR_RATE = float(os.getenv("STUB_VT_ERROR_RATE", "0"))
+VT_NOT_FOUND_RATE = float(os.getenv("STUB_VT_NOT_FOUND_RATE", "0.5"))
+VT_MALICIOUS_RATE = float(os.getenv("STUB_VT_MALICIOUS_RATE", "0.05"))
+URLSCAN_LATENCY = parse_latency(os.getenv("STUB_URLSCAN_LATENCY", "lognormal:200:0.5"))
+URLSCAN_ERROR_RATE = float(os.getenv("STUB_URLSCAN_ERROR_RATE", "0"))
+URLSCAN_SCAN_SECONDS = float(os.getenv("STUB_URLSCAN_SCAN_SECONDS", "3"))
+if os.getenv("STUB_SEED"):
+    random.seed(int(os.getenv("STUB_SEED")))
+
+VT_ENGINES = ("Avast", "BitDefender", "ESET-NOD32", "Kaspersky", "Microsoft", "Sophos", "Symantec", "TrendMicro")
+
+# uuid -> (ready_at, url); results are kept for the life of the process, which is one benchmark run
+_scans = {}
+_scans_lock = threading.Lock()
+
+
+def fraction(value):
+    """Stable value in [0, 1) for a hash or URL, so verdicts repeat across runs."""
+    return int(hashlib.sha256(value.encode("utf-8")).hexdigest()[:8], 16) / 0x100000000
+
+
+def vt_report(sha256):
+    malicious = fraction("malicious" + sha256) < VT_MALICIOUS_RATE
+    flagged = VT_ENGINES[:6] if malicious else ()
+    results = {name: {"category": "malicious" if name in flagged else "undetected"} for name in VT_ENGINES}
+    now = int(time.time())
+    return {
+        "data": {
+            "id": sha256,
+            "type": "file",
+            "attributes": {
+                "last_analysis_stats": {
+                    "malicious": 40 if malicious else 0,
+                    "suspicious": 0,
+                    "undetected": 30 if malicious else 70,
+                    "harmless": 0,
+                },
+                "first_submission_date": now - 86400,
+                "last_submission_date": now,
+                "last_analysis_results": results,
+            },
+        }
+    }
+
+
+@app.route("/api/v3/files/<sha256>", methods=["GET"])
+def vt_file(sha256):
+    time.sleep(VT_LATENCY())
+    if random.random() < VT_ERROR_RATE:
+        return jsonify({"error": {"code": "TransientError", "message": "Injected failure"}}), 500
+    if fraction(sha256) < VT_NOT_FOUND_RATE:
+        return jsonify({"error": {"code": "NotFoundError", "message": f"File \"{sha256}\" not found"}}), 404
+    return jsonify(vt_report(sha256)), 200
+
+
+@app.route("/api/v1/scan/", methods=["POST"])
+def urlscan_submit():
+    time.sleep(URLSCAN_LATENCY())
+    if random.random() < URLSCAN_ERROR_RATE:
+        return jsonify({"message": "Injected failure", "status": 500}), 500
+    url = (request.get_json(silent=True) or {}).get("url")
+    if not url:
+        return jsonify({"message": "Missing URL properties", "status": 400}), 400
+    scan_id = str(uuid.uuid4())
+    with _scans_lock:
+        _scans[scan_id] = (time.monotonic() + URLSCAN_SCAN_SECONDS, url)
+    return jsonify({
+        "message": "Submission successful",
+        "uuid": scan_id,
+        "result": f"{request.host_url}api/v1/result/{scan_id}/",
+        "url": url,
+        "visibility": "public",
+    }), 200
+
+
+@app.route("/api/v1/result/<scan_id>/", methods=["GET"])
+def urlscan_result(scan_id):
+    time.sleep(URLSCAN_LATENCY())
+    with _scans_lock:
+        scan = _scans.get(scan_id)
+    if scan is None or time.monotonic() < scan[0]:
+        return jsonify({"message": "Scan is not finished yet", "status": 404}), 404
+    malicious = fraction("malicious" + scan[1]) < VT_MALICIOUS_RATE
+    score = 100 if malicious else 0
+    return jsonify({
+        "task": {"uuid": scan_id, "url": scan[1]},
+        "verdicts": {
+            "overall": {"score": score, "malicious": malicious, "categories": ["phishing"] if malicious else []},
+            "urlscan": {"score": score, "malicious": malicious},
+        },
+    }), 200
+
+
+@app.route("/health", methods=["GET"])
+def health():
+    return jsonify({"status": "ok", "scans": len(_scans)}), 200
+
+
+if __name__ == "__main__":
+    app.run(host="0.0.0.0", port=5095, threaded=True)
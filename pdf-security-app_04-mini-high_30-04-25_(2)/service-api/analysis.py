@@ -0,0 +1,99 @@
+"""
+Server-independent pieces of the /analyze pipeline, shared by the Flask app
+(app.py) and the ASGI app (asgi.py): stage errors, progressive event framing,
+and the stored record / response shapes.
+"""
+import json
+from datetime import datetime
+
+from fastpath import VERDICT_SOURCE_LLM, VERDICT_SOURCE_RULES
+from pdffeatures import stored_features
+
+# Fields needed to answer /analyze from a stored result
+CACHED_FIELDS = {"sha256": 1, "risk_score": 1, "reasoning": 1, "verdict_source": 1, "image_base64": 1, "artifacts": 1,
+                 "profile": 1, "degraded": 1, "visual.similar": 1, "visual.reused_from": 1}
+
+
+class StageError(Exception):
+    """A downstream stage failed; the message is returned to the client."""
+
+
+def stream_mode(args, headers):
+    """Return (stream, sse) for a request: ?stream=1|true|ndjson|sse or a streaming Accept header."""
+    accept = headers.get("Accept", "")
+    stream_arg = args.get("stream", "").lower()
+    sse = "text/event-stream" in accept or stream_arg == "sse"
+    stream = sse or stream_arg in ("1", "true", "ndjson") or "application/x-ndjson" in accept
+    return stream, sse
+
+
+def format_event(event, data, sse):
+    if sse:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+    return json.dumps({"event": event, "data": data}) + "\n"
+
+
+def url_count(structural_data, content_data):
+    """Distinct URLs across annotations and extracted text, for the fast path."""
+    urls = set(structural_data.get("urls", [])) | {u.get("url") for u in content_data.get("urls", [])}
+    return len(urls)
+
+
+def build_record(md5, sha256, structural_data, content_data, file_rep_data, rule,
+                 visual_data=None, priority_url=None, url_rep_data=None, synth_data=None,
+                 llm_usage=None, tenant=None, profile=None, degraded=None, similarity=None, vector=None):
+    """The results document for a finished analysis; rule is set for rule-based verdicts.
+
+    llm_usage is accounting.summarize_usage() of the LLM stages; profile is the degradation
+    profile that produced the result and degraded names the stages it skipped; similarity is
+    the similarity sketch taken at ingest and vector the feature vector from /structural,
+    stored packed.
+    """
+    if rule:
+        risk_score, reasoning, verdict_source = rule["verdict"], rule["reasoning"], VERDICT_SOURCE_RULES
+    else:
+        risk_score, reasoning, verdict_source = synth_data.get("risk_score"), synth_data.get("reasoning"), VERDICT_SOURCE_LLM
+    return {
+        "created_at": datetime.utcnow(),
+        "md5": md5,
+        "sha256": sha256,
+        "structural": structural_data,
+        "content": content_data,
+        "visual": visual_data,
+        "file_reputation": file_rep_data,
+        "priority_url": priority_url,
+        "url_reputation": url_rep_data,
+        "risk_score": risk_score,
+        "reasoning": reasoning,
+        "verdict_source": verdict_source,
+        "rule": rule["rule"] if rule else None,
+        "tenant": tenant,
+        "llm_usage": llm_usage,
+        "profile": profile,
+        "degraded": degraded,
+        "similarity": similarity,
+        "features": stored_features(vector),
+        "image_base64": visual_data.get("image_base64") if visual_data else None
+    }
+
+
+def result_body(analysis_id, record, include):
+    """The /analyze response for a stored, queued or cached record."""
+    body = {
+        "analysis_id": analysis_id,
+        "sha256": record["sha256"],
+        "risk_score": record["risk_score"],
+        "reasoning": record["reasoning"],
+        "verdict_source": record.get("verdict_source", VERDICT_SOURCE_LLM),
+        "image_base64": record.get("image_base64") if "image" in include else None
+    }
+    if record.get("degraded"):
+        body["profile"] = record.get("profile")
+        body["degraded"] = record["degraded"]
+    # Visually near-identical earlier analyses (service-visual perceptual hash index)
+    visual = record.get("visual") or {}
+    if visual.get("similar"):
+        body["similar_analyses"] = visual["similar"]
+    if visual.get("reused_from"):
+        body["visual_reused_from"] = visual["reused_from"]
+    return body
@@ -1,9 +1,58 @@
 import os
+import json
 import logging
-import hashlib
-from flask import Flask, request, jsonify
-import requests
+import time
+from flask import Flask, Response, request, jsonify, stream_with_context
+import gridfs
 from pymongo import MongoClient
+import requests
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from accounting import DEGRADED, BudgetExceeded, TenantBudgets, summarize_usage
+from analysis import (
+    CACHED_FIELDS,
+    StageError,
+    build_record,
+    format_event,
+    result_body,
+    stream_mode,
+    url_count,
+)
+from degrade import (
+    DEGRADE_ENABLED,
+    DEGRADE_STAGE_TIMEOUT,
+    FULL,
+    NO_VISUAL,
+    RULES_ONLY,
+    SKIPPED,
+    DegradationController,
+    fallback_verdict,
+    profile_for,
+    worst,
+)
+from fastpath import fast_verdict
+from ingest import MAX_PDF_BYTES, IngestError, from_stream, from_url
+from metrics import cache_result, http_call, instrument, observe, timed
+from pages import PageNotFound, PageRenderer, store_pdf
+from storage import (
+    QueryError,
+    discard_artifacts,
+    ensure_indexes,
+    list_page,
+    load_artifacts,
+    parse_dpi,
+    parse_fields,
+    parse_include,
+    parse_limit,
+    parse_score,
+    pending_view,
+    score_query,
+    serialize,
+    store_artifacts,
+)
+from scoring import SCORE_BATCH_MAX, BatchScorer, ScoreModel
+from similarity import SIMILARITY_MIN_SCORE, SimilarityIndex, reusable, similar_verdict
+from writebehind import BufferFull, WriteBehind
 
 # Logging configuration
 log_level = os.getenv("LOG_LEVEL", "INFO")
@@ -11,12 +60,39 @@ logging.basicConfig(level=log_level)
 logger = logging.getLogger("service-api")
 
 app = Flask(__name__)
+# Reject oversized uploads before the multipart body is parsed (1 MiB allowance for form overhead)
+app.config["MAX_CONTENT_LENGTH"] = MAX_PDF_BYTES + 1024 * 1024
+instrument(app, "service-api")
 
 # MongoDB configuration
 mongo_uri = os.getenv("MONGO_URI", "mongodb://mongodb:27017/")
 client = MongoClient(mongo_uri)
 db = client.pdf_analyzer
 results_col = db.results
+artifacts_fs = gridfs.GridFS(db, collection="artifacts")
+try:
+    ensure_indexes(results_col)
+except Exception:
+    logger.exception("Index creation failed; result queries will be unindexed")
+# Results are written in batches off the request path; artifacts move to GridFS on the way
+results_writer = WriteBehind(
+    results_col, "results",
+    prepare=lambda record: store_artifacts(artifacts_fs, record),
+    discard=lambda record: discard_artifacts(artifacts_fs, results_col, record),
+    on_batch=lambda records, seconds: observe("mongo_insert", seconds),
+    # Insert time for the columnar export watermark (columnar.py)
+    stamp_field="stored_at",
+)
+budgets = TenantBudgets(db.tenant_usage)
+# Campaign variants: MinHash/LSH search over similarity sketches taken at ingest
+similar_index = SimilarityIndex(results_col)
+# Vectorized re-scoring of stored feature vectors (SCORE_MODEL_FILE or the default rule set)
+batch_scorer = BatchScorer(results_col, ScoreModel.load())
+# Page text and renders of stored PDFs, parsed on demand and LRU-cached
+page_renderer = PageRenderer(artifacts_fs)
+# Degradation profile per analysis, from the queue depth and upstream health of this worker
+degrader = DegradationController()
+STAGE_TIMEOUT = DEGRADE_STAGE_TIMEOUT if DEGRADE_ENABLED else None
 
 # Service URLs
 PDF_SERVICE_URL = os.getenv("PDF_SERVICE_URL", "http://service-pdf:5002")
@@ -24,142 +100,307 @@ VISUAL_SERVICE_URL = os.getenv("VISUAL_SERVICE_URL", "http://service-visual:5003
 REPUTATION_SERVICE_URL = os.getenv("REPUTATION_SERVICE_URL", "http://service-reputation:5005")
 LLM_SERVICE_URL = os.getenv("LLM_SERVICE_URL", "http://service-llm:5004")
 
+def stream_events(events, sse):
+    try:
+        for event, data in events:
+            yield format_event(event, data, sse)
+    except StageError as e:
+        yield format_event("error", {"error": str(e)}, sse)
+    except BudgetExceeded as e:
+        yield format_event("error", {"error": str(e)}, sse)
+    except BufferFull:
+        logger.error("Result buffer full")
+        yield format_event("error", {"error": "Service overloaded, retry later"}, sse)
+    except Exception:
+        logger.exception("Analysis error")
+        yield format_event("error", {"error": "Internal server error"}, sse)
+
+
+def stage(key, name, method, url, **kwargs):
+    """Call a downstream stage and return its JSON body, raising StageError on failure.
+
+    key labels the stage in metrics and degradation samples; name is used in errors.
+    """
+    started = time.monotonic()
+    try:
+        resp = http_call(key, method, url, **kwargs)
+    except requests.RequestException as e:
+        degrader.record(key, time.monotonic() - started, False)
+        logger.error(f"{name} failed", extra={"error": str(e)})
+        raise StageError(f"{name} failed")
+    degrader.record(key, time.monotonic() - started, resp.status_code == 200)
+    if resp.status_code != 200:
+        logger.error(f"{name} failed", extra={"status_code": resp.status_code})
+        raise StageError(f"{name} failed")
+    return resp.json()
+
+
+def synthesize(payload, stream):
+    """Yield ("synthesis_token", ...) events when streaming, then the synthesis result."""
+    if not stream:
+        yield "synthesis", stage(
+            "synthesize", "Risk synthesis", "POST", f"{LLM_SERVICE_URL}/synthesize_risk", json=payload,
+            timeout=STAGE_TIMEOUT
+        )
+        return
+    started = time.monotonic()
+    try:
+        with http_call("synthesize", "POST", f"{LLM_SERVICE_URL}/synthesize_risk/stream", json=payload, stream=True,
+                       timeout=STAGE_TIMEOUT) as synth_resp:
+            if synth_resp.status_code != 200:
+                logger.error("Risk synthesis failed", extra={"status_code": synth_resp.status_code})
+                raise StageError("Risk synthesis failed")
+            for line in synth_resp.iter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["event"] == "token":
+                    yield "synthesis_token", {"text": message["text"]}
+                elif message["event"] == "result":
+                    degrader.record("synthesize", time.monotonic() - started, True)
+                    yield "synthesis", message
+                    return
+                else:
+                    logger.error("Risk synthesis failed", extra={"error": message.get("error")})
+                    raise StageError("Risk synthesis failed")
+        raise StageError("Risk synthesis failed")
+    except requests.RequestException as e:
+        logger.error("Risk synthesis failed", extra={"error": str(e)})
+        degrader.record("synthesize", time.monotonic() - started, False)
+        raise StageError("Risk synthesis failed")
+    except StageError:
+        degrader.record("synthesize", time.monotonic() - started, False)
+        raise
+
+
+def llm_stages(pdf, md5, sha256, structural_data, content_data, file_rep_data, stream, profile, usage, skipped):
+    """Visual analysis, priority URL selection, URL reputation and risk synthesis.
+
+    Yields stage events and returns (visual, priority_url, url_reputation, synthesis). Stages the
+    degradation profile skips are left out; with degradation enabled, a failing visual or URL
+    reputation stage is skipped as well. usage and skipped are filled in with the LLM usage per
+    stage and the names of the skipped stages.
+    """
+    skipped.extend(SKIPPED[profile])
+    # Visual analysis
+    if "visual" in skipped:
+        visual_data = {"analysis": "", "skipped": profile}
+    else:
+        upload = pdf.upload(sha256=sha256)
+        try:
+            visual_data = stage(
+                "visual", "Visual analysis", "POST", f"{VISUAL_SERVICE_URL}/visual",
+                data=upload, headers=upload.headers, timeout=STAGE_TIMEOUT
+            )
+            usage["visual"] = visual_data.pop("usage", None)
+        except StageError:
+            if not DEGRADE_ENABLED:
+                raise
+            visual_data = {"analysis": "", "skipped": "failed"}
+            skipped.append("visual")
+    yield "visual", visual_data
+
+    # Priority URL selection
+    url_select = stage(
+        "select_url", "URL selection", "POST", f"{LLM_SERVICE_URL}/select_url",
+        json={
+            "structural_urls": structural_data.get("urls", []),
+            "content_urls": content_data.get("urls", []),
+            "visual_report": visual_data.get("analysis", "")
+        },
+        timeout=STAGE_TIMEOUT
+    )
+    usage["select_url"] = url_select.get("usage")
+    priority_url = url_select.get("priority_url")
+    yield "priority_url", {"priority_url": priority_url}
+
+    # URL reputation if needed
+    url_rep_data = None
+    if priority_url and "url_reputation" not in skipped:
+        try:
+            url_rep_data = stage(
+                "url_reputation", "URL reputation check", "POST", f"{REPUTATION_SERVICE_URL}/url",
+                json={"url": priority_url}, timeout=STAGE_TIMEOUT
+            )
+            yield "url_reputation", url_rep_data
+        except StageError:
+            if not DEGRADE_ENABLED:
+                raise
+            skipped.append("url_reputation")
+
+    # Risk synthesis
+    synth_payload = {
+        "sha256": sha256,
+        "md5": md5,
+        "structural": structural_data,
+        "content": content_data,
+        "visual": visual_data,
+        "file_reputation": file_rep_data,
+        "priority_url": priority_url,
+        "url_reputation": url_rep_data
+    }
+    synth_data = None
+    for event, data in synthesize(synth_payload, stream):
+        if event == "synthesis":
+            usage["synthesize"] = data.pop("usage", None)
+            synth_data = data
+        else:
+            yield event, data
+    return visual_data, priority_url, url_rep_data, synth_data
+
+
+def run_pipeline(pdf, md5, sha256, include, tenant, stream=False, sketch=None):
+    """Run every analysis stage, yielding (event, data) as soon as each stage completes.
+
+    The last event is "result", carrying the API response. Stage failures raise StageError.
+    pdf is the ingested PDF, streamed to each stage from its spooled file; sketch is the
+    similarity sketch taken at ingest.
+    """
+    # The PDF is kept for page drill-down (content-addressed, written once per file)
+    with timed("pdf_store"):
+        pdf_file = store_pdf(artifacts_fs, sha256, pdf.reader())
+
+    # Structural analysis
+    upload = pdf.upload()
+    struct_resp = http_call("structural", "POST", f"{PDF_SERVICE_URL}/structural", data=upload, headers=upload.headers)
+    if struct_resp.status_code != 200:
+        logger.error("Structural analysis failed", extra={"status_code": struct_resp.status_code})
+        raise StageError("Structural analysis failed")
+    structural_data = struct_resp.json()
+    # The feature vector is stored packed, not passed on to the LLM stages
+    vector = structural_data.pop("vector", None)
+    yield "structural", structural_data
+
+    # Content extraction
+    upload = pdf.upload()
+    content_resp = http_call("content", "POST", f"{PDF_SERVICE_URL}/content", data=upload, headers=upload.headers)
+    if content_resp.status_code != 200:
+        logger.error("Content extraction failed", extra={"status_code": content_resp.status_code})
+        raise StageError("Content extraction failed")
+    content_data = content_resp.json()
+    yield "content", {"urls": content_data.get("urls", []), "text_chars": len(content_data.get("text", ""))}
+
+    # File reputation
+    file_rep_resp = http_call("file_reputation", "POST", f"{REPUTATION_SERVICE_URL}/file", json={"sha256": sha256})
+    if file_rep_resp.status_code != 200:
+        logger.error("File reputation check failed", extra={"status_code": file_rep_resp.status_code})
+        raise StageError("File reputation check failed")
+    file_rep_data = file_rep_resp.json()
+    yield "file_reputation", file_rep_data
+
+    # Fast path: clear-cut documents skip the LLM stages
+    urls = url_count(structural_data, content_data)
+    rule = fast_verdict(structural_data, file_rep_data, urls, vector)
+    # Variants of an analysed malicious document take over its verdict
+    if not rule and sketch:
+        with timed("similarity_search"):
+            match = reusable(similar_index.search(sketch, exclude=sha256))
+        if match:
+            rule = similar_verdict(match)
+    if rule:
+        logger.info("Fast-path verdict", extra={"sha256": sha256, "rule": rule["rule"]})
+        record = build_record(md5, sha256, structural_data, content_data, file_rep_data, rule,
+                              tenant=tenant, profile=FULL, similarity=sketch, vector=vector)
+    else:
+        # Load-aware degradation, then the tenant's token budget
+        profile = degrader.admit()
+        if profile != RULES_ONLY and budgets.admit(tenant) == DEGRADED:
+            profile = worst(profile, NO_VISUAL)
+        usage, skipped, llm_data = {}, [], None
+        if profile != RULES_ONLY:
+            try:
+                llm_data = yield from llm_stages(
+                    pdf, md5, sha256, structural_data, content_data, file_rep_data, stream, profile, usage, skipped
+                )
+            except StageError:
+                if not DEGRADE_ENABLED:
+                    raise
+                logger.warning("LLM stages failed, falling back to rules", extra={"sha256": sha256})
+        if llm_data:
+            record = build_record(md5, sha256, structural_data, content_data, file_rep_data, None, *llm_data,
+                                  summarize_usage(usage), tenant=tenant, profile=profile_for(skipped),
+                                  degraded=skipped or None, similarity=sketch, vector=vector)
+        else:
+            record = build_record(md5, sha256, structural_data, content_data, file_rep_data,
+                                  fallback_verdict(structural_data, file_rep_data, urls, vector),
+                                  llm_usage=summarize_usage(usage), tenant=tenant, profile=RULES_ONLY,
+                                  degraded=list(SKIPPED[RULES_ONLY]), similarity=sketch, vector=vector)
+    record["pdf_file"] = pdf_file
+    budgets.charge(tenant, record["llm_usage"])
+
+    # Store results
+    analysis_id = results_writer.submit(record)
+    logger.info("Analysis queued for storage", extra={"sha256": sha256, "id": analysis_id})
+    yield "result", result_body(analysis_id, record, include)
+
+
+def analysis_events(pdf, include, tenant, stream):
+    """Cached result or pipeline events for an ingested PDF; closes the spooled file when done."""
+    md5, sha256 = pdf.md5, pdf.sha256
+    try:
+        yield "hashes", {"md5": md5, "sha256": sha256}
+        with timed("mongo_find"):
+            existing = results_col.find_one({"sha256": sha256}, CACHED_FIELDS) or \
+                results_writer.find_pending({"sha256": sha256})
+        cache_result("results", "hit" if existing else "miss")
+        if existing:
+            logger.info("Returning cached result", extra={"sha256": sha256})
+            existing = load_artifacts(artifacts_fs, existing, include)
+            yield "result", result_body(str(existing["_id"]), existing, include)
+            return
+        with degrader.track():
+            yield from run_pipeline(pdf, md5, sha256, include, tenant, stream, pdf.similarity)
+    finally:
+        pdf.close()
+
+
 @app.route("/analyze", methods=["POST"])
 def analyze():
     try:
-        # Accept input
+        # The page image is returned unless the caller opts out with include=none
+        include = parse_include(request.args.get("include", "image"))
+        tenant = budgets.tenant_of(request.headers)
+
+        # Accept input: streamed into a spooled file, hashed and checked for %PDF on the way
         if request.files.get("file"):
-            file = request.files["file"]
-            pdf_bytes = file.read()
+            pdf = from_stream(request.files["file"].stream)
         else:
-            data = request.get_json() or {}
+            data = request.get_json(silent=True) or {}
             pdf_url = data.get("url")
             if not pdf_url:
                 return jsonify({"error": "No file or URL provided"}), 400
-            resp = requests.get(pdf_url, timeout=10)
-            if resp.status_code != 200:
-                return jsonify({"error": "Failed to download PDF", "status_code": resp.status_code}), 400
-            pdf_bytes = resp.content
-
-        # Validate PDF
-        if not pdf_bytes.startswith(b"%PDF"):
-            return jsonify({"error": "Invalid PDF file"}), 400
-
-        # Calculate hashes
-        md5 = hashlib.md5(pdf_bytes).hexdigest()
-        sha256 = hashlib.sha256(pdf_bytes).hexdigest()
-        logger.info("PDF received", extra={"md5": md5, "sha256": sha256})
-
-        # Check prior analysis
-        existing = results_col.find_one({"sha256": sha256})
-        if existing:
-            logger.info("Returning cached result", extra={"sha256": sha256})
-            return jsonify({
-                "analysis_id": str(existing["_id"]),
-                "sha256": sha256,
-                "risk_score": existing["risk_score"],
-                "reasoning": existing["reasoning"],
-                "image_base64": existing["image_base64"]
-            }), 200
-
-        # Structural analysis
-        struct_resp = requests.post(f"{PDF_SERVICE_URL}/structural", files={"file": ("file.pdf", pdf_bytes)})
-        if struct_resp.status_code != 200:
-            logger.error("Structural analysis failed", extra={"status_code": struct_resp.status_code})
-            return jsonify({"error": "Structural analysis failed"}), 502
-        structural_data = struct_resp.json()
-
-        # Content extraction
-        content_resp = requests.post(f"{PDF_SERVICE_URL}/content", files={"file": ("file.pdf", pdf_bytes)})
-        if content_resp.status_code != 200:
-            logger.error("Content extraction failed", extra={"status_code": content_resp.status_code})
-            return jsonify({"error": "Content extraction failed"}), 502
-        content_data = content_resp.json()
-
-        # Visual analysis
-        visual_resp = requests.post(f"{VISUAL_SERVICE_URL}/visual", files={"file": ("file.pdf", pdf_bytes)})
-        if visual_resp.status_code != 200:
-            logger.error("Visual analysis failed", extra={"status_code": visual_resp.status_code})
-            return jsonify({"error": "Visual analysis failed"}), 502
-        visual_data = visual_resp.json()
-        image_base64 = visual_data.get("image_base64")
-
-        # File reputation
-        file_rep_resp = requests.post(f"{REPUTATION_SERVICE_URL}/file", json={"sha256": sha256})
-        if file_rep_resp.status_code != 200:
-            logger.error("File reputation check failed", extra={"status_code": file_rep_resp.status_code})
-            return jsonify({"error": "File reputation check failed"}), 502
-        file_rep_data = file_rep_resp.json()
-
-        # Priority URL selection
-        url_select_resp = requests.post(
-            f"{LLM_SERVICE_URL}/select_url",
-            json={
-                "structural_urls": structural_data.get("urls", []),
-                "content_urls": content_data.get("urls", []),
-                "visual_report": visual_data.get("analysis", "")
-            }
-        )
-        if url_select_resp.status_code != 200:
-            logger.error("URL selection failed", extra={"status_code": url_select_resp.status_code})
-            return jsonify({"error": "URL selection failed"}), 502
-        priority_url = url_select_resp.json().get("priority_url")
-
-        # URL reputation if needed
-        url_rep_data = None
-        if priority_url:
-            url_rep_resp = requests.post(f"{REPUTATION_SERVICE_URL}/url", json={"url": priority_url})
-            if url_rep_resp.status_code != 200:
-                logger.error("URL reputation check failed", extra={"status_code": url_rep_resp.status_code})
-                return jsonify({"error": "URL reputation check failed"}), 502
-            url_rep_data = url_rep_resp.json()
-
-        # Risk synthesis
-        synth_resp = requests.post(
-            f"{LLM_SERVICE_URL}/synthesize_risk",
-            json={
-                "sha256": sha256,
-                "md5": md5,
-                "structural": structural_data,
-                "content": content_data,
-                "visual": visual_data,
-                "file_reputation": file_rep_data,
-                "priority_url": priority_url,
-                "url_reputation": url_rep_data
-            }
-        )
-        if synth_resp.status_code != 200:
-            logger.error("Risk synthesis failed", extra={"status_code": synth_resp.status_code})
-            return jsonify({"error": "Risk synthesis failed"}), 502
-        synth_data = synth_resp.json()
-        risk_score = synth_data.get("risk_score")
-        reasoning = synth_data.get("reasoning")
-
-        # Store results
-        record = {
-            "md5": md5,
-            "sha256": sha256,
-            "structural": structural_data,
-            "content": content_data,
-            "visual": visual_data,
-            "file_reputation": file_rep_data,
-            "priority_url": priority_url,
-            "url_reputation": url_rep_data,
-            "risk_score": risk_score,
-            "reasoning": reasoning,
-            "image_base64": image_base64
-        }
-        inserted = results_col.insert_one(record)
-        logger.info("Analysis stored", extra={"sha256": sha256, "id": str(inserted.inserted_id)})
-
-        return jsonify({
-            "analysis_id": str(inserted.inserted_id),
-            "sha256": sha256,
-            "risk_score": risk_score,
-            "reasoning": reasoning,
-            "image_base64": image_base64
-        }), 200
+            with timed("download"):
+                pdf = from_url(pdf_url)
+        logger.info("PDF received", extra={"md5": pdf.md5, "sha256": pdf.sha256, "size": pdf.size})
+
+        # Progressive delivery: emit each stage result as soon as it is available
+        stream, sse = stream_mode(request.args, request.headers)
+        if stream:
+            events = analysis_events(pdf, include, tenant, stream=True)
+            return Response(
+                stream_with_context(stream_events(events, sse)),
+                mimetype="text/event-stream" if sse else "application/x-ndjson",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
 
+        result = None
+        for event, data in analysis_events(pdf, include, tenant, stream=False):
+            result = data
+        return jsonify(result), 200
+
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except IngestError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"PDF exceeds the {MAX_PDF_BYTES} byte limit"}), 413
+    except StageError as e:
+        return jsonify({"error": str(e)}), 502
+    except BudgetExceeded as e:
+        return jsonify({"error": str(e)}), 429
+    except BufferFull:
+        logger.error("Result buffer full")
+        return jsonify({"error": "Service overloaded, retry later"}), 503
     except Exception:
         logger.exception("Analysis error")
         return jsonify({"error": "Internal server error"}), 500
@@ -167,31 +408,114 @@ def analyze():
 @app.route("/results/<sha256>", methods=["GET"])
 def get_result(sha256):
     try:
-        result = results_col.find_one({"sha256": sha256})
-        if not result:
-            return jsonify({"error": "Result not found"}), 404
-        result["analysis_id"] = str(result["_id"])
-        del result["_id"]
-        return jsonify(result), 200
+        projection = parse_fields(request.args.get("fields"), None)
+        include = parse_include(request.args.get("include"))
+        result = results_col.find_one({"sha256": sha256}, projection)
+        if result:
+            result = load_artifacts(artifacts_fs, result, include)
+        else:
+            pending = results_writer.find_pending({"sha256": sha256})
+            if not pending:
+                return jsonify({"error": "Result not found"}), 404
+            result = pending_view(pending, projection, include)
+        return jsonify(serialize(result)), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception:
         logger.exception("Get result error")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route("/results/similar/<sha256>", methods=["GET"])
+def similar_results(sha256):
+    """Analyses of files that share most of their PDF objects with this one."""
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        min_score = parse_score(request.args.get("min_score"), SIMILARITY_MIN_SCORE)
+        found, sketch = similar_index.sketch_of(sha256)
+        if not found:
+            pending = results_writer.find_pending({"sha256": sha256})
+            if not pending:
+                return jsonify({"error": "Result not found"}), 404
+            sketch = pending.get("similarity")
+        if not sketch:
+            return jsonify({"error": "No similarity sketch stored for this result"}), 404
+        with timed("similarity_search"):
+            matches = similar_index.search(sketch, exclude=sha256, limit=limit, min_score=min_score)
+        return jsonify({"sha256": sha256, "fingerprint": sketch["fingerprint"], "similar": matches}), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        logger.exception("Similar results error")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route("/results/<sha256>/pages/<int:page>/text", methods=["GET"])
+def page_text(sha256, page):
+    """Text of one page of a stored PDF, extracted on demand."""
+    try:
+        with timed("page_text"):
+            text, pages = page_renderer.text(sha256, page)
+        return jsonify({"sha256": sha256, "page": page, "pages": pages, "text": text}), 200
+    except PageNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception:
+        logger.exception("Page text error")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route("/results/<sha256>/pages/<int:page>/image", methods=["GET"])
+def page_image(sha256, page):
+    """PNG render of one page of a stored PDF at ?dpi= (default PAGE_DEFAULT_DPI)."""
+    try:
+        dpi = parse_dpi(request.args.get("dpi"))
+        with timed("page_render"):
+            png, pages = page_renderer.image(sha256, page, dpi)
+        return Response(png, mimetype="image/png", headers={"X-Page-Count": str(pages)}), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except PageNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception:
+        logger.exception("Page render error")
+        return jsonify({"error": "Internal server error"}), 500
+
+@app.route("/score/batch", methods=["POST"])
+def score_batch():
+    """Score the stored feature vectors of many analyses at once with the local model."""
+    try:
+        query, limit, store = score_query(request.get_json(silent=True) or {}, SCORE_BATCH_MAX)
+        with timed("score_batch"):
+            report = batch_scorer.score(query, limit, store)
+        logger.info("Batch scored", extra={"scored": report["scored"], "model": report["model"], "stored": store})
+        return jsonify(report), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        logger.exception("Batch scoring error")
+        return jsonify({"error": "Internal server error"}), 500
+
 @app.route("/results", methods=["GET"])
 def list_results():
     try:
-        limit = int(request.args.get("limit", 10))
-        offset = int(request.args.get("offset", 0))
-        cursor = results_col.find().skip(offset).limit(limit)
-        results = []
-        for doc in cursor:
-            doc["analysis_id"] = str(doc["_id"])
-            del doc["_id"]
-            results.append(doc)
-        return jsonify({"results": results}), 200
+        results, next_cursor = list_page(results_col, artifacts_fs, request.args)
+        return jsonify({"results": results, "next_cursor": next_cursor}), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
     except Exception:
         logger.exception("List results error")
         return jsonify({"error": "Internal server error"}), 500
 
+@app.route("/degradation", methods=["GET"])
+def degradation_status():
+    """Profile new analyses get right now, and the signals behind it."""
+    return jsonify(degrader.status()), 200
+
+@app.route("/usage", methods=["GET"])
+def usage_report():
+    """LLM tokens and estimated cost per tenant in the current budget window."""
+    try:
+        return jsonify(budgets.report(request.args.get("tenant"))), 200
+    except Exception:
+        logger.exception("Usage report error")
+        return jsonify({"error": "Internal server error"}), 500
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5001)
@@ -0,0 +1,570 @@
+"""
+ASGI variant of service-api: the same routes as app.py with async handlers.
+
+Downstream calls go through one shared httpx.AsyncClient and reads through
+motor, so a worker process keeps thousands of analyses waiting on I/O
+instead of one thread each. Results are still written by the batching
+WriteBehind thread. Run with:
+
+    uvicorn asgi:app --host 0.0.0.0 --port 5001 --workers 4
+"""
+import os
+import asyncio
+import logging
+import json
+import time
+import gridfs
+import httpx
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import DESCENDING, MongoClient
+from quart import Quart, Response, request, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from accounting import DEGRADED, BudgetExceeded, TenantBudgets, summarize_usage
+from analysis import (
+    CACHED_FIELDS,
+    StageError,
+    build_record,
+    format_event,
+    result_body,
+    stream_mode,
+    url_count,
+)
+from degrade import (
+    DEGRADE_ENABLED,
+    DEGRADE_STAGE_TIMEOUT,
+    FULL,
+    NO_VISUAL,
+    RULES_ONLY,
+    SKIPPED,
+    DegradationController,
+    fallback_verdict,
+    profile_for,
+    worst,
+)
+from fastpath import fast_verdict
+from ingest import MAX_PDF_BYTES, IngestError, from_stream, from_url_async
+from metrics import cache_result, instrument_quart, observe, timed, trace_headers, upstream_error
+from pages import PageNotFound, PageRenderer, store_pdf
+from storage import (
+    QueryError,
+    artifact_refs,
+    attach_artifacts,
+    discard_artifacts,
+    ensure_indexes,
+    next_cursor,
+    page_query,
+    parse_dpi,
+    parse_fields,
+    parse_include,
+    parse_limit,
+    parse_score,
+    pending_view,
+    score_query,
+    serialize,
+    store_artifacts,
+)
+from scoring import SCORE_BATCH_MAX, BatchScorer, ScoreModel
+from similarity import SIMILARITY_MIN_SCORE, SimilarityIndex, reusable, similar_verdict
+from writebehind import BufferFull, WriteBehind
+
+# Logging configuration
+log_level = os.getenv("LOG_LEVEL", "INFO")
+logging.basicConfig(level=log_level)
+logger = logging.getLogger("service-api")
+
+app = Quart(__name__)
+# Reject oversized uploads before the multipart body is parsed (1 MiB allowance for form overhead)
+app.config["MAX_CONTENT_LENGTH"] = MAX_PDF_BYTES + 1024 * 1024
+instrument_quart(app, "service-api")
+
+# MongoDB configuration: motor for reads, pymongo for the index manager and the write-behind thread
+mongo_uri = os.getenv("MONGO_URI", "mongodb://mongodb:27017/")
+sync_db = MongoClient(mongo_uri).pdf_analyzer
+try:
+    ensure_indexes(sync_db.results)
+except Exception:
+    logger.exception("Index creation failed; result queries will be unindexed")
+artifacts_fs = gridfs.GridFS(sync_db, collection="artifacts")
+results_writer = WriteBehind(
+    sync_db.results, "results",
+    prepare=lambda record: store_artifacts(artifacts_fs, record),
+    discard=lambda record: discard_artifacts(artifacts_fs, sync_db.results, record),
+    on_batch=lambda records, seconds: observe("mongo_insert", seconds),
+    # Insert time for the columnar export watermark (columnar.py)
+    stamp_field="stored_at",
+)
+# Budget lookups are single-document reads and upserts, run off the event loop
+budgets = TenantBudgets(sync_db.tenant_usage)
+# Campaign variants: MinHash/LSH search over similarity sketches, run off the event loop
+similar_index = SimilarityIndex(sync_db.results)
+# Vectorized re-scoring of stored feature vectors, run off the event loop
+batch_scorer = BatchScorer(sync_db.results, ScoreModel.load())
+# Page text and renders of stored PDFs, parsed on demand off the event loop and LRU-cached
+page_renderer = PageRenderer(artifacts_fs)
+# Degradation profile per analysis, from the queue depth and upstream health of this worker
+degrader = DegradationController()
+
+# Service URLs
+PDF_SERVICE_URL = os.getenv("PDF_SERVICE_URL", "http://service-pdf:5002")
+VISUAL_SERVICE_URL = os.getenv("VISUAL_SERVICE_URL", "http://service-visual:5003")
+REPUTATION_SERVICE_URL = os.getenv("REPUTATION_SERVICE_URL", "http://service-reputation:5005")
+LLM_SERVICE_URL = os.getenv("LLM_SERVICE_URL", "http://service-llm:5004")
+
+# Downstream HTTP: LLM stages can take minutes; the pool is sized for many concurrent analyses
+DOWNSTREAM_TIMEOUT = float(os.getenv("DOWNSTREAM_TIMEOUT", "300"))
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "1000"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "100"))
+# LLM and URL reputation stages give up sooner while degradation can take over
+STAGE_TIMEOUT = min(DEGRADE_STAGE_TIMEOUT, DOWNSTREAM_TIMEOUT) if DEGRADE_ENABLED else DOWNSTREAM_TIMEOUT
+
+# Event-loop bound clients, created per worker process at startup
+http = None
+results_col = None
+artifacts_bucket = None
+
+
+@app.before_serving
+async def startup():
+    global http, results_col, artifacts_bucket
+    http = httpx.AsyncClient(
+        timeout=DOWNSTREAM_TIMEOUT,
+        limits=httpx.Limits(max_connections=HTTP_MAX_CONNECTIONS, max_keepalive_connections=HTTP_MAX_KEEPALIVE),
+    )
+    db = AsyncIOMotorClient(mongo_uri).pdf_analyzer
+    results_col = db.results
+    artifacts_bucket = AsyncIOMotorGridFSBucket(db, bucket_name="artifacts")
+
+
+@app.after_serving
+async def shutdown():
+    await http.aclose()
+    await asyncio.to_thread(results_writer.close)
+
+
+async def load_artifacts(doc, include):
+    loaded = {}
+    for name, file_id in artifact_refs(doc, include).items():
+        stream = await artifacts_bucket.open_download_stream(file_id)
+        loaded[name] = await stream.read()
+    return attach_artifacts(doc, loaded)
+
+
+async def stage(key, name, method, url, **kwargs):
+    """Call a downstream stage and return its JSON body, raising StageError on failure.
+
+    key labels the stage in metrics and degradation samples; name is used in errors.
+    """
+    started = time.monotonic()
+    try:
+        with timed(key):
+            headers = dict(kwargs.pop("headers", None) or {}, **trace_headers())
+            resp = await http.request(method, url, headers=headers, **kwargs)
+    except httpx.HTTPError as e:
+        degrader.record(key, time.monotonic() - started, False)
+        upstream_error(key, type(e).__name__)
+        logger.error(f"{name} failed", extra={"error": str(e)})
+        raise StageError(f"{name} failed")
+    degrader.record(key, time.monotonic() - started, resp.status_code == 200)
+    if resp.status_code != 200:
+        upstream_error(key, resp.status_code)
+        logger.error(f"{name} failed", extra={"status_code": resp.status_code})
+        raise StageError(f"{name} failed")
+    return resp.json()
+
+
+async def synthesize(payload, stream):
+    """Yield ("synthesis_token", ...) events when streaming, then the synthesis result."""
+    if not stream:
+        yield "synthesis", await stage(
+            "synthesize", "Risk synthesis", "POST", f"{LLM_SERVICE_URL}/synthesize_risk", json=payload,
+            timeout=STAGE_TIMEOUT
+        )
+        return
+    started = time.monotonic()
+    try:
+        async with http.stream(
+            "POST", f"{LLM_SERVICE_URL}/synthesize_risk/stream", json=payload, headers=trace_headers(),
+            timeout=STAGE_TIMEOUT
+        ) as synth_resp:
+            if synth_resp.status_code != 200:
+                upstream_error("synthesize", synth_resp.status_code)
+                logger.error("Risk synthesis failed", extra={"status_code": synth_resp.status_code})
+                raise StageError("Risk synthesis failed")
+            async for line in synth_resp.aiter_lines():
+                if not line:
+                    continue
+                message = json.loads(line)
+                if message["event"] == "token":
+                    yield "synthesis_token", {"text": message["text"]}
+                elif message["event"] == "result":
+                    degrader.record("synthesize", time.monotonic() - started, True)
+                    yield "synthesis", message
+                    return
+                else:
+                    logger.error("Risk synthesis failed", extra={"error": message.get("error")})
+                    raise StageError("Risk synthesis failed")
+        raise StageError("Risk synthesis failed")
+    except httpx.HTTPError as e:
+        upstream_error("synthesize", type(e).__name__)
+        logger.error("Risk synthesis failed", extra={"error": str(e)})
+        degrader.record("synthesize", time.monotonic() - started, False)
+        raise StageError("Risk synthesis failed")
+    except StageError:
+        degrader.record("synthesize", time.monotonic() - started, False)
+        raise
+
+
+async def llm_stages(pdf, md5, sha256, structural_data, content_data, file_rep_data, stream, profile, usage,
+                     skipped):
+    """Visual analysis, priority URL selection, URL reputation and risk synthesis.
+
+    Yields stage events, then ("llm_result", (visual, priority_url, url_reputation, synthesis)).
+    Skips stages as app.llm_stages does, filling in usage and skipped.
+    """
+    skipped.extend(SKIPPED[profile])
+    if "visual" in skipped:
+        visual_data = {"analysis": "", "skipped": profile}
+    else:
+        upload = pdf.upload(sha256=sha256)
+        try:
+            visual_data = await stage(
+                "visual", "Visual analysis", "POST", f"{VISUAL_SERVICE_URL}/visual",
+                content=upload, headers=upload.headers, timeout=STAGE_TIMEOUT
+            )
+            usage["visual"] = visual_data.pop("usage", None)
+        except StageError:
+            if not DEGRADE_ENABLED:
+                raise
+            visual_data = {"analysis": "", "skipped": "failed"}
+            skipped.append("visual")
+    yield "visual", visual_data
+
+    url_select = await stage(
+        "select_url", "URL selection", "POST", f"{LLM_SERVICE_URL}/select_url",
+        json={
+            "structural_urls": structural_data.get("urls", []),
+            "content_urls": content_data.get("urls", []),
+            "visual_report": visual_data.get("analysis", "")
+        },
+        timeout=STAGE_TIMEOUT
+    )
+    usage["select_url"] = url_select.get("usage")
+    priority_url = url_select.get("priority_url")
+    yield "priority_url", {"priority_url": priority_url}
+
+    url_rep_data = None
+    if priority_url and "url_reputation" not in skipped:
+        try:
+            url_rep_data = await stage(
+                "url_reputation", "URL reputation check", "POST", f"{REPUTATION_SERVICE_URL}/url",
+                json={"url": priority_url}, timeout=STAGE_TIMEOUT
+            )
+            yield "url_reputation", url_rep_data
+        except StageError:
+            if not DEGRADE_ENABLED:
+                raise
+            skipped.append("url_reputation")
+
+    synth_payload = {
+        "sha256": sha256,
+        "md5": md5,
+        "structural": structural_data,
+        "content": content_data,
+        "visual": visual_data,
+        "file_reputation": file_rep_data,
+        "priority_url": priority_url,
+        "url_reputation": url_rep_data
+    }
+    async for event, data in synthesize(synth_payload, stream):
+        if event == "synthesis":
+            usage["synthesize"] = data.pop("usage", None)
+            yield "llm_result", (visual_data, priority_url, url_rep_data, data)
+        else:
+            yield event, data
+
+
+async def run_pipeline(pdf, md5, sha256, include, tenant, stream=False, sketch=None):
+    """Async counterpart of app.run_pipeline; the last event is "result"."""
+    structural_upload, content_upload = pdf.upload(), pdf.upload()
+    # Structural analysis, content extraction and file reputation are independent, and the PDF is
+    # kept for page drill-down meanwhile
+    structural_data, content_data, file_rep_data, pdf_file = await asyncio.gather(
+        stage("structural", "Structural analysis", "POST", f"{PDF_SERVICE_URL}/structural",
+              content=structural_upload, headers=structural_upload.headers),
+        stage("content", "Content extraction", "POST", f"{PDF_SERVICE_URL}/content",
+              content=content_upload, headers=content_upload.headers),
+        stage("file_reputation", "File reputation check", "POST", f"{REPUTATION_SERVICE_URL}/file",
+              json={"sha256": sha256}),
+        asyncio.to_thread(store_pdf, artifacts_fs, sha256, pdf.reader()),
+    )
+    # The feature vector is stored packed, not passed on to the LLM stages
+    vector = structural_data.pop("vector", None)
+    yield "structural", structural_data
+    yield "content", {"urls": content_data.get("urls", []), "text_chars": len(content_data.get("text", ""))}
+    yield "file_reputation", file_rep_data
+
+    # Fast path: clear-cut documents skip the LLM stages
+    urls = url_count(structural_data, content_data)
+    rule = fast_verdict(structural_data, file_rep_data, urls, vector)
+    # Variants of an analysed malicious document take over its verdict
+    if not rule and sketch:
+        with timed("similarity_search"):
+            match = reusable(await asyncio.to_thread(similar_index.search, sketch, exclude=sha256))
+        if match:
+            rule = similar_verdict(match)
+    if rule:
+        logger.info("Fast-path verdict", extra={"sha256": sha256, "rule": rule["rule"]})
+        record = build_record(md5, sha256, structural_data, content_data, file_rep_data, rule,
+                              tenant=tenant, profile=FULL, similarity=sketch, vector=vector)
+    else:
+        # Load-aware degradation, then the tenant's token budget
+        profile = degrader.admit()
+        if profile != RULES_ONLY and await asyncio.to_thread(budgets.admit, tenant) == DEGRADED:
+            profile = worst(profile, NO_VISUAL)
+        usage, skipped, llm_data = {}, [], None
+        if profile != RULES_ONLY:
+            try:
+                async for event, data in llm_stages(
+                    pdf, md5, sha256, structural_data, content_data, file_rep_data, stream, profile, usage,
+                    skipped
+                ):
+                    if event == "llm_result":
+                        llm_data = data
+                    else:
+                        yield event, data
+            except StageError:
+                if not DEGRADE_ENABLED:
+                    raise
+                logger.warning("LLM stages failed, falling back to rules", extra={"sha256": sha256})
+        if llm_data:
+            record = build_record(md5, sha256, structural_data, content_data, file_rep_data, None, *llm_data,
+                                  summarize_usage(usage), tenant=tenant, profile=profile_for(skipped),
+                                  degraded=skipped or None, similarity=sketch, vector=vector)
+        else:
+            record = build_record(md5, sha256, structural_data, content_data, file_rep_data,
+                                  fallback_verdict(structural_data, file_rep_data, urls, vector),
+                                  llm_usage=summarize_usage(usage), tenant=tenant, profile=RULES_ONLY,
+                                  degraded=list(SKIPPED[RULES_ONLY]), similarity=sketch, vector=vector)
+    record["pdf_file"] = pdf_file
+    await asyncio.to_thread(budgets.charge, tenant, record["llm_usage"])
+
+    # Store results; submit() only blocks when the write buffer is full
+    analysis_id = await asyncio.to_thread(results_writer.submit, record)
+    logger.info("Analysis queued for storage", extra={"sha256": sha256, "id": analysis_id})
+    yield "result", result_body(analysis_id, record, include)
+
+
+async def analysis_events(pdf, include, tenant, stream):
+    """Cached result or pipeline events for an ingested PDF; closes the spooled file when done."""
+    md5, sha256 = pdf.md5, pdf.sha256
+    try:
+        yield "hashes", {"md5": md5, "sha256": sha256}
+        with timed("mongo_find"):
+            existing = await results_col.find_one({"sha256": sha256}, CACHED_FIELDS) or \
+                results_writer.find_pending({"sha256": sha256})
+        cache_result("results", "hit" if existing else "miss")
+        if existing:
+            logger.info("Returning cached result", extra={"sha256": sha256})
+            existing = await load_artifacts(existing, include)
+            yield "result", result_body(str(existing["_id"]), existing, include)
+            return
+        with degrader.track():
+            async for event, data in run_pipeline(pdf, md5, sha256, include, tenant, stream, pdf.similarity):
+                yield event, data
+    finally:
+        pdf.close()
+
+
+async def stream_events(events, sse):
+    try:
+        async for event, data in events:
+            yield format_event(event, data, sse)
+    except StageError as e:
+        yield format_event("error", {"error": str(e)}, sse)
+    except BudgetExceeded as e:
+        yield format_event("error", {"error": str(e)}, sse)
+    except BufferFull:
+        logger.error("Result buffer full")
+        yield format_event("error", {"error": "Service overloaded, retry later"}, sse)
+    except Exception:
+        logger.exception("Analysis error")
+        yield format_event("error", {"error": "Internal server error"}, sse)
+
+
+@app.route("/analyze", methods=["POST"])
+async def analyze():
+    try:
+        # The page image is returned unless the caller opts out with include=none
+        include = parse_include(request.args.get("include", "image"))
+        tenant = budgets.tenant_of(request.headers)
+
+        # Accept input: streamed into a spooled file, hashed and checked for %PDF on the way
+        files = await request.files
+        if files.get("file"):
+            pdf = from_stream(files["file"].stream)
+        else:
+            data = await request.get_json(silent=True) or {}
+            pdf_url = data.get("url")
+            if not pdf_url:
+                return jsonify({"error": "No file or URL provided"}), 400
+            with timed("download"):
+                pdf = await from_url_async(http, pdf_url)
+        logger.info("PDF received", extra={"md5": pdf.md5, "sha256": pdf.sha256, "size": pdf.size})
+
+        # Progressive delivery: emit each stage result as soon as it is available
+        stream, sse = stream_mode(request.args, request.headers)
+        if stream:
+            events = analysis_events(pdf, include, tenant, stream=True)
+            return Response(
+                stream_events(events, sse),
+                mimetype="text/event-stream" if sse else "application/x-ndjson",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        result = None
+        async for event, data in analysis_events(pdf, include, tenant, stream=False):
+            result = data
+        return jsonify(result), 200
+
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except IngestError as e:
+        return jsonify({"error": str(e)}), e.status_code
+    except RequestEntityTooLarge:
+        return jsonify({"error": f"PDF exceeds the {MAX_PDF_BYTES} byte limit"}), 413
+    except StageError as e:
+        return jsonify({"error": str(e)}), 502
+    except BudgetExceeded as e:
+        return jsonify({"error": str(e)}), 429
+    except BufferFull:
+        logger.error("Result buffer full")
+        return jsonify({"error": "Service overloaded, retry later"}), 503
+    except Exception:
+        logger.exception("Analysis error")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/results/<sha256>", methods=["GET"])
+async def get_result(sha256):
+    try:
+        projection = parse_fields(request.args.get("fields"), None)
+        include = parse_include(request.args.get("include"))
+        result = await results_col.find_one({"sha256": sha256}, projection)
+        if result:
+            result = await load_artifacts(result, include)
+        else:
+            pending = results_writer.find_pending({"sha256": sha256})
+            if not pending:
+                return jsonify({"error": "Result not found"}), 404
+            result = pending_view(pending, projection, include)
+        return jsonify(serialize(result)), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        logger.exception("Get result error")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/results/similar/<sha256>", methods=["GET"])
+async def similar_results(sha256):
+    """Analyses of files that share most of their PDF objects with this one."""
+    try:
+        limit = parse_limit(request.args.get("limit"))
+        min_score = parse_score(request.args.get("min_score"), SIMILARITY_MIN_SCORE)
+        found, sketch = await asyncio.to_thread(similar_index.sketch_of, sha256)
+        if not found:
+            pending = results_writer.find_pending({"sha256": sha256})
+            if not pending:
+                return jsonify({"error": "Result not found"}), 404
+            sketch = pending.get("similarity")
+        if not sketch:
+            return jsonify({"error": "No similarity sketch stored for this result"}), 404
+        with timed("similarity_search"):
+            matches = await asyncio.to_thread(similar_index.search, sketch, exclude=sha256, limit=limit,
+                                              min_score=min_score)
+        return jsonify({"sha256": sha256, "fingerprint": sketch["fingerprint"], "similar": matches}), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        logger.exception("Similar results error")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/results/<sha256>/pages/<int:page>/text", methods=["GET"])
+async def page_text(sha256, page):
+    """Text of one page of a stored PDF, extracted on demand."""
+    try:
+        with timed("page_text"):
+            text, pages = await asyncio.to_thread(page_renderer.text, sha256, page)
+        return jsonify({"sha256": sha256, "page": page, "pages": pages, "text": text}), 200
+    except PageNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception:
+        logger.exception("Page text error")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/results/<sha256>/pages/<int:page>/image", methods=["GET"])
+async def page_image(sha256, page):
+    """PNG render of one page of a stored PDF at ?dpi= (default PAGE_DEFAULT_DPI)."""
+    try:
+        dpi = parse_dpi(request.args.get("dpi"))
+        with timed("page_render"):
+            png, pages = await asyncio.to_thread(page_renderer.image, sha256, page, dpi)
+        return Response(png, mimetype="image/png", headers={"X-Page-Count": str(pages)}), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except PageNotFound as e:
+        return jsonify({"error": str(e)}), 404
+    except Exception:
+        logger.exception("Page render error")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/score/batch", methods=["POST"])
+async def score_batch():
+    """Score the stored feature vectors of many analyses at once with the local model."""
+    try:
+        query, limit, store = score_query(await request.get_json(silent=True) or {}, SCORE_BATCH_MAX)
+        with timed("score_batch"):
+            report = await asyncio.to_thread(batch_scorer.score, query, limit, store)
+        logger.info("Batch scored", extra={"scored": report["scored"], "model": report["model"], "stored": store})
+        return jsonify(report), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        logger.exception("Batch scoring error")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/results", methods=["GET"])
+async def list_results():
+    try:
+        query, projection, include, limit = page_query(request.args)
+        cursor = results_col.find(query, projection).sort("_id", DESCENDING).limit(limit + 1)
+        docs = await cursor.to_list(length=limit + 1)
+        cursor = next_cursor(docs, limit)
+        results = [serialize(await load_artifacts(doc, include)) for doc in docs[:limit]]
+        return jsonify({"results": results, "next_cursor": cursor}), 200
+    except QueryError as e:
+        return jsonify({"error": str(e)}), 400
+    except Exception:
+        logger.exception("List results error")
+        return jsonify({"error": "Internal server error"}), 500
+
+
+@app.route("/degradation", methods=["GET"])
+async def degradation_status():
+    """Profile new analyses get right now, and the signals behind it."""
+    return jsonify(degrader.status()), 200
+
+
+@app.route("/usage", methods=["GET"])
+async def usage_report():
+    """LLM tokens and estimated cost per tenant in the current budget window."""
+    try:
+        return jsonify(await asyncio.to_thread(budgets.report, request.args.get("tenant"))), 200
+    except Exception:
+        logger.exception("Usage report error")
+        return jsonify({"error": "Internal server error"}), 500
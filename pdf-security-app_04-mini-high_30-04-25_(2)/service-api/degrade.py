@@ -0,0 +1,209 @@
+"""
+Load-aware degradation profiles for /analyze.
+
+Profiles are ordered, each skipping more of the slow upstream stages:
+
+- full        every stage
+- no_visual   no visual analysis
+- no_urlscan  no visual analysis and no URL reputation (urlscan.io)
+- rules_only  no LLM or urlscan stage at all; the verdict comes from the feature
+              vector counts and VirusTotal (fallback_verdict)
+
+DegradationController picks the profile for each new analysis from the
+analyses in flight in this worker and, per upstream stage, the p95 latency and
+error rate of the calls that finished in the last DEGRADE_WINDOW seconds. A
+stage that fails or times out during an analysis degrades that analysis
+instead of failing it. Skipped stages stop producing samples, so once the
+window has aged out the next analyses probe the upstream again.
+
+Results record the profile and the skipped stages (`profile`, `degraded`) so
+they can be re-enriched later.
+"""
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from prometheus_client import Counter, Gauge
+
+from pdffeatures import feature_counts
+
+logger = logging.getLogger("degrade")
+
+DEGRADE_ENABLED = os.getenv("DEGRADE_ENABLED", "true").lower() in ("1", "true", "yes")
+# Operator override, e.g. rules_only during a known OpenAI incident
+DEGRADE_FORCE_PROFILE = os.getenv("DEGRADE_FORCE_PROFILE", "").strip().lower()
+DEGRADE_WINDOW = float(os.getenv("DEGRADE_WINDOW", "60"))
+DEGRADE_MIN_SAMPLES = int(os.getenv("DEGRADE_MIN_SAMPLES", "10"))
+DEGRADE_ERROR_RATE = float(os.getenv("DEGRADE_ERROR_RATE", "0.25"))
+DEGRADE_VISUAL_P95 = float(os.getenv("DEGRADE_VISUAL_P95", "20"))
+DEGRADE_URLSCAN_P95 = float(os.getenv("DEGRADE_URLSCAN_P95", "30"))
+DEGRADE_LLM_P95 = float(os.getenv("DEGRADE_LLM_P95", "30"))
+# Analyses in flight in one worker
+DEGRADE_QUEUE_NO_VISUAL = int(os.getenv("DEGRADE_QUEUE_NO_VISUAL", "64"))
+DEGRADE_QUEUE_RULES_ONLY = int(os.getenv("DEGRADE_QUEUE_RULES_ONLY", "256"))
+# Per-call timeout of the LLM and URL reputation stages; a timeout degrades the analysis
+DEGRADE_STAGE_TIMEOUT = float(os.getenv("DEGRADE_STAGE_TIMEOUT", "60"))
+
+FULL = "full"
+NO_VISUAL = "no_visual"
+NO_URLSCAN = "no_urlscan"
+RULES_ONLY = "rules_only"
+PROFILES = (FULL, NO_VISUAL, NO_URLSCAN, RULES_ONLY)
+SKIPPED = {
+    FULL: (),
+    NO_VISUAL: ("visual",),
+    NO_URLSCAN: ("visual", "url_reputation"),
+    RULES_ONLY: ("visual", "select_url", "url_reputation", "synthesize"),
+}
+# Stage whose health decides each profile, with its p95 threshold
+WATCHED = {
+    "visual": (NO_VISUAL, DEGRADE_VISUAL_P95),
+    "url_reputation": (NO_URLSCAN, DEGRADE_URLSCAN_P95),
+    "select_url": (RULES_ONLY, DEGRADE_LLM_P95),
+    "synthesize": (RULES_ONLY, DEGRADE_LLM_P95),
+}
+# Feature vector counts of active content, and the structural flag standing in for a count
+# when an analysis has no vector
+RISKY_COUNTS = ("javascript", "launch", "open_action", "additional_actions", "embedded_files")
+RISKY_FLAGS = {"javascript": "JavaScript", "open_action": "OpenAction", "embedded_files": "EmbeddedFiles"}
+
+if DEGRADE_FORCE_PROFILE and DEGRADE_FORCE_PROFILE not in PROFILES:
+    raise ValueError(f"DEGRADE_FORCE_PROFILE must be one of {', '.join(PROFILES)}")
+
+PROFILE_CHOICES = Counter("analysis_profile_total", "Analyses started per degradation profile", ["profile"])
+DEGRADATION_LEVEL = Gauge("degradation_level", "Current degradation profile (0 full .. 3 rules_only)",
+                          multiprocess_mode="max")
+
+
+def worst(*profiles):
+    return max(profiles, key=PROFILES.index)
+
+
+def profile_for(skipped):
+    """The mildest profile that skips at least the given stages."""
+    for profile in PROFILES:
+        if set(skipped) <= set(SKIPPED[profile]):
+            return profile
+    return RULES_ONLY
+
+
+def fallback_verdict(structural, file_reputation, url_count, vector=None):
+    """Rule-based verdict for analyses that cannot reach the LLM stages; always returns a verdict.
+
+    Deliberately cautious: any VirusTotal detection or active content raises the verdict. Active
+    content is read from the feature vector (of /structural, or the stored features), whose
+    counts include page and annotation actions that the catalog-level flags miss.
+    """
+    file_reputation = file_reputation or {}
+    stats = file_reputation.get("stats") or file_reputation.get("last_analysis_stats") or {}
+    malicious, suspicious = stats.get("malicious") or 0, stats.get("suspicious") or 0
+    counts = feature_counts(vector or (structural or {}).get("vector")) or {}
+    features = (structural or {}).get("features") or {}
+    risky = [name.replace("_", " ") for name in RISKY_COUNTS
+             if counts.get(name) or features.get(RISKY_FLAGS.get(name)) is True]
+    if malicious:
+        verdict = "High"
+    elif suspicious or risky:
+        verdict = "Medium"
+    else:
+        verdict = "Low"
+    signals = [f"{malicious} malicious / {suspicious} suspicious VirusTotal detections", f"{url_count} URL(s)"]
+    if risky:
+        signals.append("active content: " + ", ".join(risky))
+    return {
+        "verdict": verdict,
+        "reasoning": "Degraded analysis without LLM review, based on " + "; ".join(signals) + ".",
+        "rule": "degraded_rules_only",
+    }
+
+
+class DegradationController:
+    def __init__(self, window=DEGRADE_WINDOW, max_samples=1000):
+        self.window = window
+        self._samples = {stage: deque(maxlen=max_samples) for stage in WATCHED}
+        self._in_flight = 0
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds, ok):
+        """One finished call to an upstream stage; unwatched stages are ignored."""
+        if stage in self._samples:
+            with self._lock:
+                self._samples[stage].append((time.monotonic(), seconds, ok))
+
+    @contextmanager
+    def track(self):
+        """Count an analysis as in flight for the queue depth signal."""
+        with self._lock:
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+
+    def stage_health(self):
+        """{stage: {"samples", "p95", "error_rate"}} over the current window."""
+        cutoff = time.monotonic() - self.window
+        health = {}
+        with self._lock:
+            for stage, samples in self._samples.items():
+                while samples and samples[0][0] < cutoff:
+                    samples.popleft()
+                durations = sorted(seconds for _, seconds, _ in samples)
+                failures = sum(1 for _, _, ok in samples if not ok)
+                health[stage] = {
+                    "samples": len(durations),
+                    "p95": durations[min(len(durations) - 1, int(len(durations) * 0.95))] if durations else None,
+                    "error_rate": failures / len(durations) if durations else None,
+                }
+        return health
+
+    def choose(self):
+        """(profile, reason) for a new analysis."""
+        if not DEGRADE_ENABLED:
+            return FULL, None
+        if DEGRADE_FORCE_PROFILE:
+            return DEGRADE_FORCE_PROFILE, "forced by DEGRADE_FORCE_PROFILE"
+        profile, reasons = FULL, []
+        depth = self._in_flight
+        if depth >= DEGRADE_QUEUE_RULES_ONLY:
+            profile = RULES_ONLY
+            reasons.append(f"{depth} analyses in flight")
+        elif depth >= DEGRADE_QUEUE_NO_VISUAL:
+            profile = NO_VISUAL
+            reasons.append(f"{depth} analyses in flight")
+        for stage, health in self.stage_health().items():
+            if health["samples"] < DEGRADE_MIN_SAMPLES:
+                continue
+            target, p95_limit = WATCHED[stage]
+            if health["error_rate"] >= DEGRADE_ERROR_RATE:
+                reasons.append(f"{stage} error rate {health['error_rate']:.0%}")
+            elif health["p95"] >= p95_limit:
+                reasons.append(f"{stage} p95 {health['p95']:.1f}s")
+            else:
+                continue
+            profile = worst(profile, target)
+        return profile, "; ".join(reasons) or None
+
+    def admit(self):
+        """Choose the profile of a new analysis and export it."""
+        profile, reason = self.choose()
+        PROFILE_CHOICES.labels(profile).inc()
+        DEGRADATION_LEVEL.set(PROFILES.index(profile))
+        if profile != FULL:
+            logger.info("Degraded analysis", extra={"profile": profile, "reason": reason})
+        return profile
+
+    def status(self):
+        profile, reason = self.choose()
+        return {
+            "enabled": DEGRADE_ENABLED,
+            "profile": profile,
+            "reason": reason,
+            "in_flight": self._in_flight,
+            "window_seconds": self.window,
+            "stages": self.stage_health(),
+        }
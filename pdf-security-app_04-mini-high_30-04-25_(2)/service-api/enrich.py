@@ -0,0 +1,329 @@
+"""
+Background re-enrichment of partial or stale stored analyses.
+
+Results are written once by /analyze, some of them incomplete: VirusTotal did
+not know the file yet, urlscan.io timed out, or a degradation profile skipped
+URL selection, URL reputation or synthesis. This worker revisits them:
+
+- enrich_after(): once visited, a record carries `enrich_after`, the time it
+  is next due (new records are first due ENRICH_RETRY_AFTER after creation).
+  Partial records come back after ENRICH_RETRY_AFTER, doubling per attempt
+  that leaves stages missing, up to ENRICH_MAX_ATTEMPTS; complete ones after
+  ENRICH_MAX_AGE, when their VirusTotal and urlscan.io data are refreshed.
+- Enricher: claims due records in batches (a lease in `enrich_after`, so
+  several workers can run), recomputes only the missing, failed or expired
+  stages and updates the document in place. Synthesis runs again only when
+  its inputs changed or it never ran; fast-path verdicts are re-checked
+  against fresh VirusTotal data and go through the LLM stages once the rule
+  no longer applies.
+
+Visual analysis is not redone (only newer results keep the PDF, see pages.py),
+so it stays in `degraded`. Work only runs inside ENRICH_WINDOWS (off-peak hours,
+UTC) at up to ENRICH_RATE records per minute. Enrichment tokens are added to
+the record's `llm_usage` but not charged to tenant budgets.
+
+Run as its own process (the service-enricher compose service):
+
+    python enrich.py
+"""
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import gridfs
+import requests
+from prometheus_client import Counter
+from pymongo import ASCENDING, MongoClient, ReturnDocument
+
+import metrics
+from accounting import summarize_usage
+from analysis import url_count
+from degrade import profile_for
+from fastpath import VERDICT_SOURCE_LLM, VERDICT_SOURCE_RULES, fast_verdict
+from metrics import http_call, metrics_body
+from storage import ensure_indexes, load_artifacts
+
+logger = logging.getLogger("service-enricher")
+
+ENRICH_ENABLED = os.getenv("ENRICH_ENABLED", "true").lower() in ("1", "true", "yes")
+ENRICH_RETRY_AFTER = float(os.getenv("ENRICH_RETRY_AFTER", "3600"))
+ENRICH_MAX_ATTEMPTS = int(os.getenv("ENRICH_MAX_ATTEMPTS", "5"))
+# Refresh VirusTotal and urlscan.io data older than this (0 never refreshes complete records)
+ENRICH_MAX_AGE = float(os.getenv("ENRICH_MAX_AGE", str(7 * 86400)))
+ENRICH_BATCH_SIZE = int(os.getenv("ENRICH_BATCH_SIZE", "20"))
+ENRICH_RATE = float(os.getenv("ENRICH_RATE", "30"))
+# Comma-separated UTC HH:MM-HH:MM ranges, e.g. 22:00-06:00; empty means always
+ENRICH_WINDOWS = os.getenv("ENRICH_WINDOWS", "")
+ENRICH_IDLE_SLEEP = float(os.getenv("ENRICH_IDLE_SLEEP", "60"))
+ENRICH_LEASE = float(os.getenv("ENRICH_LEASE", "600"))
+ENRICH_METRICS_PORT = int(os.getenv("ENRICH_METRICS_PORT", "5006"))
+ENRICH_TIMEOUT = float(os.getenv("ENRICH_TIMEOUT", "300"))
+
+REPUTATION_SERVICE_URL = os.getenv("REPUTATION_SERVICE_URL", "http://service-reputation:5005")
+LLM_SERVICE_URL = os.getenv("LLM_SERVICE_URL", "http://service-llm:5004")
+
+# Rule verdicts that only stand in for the LLM stages and are replaced once they can run
+FALLBACK_RULE = "degraded_rules_only"
+SYNTHESIS_INPUTS = ("file_reputation", "priority_url", "url_reputation")
+VERDICT_FIELDS = ("risk_score", "reasoning", "verdict_source", "rule")
+
+RECORDS = Counter("enrichment_records_total", "Records processed by the enricher", ["outcome"])
+STAGE_RUNS = Counter("enrichment_stage_runs_total", "Stages recomputed by the enricher", ["stage", "result"])
+
+
+class StageFailed(Exception):
+    """A stage could not be recomputed this time; the record is retried later."""
+
+
+def missing_stages(record):
+    """Stages of a record that are missing or failed and can be recomputed."""
+    stages = []
+    if not (record.get("file_reputation") or {}).get("stats"):
+        stages.append("file_reputation")
+    degraded = record.get("degraded") or []
+    if "select_url" in degraded:
+        stages.append("select_url")
+    url_rep = record.get("url_reputation") or {}
+    if "url_reputation" in degraded or (record.get("priority_url") and not url_rep.get("verdicts")):
+        stages.append("url_reputation")
+    if "synthesize" in degraded:
+        stages.append("synthesize")
+    # Stages whose last recomputation failed, e.g. a synthesis over refreshed inputs
+    stages += [name for name in (record.get("enrichment") or {}).get("failed", []) if name not in stages]
+    return stages
+
+
+def enrich_after(record, now, attempts=0):
+    """When record is next due for enrichment, or None."""
+    if missing_stages(record) and attempts < ENRICH_MAX_ATTEMPTS:
+        return now + timedelta(seconds=ENRICH_RETRY_AFTER * 2 ** attempts)
+    if ENRICH_MAX_AGE:
+        return now + timedelta(seconds=ENRICH_MAX_AGE)
+    return None
+
+
+def parse_windows(raw):
+    windows = []
+    for item in raw.split(","):
+        if item.strip():
+            start, end = (datetime.strptime(t.strip(), "%H:%M").time() for t in item.split("-"))
+            windows.append((start, end))
+    return windows
+
+
+def in_window(windows, now):
+    if not windows:
+        return True
+    t = now.time()
+    # A range may wrap past midnight
+    return any(start <= t < end if start <= end else t >= start or t < end for start, end in windows)
+
+
+def start_metrics_server(port):
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path != "/metrics":
+                self.send_error(404)
+                return
+            body, content_type = metrics_body()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("0.0.0.0", port), Handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    return server
+
+
+class Enricher:
+    def __init__(self, collection, artifacts_fs):
+        self.collection = collection
+        self.artifacts_fs = artifacts_fs
+        self.windows = parse_windows(ENRICH_WINDOWS)
+
+    def call(self, stage, url, payload):
+        try:
+            resp = http_call(stage, "POST", url, json=payload, timeout=ENRICH_TIMEOUT)
+        except requests.RequestException as e:
+            STAGE_RUNS.labels(stage, "failed").inc()
+            raise StageFailed(f"{stage}: {type(e).__name__}")
+        if resp.status_code != 200:
+            STAGE_RUNS.labels(stage, "failed").inc()
+            raise StageFailed(f"{stage}: status {resp.status_code}")
+        STAGE_RUNS.labels(stage, "ok").inc()
+        return resp.json()
+
+    def claim(self, now):
+        """Take the next due record, leasing it to this worker.
+
+        Records never enriched have no `enrich_after` yet and are first due ENRICH_RETRY_AFTER after creation.
+        """
+        first_due = now - timedelta(seconds=ENRICH_RETRY_AFTER)
+        return self.collection.find_one_and_update(
+            {"$or": [{"enrich_after": {"$lte": now}},
+                     {"enrich_after": {"$exists": False}, "created_at": {"$lte": first_due}}]},
+            {"$set": {"enrich_after": now + timedelta(seconds=ENRICH_LEASE)}},
+            sort=[("enrich_after", ASCENDING)],
+            return_document=ReturnDocument.BEFORE,
+        )
+
+    def enrich(self, record, now):
+        """Recompute the stages record lacks or has outdated; return its $set update."""
+        previous = record.get("enrichment") or {}
+        refreshed = previous.get("at") or record.get("created_at")
+        stale = bool(ENRICH_MAX_AGE) and refreshed is not None and \
+            (now - refreshed).total_seconds() >= ENRICH_MAX_AGE
+        stages = set(missing_stages(record))
+        if stale:
+            stages.add("file_reputation")
+            if record.get("priority_url"):
+                stages.add("url_reputation")
+        current = dict(record)
+        degraded = set(record.get("degraded") or [])
+        usage, ran, failed, errors = {}, [], [], []
+
+        def run(name, fn):
+            try:
+                fn()
+            except StageFailed as e:
+                failed.append(name)
+                errors.append(str(e))
+                return False
+            ran.append(name)
+            degraded.discard(name)
+            return True
+
+        def file_reputation():
+            current["file_reputation"] = self.call(
+                "file_reputation", f"{REPUTATION_SERVICE_URL}/file", {"sha256": record["sha256"]})
+
+        def select_url():
+            selected = self.call("select_url", f"{LLM_SERVICE_URL}/select_url", {
+                "structural_urls": (current.get("structural") or {}).get("urls", []),
+                "content_urls": (current.get("content") or {}).get("urls", []),
+                "visual_report": (current.get("visual") or {}).get("analysis", ""),
+            })
+            usage["enrich:select_url"] = selected.get("usage")
+            current["priority_url"] = selected.get("priority_url")
+            current["url_reputation"] = None
+            stages.add("url_reputation")
+
+        def url_reputation():
+            current["url_reputation"] = self.call(
+                "url_reputation", f"{REPUTATION_SERVICE_URL}/url", {"url": current["priority_url"]})
+
+        def synthesize():
+            synth = self.call("synthesize", f"{LLM_SERVICE_URL}/synthesize_risk", self.synthesis_payload(current))
+            usage["enrich:synthesize"] = synth.pop("usage", None)
+            current.update(risk_score=synth.get("risk_score"), reasoning=synth.get("reasoning"),
+                           verdict_source=VERDICT_SOURCE_LLM, rule=None)
+
+        if "file_reputation" in stages:
+            run("file_reputation", file_reputation)
+
+        # Fast-path verdicts stand while their rule still holds; the degraded fallback always goes
+        rule = None
+        if record.get("verdict_source") == VERDICT_SOURCE_RULES and record.get("rule") != FALLBACK_RULE:
+            rule = fast_verdict(current.get("structural"), current.get("file_reputation"),
+                                url_count(current.get("structural") or {}, current.get("content") or {}),
+                                current.get("features"))
+        needs_llm = record.get("verdict_source") == VERDICT_SOURCE_RULES and rule is None
+
+        selected = True
+        if needs_llm or "select_url" in stages:
+            selected = run("select_url", select_url)
+        if "url_reputation" in stages:
+            if current.get("priority_url"):
+                run("url_reputation", url_reputation)
+            elif "select_url" not in degraded:
+                degraded.discard("url_reputation")
+
+        # Synthesis only reruns when its inputs changed, never ran, or replaces a rule verdict
+        changed = [name for name in SYNTHESIS_INPUTS if current.get(name) != record.get(name)]
+        if rule:
+            current.update(risk_score=rule["verdict"], reasoning=rule["reasoning"], rule=rule["rule"])
+        elif selected and (needs_llm or "synthesize" in stages or changed):
+            run("synthesize", synthesize)
+
+        update = {name: current.get(name) for name in SYNTHESIS_INPUTS + VERDICT_FIELDS
+                  if current.get(name) != record.get(name)}
+        if any(usage.values()):
+            update["llm_usage"] = summarize_usage(dict(((record.get("llm_usage") or {}).get("stages") or {}), **usage))
+        if degraded != set(record.get("degraded") or []):
+            update["degraded"] = sorted(degraded) or None
+            update["profile"] = profile_for(degraded)
+        update["enrichment"] = {"at": now, "stages": ran, "changed": sorted(update), "failed": failed,
+                                "errors": errors}
+        if update["enrichment"]["changed"]:
+            # Picked up by the columnar export (see columnar.py)
+            update["updated_at"] = now
+        merged = dict(record, **update)
+        attempts = previous.get("attempts", 0) + 1 if missing_stages(merged) else 0
+        update["enrichment"]["attempts"] = attempts
+        update["enrich_after"] = enrich_after(merged, now, attempts)
+        return update
+
+    def synthesis_payload(self, record):
+        """The /synthesize_risk request for record, with the full text read back from GridFS."""
+        doc = load_artifacts(self.artifacts_fs, dict(record, content=dict(record.get("content") or {})), {"text"})
+        payload = {name: doc.get(name) for name in ("md5", "structural", "content", "visual") + SYNTHESIS_INPUTS}
+        return dict(payload, sha256=record["sha256"])
+
+    def run_batch(self):
+        """Enrich up to ENRICH_BATCH_SIZE due records; return how many were processed."""
+        processed = 0
+        while processed < ENRICH_BATCH_SIZE:
+            now = datetime.utcnow()
+            record = self.claim(now)
+            if record is None:
+                break
+            try:
+                update = self.enrich(record, now)
+            except Exception:
+                logger.exception("Enrichment failed", extra={"sha256": record.get("sha256")})
+                RECORDS.labels("error").inc()
+                update = {"enrich_after": now + timedelta(seconds=ENRICH_RETRY_AFTER)}
+            else:
+                if update["enrichment"]["errors"]:
+                    outcome = "failed"
+                elif update["enrichment"]["changed"]:
+                    outcome = "updated"
+                else:
+                    outcome = "unchanged"
+                RECORDS.labels(outcome).inc()
+                logger.info("Record enriched", extra={"sha256": record["sha256"], "outcome": outcome,
+                                                      "stages": update["enrichment"]["stages"]})
+            self.collection.update_one({"_id": record["_id"]}, {"$set": update})
+            processed += 1
+            if ENRICH_RATE > 0:
+                time.sleep(60 / ENRICH_RATE)
+        return processed
+
+    def run_forever(self):
+        while True:
+            if in_window(self.windows, datetime.utcnow()):
+                try:
+                    if self.run_batch():
+                        continue
+                except Exception:
+                    logger.exception("Enrichment batch failed")
+            time.sleep(ENRICH_IDLE_SLEEP)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"))
+    if not ENRICH_ENABLED:
+        logger.info("Enrichment disabled")
+    else:
+        metrics.SERVICE = "service-enricher"
+        start_metrics_server(ENRICH_METRICS_PORT)
+        db = MongoClient(os.getenv("MONGO_URI", "mongodb://mongodb:27017/")).pdf_analyzer
+        ensure_indexes(db.results)
+        Enricher(db.results, gridfs.GridFS(db, collection="artifacts")).run_forever()
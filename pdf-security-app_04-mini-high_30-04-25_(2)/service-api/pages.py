@@ -0,0 +1,159 @@
+"""
+On-demand page text and renders of stored PDFs, for analyst drill-down.
+
+Results keep only the first-page render and the full text (see storage.py).
+With PAGE_STORE_PDF the analysed PDF itself is kept in the artifacts GridFS
+bucket under a content-addressed id (pdf-<sha256>), written once per file, so
+any page can be looked at later without re-running the analysis:
+
+- PageRenderer.text() / image() read the PDF back and open it with PDFium,
+  which loads the cross-reference table and parses only the requested page;
+- outputs, and the PDF bytes of recently viewed files, are kept in an LRU
+  cache of PAGE_CACHE_BYTES, so paging through one document reads it from
+  GridFS once and a page viewed again costs a dictionary lookup.
+
+PDFium is not thread-safe, so parsing is serialized per process; cached pages
+are served without waiting for it.
+"""
+import io
+import os
+import threading
+from collections import OrderedDict
+
+import pypdfium2
+from gridfs.errors import FileExists, NoFile
+
+from metrics import cache_result
+
+PAGE_STORE_PDF = os.getenv("PAGE_STORE_PDF", "true").lower() in ("1", "true", "yes")
+PAGE_CACHE_BYTES = int(os.getenv("PAGE_CACHE_BYTES", str(256 * 1024 * 1024)))
+PAGE_DEFAULT_DPI = int(os.getenv("PAGE_DEFAULT_DPI", "100"))
+PAGE_MAX_DPI = int(os.getenv("PAGE_MAX_DPI", "300"))
+# Renders are scaled down to at most this many pixels, whatever the page size
+PAGE_MAX_PIXELS = int(os.getenv("PAGE_MAX_PIXELS", str(40 * 1000 * 1000)))
+
+PDFIUM_LOCK = threading.Lock()
+
+
+class PageNotFound(LookupError):
+    """No stored PDF for the hash, or no such page; the message is returned to the client."""
+
+
+def pdf_file_id(sha256):
+    return f"pdf-{sha256}"
+
+
+def store_pdf(fs, sha256, data):
+    """Keep the PDF (bytes or a file-like reader) for page drill-down; returns its artifact id, or
+    None when disabled."""
+    if not PAGE_STORE_PDF:
+        return None
+    file_id = pdf_file_id(sha256)
+    try:
+        fs.put(data, _id=file_id, filename=f"{sha256}.pdf", content_type="application/pdf", sha256=sha256)
+    except FileExists:
+        # Stored by an earlier, failed or concurrent analysis of the same file
+        pass
+    return file_id
+
+
+class LRUCache:
+    """Thread-safe LRU mapping bounded by the total size of its values."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            self._items.move_to_end(key)
+            return entry[0]
+
+    def put(self, key, value, size):
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(key, None)
+            if old:
+                self.size -= old[1]
+            self._items[key] = (value, size)
+            self.size += size
+            while self.size > self.max_bytes:
+                _, (_, evicted) = self._items.popitem(last=False)
+                self.size -= evicted
+
+
+class PageRenderer:
+    def __init__(self, fs, cache_bytes=PAGE_CACHE_BYTES):
+        self.fs = fs
+        self.cache = LRUCache(cache_bytes)
+
+    def _pdf(self, sha256):
+        data = self.cache.get(("pdf", sha256))
+        if data is None:
+            try:
+                data = self.fs.get(pdf_file_id(sha256)).read()
+            except NoFile:
+                raise PageNotFound(f"No stored PDF for {sha256}")
+            self.cache.put(("pdf", sha256), data, len(data))
+        return data
+
+    def _page(self, sha256, number, fn):
+        """fn(page) on page number (1-based) of the stored PDF; returns (result, page count)."""
+        data = self._pdf(sha256)
+        with PDFIUM_LOCK:
+            pdf = pypdfium2.PdfDocument(data)
+            try:
+                count = len(pdf)
+                if not 1 <= number <= count:
+                    raise PageNotFound(f"Page {number} out of range, the PDF has {count} pages")
+                page = pdf[number - 1]
+                try:
+                    return fn(page), count
+                finally:
+                    page.close()
+            finally:
+                pdf.close()
+
+    def text(self, sha256, number):
+        """(text of the page, page count)."""
+        key = ("text", sha256, number)
+        cached = self.cache.get(key)
+        cache_result("pages", "miss" if cached is None else "hit")
+        if cached is None:
+            def extract(page):
+                textpage = page.get_textpage()
+                try:
+                    return textpage.get_text_range()
+                finally:
+                    textpage.close()
+
+            cached = self._page(sha256, number, extract)
+            self.cache.put(key, cached, len(cached[0]) * 2)
+        return cached
+
+    def image(self, sha256, number, dpi=PAGE_DEFAULT_DPI):
+        """(PNG render of the page at dpi, page count)."""
+        key = ("image", sha256, number, dpi)
+        cached = self.cache.get(key)
+        cache_result("pages", "miss" if cached is None else "hit")
+        if cached is None:
+            def render(page):
+                width, height = page.get_size()
+                scale = dpi / 72
+                pixels = width * scale * height * scale
+                if pixels > PAGE_MAX_PIXELS:
+                    scale *= (PAGE_MAX_PIXELS / pixels) ** 0.5
+                bitmap = page.render(scale=scale)
+                buffered = io.BytesIO()
+                bitmap.to_pil().save(buffered, format="PNG")
+                return buffered.getvalue()
+
+            cached = self._page(sha256, number, render)
+            self.cache.put(key, cached, len(cached[0]))
+        return cached
@@ -0,0 +1,294 @@
+"""
+Result storage helpers: index management and query building for the results collection.
+
+- ensure_indexes(): idempotent startup index creation (unique sha256, created_at,
+  risk_score + _id for filtered listings).
+- parse_fields(): `fields=` projections, so list views return summaries only.
+- build_filter() / keyset pagination: listings are sorted newest first by `_id` and
+  continue from an opaque cursor instead of skip(offset), so deep pages cost the same
+  as the first one.
+- score_query(): the record selection of a /score/batch request.
+- store_artifacts() / load_artifacts(): heavy artifacts (rendered first page, full
+  extracted text) live in GridFS as binary; documents keep only references and the
+  artifacts are read back when a caller asks for them with `include=`. The PDF itself,
+  when kept for page drill-down (see pages.py), is listed as the `pdf` artifact.
+  discard_artifacts() removes the artifacts of records the write-behind did not store.
+"""
+import base64
+import logging
+from datetime import datetime, timezone
+
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from pages import PAGE_DEFAULT_DPI, PAGE_MAX_DPI
+from pdffeatures import unpack
+
+logger = logging.getLogger("service-api")
+
+DEFAULT_PAGE_SIZE = 10
+MAX_PAGE_SIZE = 100
+
+RESULT_FIELDS = (
+    "md5", "sha256", "created_at", "updated_at", "structural", "content", "visual", "file_reputation",
+    "priority_url", "url_reputation", "risk_score", "reasoning", "verdict_source", "rule",
+    "tenant", "llm_usage", "profile", "degraded", "enrichment", "enrich_after", "similarity", "features", "model_score",
+    "image_base64", "artifacts"
+)
+SUMMARY_FIELDS = ("md5", "sha256", "created_at", "priority_url", "risk_score", "reasoning", "verdict_source", "rule",
+                  "profile")
+RISK_LEVELS = ("Safe", "Low", "Medium", "High", "Malicious")
+ARTIFACTS = ("image", "text")
+
+
+class QueryError(ValueError):
+    """Invalid query parameters; the message is returned to the client."""
+
+
+def ensure_indexes(col):
+    """Create the indexes result queries rely on. Safe to call on every startup."""
+    try:
+        col.create_index([("sha256", ASCENDING)], unique=True, name="sha256_unique")
+    except OperationFailure:
+        # Databases written before the index existed may hold duplicate hashes.
+        logger.exception("Unique sha256 index could not be built; falling back to a non-unique index")
+        col.create_index([("sha256", ASCENDING)], name="sha256")
+    col.create_index([("created_at", DESCENDING)], name="created_at")
+    col.create_index([("risk_score", ASCENDING), ("_id", DESCENDING)], name="risk_score_id")
+    # Re-enrichment queue (enrich.py)
+    col.create_index([("enrich_after", ASCENDING)], name="enrich_after")
+
+
+def parse_fields(raw, default):
+    """Turn `fields=a,b,c` into a Mongo projection; `fields=all` returns whole documents."""
+    if not raw:
+        names = default
+    elif raw == "all":
+        return None
+    else:
+        names = [name.strip() for name in raw.split(",") if name.strip()]
+        unknown = sorted(set(names) - set(RESULT_FIELDS))
+        if unknown:
+            raise QueryError(f"Unknown fields: {', '.join(unknown)}")
+    if names is None:
+        return None
+    # Artifact references are always needed to honour include=
+    return dict({name: 1 for name in names}, artifacts=1)
+
+
+def parse_include(raw):
+    """Turn `include=image,text` into the set of artifacts to load."""
+    names = {name.strip() for name in (raw or "").split(",") if name.strip()}
+    names.discard("none")
+    unknown = sorted(names - set(ARTIFACTS))
+    if unknown:
+        raise QueryError(f"Unknown artifacts: {', '.join(unknown)}")
+    return names
+
+
+def parse_limit(raw):
+    try:
+        limit = int(raw) if raw else DEFAULT_PAGE_SIZE
+    except ValueError:
+        raise QueryError("limit must be an integer")
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+
+def parse_score(raw, default):
+    """A similarity threshold between 0 and 1."""
+    try:
+        score = float(raw) if raw else default
+    except ValueError:
+        raise QueryError("min_score must be a number")
+    if not 0 <= score <= 1:
+        raise QueryError("min_score must be between 0 and 1")
+    return score
+
+
+def parse_dpi(raw):
+    try:
+        dpi = int(raw) if raw else PAGE_DEFAULT_DPI
+    except ValueError:
+        raise QueryError("dpi must be an integer")
+    if not 18 <= dpi <= PAGE_MAX_DPI:
+        raise QueryError(f"dpi must be between 18 and {PAGE_MAX_DPI}")
+    return dpi
+
+
+def parse_date(raw, name):
+    try:
+        value = datetime.fromisoformat(raw.replace("Z", "+00:00"))
+    except ValueError:
+        raise QueryError(f"{name} must be an ISO 8601 date or datetime")
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def build_filter(args):
+    """Mongo filter from `risk`, `since`, `until` and `cursor` query arguments."""
+    query = {}
+    risk = args.get("risk")
+    if risk:
+        levels = [level.strip().capitalize() for level in risk.split(",") if level.strip()]
+        unknown = sorted(set(levels) - set(RISK_LEVELS))
+        if unknown:
+            raise QueryError(f"Unknown risk levels: {', '.join(unknown)}")
+        query["risk_score"] = levels[0] if len(levels) == 1 else {"$in": levels}
+
+    created = {}
+    if args.get("since"):
+        created["$gte"] = parse_date(args["since"], "since")
+    if args.get("until"):
+        created["$lt"] = parse_date(args["until"], "until")
+    if created:
+        query["created_at"] = created
+
+    cursor = args.get("cursor")
+    if cursor:
+        try:
+            query["_id"] = {"$lt": ObjectId(cursor)}
+        except (InvalidId, TypeError):
+            raise QueryError("Invalid cursor")
+    return query
+
+
+def score_query(body, max_limit):
+    """Parse a /score/batch body into (query, limit, store).
+
+    Records are selected by `sha256` (a list of hashes) and the `risk`, `since` and `until`
+    filters of listings; limit defaults to max_limit.
+    """
+    if not isinstance(body, dict):
+        raise QueryError("Expected a JSON object")
+    risk = body.get("risk")
+    query = build_filter({
+        "risk": ",".join(risk) if isinstance(risk, list) else risk,
+        "since": body.get("since"),
+        "until": body.get("until"),
+    })
+    hashes = body.get("sha256")
+    if hashes is not None:
+        if not isinstance(hashes, list) or not all(isinstance(h, str) for h in hashes):
+            raise QueryError("sha256 must be a list of hashes")
+        query["sha256"] = {"$in": hashes}
+    limit = body.get("limit", max_limit)
+    if not isinstance(limit, int) or isinstance(limit, bool) or limit < 1:
+        raise QueryError("limit must be a positive integer")
+    return query, min(limit, max_limit), bool(body.get("store"))
+
+
+def store_artifacts(fs, record):
+    """Return a copy of record with the page image and full text moved to GridFS."""
+    if "artifacts" in record:
+        return record
+    record = dict(record)
+    sha256 = record["sha256"]
+    image_base64 = record.pop("image_base64", None)
+    pdf_file = record.pop("pdf_file", None)
+    artifacts = {"pdf": pdf_file} if pdf_file else {}
+    if image_base64:
+        artifacts["image"] = fs.put(
+            base64.b64decode(image_base64), filename=f"{sha256}.png", content_type="image/png", sha256=sha256
+        )
+    content = record.get("content") or {}
+    if content.get("text"):
+        text = content["text"]
+        artifacts["text"] = fs.put(
+            text.encode("utf-8"), filename=f"{sha256}.txt", content_type="text/plain; charset=utf-8", sha256=sha256
+        )
+        record["content"] = dict({k: v for k, v in content.items() if k != "text"}, text_chars=len(text))
+    if record.get("visual"):
+        record["visual"] = {k: v for k, v in record["visual"].items() if k != "image_base64"}
+    record["artifacts"] = artifacts
+    return record
+
+
+def discard_artifacts(fs, col, record):
+    """Delete the GridFS artifacts of a prepared record that was not stored.
+
+    Artifacts the stored record with the same `_id` refers to are kept (an insert that was
+    retried after it had gone through), and so is the PDF, which is shared by content hash.
+    """
+    stored = col.find_one({"_id": record["_id"]}, {"artifacts": 1}) or {}
+    keep = set((stored.get("artifacts") or {}).values())
+    for name, file_id in (record.get("artifacts") or {}).items():
+        if name != "pdf" and file_id not in keep:
+            fs.delete(file_id)
+
+
+def artifact_refs(doc, include):
+    """Replace doc's artifact references with the list of available artifacts and
+    return {name: file_id} for the requested ones."""
+    refs = doc.pop("artifacts", None)
+    if refs is None:
+        # Documents stored before artifacts were split out keep them inline.
+        return {}
+    doc["artifacts"] = sorted(refs)
+    return {name: file_id for name, file_id in refs.items() if name in include}
+
+
+def attach_artifacts(doc, loaded):
+    """Put artifact bytes read from GridFS into doc in their API form."""
+    if "image" in loaded:
+        doc["image_base64"] = base64.b64encode(loaded["image"]).decode("utf-8")
+    if "text" in loaded:
+        doc.setdefault("content", {})["text"] = loaded["text"].decode("utf-8")
+    return doc
+
+
+def load_artifacts(fs, doc, include):
+    """Replace artifact references with the requested artifacts; list the ones available."""
+    refs = artifact_refs(doc, include)
+    return attach_artifacts(doc, {name: fs.get(file_id).read() for name, file_id in refs.items()})
+
+
+def pending_view(doc, projection, include):
+    """Shape a record that is still queued for storage like a stored one."""
+    if projection is not None:
+        doc = {k: v for k, v in doc.items() if k in projection or k == "_id"}
+    doc = {k: v for k, v in doc.items() if (k != "image_base64" or "image" in include) and k != "pdf_file"}
+    content = doc.get("content")
+    if content and "text" not in include and "text" in content:
+        doc["content"] = dict({k: v for k, v in content.items() if k != "text"}, text_chars=len(content["text"]))
+    if doc.get("visual"):
+        doc["visual"] = {k: v for k, v in doc["visual"].items() if k != "image_base64"}
+    return doc
+
+
+def serialize(doc):
+    """Prepare a stored document for JSON output."""
+    doc["analysis_id"] = str(doc.pop("_id"))
+    for parent, name in ((doc, "created_at"), (doc, "updated_at"), (doc, "enrich_after"),
+                         (doc.get("enrichment") or {}, "at"), (doc.get("model_score") or {}, "at")):
+        if isinstance(parent.get(name), datetime):
+            parent[name] = parent[name].replace(tzinfo=timezone.utc).isoformat()
+    features = doc.get("features")
+    if features and isinstance(features.get("vector"), bytes):
+        doc["features"] = dict(features, vector=unpack(features["vector"]))
+    return doc
+
+
+def page_query(args):
+    """Parse listing arguments into (query, projection, include, limit)."""
+    return (
+        build_filter(args),
+        parse_fields(args.get("fields"), SUMMARY_FIELDS),
+        parse_include(args.get("include")),
+        parse_limit(args.get("limit")),
+    )
+
+
+def next_cursor(docs, limit):
+    """Listings fetch limit + 1 documents; the extra one means another page exists."""
+    return str(docs[limit - 1]["_id"]) if len(docs) > limit else None
+
+
+def list_page(col, fs, args):
+    """Return (results, next_cursor) for one page of the newest-first listing."""
+    query, projection, include, limit = page_query(args)
+    docs = list(col.find(query, projection).sort("_id", DESCENDING).limit(limit + 1))
+    cursor = next_cursor(docs, limit)
+    return [serialize(load_artifacts(fs, doc, include)) for doc in docs[:limit]], cursor
@@ -0,0 +1,432 @@
+"""
+Write-behind persistence for MongoDB inserts.
+
+Request handlers hand records to WriteBehind.submit(), which assigns the `_id`,
+appends the record to a local spool file and queues it; a background thread
+writes queued records in batches with insert_many. Responses no longer wait for
+a database round trip, and a slow MongoDB fills the buffer instead of stalling
+every request.
+
+- The buffer is bounded: submit() blocks for up to WRITE_SUBMIT_TIMEOUT seconds
+  when it is full and then raises BufferFull, so callers can shed load.
+- The spool is a directory of JSON-lines segments; a segment is deleted once
+  every record in it is stored. Segments left over from a crash are replayed on
+  startup; records already stored are skipped as duplicate `_id`s. Each writer
+  spools into its own locked subdirectory, so several server worker processes
+  can share a spool; a starting writer adopts the directories of writers that
+  are no longer running.
+- Records that fail for a transient reason (network, failover, timeouts) are
+  retried with backoff, at most WRITE_MAX_RETRIES times. Records that fail
+  for good (too large, rejected by validation) or run out of retries leave
+  the spool for a dead-letter segment under <WRITE_SPOOL_DIR>/dead-letter/,
+  in spool format: moving a segment into the writer's spool directory replays
+  it. One bad record no longer holds up the records behind it.
+- Records rejected as duplicates (a replayed `_id`, or a unique key such as
+  sha256 already stored by another record) are handed to the optional
+  discard callback, so whatever prepare wrote for them can be removed.
+- With a stamp field, each record is inserted by an upsert that sets the field
+  to the server's clock at the moment it is stored (`$currentDate`). Unlike
+  the `_id`, taken at submit(), the stamp orders records by when they became
+  readable, however long they waited in the buffer or spool, so incremental
+  readers (the columnar export) can use it as a watermark.
+"""
+import atexit
+import fcntl
+import glob
+import logging
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import deque
+
+from bson import ObjectId, json_util
+from pymongo import UpdateOne, WriteConcern
+from pymongo.errors import BulkWriteError, ConnectionFailure, ExecutionTimeout, OperationFailure, PyMongoError, WTimeoutError
+
+WRITE_BEHIND_ENABLED = os.getenv("WRITE_BEHIND_ENABLED", "true").lower() in ("1", "true", "yes")
+WRITE_BUFFER_SIZE = int(os.getenv("WRITE_BUFFER_SIZE", "1000"))
+WRITE_BATCH_SIZE = int(os.getenv("WRITE_BATCH_SIZE", "100"))
+WRITE_FLUSH_INTERVAL = float(os.getenv("WRITE_FLUSH_INTERVAL", "0.5"))
+WRITE_SUBMIT_TIMEOUT = float(os.getenv("WRITE_SUBMIT_TIMEOUT", "5"))
+WRITE_SPOOL_DIR = os.getenv("WRITE_SPOOL_DIR", "spool")
+# fsync every spooled record; without it the spool survives process crashes but not power loss
+WRITE_SPOOL_FSYNC = os.getenv("WRITE_SPOOL_FSYNC", "false").lower() in ("1", "true", "yes")
+WRITE_CONCERN_W = os.getenv("WRITE_CONCERN_W", "1")
+WRITE_CONCERN_J = os.getenv("WRITE_CONCERN_J", "false").lower() in ("1", "true", "yes")
+# Attempts after the first before a record is dead-lettered (about 8 minutes of backoff)
+WRITE_MAX_RETRIES = int(os.getenv("WRITE_MAX_RETRIES", "20"))
+SPOOL_SEGMENT_RECORDS = 1000
+MAX_RETRY_DELAY = 30
+DEAD_LETTER_DIR = "dead-letter"
+DUPLICATE_KEY = 11000
+# Server errors that go away on their own: unreachable hosts, shutdown, failover, time limits
+TRANSIENT_CODES = {6, 7, 50, 89, 91, 189, 262, 9001, 10107, 11600, 11602, 13435, 13436}
+# Outcomes of a record that was not stored; any other outcome is the error of a permanent failure
+DUPLICATE = "duplicate"
+RETRY = "retry"
+
+logger = logging.getLogger("writebehind")
+
+
+class BufferFull(Exception):
+    """The write buffer stayed full for the whole submit timeout."""
+
+
+def write_concern():
+    w = int(WRITE_CONCERN_W) if WRITE_CONCERN_W.isdigit() else WRITE_CONCERN_W
+    return WriteConcern(w=w, j=WRITE_CONCERN_J)
+
+
+def transient(error):
+    """Whether a failed write may succeed when retried."""
+    if isinstance(error, (ConnectionFailure, ExecutionTimeout, WTimeoutError)):
+        return True
+    if isinstance(error, PyMongoError) and error.has_error_label("RetryableWriteError"):
+        return True
+    return isinstance(error, OperationFailure) and error.code in TRANSIENT_CODES
+
+
+def field_value(doc, path):
+    for key in path.split("."):
+        if not isinstance(doc, dict):
+            return None
+        doc = doc.get(key)
+    return doc
+
+
+class WriteBehind:
+    def __init__(self, collection, name, prepare=None, discard=None, on_batch=None, stamp_field=None):
+        """collection: target collection; name: spool subdirectory; prepare: optional
+        per-record transform applied just before the record is written; discard: optional
+        callback(prepared) for prepared records that are not stored (duplicates and
+        dead letters), to undo side effects of prepare; on_batch: optional
+        callback(records, seconds) after each stored batch, for metrics; stamp_field:
+        optional field set to the server time at which each record is stored."""
+        self.collection = collection.with_options(write_concern=write_concern())
+        self.name = name
+        self.prepare = prepare
+        self.discard = discard
+        self.stamp_field = stamp_field
+        self.on_batch = on_batch
+        self.enabled = WRITE_BEHIND_ENABLED
+        self._buffer = deque()
+        self._batch = []
+        self._cond = threading.Condition()
+        self._closed = False
+        self._pending = {}  # spool segment -> records not yet stored
+        self._segment = None
+        self._segment_file = None
+        self._segment_records = 0
+        self._stats = {"submitted": 0, "stored": 0, "duplicates": 0, "dead_lettered": 0, "batches": 0,
+                       "failed_batches": 0, "rejected": 0}
+        if not self.enabled:
+            return
+        spool_root = os.path.join(WRITE_SPOOL_DIR, name)
+        self.spool_dir = os.path.join(spool_root, f"{os.getpid()}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(self.spool_dir)
+        self._lock_file = open(os.path.join(self.spool_dir, "lock"), "w")
+        fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        self._adopt_orphans(spool_root)
+        self._replay_spool()
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name=f"writebehind-{name}", daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    def submit(self, doc):
+        """Queue doc for insertion and return its `_id` as a string."""
+        doc.setdefault("_id", ObjectId())
+        if not self.enabled or self._closed:
+            prepared = self.prepare(doc) if self.prepare else doc
+            if self.stamp_field:
+                self.collection.bulk_write([self._upsert(prepared)])
+            else:
+                self.collection.insert_one(prepared)
+            return str(doc["_id"])
+        deadline = time.monotonic() + WRITE_SUBMIT_TIMEOUT
+        with self._cond:
+            while len(self._buffer) >= WRITE_BUFFER_SIZE:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self._stats["rejected"] += 1
+                    raise BufferFull(f"Write buffer full ({WRITE_BUFFER_SIZE} records)")
+                self._cond.wait(remaining)
+            segment = self._spool(doc)
+            self._buffer.append((segment, doc))
+            self._stats["submitted"] += 1
+            self._cond.notify_all()
+        return str(doc["_id"])
+
+    def find_pending(self, query):
+        """Return a copy of the first unstored record whose fields (dotted paths allowed)
+        equal query, or None."""
+        with self._cond:
+            for _, doc in list(self._batch) + list(self._buffer):
+                if all(field_value(doc, k) == v for k, v in query.items()):
+                    return dict(doc)
+        return None
+
+    def flush(self, timeout=None):
+        """Wait until every submitted record has been stored; returns False on timeout."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._cond.notify_all()
+            while self._buffer or self._batch:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._cond.wait(remaining)
+        return True
+
+    def close(self):
+        if not self.enabled or self._closed:
+            return
+        self.flush(timeout=WRITE_SUBMIT_TIMEOUT)
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            self._segment_file.close()
+            if not any(self._pending.values()):
+                shutil.rmtree(self.spool_dir, ignore_errors=True)
+            self._lock_file.close()
+
+    def stats(self):
+        with self._cond:
+            return dict(self._stats, buffered=len(self._buffer), in_flight=len(self._batch),
+                        spool_segments=len(self._pending))
+
+    # Spool
+
+    def _open_segment(self):
+        self._segment = os.path.join(self.spool_dir, f"{time.time_ns()}.jsonl")
+        self._segment_file = open(self._segment, "a", encoding="utf-8")
+        self._segment_records = 0
+        self._pending[self._segment] = 0
+
+    def _spool(self, doc):
+        if self._segment_records >= SPOOL_SEGMENT_RECORDS:
+            self._rotate_segment()
+        self._segment_file.write(json_util.dumps(doc, json_options=json_util.CANONICAL_JSON_OPTIONS) + "\n")
+        self._segment_file.flush()
+        if WRITE_SPOOL_FSYNC:
+            os.fsync(self._segment_file.fileno())
+        self._segment_records += 1
+        self._pending[self._segment] += 1
+        return self._segment
+
+    def _rotate_segment(self):
+        self._segment_file.close()
+        previous = self._segment
+        self._open_segment()
+        self._release_segment(previous)
+
+    def _release_segment(self, segment):
+        if self._pending.get(segment) == 0 and segment != self._segment:
+            del self._pending[segment]
+            os.remove(segment)
+
+    def _adopt_orphans(self, spool_root):
+        """Move segments of writers that are no longer running into this writer's spool."""
+        for path in glob.glob(os.path.join(spool_root, "*.jsonl")):
+            # Flat layout used before spools were per writer
+            os.rename(path, os.path.join(self.spool_dir, os.path.basename(path)))
+        for directory in glob.glob(os.path.join(spool_root, "*", "")):
+            directory = os.path.dirname(directory)
+            if directory == self.spool_dir:
+                continue
+            try:
+                with open(os.path.join(directory, "lock"), "a") as lock:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    for path in glob.glob(os.path.join(directory, "*.jsonl")):
+                        os.rename(path, os.path.join(self.spool_dir, os.path.basename(path)))
+                    shutil.rmtree(directory, ignore_errors=True)
+            except BlockingIOError:
+                continue  # owner still running
+            except OSError:
+                logger.exception("Could not adopt spool directory", extra={"directory": directory})
+
+    def _replay_spool(self):
+        replayed = 0
+        for segment in sorted(glob.glob(os.path.join(self.spool_dir, "*.jsonl"))):
+            count = 0
+            with open(segment, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        doc = json_util.loads(line)
+                    except ValueError:
+                        # A record cut short by a crash was never acknowledged.
+                        logger.warning("Skipping truncated spool record", extra={"segment": segment})
+                        continue
+                    self._buffer.append((segment, doc))
+                    count += 1
+            self._pending[segment] = count
+            replayed += count
+            if not count:
+                del self._pending[segment]
+                os.remove(segment)
+        if replayed:
+            logger.info("Replaying spooled records", extra={"records": replayed})
+
+    # Flusher
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._buffer:
+                    self._cond.wait(WRITE_FLUSH_INTERVAL)
+                elif len(self._buffer) < WRITE_BATCH_SIZE:
+                    # Give a burst a moment to fill the batch
+                    self._cond.wait_for(lambda: len(self._buffer) >= WRITE_BATCH_SIZE or self._closed,
+                                        WRITE_FLUSH_INTERVAL)
+                if self._closed:
+                    return
+                batch = [self._buffer.popleft() for _ in range(min(WRITE_BATCH_SIZE, len(self._buffer)))]
+                self._batch = batch
+            if batch:
+                self._write(batch)
+
+    def _upsert(self, doc):
+        """Insert doc stamped with the server time. Matching only unstamped `_id`s makes a
+        stored record a duplicate key error, as with insert_many."""
+        fields = {k: v for k, v in doc.items() if k not in ("_id", self.stamp_field)}
+        return UpdateOne({"_id": doc["_id"], self.stamp_field: {"$exists": False}},
+                         {"$setOnInsert": fields, "$currentDate": {self.stamp_field: True}}, upsert=True)
+
+    def _insert(self, docs):
+        """Insert docs once; returns {index: outcome} for the docs that were not stored."""
+        try:
+            if not self.stamp_field:
+                self.collection.insert_many(docs, ordered=False)
+                return {}
+            result = self.collection.bulk_write([self._upsert(doc) for doc in docs], ordered=False)
+            # A record stored before stamping was enabled is matched (and stamped), not inserted
+            return {i: DUPLICATE for i in range(len(docs)) if i not in result.upserted_ids}
+        except BulkWriteError as e:
+            outcomes = {}
+            for err in e.details.get("writeErrors", []):
+                code = err.get("code")
+                if code == DUPLICATE_KEY:
+                    outcomes[err["index"]] = DUPLICATE
+                elif code in TRANSIENT_CODES:
+                    outcomes[err["index"]] = RETRY
+                else:
+                    outcomes[err["index"]] = f"{code}: {err.get('errmsg')}"
+            if e.details.get("writeConcernErrors"):
+                # Written but not acknowledged: write again, stored copies come back as duplicates
+                outcomes.update({i: RETRY for i in range(len(docs)) if i not in outcomes})
+            if self.stamp_field:
+                upserted = {u["index"] for u in e.details.get("upserted", [])}
+                outcomes.update({i: DUPLICATE for i in range(len(docs)) if i not in outcomes and i not in upserted})
+            return outcomes
+        except Exception as e:
+            if transient(e):
+                return {i: RETRY for i in range(len(docs))}
+            if len(docs) == 1:
+                return {0: f"{type(e).__name__}: {e}"}
+            # A client-side error (DocumentTooLarge, InvalidDocument) fails the whole call:
+            # write the records one by one to find the ones at fault
+            outcomes = {}
+            for i, doc in enumerate(docs):
+                outcome = self._insert([doc]).get(0)
+                if outcome:
+                    outcomes[i] = outcome
+            return outcomes
+
+    def _prepare(self, doc):
+        """(prepared record, None), or (None, outcome) when prepare fails."""
+        try:
+            return (self.prepare(doc) if self.prepare else doc), None
+        except Exception as e:
+            logger.exception("Preparing a record failed", extra={"_id": str(doc["_id"])})
+            return None, RETRY if transient(e) else f"{type(e).__name__}: {e}"
+
+    def _discard(self, prepared, doc):
+        if self.discard and prepared is not None and prepared is not doc:
+            try:
+                self.discard(prepared)
+            except Exception:
+                logger.exception("Discarding a prepared record failed", extra={"_id": str(doc["_id"])})
+
+    def _dead_letter(self, records):
+        """Append (doc, error) records to this writer's dead-letter segment."""
+        directory = os.path.join(WRITE_SPOOL_DIR, DEAD_LETTER_DIR, self.name)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            path = os.path.join(directory, f"{os.getpid()}-{time.time_ns()}.jsonl")
+            with open(path, "a", encoding="utf-8") as f:
+                for doc, _ in records:
+                    f.write(json_util.dumps(doc, json_options=json_util.CANONICAL_JSON_OPTIONS) + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        except OSError:
+            logger.exception("Dead-letter segment could not be written", extra={"records": len(records)})
+            path = None
+        for doc, error in records:
+            logger.error("Record dead-lettered", extra={"_id": str(doc["_id"]), "error": error, "segment": path})
+
+    def _write(self, batch):
+        docs = [doc for _, doc in batch]
+        # Prepared records are kept across retries so prepare runs once per record
+        prepared = [None] * len(batch)
+        pending = list(range(len(batch)))
+        stored = duplicates = attempts = 0
+        elapsed = 0.0
+        delay = 0.5
+        dead = []
+        while pending:
+            attempts += 1
+            outcomes, ready = {}, []
+            for i in pending:
+                if prepared[i] is None:
+                    prepared[i], outcome = self._prepare(docs[i])
+                    if outcome:
+                        outcomes[i] = outcome
+                        continue
+                ready.append(i)
+            if ready:
+                started = time.monotonic()
+                for n, outcome in self._insert([prepared[i] for i in ready]).items():
+                    outcomes[ready[n]] = outcome
+                elapsed = time.monotonic() - started
+            stored += sum(1 for i in ready if i not in outcomes)
+            pending = [i for i, outcome in sorted(outcomes.items()) if outcome == RETRY]
+            if pending and attempts > WRITE_MAX_RETRIES:
+                outcomes.update({i: f"gave up after {attempts} attempts" for i in pending})
+                pending = []
+            for i, outcome in sorted(outcomes.items()):
+                if outcome == RETRY:
+                    continue
+                if outcome == DUPLICATE:
+                    # Replayed, or another record holds a unique key (sha256): this `_id` is not stored
+                    duplicates += 1
+                    logger.info("Duplicate record not stored", extra={"_id": str(docs[i]["_id"])})
+                else:
+                    dead.append((docs[i], outcome))
+                self._discard(prepared[i], docs[i])
+            if pending:
+                with self._cond:
+                    self._stats["failed_batches"] += 1
+                logger.warning("Batch write failed", extra={"records": len(pending), "retry_in": delay})
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+        if dead:
+            self._dead_letter(dead)
+        with self._cond:
+            self._stats["stored"] += stored
+            self._stats["duplicates"] += duplicates
+            self._stats["dead_lettered"] += len(dead)
+            self._stats["batches"] += 1
+            self._batch = []
+            for segment, _ in batch:
+                self._pending[segment] -= 1
+            for segment in {segment for segment, _ in batch}:
+                self._release_segment(segment)
+            if self._segment_records and not self._pending.get(self._segment):
+                # Everything spooled so far is stored: start a fresh segment so restarts replay nothing
+                self._rotate_segment()
+            self._cond.notify_all()
+        logger.debug("Batch stored", extra={"records": stored, "duplicates": duplicates})
+        if self.on_batch:
+            self.on_batch(len(batch), elapsed)
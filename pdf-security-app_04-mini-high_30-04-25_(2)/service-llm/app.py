@@ -1,8 +1,20 @@
 import os
+import json
 import logging
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import openai
 
+from evidence import compact_evidence, dumps as evidence_dumps, url_candidates
+from metrics import LLMUsage, instrument, llm_headers
+from llmjson import (
+    JSON_MODE,
+    PRIORITY_SCHEMA_HINT,
+    RISK_SCHEMA_HINT,
+    parse_structured,
+    validate_priority,
+    validate_risk,
+)
+
 # Logging configuration
 log_level = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=log_level)
@@ -11,79 +23,106 @@ logger = logging.getLogger("service-llm")
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 app = Flask(__name__)
+instrument(app, "service-llm")
 
 @app.route("/select_url", methods=["POST"])
 def select_url():
     try:
         data = request.get_json()
-        struct_urls = data.get("structural_urls", [])
-        content_urls = data.get("content_urls", [])
-        visual = data.get("visual_report", "")
+        urls, visual = url_candidates(
+            data.get("structural_urls"), data.get("content_urls"), data.get("visual_report", "")
+        )
         prompt = (
             "You are a security analyst. Given the following data:\n"
-            f"Structural URLs: {struct_urls}\n"
-            f"Content URLs: {content_urls}\n"
-            f"Visual Analysis: {visual}\n"
+            "URLs, one per line (URL | where found x count | local domain risk: signals | context):\n"
+            f"{urls or 'none'}\n"
+            f"Visual Analysis: {visual or ''}\n"
             "Select the single URL that is the most likely primary call-to-action "
-            "or the most suspicious target. Respond with only the URL or null."
+            f"or the most suspicious target. Respond with JSON {PRIORITY_SCHEMA_HINT}."
         )
-        response = openai.ChatCompletion.create(
+        usage = LLMUsage()
+        response = usage.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are a security analyst."},
                 {"role": "user", "content": prompt}
-            ]
+            ],
+            headers=llm_headers("service-llm.select_url"),
+            **JSON_MODE
         )
-        answer = response.choices[0].message.content.strip()
-        if answer.lower() in ["null", "none", ""]:
-            priority_url = None
-        else:
-            priority_url = answer
-        return jsonify({"priority_url": priority_url}), 200
+        result = parse_structured(
+            response.choices[0].message.content, validate_priority, PRIORITY_SCHEMA_HINT, "service-llm.select_url",
+            usage
+        )
+        return jsonify(dict(result, usage=usage.as_dict())), 200
     except Exception:
         logger.exception("URL selection error")
         return jsonify({"error": "URL selection error"}), 500
 
+def synthesis_messages(data):
+    evidence = compact_evidence(data)
+    prompt = (
+        "You are a security analyst. Given the following evidence about a PDF "
+        "(compact JSON; text_excerpt is truncated, text_chars is the full length):\n"
+        f"{evidence_dumps(evidence)}\n"
+        "Synthesize a final risk assessment. "
+        f"Respond with JSON {RISK_SCHEMA_HINT}."
+    )
+    return [
+        {"role": "system", "content": "You are a security analyst."},
+        {"role": "user", "content": prompt}
+    ]
+
+def parse_risk(content_resp, usage):
+    result = parse_structured(content_resp, validate_risk, RISK_SCHEMA_HINT, "service-llm.synthesize_risk", usage)
+    return result["risk_score"], result["reasoning"]
+
 @app.route("/synthesize_risk", methods=["POST"])
 def synthesize_risk():
     try:
         data = request.get_json()
-        sha256 = data.get("sha256")
-        md5 = data.get("md5")
-        structural = data.get("structural")
-        content = data.get("content")
-        visual = data.get("visual")
-        file_rep = data.get("file_reputation")
-        priority_url = data.get("priority_url")
-        url_rep = data.get("url_reputation")
-        prompt = (
-            "You are a security analyst. Given the following data:\n"
-            f"SHA256: {sha256}\n"
-            f"MD5: {md5}\n"
-            f"Structural Analysis: {structural}\n"
-            f"Content Analysis: {content}\n"
-            f"Visual Analysis: {visual}\n"
-            f"File Reputation: {file_rep}\n"
-            f"Priority URL: {priority_url}\n"
-            f"URL Reputation: {url_rep}\n"
-            "Synthesize a final risk assessment. "
-            "Provide a risk score (Safe, Low, Medium, High, Malicious) and a brief reasoning."
-        )
-        response = openai.ChatCompletion.create(
+        usage = LLMUsage()
+        response = usage.create(
             model="gpt-4o",
-            messages=[
-                {"role": "system", "content": "You are a security analyst."},
-                {"role": "user", "content": prompt}
-            ]
+            messages=synthesis_messages(data),
+            headers=llm_headers("service-llm.synthesize_risk"),
+            **JSON_MODE
         )
-        content_resp = response.choices[0].message.content.strip()
-        parts = content_resp.split("\n", 1)
-        risk_score = parts[0]
-        reasoning = parts[1] if len(parts) > 1 else ""
-        return jsonify({"risk_score": risk_score, "reasoning": reasoning}), 200
+        risk_score, reasoning = parse_risk(response.choices[0].message.content, usage)
+        return jsonify({"risk_score": risk_score, "reasoning": reasoning, "usage": usage.as_dict()}), 200
     except Exception:
         logger.exception("Risk synthesis error")
         return jsonify({"error": "Risk synthesis error"}), 500
 
+@app.route("/synthesize_risk/stream", methods=["POST"])
+def synthesize_risk_stream():
+    """Same as /synthesize_risk, streamed as NDJSON: token events, then a result event."""
+    data = request.get_json()
+
+    def generate():
+        chunks = []
+        usage = LLMUsage()
+        try:
+            response = usage.create(
+                model="gpt-4o",
+                messages=synthesis_messages(data),
+                stream=True,
+                headers=llm_headers("service-llm.synthesize_risk"),
+                **JSON_MODE
+            )
+            for chunk in response:
+                text = chunk.choices[0].delta.get("content") if chunk.choices else None
+                if text:
+                    chunks.append(text)
+                    yield json.dumps({"event": "token", "text": text}) + "\n"
+            risk_score, reasoning = parse_risk("".join(chunks), usage)
+            yield json.dumps({"event": "result", "risk_score": risk_score, "reasoning": reasoning,
+                              "usage": usage.as_dict()}) + "\n"
+        except Exception:
+            logger.exception("Risk synthesis stream error")
+            yield json.dumps({"event": "error", "error": "Risk synthesis error"}) + "\n"
+
+    return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
 if __name__ == "__main__":
     app.run(host="0.0.0.0", port=5004)
@@ -1,9 +1,12 @@
 import os
 import logging
-import io
-import re
 from flask import Flask, request, jsonify
-from PyPDF2 import PdfReader
+
+from domainintel import DomainIndex
+from extractors import get_extractor
+from metrics import instrument, timed
+from pdfwalk import structure
+from urlextract import extract_urls, merge_annotations
 
 # Logging configuration
 log_level = os.getenv("LOG_LEVEL", "INFO")
@@ -11,8 +14,14 @@ logging.basicConfig(level=log_level)
 logger = logging.getLogger("service-pdf")
 
 app = Flask(__name__)
+instrument(app, "service-pdf")
+
+# Text extraction engine, PDF_TEXT_BACKEND (see extractors.py)
+TEXT_BACKEND, extract_pages = get_extractor(default="pypdf2")
+logger.info(f"Text extraction backend: {TEXT_BACKEND}")
 
-URL_REGEX = re.compile(r"https?://[^\s)>\"]+")
+# Local allow/deny lists, public suffixes and lookalike brands (see domainintel.py)
+domain_index = DomainIndex()
 
 @app.route("/structural", methods=["POST"])
 def structural():
@@ -21,42 +30,34 @@ def structural():
         if not file:
             return jsonify({"error": "No file provided"}), 400
         data = file.read()
-        reader = PdfReader(io.BytesIO(data))
-
-        # Metadata
-        info = reader.metadata
-        metadata = {k.lstrip("/"): v for k, v in info.items()} if info else {}
+        # Catalog, document info and link annotations, walked lazily within budgets, and the
+        # fixed-schema feature vector for bulk scoring, from the same walk (see pdfwalk.py)
+        with timed("parse"):
+            walked = structure(data)
+        metadata = walked["metadata"]
 
-        # Features
+        # Features; JavaScript and embedded files also count when they sit in page or annotation
+        # actions, which the walk does not read (counted in the feature vector)
         features = {
-            "JavaScript": False,
-            "EmbeddedFiles": False,
-            "Encrypted": reader.is_encrypted,
-            "AcroForm": "/AcroForm" in reader.trailer,
-            "OpenAction": "/OpenAction" in reader.trailer
+            "JavaScript": walked["javascript"],
+            "EmbeddedFiles": walked["embedded_files"],
+            "Encrypted": walked["encrypted"],
+            "AcroForm": walked["forms"],
+            "OpenAction": walked["open_action"]
         }
 
-        # URLs from annotations
-        urls = []
-        for page in reader.pages:
-            annots = page.get("/Annots") or []
-            for annot in annots:
-                obj = annot.get_object()
-                action = obj.get("/A")
-                if action and action.get("/URI"):
-                    urls.append(action.get("/URI"))
-
-        # Check raw content for JavaScript or embedded files
-        raw = data.decode("latin-1", errors="ignore")
-        if "/JavaScript" in raw:
-            features["JavaScript"] = True
-        if "/EmbeddedFile" in raw:
-            features["EmbeddedFiles"] = True
+        # Link annotations, deduplicated, with the text shown under each link
+        links = merge_annotations([], walked["links"])
+        with timed("domain_intel"):
+            domain_index.annotate(links)
 
         return jsonify({
             "metadata": metadata,
             "features": features,
-            "urls": list(set(urls))
+            "urls": [link["url"] for link in links],
+            "links": links,
+            "walk": walked["walk"],
+            "vector": walked["vector"]
         }), 200
     except Exception:
         logger.exception("Structural analysis error")
@@ -69,21 +70,15 @@ def content():
         if not file:
             return jsonify({"error": "No file provided"}), 400
         data = file.read()
-        reader = PdfReader(io.BytesIO(data))
-
-        # Extract text
-        text = ""
-        for page in reader.pages:
-            text += page.extract_text() or ""
+        with timed("extract_text"):
+            pages = extract_pages(data)
+        text = "\n".join(pages)
 
-        # Find URLs with context
-        urls = []
-        for match in URL_REGEX.finditer(text):
-            url = match.group(0)
-            start = max(match.start() - 30, 0)
-            end = min(match.end() + 30, len(text))
-            context = text[start:end]
-            urls.append({"url": url, "context": context})
+        # Deduplicated, normalized URLs with the context of their first occurrence
+        with timed("extract_urls"):
+            urls = extract_urls(pages)
+        with timed("domain_intel"):
+            domain_index.annotate(urls)
 
         return jsonify({
             "text": text,
@@ -0,0 +1,385 @@
+"""
+Local domain intelligence for extracted URLs.
+
+DomainIndex.lookup(host) returns risk features for a host from lists held in
+memory, without any network call:
+
+- the registered domain and public suffix, from the public suffix list
+  (DOMAIN_PSL_FILE; a built-in subset of common multi-label suffixes when the
+  file is missing);
+- allow and deny lists (allow.txt, deny.txt in DOMAIN_LISTS_DIR), which cover
+  subdomains of every entry;
+- URL shorteners and file-hosting services (built in, extended by
+  shorteners.txt and filehosting.txt);
+- lookalike brands (built in, extended by brands.txt, one `brand domain...`
+  per line): the brand in a domain it does not own, digit and homoglyph
+  substitutions (paypa1, micr0soft, Cyrillic letters) and one-letter typos;
+- IP address hosts, punycode, deep subdomains and risky top-level domains.
+
+Allow and deny lists can hold millions of domains: they are kept as one sorted,
+packed byte string searched by bisection (DomainSet), about the size of the
+list file in memory. Lookups are cached per host. The list files are checked
+every DOMAIN_LISTS_RELOAD seconds and, when one changed, a new index is built in
+the background and swapped in, so list updates need no restart.
+"""
+import ipaddress
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from array import array
+from bisect import bisect_right
+from functools import lru_cache
+from itertools import accumulate
+from urllib.parse import urlsplit
+
+logger = logging.getLogger("domainintel")
+
+DOMAIN_LISTS_DIR = os.getenv("DOMAIN_LISTS_DIR", "domain-lists")
+DOMAIN_PSL_FILE = os.getenv("DOMAIN_PSL_FILE", "public_suffix_list.dat")
+DOMAIN_LISTS_RELOAD = float(os.getenv("DOMAIN_LISTS_RELOAD", "30"))
+DOMAIN_RISKY_TLDS = os.getenv("DOMAIN_RISKY_TLDS", "zip,mov,xyz,top,tk,ml,ga,cf,gq,click,link,work,rest,icu,cam,support")
+# Subdomain labels below the registered domain from which a host counts as deep
+DOMAIN_DEEP_SUBDOMAINS = int(os.getenv("DOMAIN_DEEP_SUBDOMAINS", "3"))
+
+SHORTENERS = (
+    "bit.ly", "bitly.com", "tinyurl.com", "t.co", "goo.gl", "ow.ly", "is.gd", "buff.ly", "rebrand.ly", "cutt.ly",
+    "shorturl.at", "rb.gy", "t.ly", "tiny.cc", "lnkd.in", "s.id", "v.gd", "bl.ink", "short.io", "qrco.de",
+)
+FILE_HOSTING = (
+    "drive.google.com", "docs.google.com", "storage.googleapis.com", "firebasestorage.googleapis.com",
+    "dropbox.com", "dropboxusercontent.com", "onedrive.live.com", "1drv.ms", "sharepoint.com", "box.com",
+    "wetransfer.com", "we.tl", "mediafire.com", "mega.nz", "sendspace.com", "transfer.sh", "files.fm",
+    "gofile.io", "pixeldrain.com", "cdn.discordapp.com", "ipfs.io", "pastebin.com", "github.io", "gitlab.io",
+)
+BRANDS = {
+    "paypal": ("paypal.com", "paypal.me"),
+    "microsoft": ("microsoft.com", "live.com", "office.com", "microsoftonline.com"),
+    "office365": ("office.com", "microsoft.com"),
+    "outlook": ("outlook.com", "live.com", "office.com"),
+    "apple": ("apple.com", "icloud.com"),
+    "icloud": ("icloud.com", "apple.com"),
+    "amazon": ("amazon.com", "amazon.co.uk", "amazon.de", "amazonaws.com"),
+    "netflix": ("netflix.com",),
+    "google": ("google.com", "googleapis.com", "gstatic.com", "googleusercontent.com"),
+    "facebook": ("facebook.com", "fb.com"),
+    "instagram": ("instagram.com",),
+    "linkedin": ("linkedin.com", "lnkd.in"),
+    "docusign": ("docusign.com", "docusign.net"),
+    "adobe": ("adobe.com",),
+    "dropbox": ("dropbox.com", "dropboxusercontent.com"),
+    "wellsfargo": ("wellsfargo.com",),
+    "chase": ("chase.com",),
+    "bankofamerica": ("bankofamerica.com",),
+    "dhl": ("dhl.com", "dhl.de"),
+    "fedex": ("fedex.com",),
+    "usps": ("usps.com",),
+    "coinbase": ("coinbase.com",),
+    "binance": ("binance.com",),
+}
+# Used when DOMAIN_PSL_FILE is missing; every other suffix is taken to be one label
+FALLBACK_SUFFIXES = (
+    "co.uk", "org.uk", "ac.uk", "gov.uk", "com.au", "net.au", "org.au", "co.jp", "co.nz", "co.za", "co.in",
+    "com.br", "com.cn", "com.mx", "com.tr", "com.sg", "com.hk", "github.io", "gitlab.io", "blogspot.com",
+    "herokuapp.com", "appspot.com", "azurewebsites.net", "cloudfront.net", "web.app", "firebaseapp.com",
+    "netlify.app", "vercel.app", "pages.dev", "workers.dev", "ngrok.io", "ngrok-free.app", "s3.amazonaws.com",
+)
+# Characters that render like Latin letters
+HOMOGLYPHS = str.maketrans({
+    "0": "o", "1": "l", "3": "e", "4": "a", "5": "s", "7": "t", "8": "b", "@": "a", "$": "s",
+    "а": "a", "е": "e", "о": "o", "р": "p", "с": "c", "х": "x", "у": "y", "і": "i", "ј": "j", "ѕ": "s",
+    "ԁ": "d", "ɡ": "g", "ӏ": "l", "ο": "o", "α": "a", "ν": "v", "ı": "i",
+})
+SEQUENCES = (("rn", "m"), ("vv", "w"), ("cl", "d"))
+LIST_FILES = ("allow.txt", "deny.txt", "shorteners.txt", "filehosting.txt", "brands.txt")
+TOKEN_SEPARATORS = re.compile(r"[-_.0-9]+")
+
+
+def _idna(name):
+    name = name.strip().strip(".").lower()
+    if name.startswith("*."):
+        name = name[2:]
+    if name.isascii():
+        return name
+    try:
+        return name.encode("idna").decode("ascii")
+    except UnicodeError:
+        return name
+
+
+def _parents(host):
+    """host and every parent domain: a.b.c, b.c, c."""
+    labels = host.split(".")
+    return [".".join(labels[i:]) for i in range(len(labels))]
+
+
+def _read_lines(path):
+    """Entries of a list file without comments and blank lines; [] when it does not exist."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return [line.split("#", 1)[0].strip() for line in f if line.split("#", 1)[0].strip()]
+    except FileNotFoundError:
+        return []
+
+
+def skeleton(label):
+    """label with homoglyphs and look-alike letter pairs replaced by the letters they imitate."""
+    if label.startswith("xn--"):
+        try:
+            label = label.encode("ascii").decode("idna")
+        except UnicodeError:
+            pass
+    label = unicodedata.normalize("NFKC", label).lower().translate(HOMOGLYPHS)
+    for sequence, letter in SEQUENCES:
+        label = label.replace(sequence, letter)
+    return label
+
+
+def _deletions(word):
+    """word and every string one deletion away from it."""
+    return {word} | {word[:i] + word[i + 1:] for i in range(len(word))}
+
+
+def _one_edit(a, b):
+    """Whether a and b differ by exactly one insertion, deletion, substitution or transposition."""
+    if a == b or abs(len(a) - len(b)) > 1:
+        return False
+    if len(a) == len(b):
+        diffs = [i for i in range(len(a)) if a[i] != b[i]]
+        return len(diffs) == 1 or (len(diffs) == 2 and diffs[1] == diffs[0] + 1
+                                   and a[diffs[0]] == b[diffs[1]] and a[diffs[1]] == b[diffs[0]])
+    if len(a) > len(b):
+        a, b = b, a
+    i = 0
+    while i < len(a) and a[i] == b[i]:
+        i += 1
+    return a[i:] == b[i + 1:]
+
+
+class DomainSet:
+    """A large set of domain names packed into one sorted, newline-separated byte string.
+
+    Every BLOCK-th name is kept as a sample: membership is a bisection over the samples and a
+    search within one block of the string, so memory stays close to the size of the list file
+    instead of a Python object per name.
+    """
+
+    BLOCK = 64
+
+    def __init__(self, names):
+        names = sorted({name.encode("ascii", "ignore") for name in names if name})
+        self._blob = b"\n" + b"\n".join(names) + b"\n"
+        self._samples = names[::self.BLOCK]
+        # Offset of each sample's leading newline in the blob
+        offsets = accumulate([0] + [len(name) + 1 for name in names])
+        self._starts = array("Q", (offset for i, offset in enumerate(offsets) if i % self.BLOCK == 0))
+        self._size = len(names)
+
+    def __len__(self):
+        return self._size
+
+    def __contains__(self, name):
+        key = name.encode("ascii", "ignore")
+        block = bisect_right(self._samples, key) - 1
+        if block < 0:
+            return False
+        end = self._starts[block + 1] + 1 if block + 1 < len(self._starts) else len(self._blob)
+        return self._blob.find(b"\n" + key + b"\n", self._starts[block], end) >= 0
+
+    def covers(self, host):
+        """The entry that host is or is a subdomain of, or None."""
+        return next((parent for parent in _parents(host) if parent in self), None)
+
+
+class PublicSuffixes:
+    def __init__(self, lines):
+        self.rules, self.wildcards, self.exceptions = set(), set(), set()
+        for line in lines:
+            rule = line.split()[0]
+            if rule.startswith("!"):
+                self.exceptions.add(_idna(rule[1:]))
+            elif rule.startswith("*."):
+                self.wildcards.add(_idna(rule[2:]))
+            else:
+                self.rules.add(_idna(rule))
+
+    def split(self, host):
+        """(registered domain or None, public suffix) of host."""
+        labels = host.split(".")
+        suffix_at = len(labels) - 1
+        for i in range(len(labels)):
+            candidate = ".".join(labels[i:])
+            if candidate in self.exceptions:
+                suffix_at = i + 1
+                break
+            if candidate in self.rules or (i + 1 < len(labels) and ".".join(labels[i + 1:]) in self.wildcards):
+                suffix_at = i
+                break
+        suffix = ".".join(labels[suffix_at:])
+        return (".".join(labels[suffix_at - 1:]) if suffix_at > 0 else None), suffix
+
+
+class _Snapshot:
+    """Lists loaded at one point in time; replaced as a whole on reload."""
+
+    def __init__(self, lists_dir, psl_file):
+        started = time.monotonic()
+        psl_lines = _read_lines(psl_file) if psl_file else []
+        if not psl_lines:
+            psl_lines = list(FALLBACK_SUFFIXES)
+        self.suffixes = PublicSuffixes(psl_lines)
+        self.allow = DomainSet(_idna(name) for name in _read_lines(os.path.join(lists_dir, "allow.txt")))
+        self.deny = DomainSet(_idna(name) for name in _read_lines(os.path.join(lists_dir, "deny.txt")))
+        self.shorteners = frozenset(_idna(name) for name in SHORTENERS + tuple(
+            _read_lines(os.path.join(lists_dir, "shorteners.txt"))))
+        self.file_hosting = frozenset(_idna(name) for name in FILE_HOSTING + tuple(
+            _read_lines(os.path.join(lists_dir, "filehosting.txt"))))
+        brands = {name: set(domains) for name, domains in BRANDS.items()}
+        for line in _read_lines(os.path.join(lists_dir, "brands.txt")):
+            name, *domains = line.lower().split()
+            brands.setdefault(name, set()).update(_idna(domain) for domain in domains)
+        self.brands = {name: frozenset(domains) for name, domains in brands.items() if len(name) >= 4}
+        self.owners = {}
+        for name, domains in self.brands.items():
+            for domain in domains:
+                self.owners.setdefault(domain, set()).add(name)
+        self.brand_words = frozenset(self.brands)
+        long_brands = sorted((name for name in self.brands if len(name) >= 6), key=len, reverse=True)
+        self.long_brands = re.compile("|".join(map(re.escape, long_brands)) or "(?!)")
+        # One-letter typos of brands of five letters or more, found through shared deletion variants
+        self.typos = {}
+        for name in self.brands:
+            if len(name) >= 5:
+                for variant in _deletions(name):
+                    self.typos.setdefault(variant, set()).add(name)
+        self.risky_tlds = frozenset(t.strip().lower() for t in DOMAIN_RISKY_TLDS.split(",") if t.strip())
+        self.lookup = lru_cache(maxsize=65536)(self._lookup)
+        logger.info("Domain lists loaded", extra={
+            "public_suffixes": len(psl_lines), "allow": len(self.allow), "deny": len(self.deny),
+            "brands": len(self.brands), "seconds": round(time.monotonic() - started, 3),
+        })
+
+    def _brand(self, host, registered):
+        """(brand, signal) for a host imitating a brand it does not belong to, or (None, None)."""
+        owned = self.owners.get(registered, ())
+        label = registered.split(".")[0]
+        shape = skeleton(label)
+
+        def mentioned(text):
+            # Short brands must be a whole word (chase, not purchase); long ones may be run together
+            found = (set(TOKEN_SEPARATORS.split(text)) & self.brand_words) | set(self.long_brands.findall(text))
+            return sorted(found - set(owned))
+
+        for brand in mentioned(host):
+            return brand, "brand_in_domain"
+        if shape != label:
+            for brand in mentioned(shape):
+                return brand, "brand_lookalike"
+        candidates = set().union(*(self.typos.get(variant, ()) for variant in _deletions(shape)))
+        for brand in sorted(candidates):
+            if brand not in owned and _one_edit(shape, brand):
+                return brand, "brand_typo"
+        return None, None
+
+    def _lookup(self, host):
+        host = _idna(host.strip("[]"))
+        features = {"host": host, "registered_domain": None, "public_suffix": None, "list": None,
+                    "brand": None, "signals": []}
+        signals = features["signals"]
+        try:
+            ipaddress.ip_address(host)
+            signals.append("ip_host")
+        except ValueError:
+            registered, suffix = self.suffixes.split(host)
+            features.update(registered_domain=registered, public_suffix=suffix)
+            if registered:
+                brand, signal = self._brand(host, registered)
+                if brand:
+                    features["brand"] = brand
+                    signals.append(signal)
+                if len(host.split(".")) - len(registered.split(".")) >= DOMAIN_DEEP_SUBDOMAINS:
+                    signals.append("deep_subdomain")
+            if any(label.startswith("xn--") for label in host.split(".")):
+                signals.append("punycode")
+            if suffix.rsplit(".", 1)[-1] in self.risky_tlds:
+                signals.append("risky_tld")
+            parents = _parents(host)
+            if any(parent in self.shorteners for parent in parents):
+                signals.append("shortener")
+            if any(parent in self.file_hosting for parent in parents):
+                signals.append("file_hosting")
+        if self.deny.covers(host):
+            features["list"] = "deny"
+        elif self.allow.covers(host):
+            features["list"] = "allow"
+        features["risk"] = self._risk(features)
+        return features
+
+    @staticmethod
+    def _risk(features):
+        signals = set(features["signals"])
+        if features["list"] == "deny":
+            return "high"
+        if features["list"] != "allow" and signals & {"brand_in_domain", "brand_lookalike", "brand_typo"}:
+            return "high"
+        if features["list"] == "allow":
+            return "low"
+        return "medium" if signals else "none"
+
+
+class DomainIndex:
+    def __init__(self, lists_dir=DOMAIN_LISTS_DIR, psl_file=DOMAIN_PSL_FILE, reload_interval=DOMAIN_LISTS_RELOAD):
+        self.lists_dir = lists_dir
+        self.psl_file = psl_file
+        self.reload_interval = reload_interval
+        self._signature = self._files()
+        self._snapshot = _Snapshot(lists_dir, psl_file)
+        self._checked = time.monotonic()
+        self._reloading = threading.Lock()
+
+    def _files(self):
+        signature = []
+        for path in [self.psl_file] + [os.path.join(self.lists_dir, name) for name in LIST_FILES]:
+            try:
+                stat = os.stat(path)
+                signature.append((path, stat.st_mtime_ns, stat.st_size))
+            except (OSError, TypeError):
+                signature.append((path, None, None))
+        return signature
+
+    def _reload(self, signature):
+        try:
+            self._snapshot = _Snapshot(self.lists_dir, self.psl_file)
+            self._signature = signature
+        except Exception:
+            logger.exception("Domain list reload failed; keeping the previous lists")
+        finally:
+            self._reloading.release()
+
+    def maybe_reload(self):
+        """Rebuild the index in the background when a list file changed; checked at most every reload_interval."""
+        if not self.reload_interval or time.monotonic() - self._checked < self.reload_interval:
+            return
+        self._checked = time.monotonic()
+        signature = self._files()
+        if signature != self._signature and self._reloading.acquire(blocking=False):
+            threading.Thread(target=self._reload, args=(signature,), name="domain-lists", daemon=True).start()
+
+    def lookup(self, host):
+        """Local risk features of host (a hostname or IP address, as in a normalized URL)."""
+        self.maybe_reload()
+        features = self._snapshot.lookup(host)
+        # Cached results are shared; callers get their own copy
+        return dict(features, signals=list(features["signals"]))
+
+    def annotate(self, entries):
+        """Add `domain` features to urlextract entries (dicts with a normalized `url`), in place."""
+        for entry in entries:
+            try:
+                host = urlsplit(entry["url"]).hostname
+            except ValueError:
+                host = None
+            entry["domain"] = self.lookup(host) if host else None
+        return entries
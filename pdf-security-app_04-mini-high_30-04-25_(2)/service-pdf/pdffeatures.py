@@ -0,0 +1,237 @@
+"""
+Fixed-schema numeric feature vectors of PDFs, for bulk scoring and analytics.
+
+feature_vector() reads the raw bytes once and returns one float per name in
+FEATURE_NAMES, in that order:
+
+- object, stream and page counts, incremental updates (startxref sections);
+- counts of risky names: JavaScript, Launch, OpenAction, additional actions,
+  embedded files, forms (AcroForm, XFA, SubmitForm), remote GoTo, RichMedia,
+  link annotations and URI actions;
+- stream filter counts, total stream bytes and the mean and maximum Shannon
+  entropy of stream data (sampled, in bits per byte);
+- anomalies: names obfuscated with #xx escapes, bytes before the header or
+  after the last %%EOF, missing producer/creator, a modification date before
+  the creation date or a creation date in the future.
+
+Names are counted in object dictionaries only, not in stream data, plus the
+dictionaries packed into Flate-compressed object streams, so compressed page
+content cannot produce false matches and /ObjStm cannot hide actions. The
+work is bytes.find, zlib and compiled patterns; it does not need a parser and
+works on files PyPDF2 rejects. It is bounded per file: at most
+FEATURE_MAX_STREAMS streams are walked and FEATURE_MAX_DICT_BYTES of
+dictionaries searched for names, so for files past either budget the stream
+and name counts are lower bounds. pdfwalk.structure() computes the vector in
+the same call as the walk and passes the object streams it already inflated.
+
+Vectors are stored packed as little-endian float32 (pack()/unpack()) together
+with FEATURE_VERSION; adding or reordering features must bump the version.
+"""
+import math
+import os
+import re
+import struct
+import time
+import zlib
+from collections import Counter
+
+FEATURE_VERSION = 1
+FEATURE_NAMES = (
+    "file_bytes", "pdf_version", "objects", "streams", "object_streams", "xref_sections", "pages",
+    "fonts", "images", "annotations", "link_annotations", "uri_actions",
+    "javascript", "launch", "open_action", "additional_actions", "embedded_files",
+    "acroform", "xfa", "submit_form", "goto_remote", "rich_media", "encrypted",
+    "filter_flate", "filter_lzw", "filter_ascii_hex", "filter_ascii85", "filter_run_length",
+    "filter_dct", "filter_jpx", "filter_jbig2", "filter_ccitt", "filter_crypt",
+    "stream_bytes", "stream_entropy_mean", "stream_entropy_max",
+    "hex_escaped_names", "header_offset", "trailing_bytes",
+    "metadata_missing", "metadata_date_mismatch", "metadata_future_date",
+)
+FEATURE_COUNT = len(FEATURE_NAMES)
+
+# Names counted per feature; abbreviations are the inline image forms of the filters
+NAMES = {
+    "fonts": ("BaseFont",),
+    "images": ("Image",),
+    "annotations": ("Rect",),
+    "link_annotations": ("Link",),
+    "uri_actions": ("URI",),
+    "javascript": ("JavaScript", "JS"),
+    "launch": ("Launch",),
+    "open_action": ("OpenAction",),
+    "additional_actions": ("AA",),
+    "embedded_files": ("EmbeddedFile", "FileAttachment"),
+    "acroform": ("AcroForm",),
+    "xfa": ("XFA",),
+    "submit_form": ("SubmitForm",),
+    "goto_remote": ("GoToR", "GoToE"),
+    "rich_media": ("RichMedia",),
+    "encrypted": ("Encrypt",),
+    "filter_flate": ("FlateDecode", "Fl"),
+    "filter_lzw": ("LZWDecode", "LZW"),
+    "filter_ascii_hex": ("ASCIIHexDecode", "AHx"),
+    "filter_ascii85": ("ASCII85Decode", "A85"),
+    "filter_run_length": ("RunLengthDecode", "RL"),
+    "filter_dct": ("DCTDecode", "DCT"),
+    "filter_jpx": ("JPXDecode",),
+    "filter_jbig2": ("JBIG2Decode",),
+    "filter_ccitt": ("CCITTFaxDecode", "CCF"),
+    "filter_crypt": ("Crypt",),
+}
+
+# Stream bytes sampled for entropy, and streams sampled per file
+ENTROPY_SAMPLE = 4096
+ENTROPY_STREAMS = 256
+# Dictionary bytes before a stream searched for its type
+STREAM_DICT_BYTES = 1024
+# Decompressed object stream bytes read per file
+OBJSTM_MAX_BYTES = 16 * 1024 * 1024
+# Streams walked and dictionary bytes (object streams included) searched for names per file
+FEATURE_MAX_STREAMS = int(os.getenv("FEATURE_MAX_STREAMS", "20000"))
+FEATURE_MAX_DICT_BYTES = int(os.getenv("FEATURE_MAX_DICT_BYTES", str(4 * 1024 * 1024)))
+
+NAME = re.compile(rb"/([A-Za-z][A-Za-z0-9]*)")
+ESCAPED_NAME = re.compile(rb"/[^\s/<>\[\]()%#]*(?:#[0-9A-Fa-f]{2}[^\s/<>\[\]()%#]*)+")
+HEX_ESCAPE = re.compile(rb"#([0-9A-Fa-f]{2})")
+OBJECT_HEADER = re.compile(rb"\d+\s+\d+\s+obj\b")
+OBJSTM_COUNT = re.compile(rb"/N\s+(\d+)")
+DATE = re.compile(rb"/(CreationDate|ModDate)\s*\(\s*(?:D:)?(\d{4,14})")
+VERSION = re.compile(rb"%PDF-(\d\.\d)")
+
+
+def _entropy(sample):
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in Counter(sample).values())
+
+
+def _streams(data):
+    """Yield (dictionary, data, offset of the data) of every stream, and the bytes after the last
+    one as (chunk, None, None)."""
+    pos = 0
+    while True:
+        start = data.find(b"stream", pos)
+        while start >= 3 and data[start - 3:start] == b"end":
+            start = data.find(b"stream", start + 6)
+        if start < 0:
+            yield data[pos:], None, None
+            return
+        body = start + 6
+        if data[body:body + 2] == b"\r\n":
+            body += 2
+        elif data[body:body + 1] in (b"\n", b"\r"):
+            body += 1
+        end = data.find(b"endstream", body)
+        if end < 0:
+            end = len(data)
+        yield data[pos:start], data[body:end], body
+        pos = end + 9
+
+
+def _unescape(name):
+    return HEX_ESCAPE.sub(lambda m: bytes([int(m.group(1), 16)]), name)
+
+
+def feature_vector(data, inflated=None):
+    """The FEATURE_NAMES values of a PDF, as a list of floats.
+
+    inflated: {file offset of the stream data: inflated data} of object streams a reader has
+    already decompressed (PDFWalker.objstm_data); they are not inflated again.
+    """
+    inflated = inflated or {}
+    features = dict.fromkeys(FEATURE_NAMES, 0.0)
+    features["file_bytes"] = len(data)
+    header = data.find(b"%PDF-", 0, 1024)
+    features["header_offset"] = max(header, 0)
+    version = VERSION.match(data, max(header, 0))
+    features["pdf_version"] = float(version.group(1)) if version else 0.0
+    eof = data.rfind(b"%%EOF")
+    features["trailing_bytes"] = len(data[eof + 5:].strip()) if eof >= 0 else 0
+    features["xref_sections"] = data.count(b"startxref")
+
+    dictionaries = []
+    entropies = []
+    objstm_budget = OBJSTM_MAX_BYTES
+    dict_budget = FEATURE_MAX_DICT_BYTES
+    for chunk, stream, offset in _streams(data):
+        if dict_budget > 0:
+            dictionaries.append(chunk[:dict_budget])
+            dict_budget -= len(chunk)
+        if stream is None or features["streams"] >= FEATURE_MAX_STREAMS:
+            break
+        features["streams"] += 1
+        features["stream_bytes"] += len(stream)
+        if stream and len(entropies) < ENTROPY_STREAMS:
+            entropies.append(_entropy(stream[:ENTROPY_SAMPLE]))
+        stream_dict = chunk[-STREAM_DICT_BYTES:]
+        if b"/ObjStm" in stream_dict:
+            features["object_streams"] += 1
+            count = OBJSTM_COUNT.search(stream_dict)
+            features["objects"] += int(count.group(1)) if count else 0
+            if objstm_budget > 0 and dict_budget > 0 and b"/Fl" in stream_dict:
+                limit = min(objstm_budget, dict_budget)
+                if offset in inflated:
+                    unpacked = inflated[offset][:limit]
+                else:
+                    try:
+                        unpacked = zlib.decompressobj().decompress(stream, limit)
+                    except zlib.error:
+                        continue
+                objstm_budget -= len(unpacked)
+                dict_budget -= len(unpacked)
+                dictionaries.append(unpacked)
+    head = b"\n".join(dictionaries)
+
+    if b"#" in head:
+        escaped = ESCAPED_NAME.findall(head)
+        features["hex_escaped_names"] = len(escaped)
+        if escaped:
+            # Each distinct name is unescaped once
+            plain = {name: _unescape(name) for name in set(escaped)}
+            head = ESCAPED_NAME.sub(lambda m: plain[m.group(0)], head)
+    names = Counter(NAME.findall(head))
+    for feature, keys in NAMES.items():
+        features[feature] = sum(names[key.encode()] for key in keys)
+    features["pages"] = names[b"Page"]
+    features["objects"] += len(OBJECT_HEADER.findall(head))
+    if entropies:
+        features["stream_entropy_mean"] = sum(entropies) / len(entropies)
+        features["stream_entropy_max"] = max(entropies)
+
+    features["metadata_missing"] = float(not names[b"Producer"] and not names[b"Creator"])
+    dates = {}
+    for key, value in DATE.findall(head):
+        dates.setdefault(key, value.decode("ascii").ljust(14, "0"))
+    created, modified = dates.get(b"CreationDate"), dates.get(b"ModDate")
+    features["metadata_date_mismatch"] = float(bool(created and modified and modified < created))
+    tomorrow = time.strftime("%Y%m%d%H%M%S", time.gmtime(time.time() + 86400))
+    features["metadata_future_date"] = float(bool(created and created > tomorrow))
+    return [float(features[name]) for name in FEATURE_NAMES]
+
+
+def pack(values):
+    """Little-endian float32 bytes of a feature vector."""
+    return struct.pack(f"<{len(values)}f", *values)
+
+
+def unpack(blob):
+    return list(struct.unpack(f"<{len(blob) // 4}f", blob))
+
+
+def feature_counts(vector):
+    """{feature name: value} of a {"version", "values"} vector or of stored features
+    ({"version", "vector": packed}), or None when it is missing or of another FEATURE_VERSION."""
+    if not isinstance(vector, dict) or vector.get("version") != FEATURE_VERSION:
+        return None
+    values = vector.get("values")
+    if values is None and isinstance(vector.get("vector"), bytes):
+        values = unpack(vector["vector"])
+    if not isinstance(values, list) or len(values) != FEATURE_COUNT:
+        return None
+    return dict(zip(FEATURE_NAMES, values))
+
+
+def stored_features(vector):
+    """The `features` field of a stored analysis for a {"version", "values"} vector, or None."""
+    if not vector:
+        return None
+    return {"version": vector["version"], "vector": pack(vector["values"])}
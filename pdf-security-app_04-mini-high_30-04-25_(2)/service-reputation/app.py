@@ -4,15 +4,22 @@ import time
 from flask import Flask, request, jsonify
 import requests
 
+from metrics import http_call, instrument, timed, upstream_error
+
 # Logging configuration
 log_level = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=log_level)
 logger = logging.getLogger("service-reputation")
 
 app = Flask(__name__)
+instrument(app, "service-reputation")
 
 VT_API_KEY = os.getenv("VT_API_KEY")
 URLSCAN_API_KEY = os.getenv("URLSCAN_API_KEY")
+# Overridable so benchmarks can point the service at local stubs (bench/stubs.py)
+VT_API_BASE = os.getenv("VT_API_BASE", "https://www.virustotal.com/api/v3").rstrip("/")
+URLSCAN_API_BASE = os.getenv("URLSCAN_API_BASE", "https://urlscan.io/api/v1").rstrip("/")
+URLSCAN_POLL_INTERVAL = float(os.getenv("URLSCAN_POLL_INTERVAL", "2"))
 
 @app.route("/file", methods=["POST"])
 def file_reputation():
@@ -22,7 +29,8 @@ def file_reputation():
         if not sha256:
             return jsonify({"error": "No sha256 provided"}), 400
         headers = {"x-apikey": VT_API_KEY}
-        resp = requests.get(f"https://www.virustotal.com/api/v3/files/{sha256}", headers=headers)
+        resp = http_call("virustotal", "GET", f"{VT_API_BASE}/files/{sha256}", propagate=False,
+                         headers=headers)
         if resp.status_code != 200:
             logger.warning(f"VirusTotal response failed — status: {resp.status_code}, body: {resp.text}")
             return jsonify({"error": "Not found in VirusTotal", "status_code": resp.status_code}), 200
@@ -52,22 +60,26 @@ def url_reputation():
         if not url:
             return jsonify({"error": "No url provided"}), 400
         headers = {"API-Key": URLSCAN_API_KEY, "Content-Type": "application/json"}
-        resp = requests.post("https://urlscan.io/api/v1/scan/", headers=headers, json={"url": url, "public": "on"})
+        resp = http_call("urlscan_submit", "POST", f"{URLSCAN_API_BASE}/scan/", propagate=False,
+                         headers=headers, json={"url": url, "public": "on"})
         if resp.status_code not in [200, 201]:
             return jsonify({"error": "urlscan submission failed", "status_code": resp.status_code}), 502
         result = resp.json()
         uuid = result.get("uuid")
         if not uuid:
             return jsonify({"error": "No uuid from urlscan"}), 502
-        # Poll for result
+        # Poll for result (404 until the scan has finished)
         verdicts = {}
-        for _ in range(10):
-            res2 = requests.get(f"https://urlscan.io/api/v1/result/{uuid}/")
-            if res2.status_code == 200:
-                jr = res2.json()
-                verdicts = jr.get("verdicts", {})
-                break
-            time.sleep(2)
+        with timed("urlscan_poll"):
+            for _ in range(10):
+                res2 = requests.get(f"{URLSCAN_API_BASE}/result/{uuid}/")
+                if res2.status_code == 200:
+                    jr = res2.json()
+                    verdicts = jr.get("verdicts", {})
+                    break
+                time.sleep(URLSCAN_POLL_INTERVAL)
+            else:
+                upstream_error("urlscan_poll", "timeout")
         summary = {"verdicts": verdicts, "uuid": uuid}
         return jsonify(summary), 200
     except Exception:
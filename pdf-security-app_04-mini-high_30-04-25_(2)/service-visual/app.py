@@ -6,6 +6,9 @@ from flask import Flask, request, jsonify
 from pdf2image import convert_from_bytes
 import openai
 
+from metrics import LLMUsage, cache_result, instrument, llm_headers, timed
+from visualindex import VisualIndex, image_hashes
+
 # Logging configuration
 log_level = os.getenv("LOG_LEVEL", "INFO")
 logging.basicConfig(level=log_level)
@@ -14,6 +17,10 @@ logger = logging.getLogger("service-visual")
 openai.api_key = os.getenv("OPENAI_API_KEY")
 
 app = Flask(__name__)
+instrument(app, "service-visual")
+
+# Near-duplicate pages reuse earlier visual reports (see visualindex.py)
+visual_index = VisualIndex()
 
 @app.route("/visual", methods=["POST"])
 def visual():
@@ -22,9 +29,11 @@ def visual():
         if not file:
             return jsonify({"error": "No file provided"}), 400
         data = file.read()
+        sha256 = request.form.get("sha256")
 
         # Convert first page to image
-        images = convert_from_bytes(data, first_page=1, last_page=1)
+        with timed("render"):
+            images = convert_from_bytes(data, first_page=1, last_page=1)
         if not images:
             return jsonify({"error": "Failed to convert PDF to image"}), 500
         img = images[0]
@@ -34,6 +43,22 @@ def visual():
         img_bytes = buffered.getvalue()
         img_b64 = base64.b64encode(img_bytes).decode("utf-8")
 
+        # Perceptual hashes of the render; a near-identical analysed page skips the GPT-4o call
+        with timed("phash"):
+            page_phash, page_dhash = image_hashes(img)
+        reuse, distance, similar = visual_index.lookup(page_phash, page_dhash)
+        hashes = {"phash": f"{page_phash:016x}", "dhash": f"{page_dhash:016x}", "similar": similar}
+        if reuse:
+            cache_result("visual_phash", "hit")
+            logger.info(f"Reusing the visual report of {reuse['sha256']} (distance {distance})")
+            return jsonify(dict(hashes, **{
+                "analysis": reuse["analysis"],
+                "image_base64": img_b64,
+                "reused_from": {"sha256": reuse["sha256"], "distance": distance},
+                "usage": None
+            })), 200
+        cache_result("visual_phash", "miss")
+
         # Create prompt
         prompt = (
             "You are a security analyst. Analyze the following PDF page image.\n"
@@ -46,7 +71,8 @@ def visual():
         )
 
         # Send to GPT-4o with base64 image
-        response = openai.ChatCompletion.create(
+        usage = LLMUsage()
+        response = usage.create(
             model="gpt-4o",
             messages=[
                 {"role": "system", "content": "You are a security analyst who analyzes PDF page images for deception and anomalies."},
@@ -60,14 +86,17 @@ def visual():
                         }
                     ]
                  }
-            ]
+            ],
+            headers=llm_headers("service-visual.visual")
         )
         analysis = response.choices[0].message.content
+        visual_index.add(sha256, page_phash, page_dhash, analysis)
 
-        return jsonify({
+        return jsonify(dict(hashes, **{
             "analysis": analysis,
-            "image_base64": img_b64
-        }), 200
+            "image_base64": img_b64,
+            "usage": usage.as_dict()
+        })), 200
     except Exception:
         logger.exception("Visual analysis error")
         return jsonify({"error": "Visual analysis error"}), 500
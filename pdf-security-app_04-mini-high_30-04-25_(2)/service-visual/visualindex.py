@@ -0,0 +1,158 @@
+"""
+Perceptual hashes of rendered first pages and a near-duplicate index over them.
+
+Phishing campaigns send the same lure with different bytes (another recipient
+name, a new link, re-saved by another tool), so every copy has a new SHA256 but
+renders almost the same. image_hashes() computes two 64-bit hashes of the
+render: a DCT-based pHash (overall layout) and a gradient dHash (edges).
+
+VisualIndex keeps every analysed page in a BK-tree keyed by pHash, searched by
+Hamming distance. A page within VISUAL_REUSE_DISTANCE bits of an analysed one
+in both hashes reuses that visual report instead of calling GPT-4o again; pages
+within VISUAL_SIMILAR_DISTANCE pHash bits are reported as similar analyses.
+Entries are appended to VISUAL_INDEX_FILE and loaded back on startup.
+"""
+import json
+import logging
+import math
+import os
+import threading
+
+from PIL import Image
+
+logger = logging.getLogger("visualindex")
+
+VISUAL_REUSE_ENABLED = os.getenv("VISUAL_REUSE_ENABLED", "true").lower() in ("1", "true", "yes")
+VISUAL_REUSE_DISTANCE = int(os.getenv("VISUAL_REUSE_DISTANCE", "6"))
+VISUAL_SIMILAR_DISTANCE = int(os.getenv("VISUAL_SIMILAR_DISTANCE", "10"))
+VISUAL_SIMILAR_MAX = int(os.getenv("VISUAL_SIMILAR_MAX", "5"))
+VISUAL_INDEX_FILE = os.getenv("VISUAL_INDEX_FILE", "visual-index/index.jsonl")
+
+# pHash: DCT of a 32x32 grayscale thumbnail, 8x8 lowest frequencies
+DCT_SIZE = 32
+DCT_LOW = 8
+COSINES = [[math.cos(math.pi * (2 * x + 1) * u / (2 * DCT_SIZE)) for x in range(DCT_SIZE)] for u in range(DCT_LOW)]
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+def phash(image):
+    pixels = list(image.convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS).getdata())
+    rows = [pixels[i * DCT_SIZE:(i + 1) * DCT_SIZE] for i in range(DCT_SIZE)]
+    # Separable DCT: rows first, then columns, only for the low frequencies kept
+    partial = [[sum(c * p for c, p in zip(cosines, row)) for cosines in COSINES] for row in rows]
+    coefficients = [sum(COSINES[u][y] * partial[y][v] for y in range(DCT_SIZE))
+                    for u in range(DCT_LOW) for v in range(DCT_LOW)]
+    # The DC term only measures brightness and would skew the median
+    median = sorted(coefficients[1:])[len(coefficients) // 2 - 1]
+    value = 0
+    for coefficient in coefficients:
+        value = value << 1 | (coefficient > median)
+    return value
+
+
+def dhash(image):
+    pixels = list(image.convert("L").resize((9, 8), Image.LANCZOS).getdata())
+    value = 0
+    for row in range(8):
+        for col in range(8):
+            value = value << 1 | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return value
+
+
+def image_hashes(image):
+    """(phash, dhash) of a PIL image, as 64-bit integers."""
+    return phash(image), dhash(image)
+
+
+class BKTree:
+    """Burkhard-Keller tree over Hamming distance: searching a radius visits a small part of the tree."""
+
+    def __init__(self):
+        self.root = None
+        self.size = 0
+
+    def add(self, key, item):
+        self.size += 1
+        if self.root is None:
+            self.root = (key, [item], {})
+            return
+        node = self.root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(item)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = (key, [item], {})
+                return
+            node = child
+
+    def search(self, key, radius):
+        """[(distance, item)] within radius of key, closest first."""
+        found = []
+        stack = [self.root] if self.root else []
+        while stack:
+            node_key, items, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= radius:
+                found.extend((distance, item) for item in items)
+            for edge in range(max(1, distance - radius), distance + radius + 1):
+                child = children.get(edge)
+                if child is not None:
+                    stack.append(child)
+        found.sort(key=lambda pair: pair[0])
+        return found
+
+
+class VisualIndex:
+    def __init__(self, path=VISUAL_INDEX_FILE):
+        self.path = path
+        self.tree = BKTree()
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        with open(self.path, encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                    entry["phash"], entry["dhash"] = int(entry["phash"], 16), int(entry["dhash"], 16)
+                except (ValueError, KeyError, TypeError):
+                    continue
+                self.tree.add(entry["phash"], entry)
+        logger.info(f"Loaded {self.tree.size} pages into the visual index")
+
+    def lookup(self, page_phash, page_dhash):
+        """(entry to reuse or None, its pHash distance, [{"sha256", "distance"}] of similar pages)."""
+        with self._lock:
+            near = self.tree.search(page_phash, max(VISUAL_SIMILAR_DISTANCE, VISUAL_REUSE_DISTANCE))
+        reuse, reuse_distance = None, None
+        if VISUAL_REUSE_ENABLED:
+            for distance, entry in near:
+                if distance <= VISUAL_REUSE_DISTANCE and hamming(page_dhash, entry["dhash"]) <= VISUAL_REUSE_DISTANCE:
+                    reuse, reuse_distance = entry, distance
+                    break
+        similar = []
+        for distance, entry in near:
+            if distance <= VISUAL_SIMILAR_DISTANCE and entry["sha256"] and \
+                    entry["sha256"] not in (item["sha256"] for item in similar):
+                similar.append({"sha256": entry["sha256"], "distance": distance})
+        return reuse, reuse_distance, similar[:VISUAL_SIMILAR_MAX]
+
+    def add(self, sha256, page_phash, page_dhash, analysis):
+        entry = {"sha256": sha256, "phash": page_phash, "dhash": page_dhash, "analysis": analysis}
+        with self._lock:
+            self.tree.add(page_phash, entry)
+            if self.path:
+                try:
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write(json.dumps(dict(entry, phash=f"{page_phash:016x}", dhash=f"{page_dhash:016x}")) + "\n")
+                except OSError:
+                    logger.exception("Visual index entry could not be persisted")